@@ -6,137 +6,312 @@ Extrai informações sobre planilhas, colunas, dados e estrutura
 
 import sys
 import os
+import importlib.util
 import openpyxl
 from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter
 import json
+import zipfile
 from datetime import datetime
 
-def analisar_estrutura_excel(caminho_arquivo):
+# Termos procurados nas células (minúsculas, por substring)
+TERMOS_BUSCA = ['qx', 'mort', 'idade', 'óbito', 'participante', 'massa', 'tábua', 'exp', 'obs']
+
+# Células encontradas impressas por planilha na busca completa (o JSON traz todas)
+LIMITE_IMPRESSAO_BUSCA = 50
+
+# Linhas lidas para cabeçalhos e amostra quando o workbook é aberto em modo leitura
+LINHAS_AMOSTRA = 6
+
+def carregar_analisador():
+    """
+    Importa o analisar-mortalidade-python.py (nome com hífens) para reutilizar
+    o sidecar colunar gravado pelas análises; retorna None se não for possível
+    """
+    caminho = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analisar-mortalidade-python.py')
+    try:
+        spec = importlib.util.spec_from_file_location('analisar_mortalidade_python', caminho)
+        modulo = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = modulo
+        spec.loader.exec_module(modulo)
+        return modulo
+    except Exception:
+        return None
+
+def ler_estrutura_sidecar(caminho_arquivo):
+    """
+    Lê dimensões e a janela inicial (100 linhas × 20 colunas) de cada planilha
+    do sidecar colunar, sem reabrir o workbook. Retorna None se o sidecar não
+    existir, estiver desatualizado (hash diferente) ou não cobrir todas as planilhas
+    """
+    analisador = carregar_analisador()
+    if analisador is None:
+        return None
+
+    try:
+        sidecar = analisador.SidecarColunar(
+            analisador.diretorio_cache_padrao(caminho_arquivo, {}),
+            analisador.calcular_hash_arquivo(caminho_arquivo)
+        )
+        planilhas = sidecar.ler_planilhas()
+        if planilhas is None:
+            return None
+
+        estrutura = []
+        for nome_planilha in planilhas:
+            manifesto = sidecar.ler_manifesto(nome_planilha)
+            if manifesto is None or manifesto.get('janela') is None:
+                return None
+            estrutura.append((nome_planilha, manifesto))
+        return estrutura
+    except OSError:
+        return None
+
+def buscar_termos_indice(caminho_arquivo, termos_busca):
+    """
+    Busca os termos em todas as células de todas as planilhas pelo índice
+    invertido da tabela de strings (IndiceStrings), sem carregar o workbook.
+    Retorna (células por planilha, resumo por termo) ou None se indisponível
+    """
+    analisador = carregar_analisador()
+    if analisador is None:
+        return None
+
+    try:
+        indice = analisador.IndiceStrings(caminho_arquivo, termos_busca)
+        por_planilha = indice.buscar()
+        return por_planilha, indice.resumo_termos(por_planilha)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+def analisar_planilha(nome_planilha, max_row, max_col, ler_celula, celulas_indice=None):
+    """
+    Analisa uma planilha a partir das dimensões e de ler_celula(linha, coluna),
+    que devolve (valor, nome do tipo). Com celulas_indice (busca completa pelo
+    índice de strings) a busca por termos não se limita à janela inicial
+    """
+    print(f"   📐 Dimensões: {max_row} linhas × {max_col} colunas")
+    print(f"   📍 Intervalo: A1:{get_column_letter(max(max_col, 1))}{max_row}")
+
+    # Analisa cabeçalhos (primeira linha)
+    print(f"\n   📝 CABEÇALHOS (Linha 1):")
+    cabecalhos = []
+    for col in range(1, min(max_col + 1, 21)):  # Máximo 20 colunas para evitar spam
+        valor, tipo = ler_celula(1, col)
+        coordenada = f"{get_column_letter(col)}1"
+        cabecalhos.append({
+            "coluna": get_column_letter(col),
+            "valor": str(valor) if valor is not None else "",
+            "tipo": tipo
+        })
+        print(f"      {coordenada}: {valor} ({tipo})")
+
+    # Analisa algumas linhas de dados
+    print(f"\n   🔢 AMOSTRA DE DADOS (Linhas 2-6):")
+    linhas_amostra = []
+    for row in range(2, min(max_row + 1, 7)):  # Linhas 2-6
+        linha_dados = []
+        print(f"      Linha {row}:")
+        for col in range(1, min(max_col + 1, 11)):  # Máximo 10 colunas
+            valor, tipo = ler_celula(row, col)
+            coordenada = f"{get_column_letter(col)}{row}"
+            linha_dados.append({
+                "celula": coordenada,
+                "valor": valor,
+                "tipo": tipo
+            })
+            print(f"         {coordenada}: {valor} ({tipo})")
+        linhas_amostra.append(linha_dados)
+
+    # Busca por dados específicos de mortalidade
+    print(f"\n   🎯 BUSCA POR DADOS DE MORTALIDADE:")
+    celulas_relevantes = []
+
+    if celulas_indice is not None:
+        # Planilha inteira, pelo índice de strings
+        celulas_relevantes = celulas_indice
+        for celula in celulas_relevantes[:LIMITE_IMPRESSAO_BUSCA]:
+            print(f"      ✓ {celula['celula']}: {celula['valor']}")
+        if len(celulas_relevantes) > LIMITE_IMPRESSAO_BUSCA:
+            print(f"      ... e mais {len(celulas_relevantes) - LIMITE_IMPRESSAO_BUSCA} células")
+    else:
+        for row in range(1, min(max_row + 1, 101)):  # Primeiras 100 linhas
+            for col in range(1, min(max_col + 1, 21)):  # Primeiras 20 colunas
+                valor, _ = ler_celula(row, col)
+                valor_str = str(valor).lower() if valor else ""
+
+                if any(termo in valor_str for termo in TERMOS_BUSCA):
+                    coordenada = f"{get_column_letter(col)}{row}"
+                    celulas_relevantes.append({
+                        "celula": coordenada,
+                        "valor": valor,
+                        "linha": row,
+                        "coluna": col
+                    })
+                    print(f"      ✓ {coordenada}: {valor}")
+
+    return {
+        "nome": nome_planilha,
+        "dimensoes": {
+            "linhas": max_row,
+            "colunas": max_col,
+            "intervalo": f"A1:{get_column_letter(max(max_col, 1))}{max_row}"
+        },
+        "cabecalhos": cabecalhos,
+        "linhas_amostra": linhas_amostra,
+        "celulas_relevantes": celulas_relevantes
+    }
+
+def analisar_estrutura_excel(caminho_arquivo, busca_completa=False):
     """
     Analisa a estrutura completa de um arquivo Excel
     Retorna informações sobre planilhas, colunas, dados e estrutura
+
+    Com busca_completa os termos são procurados em todas as células pelo
+    índice de strings, e o workbook (se preciso) é aberto só em modo leitura
     """
-    
+
     print(f"🔍 ANÁLISE ESTRUTURAL DO ARQUIVO EXCEL")
     print(f"📁 Arquivo: {os.path.basename(caminho_arquivo)}")
     print(f"📊 Tamanho: {os.path.getsize(caminho_arquivo):,} bytes")
     print("=" * 80)
-    
+
     try:
-        # Carrega o arquivo Excel
-        workbook = load_workbook(caminho_arquivo, data_only=False)
-        
         resultado = {
             "arquivo": os.path.basename(caminho_arquivo),
             "tamanho_bytes": os.path.getsize(caminho_arquivo),
             "data_analise": datetime.now().isoformat(),
             "planilhas": []
         }
-        
-        print(f"📋 PLANILHAS ENCONTRADAS: {len(workbook.sheetnames)}")
-        
-        for idx, nome_planilha in enumerate(workbook.sheetnames, 1):
-            print(f"\n{idx}. PLANILHA: '{nome_planilha}'")
-            print("-" * 50)
-            
-            worksheet = workbook[nome_planilha]
-            
-            # Dimensões da planilha
-            max_row = worksheet.max_row
-            max_col = worksheet.max_column
-            
-            print(f"   📐 Dimensões: {max_row} linhas × {max_col} colunas")
-            print(f"   📍 Intervalo: A1:{worksheet.cell(max_row, max_col).coordinate}")
-            
-            # Analisa cabeçalhos (primeira linha)
-            print(f"\n   📝 CABEÇALHOS (Linha 1):")
-            cabecalhos = []
-            for col in range(1, min(max_col + 1, 21)):  # Máximo 20 colunas para evitar spam
-                celula = worksheet.cell(1, col)
-                valor = celula.value
-                cabecalhos.append({
-                    "coluna": celula.coordinate.replace('1', ''),
-                    "valor": str(valor) if valor is not None else "",
-                    "tipo": type(valor).__name__
-                })
-                print(f"      {celula.coordinate}: {valor} ({type(valor).__name__})")
-            
-            # Analisa algumas linhas de dados
-            print(f"\n   🔢 AMOSTRA DE DADOS (Linhas 2-6):")
-            linhas_amostra = []
-            for row in range(2, min(max_row + 1, 7)):  # Linhas 2-6
-                linha_dados = []
-                print(f"      Linha {row}:")
-                for col in range(1, min(max_col + 1, 11)):  # Máximo 10 colunas
-                    celula = worksheet.cell(row, col)
-                    valor = celula.value
-                    linha_dados.append({
-                        "celula": celula.coordinate,
-                        "valor": valor,
-                        "tipo": type(valor).__name__
-                    })
-                    print(f"         {celula.coordinate}: {valor} ({type(valor).__name__})")
-                linhas_amostra.append(linha_dados)
-            
-            # Busca por dados específicos de mortalidade
-            print(f"\n   🎯 BUSCA POR DADOS DE MORTALIDADE:")
-            termos_busca = ['qx', 'mort', 'idade', 'óbito', 'participante', 'massa', 'tábua', 'exp', 'obs']
-            celulas_relevantes = []
-            
-            for row in range(1, min(max_row + 1, 101)):  # Primeiras 100 linhas
-                for col in range(1, min(max_col + 1, 21)):  # Primeiras 20 colunas
-                    celula = worksheet.cell(row, col)
-                    valor_str = str(celula.value).lower() if celula.value else ""
-                    
-                    if any(termo in valor_str for termo in termos_busca):
-                        celulas_relevantes.append({
-                            "celula": celula.coordinate,
-                            "valor": celula.value,
-                            "linha": row,
-                            "coluna": col
-                        })
-                        print(f"      ✓ {celula.coordinate}: {celula.value}")
-            
-            # Adiciona informações da planilha ao resultado
-            resultado["planilhas"].append({
-                "nome": nome_planilha,
-                "dimensoes": {
-                    "linhas": max_row,
-                    "colunas": max_col,
-                    "intervalo": f"A1:{worksheet.cell(max_row, max_col).coordinate}"
-                },
-                "cabecalhos": cabecalhos,
-                "linhas_amostra": linhas_amostra,
-                "celulas_relevantes": celulas_relevantes
-            })
-        
+
+        # Sidecar colunar gravado por uma análise anterior: sem reabrir o XML
+        estrutura_sidecar = ler_estrutura_sidecar(caminho_arquivo)
+
+        busca_indice = None
+        if busca_completa:
+            busca_indice = buscar_termos_indice(caminho_arquivo, TERMOS_BUSCA)
+            if busca_indice is None:
+                print("⚠️ Índice de strings indisponível; busca limitada à janela inicial")
+            else:
+                resultado["indice_termos"] = busca_indice[1]
+
+        def celulas_indice(nome_planilha):
+            return busca_indice[0][nome_planilha]['celulas'] if busca_indice is not None else None
+
+        if estrutura_sidecar is not None:
+            resultado["origem"] = "sidecar"
+            print(f"📋 PLANILHAS ENCONTRADAS: {len(estrutura_sidecar)} (sidecar colunar)")
+
+            for idx, (nome_planilha, manifesto) in enumerate(estrutura_sidecar, 1):
+                print(f"\n{idx}. PLANILHA: '{nome_planilha}'")
+                print("-" * 50)
+
+                janela = manifesto['janela']
+
+                def ler_celula(row, col, janela=janela):
+                    if row <= len(janela) and col <= len(janela[row - 1]):
+                        return tuple(janela[row - 1][col - 1])
+                    return None, type(None).__name__
+
+                resultado["planilhas"].append(analisar_planilha(
+                    nome_planilha, manifesto['linhas'], manifesto['colunas'], ler_celula,
+                    celulas_indice(nome_planilha)
+                ))
+        elif busca_indice is not None:
+            # Só cabeçalhos e amostra vêm do workbook, lido em streaming
+            workbook = load_workbook(caminho_arquivo, read_only=True, data_only=False)
+            resultado["origem"] = "indice_strings"
+
+            print(f"📋 PLANILHAS ENCONTRADAS: {len(workbook.sheetnames)} (busca completa)")
+
+            for idx, nome_planilha in enumerate(workbook.sheetnames, 1):
+                print(f"\n{idx}. PLANILHA: '{nome_planilha}'")
+                print("-" * 50)
+
+                worksheet = workbook[nome_planilha]
+                janela = [list(linha) for linha in worksheet.iter_rows(max_row=LINHAS_AMOSTRA, max_col=20, values_only=True)]
+
+                # Dimensão declarada; sem ela (planilha sem <dimension>), a última linha e a
+                # última coluna vistas pelo índice. iter_rows completa as linhas até max_col com
+                # None, então a janela é cortada na última coluna real
+                max_row = worksheet.max_row or busca_indice[0][nome_planilha]['linhas']
+                max_col = worksheet.max_column or max(
+                    [busca_indice[0][nome_planilha].get('colunas', 0)]
+                    + [max((col for col, valor in enumerate(linha, 1) if valor is not None), default=0) for linha in janela]
+                )
+                janela = [linha[:max_col] for linha in janela]
+
+                def ler_celula(row, col, janela=janela):
+                    if row <= len(janela) and col <= len(janela[row - 1]):
+                        valor = janela[row - 1][col - 1]
+                        return valor, type(valor).__name__
+                    return None, type(None).__name__
+
+                resultado["planilhas"].append(analisar_planilha(
+                    nome_planilha, max_row, max_col, ler_celula, celulas_indice(nome_planilha)
+                ))
+
+            workbook.close()
+        else:
+            # Carrega o arquivo Excel
+            workbook = load_workbook(caminho_arquivo, data_only=False)
+            resultado["origem"] = "workbook"
+
+            print(f"📋 PLANILHAS ENCONTRADAS: {len(workbook.sheetnames)}")
+
+            for idx, nome_planilha in enumerate(workbook.sheetnames, 1):
+                print(f"\n{idx}. PLANILHA: '{nome_planilha}'")
+                print("-" * 50)
+
+                worksheet = workbook[nome_planilha]
+
+                def ler_celula(row, col, worksheet=worksheet):
+                    valor = worksheet.cell(row, col).value
+                    return valor, type(valor).__name__
+
+                # Adiciona informações da planilha ao resultado
+                resultado["planilhas"].append(analisar_planilha(
+                    nome_planilha, worksheet.max_row, worksheet.max_column, ler_celula
+                ))
+
         print(f"\n" + "=" * 80)
         print(f"✅ ANÁLISE CONCLUÍDA")
         print(f"📊 Total de planilhas: {len(resultado['planilhas'])}")
-        
+        for termo, contagem in resultado.get("indice_termos", {}).items():
+            print(f"   🔎 '{termo}': {contagem['strings']} strings, {contagem['celulas']} células")
+
         return resultado
-        
+
     except Exception as e:
         print(f"❌ ERRO na análise: {str(e)}")
         return None
 
 def main():
-    # Caminho do arquivo Excel
+    # Caminho do arquivo Excel (padrão) ou informado na linha de comando
     caminho_arquivo = "/home/felipe/Área de Trabalho/GitHub/SiteMetodoAtuarial/revisao-completa/MORTALIDADE APOSENTADOS dez 2024 2019 A 2024 FELIPE qx masc e fem (Massa Janeiro).xlsx"
-    
+    arquivo_resultado = "/home/felipe/Área de Trabalho/GitHub/SiteMetodoAtuarial/XLOGS/analise-estrutura-excel.json"
+
+    # --busca-completa: termos procurados em todas as células (índice de strings)
+    argumentos = [argumento for argumento in sys.argv[1:] if argumento != '--busca-completa']
+    busca_completa = len(argumentos) != len(sys.argv) - 1
+
+    if len(argumentos) > 0:
+        caminho_arquivo = argumentos[0]
+    if len(argumentos) > 1:
+        arquivo_resultado = argumentos[1]
+
     if not os.path.exists(caminho_arquivo):
         print(f"❌ Arquivo não encontrado: {caminho_arquivo}")
         return 1
-    
+
     # Executa a análise
-    resultado = analisar_estrutura_excel(caminho_arquivo)
-    
+    resultado = analisar_estrutura_excel(caminho_arquivo, busca_completa)
+
     if resultado:
         # Salva o resultado em JSON
-        arquivo_resultado = "/home/felipe/Área de Trabalho/GitHub/SiteMetodoAtuarial/XLOGS/analise-estrutura-excel.json"
         with open(arquivo_resultado, 'w', encoding='utf-8') as f:
             json.dump(resultado, f, indent=2, ensure_ascii=False, default=str)
-        
+
         print(f"💾 Resultado salvo em: {arquivo_resultado}")
         return 0
     else:
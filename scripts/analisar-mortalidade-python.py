@@ -8,37 +8,3881 @@ Compatível com OpenPyXL, Pandas, NumPy e SciPy
 import sys
 import json
 import os
+import io
+import glob
+import argparse
+import hashlib
+import shutil
+import socketserver
+import zipfile
+import posixpath
+import html
+import math
+import unicodedata
+import time
+import threading
+import cProfile
+import tracemalloc
+import xml.etree.ElementTree as ET
+from collections import Counter, OrderedDict
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
+import openpyxl
+import scipy
 from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
-from scipy import stats
+from openpyxl.formula.translate import Translator
+from openpyxl.reader.strings import read_string_table
+from openpyxl.utils.datetime import WINDOWS_EPOCH, from_excel, from_ISO8601
+from openpyxl.worksheet.formula import ArrayFormula, DataTableFormula
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+from scipy import linalg, stats
 import warnings
 from datetime import datetime, date
 import re
-from typing import Dict, List, Any, Optional, Union
+from typing import Callable, Dict, List, Any, Optional, Union
+
+try:
+    import resource
+except ImportError:  # Windows: sem pico de RSS no perfil
+    resource = None
 
 # Configurar warnings
 warnings.filterwarnings('ignore', category=UserWarning)
 
+# Quantidade de linhas mantidas em memória por vez na leitura em streaming
+TAMANHO_BLOCO_PADRAO = 5000
+
+# Janela inicial de cada planilha guardada no sidecar (linhas × colunas)
+LINHAS_JANELA = 100
+COLUNAS_JANELA = 20
+
+# Fórmulas por evento 'lote_formulas' na saída NDJSON
+TAMANHO_LOTE_FORMULAS = 1000
+
+# Segundos entre eventos 'pulso' emitidos durante etapas longas sem progresso próprio
+INTERVALO_PULSO_SEGUNDOS = 15
+
+# Bytes descompactados do XML da planilha lidos por vez pelo ScannerFormulas
+TAMANHO_TRECHO_XML = 1 << 22
+
+# Versão do analisador; entra na chave do cache de resultados
+VERSAO_ANALISADOR = '2.9.0'
+
+# Valores padrão e opções que não alteram o resultado (ignoradas na chave do cache)
+CONFIGURACAO_PADRAO = {
+    'metodoAnalise': 'COMPLETO',
+    'extrairFormulas': True,
+    'calcularEstatisticas': True,
+    'validarIntegridade': True
+}
+CHAVES_CONFIGURACAO_SEM_EFEITO = {
+    'timeoutSegundos', 'leituraStreaming', 'tamanhoBloco', 'processosParalelos',
+    'usarCache', 'invalidarCache', 'diretorioCache', 'tamanhoMaximoCacheMB', 'usarSidecar',
+    'usarRegistroLayouts', 'registroLayouts', 'leituraXmlDireta', 'diretorioIncremental',
+    'perfilMemoria', 'perfilDetalhado', 'diretorioPerfil', 'processosSimulacao', 'registroTabuas',
+    'intervaloPulsoSegundos'
+}
+
+# Tipo final de cada papel de coluna no carregador colunar ('chave': texto normalizado)
+TIPOS_COLUNAS = {
+    'matricula': 'chave',
+    'cpf': 'chave',
+    'nome': 'chave',
+    'idade': 'int16',
+    'idade_obito': 'int16',
+    'ano_cadastro': 'int16',
+    'ano_obito': 'int16',
+    'sexo': 'category',
+    'data_nascimento': 'datetime64[ns]',
+    'data_entrada': 'datetime64[ns]',
+    'data_saida': 'datetime64[ns]',
+    'data_obito': 'datetime64[ns]',
+    'salario': 'float64',
+    'qx_masculino': 'float64',
+    'qx_feminino': 'float64',
+    'qx_geral': 'float64'
+}
+
+# Rótulos do delta do modo incremental por tipo: grupos incluídos, excluídos e alterados
+ROTULOS_DELTA = {
+    'massa': ('entradas', 'saidas', 'alterados'),
+    'obitos': ('novos_obitos', 'obitos_excluidos', 'obitos_alterados')
+}
+# Matrículas listadas por rótulo no delta
+LIMITE_MATRICULAS_DELTA = 20
+
+# Normalização de sexo; 1/2 seguem a codificação usada nas rotas de aderência
+CATEGORIAS_SEXO = ['MASCULINO', 'FEMININO', 'OUTROS']
+MAPA_SEXO = {
+    'M': 'MASCULINO', 'MASC': 'MASCULINO', 'MASCULINO': 'MASCULINO', 'MALE': 'MASCULINO', '1': 'MASCULINO',
+    'F': 'FEMININO', 'FEM': 'FEMININO', 'FEMININO': 'FEMININO', 'FEMALE': 'FEMININO', '2': 'FEMININO'
+}
+CODIGOS_SEXO = {valor: CATEGORIAS_SEXO.index(nome) for valor, nome in MAPA_SEXO.items()}
+
+# Faixas etárias do resumo de idades: (rótulo, limite inferior exclusivo, limite superior inclusivo)
+FAIXAS_IDADE = [
+    ('0-20', None, 20), ('21-30', 20, 30), ('31-40', 30, 40), ('41-50', 40, 50),
+    ('51-60', 50, 60), ('61-70', 60, 70), ('71+', 70, None)
+]
+
+# Erro relativo padrão dos quantis no modo RAPIDO (configuracao.erroRelativoQuantis)
+ERRO_RELATIVO_QUANTIS = 0.005
+
+# Graduação: suavização h e ordem das diferenças de Whittaker–Henderson; idade inicial do ajuste de Gompertz/Makeham
+SUAVIZACAO_WHITTAKER_PADRAO = 100.0
+ORDEM_WHITTAKER_PADRAO = 3
+IDADE_INICIAL_LEIS_PADRAO = 30
+# Maior c aceito como plausível num ajuste de Gompertz/Makeham (força dobrando a cada ~1,7 ano)
+C_MAXIMO_LEIS = 1.5
+
+# Simulação (bootstrap paramétrico): réplicas por bloco e memória máxima de cada bloco
+REPLICAS_POR_BLOCO_SIMULACAO = 1000
+MEMORIA_BLOCO_SIMULACAO_MB = 64
+
+# Ligação dos óbitos à massa: pontuação mínima do par aproximado, maior bloco de candidatos
+# comparado (datas padrão e nomes muito comuns formam blocos enormes) e óbitos não ligados listados
+LIMIAR_LIGACAO_APROXIMADA = 7.0
+LIMITE_BLOCO_LIGACAO = 200
+LIMITE_OBITOS_NAO_LIGADOS = 50
+# Pontos de cada campo no par aproximado: (concorda, discorda); campo ausente em um dos lados vale 0
+PESOS_LIGACAO = {
+    'nome_completo': (4.0, 0.0),
+    'primeiro_nome': (2.0, -1.0),
+    'ultimo_nome': (2.0, -1.0),
+    'data_nascimento': (4.0, -4.0),
+    'sexo': (1.0, -3.0)
+}
+# Nascimento com um só campo divergente (dia, mês ou dia/mês trocados)
+PESO_NASCIMENTO_PARCIAL = 1.5
+METODOS_LIGACAO = ('matricula', 'cpf', 'aproximada')
+# Sufixos de geração, que não contam como último nome (JOSÉ SILVA FILHO → SILVA)
+SUFIXOS_NOME = {'FILHO', 'FILHA', 'JUNIOR', 'JÚNIOR', 'JR', 'NETO', 'NETA', 'SOBRINHO', 'SOBRINHA', 'II', 'III'}
+
+# Registro de tábuas padrão: última idade guardada (idades acima repetem o último qx)
+IDADE_MAXIMA_REGISTRO_TABUAS = 130
+# Tábuas de referência conhecidas; os valores oficiais são importados uma vez (--tabuas importar)
+CATALOGO_TABUAS = {
+    'AT-49': 'Annuity Table 1949 (SOA)',
+    'AT-83': 'Annuity Table 1983 (SOA)',
+    'AT-2000': 'Annuity 2000 Basic Table (SOA)',
+    'BR-EMSsb': 'Tábua BR-EMS de sobrevivência (mercado segurador brasileiro)',
+    'BR-EMSmt': 'Tábua BR-EMS de mortalidade (mercado segurador brasileiro)',
+    'IBGE': 'Tábua completa de mortalidade do Brasil (IBGE)'
+}
+
+# Cubo agregado: situação do participante no ano-calendário (eixo final do cubo)
+SITUACOES_CUBO = ('ativo', 'saida', 'obito')
+
+# Datas em texto: quantidade de dígitos aceita em cada campo e separadores; hora após ' ' ou 'T' é ignorada
+FORMATOS_DATA_TEXTO = {
+    'brasileira': {'campos': ('dia', 'mes', 'ano'), 'digitos': ((1, 2), (1, 2), (4, 4)), 'separadores': '/-.'},
+    'iso': {'campos': ('ano', 'mes', 'dia'), 'digitos': ((4, 4), (1, 2), (1, 2)), 'separadores': '-'}
+}
+# Textos mais longos que isto não são decompostos como data
+LARGURA_MAXIMA_DATA_TEXTO = 32
+# Série do Excel aceita como data (sistema de 1900, sem o dia fictício 29/02/1900)
+EPOCA_SERIAL_EXCEL = np.datetime64('1899-12-30', 'ms')
+SERIAL_EXCEL_MINIMO = 61
+SERIAL_EXCEL_MAXIMO = 100000
+# Anos aceitos nas datas normalizadas (datetime64[ns] vai de 1677 a 2262)
+ANO_MINIMO_DATA = 1800
+ANO_MAXIMO_DATA = 2200
+
+
+def compor_datas(anos: np.ndarray, meses: np.ndarray, dias: np.ndarray) -> np.ndarray:
+    """datetime64[ns] a partir de ano, mês e dia inteiros; combinações inválidas viram NaT"""
+    validas = ((anos >= ANO_MINIMO_DATA) & (anos <= ANO_MAXIMO_DATA) & (meses >= 1) & (meses <= 12)
+               & (dias >= 1) & (dias <= 31))
+    inicio_mes = (np.where(validas, anos, 1970) - 1970).astype('datetime64[Y]').astype('datetime64[M]')
+    inicio_mes += np.where(validas, meses, 1) - 1
+    datas = inicio_mes.astype('datetime64[D]') + (np.where(validas, dias, 1) - 1)
+    # 31/02 cai em março: o dia não existe no mês
+    validas &= datas.astype('datetime64[M]') == inicio_mes
+    return np.where(validas, datas, np.datetime64('NaT')).astype('datetime64[ns]')
+
+
+def limitar_datas(datas: np.ndarray) -> np.ndarray:
+    """datetime64[ns], com NaT fora de ANO_MINIMO_DATA..ANO_MAXIMO_DATA (sem estouro na conversão)"""
+    anos = datas.astype('datetime64[Y]').astype(np.int64) + 1970
+    foras = np.isnat(datas) | (anos < ANO_MINIMO_DATA) | (anos > ANO_MAXIMO_DATA)
+    return np.where(foras, np.datetime64('NaT'), datas).astype('datetime64[ns]')
+
+
+def classe_data(valor: Any) -> Optional[str]:
+    """Classe de uma célula de coluna de data com tipos misturados"""
+    if isinstance(valor, (datetime, date, np.datetime64)):
+        return 'datetime'
+    if isinstance(valor, (int, float, np.number)) and not isinstance(valor, (bool, np.bool_)):
+        return 'numero'
+    if isinstance(valor, str):
+        return 'texto'
+    return None
+
+
+class NormalizadorDatas:
+    """Conversão vetorizada de uma coluna de datas, com a codificação detectada uma vez
+    
+    Cada fatia é separada pelo tipo das células (inferido em lote pelo pandas;
+    célula a célula só em fatias misturadas) e convertida pelo caminho de cada
+    codificação: objetos de data, série numérica do Excel, texto ISO
+    (aaaa-mm-dd) ou texto brasileiro (dd/mm/aaaa, também com '-' ou '.').
+    A ordem dos textos é detectada na primeira fatia com texto e reaproveitada
+    nas seguintes. Textos de largura fixa são decompostos direto dos códigos
+    dos caracteres; os demais passam por expressão regular. Valores que nenhuma
+    codificação aceita ficam ausentes e são contados como inválidos.
+    """
+    
+    LIMITE_EXEMPLOS = 5
+    
+    def __init__(self):
+        self.texto = None
+        self.contagens = Counter()
+        self.invalidos = 0
+        self.exemplos_invalidos = []
+    
+    def converter(self, valores) -> tuple:
+        """(datas datetime64[ns], ausentes) de uma fatia da coluna"""
+        if isinstance(valores, np.ndarray) and valores.dtype.kind == 'M':
+            return self.registrar_datas(valores)
+        serie = valores.reset_index(drop=True) if isinstance(valores, pd.Series) else pd.Series(valores, dtype=object)
+        if is_datetime64_any_dtype(serie):
+            return self.registrar_datas(serie.to_numpy(dtype='datetime64[ns]'))
+        
+        datas = np.full(len(serie), np.datetime64('NaT'), dtype='datetime64[ns]')
+        tipo = pd.api.types.infer_dtype(serie, skipna=True)
+        if tipo in ('datetime', 'datetime64', 'date'):
+            partes = [('datetime', serie)]
+        elif tipo in ('integer', 'floating', 'mixed-integer-float', 'decimal'):
+            partes = [('numero', serie)]
+        elif tipo == 'string':
+            partes = [('texto', serie)]
+        elif tipo == 'empty':
+            partes = []
+        else:
+            classes = serie.map(classe_data)
+            partes = [(classe, serie[classes == classe]) for classe in ('datetime', 'numero', 'texto')]
+            self.registrar_invalidos(serie[classes.isna() & serie.notna()])
+        
+        for classe, parte in partes:
+            parte = parte.dropna()
+            if not len(parte):
+                continue
+            posicoes = parte.index.to_numpy()
+            if classe == 'datetime':
+                convertidas = limitar_datas(pd.to_datetime(parte, errors='coerce').to_numpy(dtype='datetime64[us]'))
+                self.contagens['datetime'] += int((~np.isnat(convertidas)).sum())
+                brancos = np.zeros(len(parte), dtype=bool)
+            elif classe == 'numero':
+                convertidas = self.converter_serial(pd.to_numeric(parte, errors='coerce').to_numpy(dtype=np.float64))
+                brancos = np.zeros(len(parte), dtype=bool)
+            else:
+                convertidas, brancos = self.converter_texto(parte.to_numpy(dtype=object))
+            datas[posicoes] = convertidas
+            self.registrar_invalidos(parte[np.isnat(convertidas) & ~brancos])
+        return datas, np.isnat(datas)
+    
+    def registrar_datas(self, datas: np.ndarray) -> tuple:
+        datas = limitar_datas(datas)
+        ausentes = np.isnat(datas)
+        self.contagens['datetime'] += int((~ausentes).sum())
+        return datas, ausentes
+    
+    def registrar_invalidos(self, invalidos: pd.Series):
+        self.invalidos += len(invalidos)
+        faltam = self.LIMITE_EXEMPLOS - len(self.exemplos_invalidos)
+        if faltam > 0 and len(invalidos):
+            self.exemplos_invalidos.extend(str(valor) for valor in invalidos.iloc[:faltam])
+    
+    def converter_serial(self, numeros: np.ndarray) -> np.ndarray:
+        """Série do Excel (dias desde a época, fração = hora) como no from_excel do OpenPyXL"""
+        validos = np.isfinite(numeros) & (numeros >= SERIAL_EXCEL_MINIMO) & (numeros < SERIAL_EXCEL_MAXIMO)
+        # Inteiros como 1985 numa coluna de data são anos soltos, não a série de 1905
+        validos &= ~((numeros >= ANO_MINIMO_DATA) & (numeros <= ANO_MAXIMO_DATA) & (numeros == np.floor(numeros)))
+        numeros = np.where(validos, numeros, SERIAL_EXCEL_MINIMO)
+        dias = np.floor(numeros)
+        milissegundos = np.round((numeros - dias) * 86400 * 1000)
+        datas = (EPOCA_SERIAL_EXCEL + dias.astype(np.int64).astype('timedelta64[D]')
+                 + milissegundos.astype(np.int64).astype('timedelta64[ms]'))
+        self.contagens['serial_excel'] += int(validos.sum())
+        return np.where(validos, datas, np.datetime64('NaT')).astype('datetime64[ns]')
+    
+    def converter_texto(self, textos: np.ndarray) -> tuple:
+        """(datas, brancos) de textos; brancos (só espaços) são ausentes, não inválidos"""
+        datas = np.full(len(textos), np.datetime64('NaT'), dtype='datetime64[ns]')
+        brancos = np.zeros(len(textos), dtype=bool)
+        if self.texto is None:
+            self.texto = self.detectar_texto(textos[:100])
+        ordem = [self.texto] + [codificacao for codificacao in FORMATOS_DATA_TEXTO if codificacao != self.texto]
+        
+        pendentes = np.arange(len(textos))
+        for tentativa in ('direta', 'aparada'):
+            if tentativa == 'aparada':
+                # Espaços nas pontas, brancos e números em texto (série do Excel)
+                textos = pd.Series(textos, dtype=object).str.strip().to_numpy(dtype=object)
+                brancos[pendentes] = textos == ''
+            for codificacao in ordem:
+                convertidas = self.decompor_texto(textos, codificacao)
+                convertidas_ok = ~np.isnat(convertidas)
+                datas[pendentes[convertidas_ok]] = convertidas[convertidas_ok]
+                self.contagens[codificacao] += int(convertidas_ok.sum())
+                pendentes, textos = pendentes[~convertidas_ok], textos[~convertidas_ok]
+                if not len(pendentes):
+                    return datas, brancos
+        
+        numeros = pd.to_numeric(pd.Series(textos, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+        datas[pendentes] = self.converter_serial(numeros)
+        return datas, brancos
+    
+    @classmethod
+    def detectar_texto(cls, amostra: np.ndarray) -> str:
+        """Codificação de texto que converte mais valores da amostra (brasileira em caso de empate)"""
+        amostra = pd.Series(amostra, dtype=object).str.strip().to_numpy(dtype=object)
+        acertos = {codificacao: int((~np.isnat(cls.decompor_texto(amostra, codificacao))).sum())
+                   for codificacao in FORMATOS_DATA_TEXTO}
+        return max(FORMATOS_DATA_TEXTO, key=acertos.__getitem__)
+    
+    @staticmethod
+    def decompor_texto(textos: np.ndarray, codificacao: str) -> np.ndarray:
+        """Datas em texto decompostas pelos códigos dos caracteres, sem parsing célula a célula
+        
+        Os textos viram uma matriz de code points (uma linha por texto). A data
+        vai até o primeiro espaço ou 'T'; nela, os não dígitos são separadores.
+        Com exatamente dois separadores iguais, os três campos ficam entre eles e
+        cada número sai dos seus últimos dígitos lidos por posição. Quantidade de
+        dígitos por campo e separadores seguem FORMATOS_DATA_TEXTO; o resto vira NaT.
+        """
+        formato = FORMATOS_DATA_TEXTO[codificacao]
+        datas = np.full(len(textos), np.datetime64('NaT'), dtype='datetime64[ns]')
+        larguras = np.fromiter(map(len, textos), dtype=np.int64, count=len(textos))
+        candidatos = np.flatnonzero((larguras >= 8) & (larguras <= LARGURA_MAXIMA_DATA_TEXTO))
+        if not len(candidatos):
+            return datas
+        
+        unicos = textos[candidatos].astype('U')
+        largura = unicos.dtype.itemsize // 4
+        codigos = unicos.view(np.uint32).reshape(len(candidatos), largura)
+        # Sem sinal, tudo que vem antes de '0' dá a volta e fica acima de 9
+        digitos = codigos - np.uint32(ord('0'))
+        fim = (codigos == ord(' ')) | (codigos == ord('T')) | (codigos == 0)
+        na_data = ~np.logical_or.accumulate(fim, axis=1)
+        separador = na_data & (digitos > 9)
+        
+        linhas = np.arange(len(candidatos))
+        primeiro = np.argmax(separador, axis=1)
+        ultimo = largura - 1 - np.argmax(separador[:, ::-1], axis=1)
+        simbolos = codigos[linhas, primeiro]
+        validos = (separador.sum(axis=1) == 2) & (simbolos == codigos[linhas, ultimo])
+        validos &= np.isin(simbolos, [ord(simbolo) for simbolo in formato['separadores']])
+        
+        limites = [(np.zeros_like(primeiro), primeiro), (primeiro + 1, ultimo), (ultimo + 1, na_data.sum(axis=1))]
+        numeros = {}
+        for nome, (minimo, maximo), (inicio, termino) in zip(formato['campos'], formato['digitos'], limites):
+            quantidade = termino - inicio
+            validos &= (quantidade >= minimo) & (quantidade <= maximo)
+            numero = np.zeros(len(candidatos), dtype=np.uint32)
+            for casa in range(maximo):
+                posicao = termino - 1 - casa
+                digito = digitos[linhas, np.clip(posicao, 0, largura - 1)]
+                numero += digito * (posicao >= inicio) * np.uint32(10 ** casa)
+            numeros[nome] = numero.astype(np.int64)
+        
+        selecionados = np.flatnonzero(validos)
+        datas[candidatos[selecionados]] = compor_datas(numeros['ano'][selecionados], numeros['mes'][selecionados],
+                                                       numeros['dia'][selecionados])
+        return datas
+    
+    def resumo(self) -> Dict[str, Any]:
+        return {
+            'codificacao': self.contagens.most_common(1)[0][0] if +self.contagens else None,
+            'convertidos': dict(+self.contagens),
+            'invalidos': self.invalidos,
+            'exemplos_invalidos': list(self.exemplos_invalidos)
+        }
+    
+    def estado(self) -> Dict[str, Any]:
+        """Estado serializável em JSON (manifesto do sidecar)"""
+        return {'texto': self.texto, 'contagens': dict(self.contagens), 'invalidos': self.invalidos,
+                'exemplos_invalidos': list(self.exemplos_invalidos)}
+    
+    @classmethod
+    def de_estado(cls, estado: Dict[str, Any]) -> 'NormalizadorDatas':
+        normalizador = cls()
+        normalizador.texto = estado['texto']
+        normalizador.contagens = Counter(estado['contagens'])
+        normalizador.invalidos = estado['invalidos']
+        normalizador.exemplos_invalidos = list(estado['exemplos_invalidos'])
+        return normalizador
+
+
+class CarregadorColunar:
+    """Monta colunas tipadas em arrays NumPy à medida que os blocos da planilha chegam
+    
+    Cada coluna identificada é convertida uma única vez por bloco e gravada no
+    buffer do seu tipo final (int16, categoria, datetime64 ou float64). As colunas
+    preservam o alinhamento por linha; valores inválidos ficam como ausentes.
+    """
+    
+    def __init__(self, colunas_identificadas: Dict[str, Optional[str]], capacidade: int = 0):
+        self.colunas_identificadas = colunas_identificadas
+        self.colunas = {papel: col for papel, col in colunas_identificadas.items() if col and papel in TIPOS_COLUNAS}
+        self.colunas_validacao = [col for col in colunas_identificadas.values() if col]
+        self.total_registros = 0
+        self.registros_validos = 0
+        self.amostra = []
+        self.valores = {}
+        self.ausentes = {}
+        # Datas: codificação detectada e valores inválidos por papel
+        self.normalizadores = {papel: NormalizadorDatas() for papel in self.colunas
+                               if TIPOS_COLUNAS[papel].startswith('datetime64')}
+        self._reservar(max(int(capacidade), 1024))
+    
+    def _reservar(self, capacidade: int):
+        """Garante espaço nos buffers (crescimento geométrico quando a dimensão é desconhecida)"""
+        for papel in self.colunas:
+            tipo = TIPOS_COLUNAS[papel]
+            dtype = {'category': np.int8, 'chave': object}.get(tipo) or np.dtype(tipo)
+            novo = np.empty(capacidade, dtype=dtype)
+            ausente = np.ones(capacidade, dtype=bool)
+            if papel in self.valores:
+                novo[:self.total_registros] = self.valores[papel][:self.total_registros]
+                ausente[:self.total_registros] = self.ausentes[papel][:self.total_registros]
+            self.valores[papel] = novo
+            self.ausentes[papel] = ausente
+        self.capacidade = capacidade
+    
+    def converter(self, papel: str, serie):
+        """Converte a fatia de uma coluna para o tipo do papel; retorna (valores, ausentes)"""
+        tipo = TIPOS_COLUNAS[papel]
+        
+        if tipo == 'category':
+            texto = serie.astype(str).str.strip().str.upper().str.replace(r'\.0$', '', regex=True)
+            codigos = texto.map(CODIGOS_SEXO).fillna(CATEGORIAS_SEXO.index('OUTROS')).to_numpy(dtype=np.int8)
+            return codigos, serie.isna().to_numpy()
+        
+        if tipo == 'chave':
+            texto = serie.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+            return texto.to_numpy(dtype=object), (serie.isna() | (texto == '')).to_numpy()
+        
+        if tipo.startswith('datetime64'):
+            return self.normalizadores[papel].converter(serie)
+        
+        numeros = pd.to_numeric(serie, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        return self.tipar_numeros(tipo, numeros)
+    
+    @staticmethod
+    def tipar_numeros(tipo: str, numeros: np.ndarray):
+        if tipo == 'int16':
+            ausentes = ~np.isfinite(numeros) | (numeros < 0) | (numeros > np.iinfo(np.int16).max)
+            return np.where(ausentes, 0, np.floor(numeros)).astype(np.int16), ausentes
+        return numeros, np.isnan(numeros)
+    
+    def converter_lista(self, papel: str, valores: Union[List[Any], np.ndarray]):
+        """Como converter(), para os valores de uma coluna lidos direto do XML
+        
+        Colunas homogêneas (só números, códigos de sexo, chaves numéricas) são
+        tipadas sem passar por uma Series de objetos; as demais seguem pelo
+        converter(). Datas seguem sempre pelo NormalizadorDatas do papel.
+        """
+        tipo = TIPOS_COLUNAS[papel]
+        
+        # Datas (já tipadas em lote pelo LeitorColunasXml ou não) vão pelo normalizador
+        if tipo.startswith('datetime64'):
+            return self.normalizadores[papel].converter(valores)
+        
+        # Colunas já tipadas em lote pelo LeitorColunasXml
+        if isinstance(valores, np.ndarray) and valores.dtype.kind == 'f' and tipo in ('int16', 'float64'):
+            return self.tipar_numeros(tipo, valores)
+        
+        if tipo in ('int16', 'float64'):
+            if all(valor is None or type(valor) in (int, float) for valor in valores):
+                numeros = np.array([np.nan if valor is None else valor for valor in valores], dtype=np.float64)
+                return self.tipar_numeros(tipo, numeros)
+        
+        elif tipo == 'category':
+            codigos = {}
+            for valor in set(valores):
+                texto = re.sub(r'\.0$', '', str(valor).strip().upper())
+                codigos[valor] = CODIGOS_SEXO.get(texto, CATEGORIAS_SEXO.index('OUTROS'))
+            return (np.array([codigos[valor] for valor in valores], dtype=np.int8),
+                    np.array([valor is None for valor in valores], dtype=bool))
+        
+        elif tipo == 'chave':
+            if all(valor is None or type(valor) is int for valor in valores):
+                return (np.array(['None' if valor is None else str(valor) for valor in valores], dtype=object),
+                        np.array([valor is None for valor in valores], dtype=bool))
+        
+        return self.converter(papel, pd.Series(valores, dtype=object))
+    
+    def adicionar_bloco(self, df):
+        """Converte e anexa um bloco de linhas brutas"""
+        if not self.amostra:
+            self.amostra = df.head(5).to_dict('records')
+        
+        inicio = self.total_registros
+        fim = inicio + len(df)
+        if fim > self.capacidade:
+            self._reservar(max(fim, self.capacidade * 2))
+        
+        for papel, coluna in self.colunas.items():
+            valores, ausentes = self.converter(papel, df[coluna])
+            self.valores[papel][inicio:fim] = valores
+            self.ausentes[papel][inicio:fim] = ausentes
+        
+        self.total_registros = fim
+        self.registros_validos += len(df.dropna(subset=self.colunas_validacao))
+    
+    def adicionar_valores(self, valores: Dict[str, List[Any]], total: int, validos: int):
+        """Anexa um bloco de valores por papel lidos direto do XML (LeitorColunasXml)"""
+        inicio = self.total_registros
+        fim = inicio + total
+        if fim > self.capacidade:
+            self._reservar(max(fim, self.capacidade * 2))
+        
+        for papel in self.colunas:
+            tipados, ausentes = self.converter_lista(papel, valores[papel])
+            self.valores[papel][inicio:fim] = tipados
+            self.ausentes[papel][inicio:fim] = ausentes
+        
+        self.total_registros = fim
+        self.registros_validos += validos
+    
+    @classmethod
+    def de_colunas(cls, colunas_identificadas: Dict[str, Optional[str]], valores: Dict[str, np.ndarray],
+                   ausentes: Dict[str, np.ndarray], total_registros: int, registros_validos: int,
+                   amostra: List[Dict[str, Any]], **opcoes) -> 'CarregadorColunar':
+        """Reconstrói o carregador a partir de colunas já tipadas (sidecar colunar)"""
+        carregador = cls(colunas_identificadas, **opcoes)
+        carregador.incorporar_colunas(valores, ausentes, total_registros)
+        carregador.registros_validos = registros_validos
+        carregador.amostra = amostra
+        return carregador
+    
+    def normalizacao_datas(self) -> Dict[str, Any]:
+        """Codificação detectada e valores inválidos de cada coluna de data"""
+        return {papel: normalizador.resumo() for papel, normalizador in self.normalizadores.items()}
+    
+    def incorporar_colunas(self, valores: Dict[str, np.ndarray], ausentes: Dict[str, np.ndarray], total_registros: int):
+        self.valores = dict(valores)
+        self.ausentes = dict(ausentes)
+        self.total_registros = self.capacidade = total_registros
+    
+    @staticmethod
+    def colunas_da_tabela(tabela: pd.DataFrame):
+        """Inverso de finalizar: (valores, ausentes) por papel a partir da tabela tipada"""
+        valores, ausentes = {}, {}
+        for papel in tabela:
+            tipo = TIPOS_COLUNAS[papel]
+            serie = tabela[papel]
+            if tipo == 'int16':
+                ausentes[papel] = serie.isna().to_numpy()
+                valores[papel] = serie.to_numpy(dtype=np.int16, na_value=0)
+            elif tipo == 'category':
+                codigos = serie.cat.codes.to_numpy()
+                ausentes[papel] = codigos < 0
+                valores[papel] = np.maximum(codigos, 0).astype(np.int8)
+            elif tipo == 'chave':
+                ausentes[papel] = serie.isna().to_numpy()
+                # Texto de largura fixa ('U'), como no sidecar
+                valores[papel] = np.where(ausentes[papel], '', serie.to_numpy(dtype=object)).astype(str)
+            elif tipo.startswith('datetime64'):
+                valores[papel] = serie.to_numpy(dtype='datetime64[ns]')
+                ausentes[papel] = np.isnat(valores[papel])
+            else:
+                valores[papel] = serie.to_numpy(dtype=np.float64)
+                ausentes[papel] = np.isnan(valores[papel])
+        return valores, ausentes
+    
+    def finalizar(self) -> pd.DataFrame:
+        """Devolve um DataFrame com uma coluna tipada por papel identificado"""
+        n = self.total_registros
+        dados = {}
+        for papel in self.colunas:
+            tipo = TIPOS_COLUNAS[papel]
+            valores = self.valores[papel][:n]
+            ausentes = self.ausentes[papel][:n]
+            if tipo == 'int16':
+                dados[papel] = pd.arrays.IntegerArray(valores, ausentes)
+            elif tipo == 'category':
+                dados[papel] = pd.Categorical.from_codes(np.where(ausentes, -1, valores), CATEGORIAS_SEXO)
+            elif tipo == 'chave':
+                dados[papel] = np.where(ausentes, None, valores)
+            else:
+                dados[papel] = valores
+        return pd.DataFrame(dados, index=pd.RangeIndex(n))
+
+
+class EstatisticaStreaming:
+    """Estatísticas de uma coluna numérica em uma passada, combináveis entre blocos
+    
+    Contagem, média, variância (combinação de Chan et al.), mínimo e máximo são
+    exatos. Os quantis vêm de um sketch de erro relativo (DDSketch): o valor
+    estimado para qualquer quantil fica a no máximo `erro_relativo` do valor real,
+    com memória proporcional a log(max/min) / erro_relativo. Colunas inteiras
+    (idade) mantêm também um histograma por valor, que dá quantis e faixas exatos.
+    """
+    
+    def __init__(self, erro_relativo: float = 0.005, inteira: bool = False):
+        self.erro_relativo = erro_relativo
+        self.gamma = (1 + erro_relativo) / (1 - erro_relativo)
+        self.log_gamma = np.log(self.gamma)
+        self.n = 0
+        self.media = 0.0
+        self.m2 = 0.0
+        self.minimo = np.inf
+        self.maximo = -np.inf
+        self.positivos = Counter()
+        self.negativos = Counter()
+        self.zeros = 0
+        self.histograma = np.zeros(0, dtype=np.int64) if inteira else None
+    
+    def _contar(self, valores: np.ndarray, sinal: int):
+        """Histograma e buckets do sketch de um bloco, somados (sinal 1) ou subtraídos (-1)"""
+        if self.histograma is not None:
+            contagens = np.bincount(valores.astype(np.int64))
+            if len(contagens) > len(self.histograma):
+                self.histograma = np.pad(self.histograma, (0, len(contagens) - len(self.histograma)))
+            self.histograma[:len(contagens)] += sinal * contagens
+        
+        for contador, parte in ((self.positivos, valores[valores > 0]), (self.negativos, -valores[valores < 0])):
+            if len(parte):
+                chaves, contagens = np.unique(np.ceil(np.log(parte) / self.log_gamma).astype(np.int64), return_counts=True)
+                contador.update(dict(zip(chaves.tolist(), (sinal * contagens).tolist())))
+        self.zeros += sinal * int((valores == 0).sum())
+    
+    def adicionar(self, valores: np.ndarray, ausentes: np.ndarray):
+        valores = valores[~ausentes]
+        if not len(valores):
+            return
+        
+        valores = valores.astype(np.float64)
+        self._contar(valores, 1)
+        media_bloco = float(valores.mean())
+        self._combinar_momentos(len(valores), media_bloco, float(((valores - media_bloco) ** 2).sum()))
+        self.minimo = min(self.minimo, float(valores.min()))
+        self.maximo = max(self.maximo, float(valores.max()))
+    
+    def remover(self, valores: np.ndarray, ausentes: np.ndarray) -> bool:
+        """Retira valores já contados (modo incremental)
+        
+        Momentos, histograma e sketch ficam exatos. Devolve True quando um valor
+        retirado era o mínimo ou o máximo: os extremos passam a depender da
+        coluna atual (redefinir_extremos).
+        """
+        valores = valores[~ausentes]
+        if not len(valores):
+            return False
+        
+        valores = valores.astype(np.float64)
+        self._contar(valores, -1)
+        self.positivos = +self.positivos
+        self.negativos = +self.negativos
+        
+        restantes = self.n - len(valores)
+        if restantes <= 0:
+            self.n, self.media, self.m2 = 0, 0.0, 0.0
+            self.minimo, self.maximo = np.inf, -np.inf
+            return False
+        # Combinação de Chan et al. resolvida para a parte que fica
+        media_bloco = float(valores.mean())
+        media = (self.n * self.media - len(valores) * media_bloco) / restantes
+        delta = media_bloco - media
+        self.m2 = max(self.m2 - float(((valores - media_bloco) ** 2).sum())
+                      - delta * delta * restantes * len(valores) / self.n, 0.0)
+        self.media, self.n = media, restantes
+        return bool(valores.min() <= self.minimo or valores.max() >= self.maximo)
+    
+    def redefinir_extremos(self, valores: np.ndarray, ausentes: np.ndarray):
+        valores = valores[~ausentes]
+        self.minimo = float(valores.min()) if len(valores) else np.inf
+        self.maximo = float(valores.max()) if len(valores) else -np.inf
+    
+    def _combinar_momentos(self, n: int, media: float, m2: float):
+        total = self.n + n
+        delta = media - self.media
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.media += delta * n / total
+        self.n = total
+    
+    def combinar(self, outra: 'EstatisticaStreaming'):
+        """Incorpora outro acumulador (por exemplo, de outro processo)"""
+        if not outra.n:
+            return
+        self._combinar_momentos(outra.n, outra.media, outra.m2)
+        self.minimo = min(self.minimo, outra.minimo)
+        self.maximo = max(self.maximo, outra.maximo)
+        self.positivos.update(outra.positivos)
+        self.negativos.update(outra.negativos)
+        self.zeros += outra.zeros
+        if self.histograma is not None and outra.histograma is not None:
+            tamanho = max(len(self.histograma), len(outra.histograma))
+            self.histograma = (np.pad(self.histograma, (0, tamanho - len(self.histograma)))
+                               + np.pad(outra.histograma, (0, tamanho - len(outra.histograma))))
+    
+    @property
+    def desvio_padrao(self) -> float:
+        return float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else float('nan')
+    
+    def _valor_na_posicao(self, posicao: int) -> float:
+        if self.histograma is not None:
+            return float(np.searchsorted(np.cumsum(self.histograma), posicao, side='right'))
+        
+        # Buckets em ordem crescente de valor: negativos, zeros, positivos
+        valores = [-2 * self.gamma ** k / (self.gamma + 1) for k in sorted(self.negativos, reverse=True)]
+        contagens = [self.negativos[k] for k in sorted(self.negativos, reverse=True)]
+        valores.append(0.0)
+        contagens.append(self.zeros)
+        valores.extend(2 * self.gamma ** k / (self.gamma + 1) for k in sorted(self.positivos))
+        contagens.extend(self.positivos[k] for k in sorted(self.positivos))
+        
+        indice = int(np.searchsorted(np.cumsum(contagens), posicao, side='right'))
+        return float(min(max(valores[indice], self.minimo), self.maximo))
+    
+    def quantil(self, q: float) -> float:
+        """Quantil com interpolação linear entre posições (mesma convenção do pandas)"""
+        posicao = q * (self.n - 1)
+        inferior, superior = int(np.floor(posicao)), int(np.ceil(posicao))
+        valor_inferior = self._valor_na_posicao(inferior)
+        if superior == inferior:
+            return valor_inferior
+        return valor_inferior + (self._valor_na_posicao(superior) - valor_inferior) * (posicao - inferior)
+    
+    def estado(self) -> Dict[str, Any]:
+        """Estado serializável em JSON (snapshot do modo incremental)"""
+        return {
+            'erro_relativo': self.erro_relativo,
+            'n': self.n,
+            'media': self.media,
+            'm2': self.m2,
+            'minimo': self.minimo if self.n else None,
+            'maximo': self.maximo if self.n else None,
+            'positivos': {str(k): v for k, v in self.positivos.items()},
+            'negativos': {str(k): v for k, v in self.negativos.items()},
+            'zeros': self.zeros,
+            'histograma': None if self.histograma is None else self.histograma.tolist()
+        }
+    
+    @classmethod
+    def de_estado(cls, estado: Dict[str, Any]) -> 'EstatisticaStreaming':
+        estatistica = cls(estado['erro_relativo'], inteira=estado['histograma'] is not None)
+        estatistica.n, estatistica.media, estatistica.m2 = estado['n'], estado['media'], estado['m2']
+        if estado['n']:
+            estatistica.minimo, estatistica.maximo = estado['minimo'], estado['maximo']
+        estatistica.positivos = Counter({int(k): v for k, v in estado['positivos'].items()})
+        estatistica.negativos = Counter({int(k): v for k, v in estado['negativos'].items()})
+        estatistica.zeros = estado['zeros']
+        if estado['histograma'] is not None:
+            estatistica.histograma = np.asarray(estado['histograma'], dtype=np.int64)
+        return estatistica
+    
+    def contar_intervalo(self, minimo_exclusivo: Optional[float], maximo_inclusivo: Optional[float]) -> int:
+        """Contagem exata em (minimo, maximo] a partir do histograma inteiro"""
+        valores = np.arange(len(self.histograma))
+        mascara = np.ones(len(valores), dtype=bool)
+        if minimo_exclusivo is not None:
+            mascara &= valores > minimo_exclusivo
+        if maximo_inclusivo is not None:
+            mascara &= valores <= maximo_inclusivo
+        return int(self.histograma[mascara].sum())
+
+
+class ContagemCategorias:
+    """Contagem exata em uma passada de uma coluna categórica (sexo)"""
+    
+    def __init__(self, categorias: List[str]):
+        self.categorias = categorias
+        self.contagens = np.zeros(len(categorias), dtype=np.int64)
+    
+    def adicionar(self, codigos: np.ndarray, ausentes: np.ndarray):
+        self.contagens += np.bincount(codigos[~ausentes].astype(np.int64), minlength=len(self.categorias))
+    
+    def remover(self, codigos: np.ndarray, ausentes: np.ndarray) -> bool:
+        self.contagens -= np.bincount(codigos[~ausentes].astype(np.int64), minlength=len(self.categorias))
+        return False
+    
+    def estado(self) -> Dict[str, Any]:
+        return {'categorias': self.categorias, 'contagens': self.contagens.tolist()}
+    
+    @classmethod
+    def de_estado(cls, estado: Dict[str, Any]) -> 'ContagemCategorias':
+        contagem = cls(estado['categorias'])
+        contagem.contagens = np.asarray(estado['contagens'], dtype=np.int64)
+        return contagem
+    
+    def distribuicao(self) -> Dict[str, int]:
+        ordem = np.argsort(-self.contagens, kind='stable')
+        return {self.categorias[i]: int(self.contagens[i]) for i in ordem if self.contagens[i] > 0}
+
+
+class ContagemDatas:
+    """Período e contagens por ano e mês de uma coluna de datas, em uma passada"""
+    
+    def __init__(self):
+        self.n = 0
+        self.minimo = None
+        self.maximo = None
+        self.anos = Counter()
+        self.meses = np.zeros(13, dtype=np.int64)
+    
+    def adicionar(self, valores: np.ndarray, ausentes: np.ndarray):
+        valores = valores[~ausentes]
+        if not len(valores):
+            return
+        self.n += len(valores)
+        self.minimo = valores.min() if self.minimo is None else min(self.minimo, valores.min())
+        self.maximo = valores.max() if self.maximo is None else max(self.maximo, valores.max())
+        anos = valores.astype('datetime64[Y]').astype(np.int64) + 1970
+        chaves, contagens = np.unique(anos, return_counts=True)
+        self.anos.update(dict(zip(chaves.tolist(), contagens.tolist())))
+        meses = valores.astype('datetime64[M]').astype(np.int64) % 12 + 1
+        self.meses += np.bincount(meses, minlength=13)
+    
+    def remover(self, valores: np.ndarray, ausentes: np.ndarray) -> bool:
+        """Retira datas já contadas; True se o período (mínimo/máximo) precisa ser refeito"""
+        valores = valores[~ausentes]
+        if not len(valores):
+            return False
+        self.n -= len(valores)
+        anos = valores.astype('datetime64[Y]').astype(np.int64) + 1970
+        chaves, contagens = np.unique(anos, return_counts=True)
+        self.anos.subtract(dict(zip(chaves.tolist(), contagens.tolist())))
+        self.anos = +self.anos
+        self.meses -= np.bincount(valores.astype('datetime64[M]').astype(np.int64) % 12 + 1, minlength=13)
+        if not self.n:
+            self.minimo = self.maximo = None
+            return False
+        return bool(valores.min() <= self.minimo or valores.max() >= self.maximo)
+    
+    def redefinir_extremos(self, valores: np.ndarray, ausentes: np.ndarray):
+        valores = valores[~ausentes]
+        self.minimo = valores.min() if len(valores) else None
+        self.maximo = valores.max() if len(valores) else None
+    
+    def estado(self) -> Dict[str, Any]:
+        return {
+            'n': self.n,
+            # datetime64[ns] como inteiros
+            'minimo': None if self.minimo is None else int(np.datetime64(self.minimo, 'ns').astype(np.int64)),
+            'maximo': None if self.maximo is None else int(np.datetime64(self.maximo, 'ns').astype(np.int64)),
+            'anos': {str(k): v for k, v in self.anos.items()},
+            'meses': self.meses.tolist()
+        }
+    
+    @classmethod
+    def de_estado(cls, estado: Dict[str, Any]) -> 'ContagemDatas':
+        contagem = cls()
+        contagem.n = estado['n']
+        if estado['minimo'] is not None:
+            contagem.minimo = np.datetime64(estado['minimo'], 'ns')
+            contagem.maximo = np.datetime64(estado['maximo'], 'ns')
+        contagem.anos = Counter({int(k): v for k, v in estado['anos'].items()})
+        contagem.meses = np.asarray(estado['meses'], dtype=np.int64)
+        return contagem
+    
+    def contagem_anos(self) -> pd.Series:
+        return pd.Series(dict(sorted(self.anos.items())), dtype=np.int64)
+    
+    def contagem_meses(self) -> pd.Series:
+        return pd.Series({mes: int(self.meses[mes]) for mes in range(1, 13) if self.meses[mes]}, dtype=np.int64)
+
+
+class AmostraReservatorio:
+    """Amostra aleatória uniforme de tamanho fixo sobre um fluxo de linhas (algoritmo R)"""
+    
+    def __init__(self, tamanho: int = 5, semente: int = 0):
+        self.tamanho = tamanho
+        self.gerador = np.random.default_rng(semente)
+        self.itens = []
+        self.vistos = 0
+    
+    def adicionar(self, df: pd.DataFrame):
+        inicio = 0
+        if len(self.itens) < self.tamanho:
+            inicio = min(len(df), self.tamanho - len(self.itens))
+            self.itens.extend(df.iloc[:inicio].to_dict('records'))
+        
+        if inicio < len(df):
+            posicoes_globais = np.arange(self.vistos + inicio, self.vistos + len(df))
+            sorteios = self.gerador.integers(0, posicoes_globais + 1)
+            for posicao in np.flatnonzero(sorteios < self.tamanho):
+                self.itens[sorteios[posicao]] = df.iloc[inicio + posicao].to_dict()
+        
+        self.vistos += len(df)
+
+
+class CarregadorAproximado(CarregadorColunar):
+    """Leitura de passada única do modo RAPIDO
+    
+    Em vez de guardar as colunas, alimenta acumuladores de tamanho fixo
+    (EstatisticaStreaming, ContagemCategorias, ContagemDatas) e mantém uma amostra
+    por reservatório. A memória não depende do número de linhas.
+    """
+    
+    def __init__(self, colunas_identificadas: Dict[str, Optional[str]],
+                 erro_relativo: float = ERRO_RELATIVO_QUANTIS, semente: int = 0):
+        super().__init__(colunas_identificadas)
+        self.reservatorio = AmostraReservatorio(semente=semente)
+        self.acumuladores = self.criar_acumuladores(self.colunas, erro_relativo)
+    
+    @staticmethod
+    def criar_acumuladores(papeis, erro_relativo: float = ERRO_RELATIVO_QUANTIS) -> Dict[str, Any]:
+        """Acumulador de tamanho fixo de cada papel tipado (chaves não são resumidas)"""
+        acumuladores = {}
+        for papel in papeis:
+            tipo = TIPOS_COLUNAS[papel]
+            if tipo == 'chave':
+                continue
+            if tipo == 'category':
+                acumuladores[papel] = ContagemCategorias(CATEGORIAS_SEXO)
+            elif tipo.startswith('datetime64'):
+                acumuladores[papel] = ContagemDatas()
+            else:
+                acumuladores[papel] = EstatisticaStreaming(erro_relativo, inteira=(tipo == 'int16'))
+        return acumuladores
+    
+    def _reservar(self, capacidade: int):
+        # Sem buffers por coluna
+        self.capacidade = capacidade
+    
+    def adicionar_bloco(self, df):
+        self.reservatorio.adicionar(df)
+        self.amostra = self.reservatorio.itens
+        
+        for papel, acumulador in self.acumuladores.items():
+            acumulador.adicionar(*self.converter(papel, df[self.colunas[papel]]))
+        
+        self.total_registros += len(df)
+        self.registros_validos += len(df.dropna(subset=self.colunas_validacao))
+    
+    def incorporar_colunas(self, valores: Dict[str, np.ndarray], ausentes: Dict[str, np.ndarray], total_registros: int):
+        # Colunas já tipadas entram nos acumuladores como um único bloco
+        for papel, acumulador in self.acumuladores.items():
+            acumulador.adicionar(np.asarray(valores[papel]), np.asarray(ausentes[papel]))
+        self.total_registros = total_registros
+    
+    def finalizar(self) -> Dict[str, Any]:
+        """Devolve os acumuladores por papel (no lugar das colunas tipadas)"""
+        return dict(self.acumuladores)
+
+
+class CarregadorResumo:
+    """Carregador já lido: contagens e amostra da leitura mais a tabela ou os acumuladores
+    
+    O modo incremental analisa massa e óbitos depois de todas as planilhas
+    lidas, a partir dos acumuladores atualizados pelo delta (ou da tabela
+    tipada, para planilhas fora do snapshot).
+    """
+    
+    def __init__(self, resumo: Dict[str, Any], dados):
+        self.colunas_identificadas = resumo['colunas_identificadas']
+        self.total_registros = resumo['total_registros']
+        self.registros_validos = resumo['registros_validos']
+        self.amostra = resumo['amostra']
+        self.datas = resumo.get('normalizacao_datas', {})
+        self.dados = dados
+    
+    def normalizacao_datas(self) -> Dict[str, Any]:
+        return self.datas
+    
+    def finalizar(self):
+        return self.dados
+
+
+ACUMULADORES = {classe.__name__: classe for classe in (EstatisticaStreaming, ContagemCategorias, ContagemDatas)}
+
+
+def anos_decimais(datas: np.ndarray) -> np.ndarray:
+    """Converte datas (datetime64) em anos decimais: ano + fração do ano decorrida; NaT vira NaN"""
+    dias = datas.astype('datetime64[D]')
+    anos = dias.astype('datetime64[Y]')
+    inicio_ano = anos.astype('datetime64[D]')
+    duracao_ano = ((anos + 1).astype('datetime64[D]') - inicio_ano).astype(np.float64)
+    resultado = anos.astype(np.int64) + 1970 + (dias - inicio_ano).astype(np.float64) / duracao_ano
+    resultado[np.isnat(dias)] = np.nan
+    return resultado
+
+
+def codigos_sexo_tabela(tabela: pd.DataFrame) -> np.ndarray:
+    """Código em CATEGORIAS_SEXO de cada linha (-1 para ausente ou sem a coluna)"""
+    if 'sexo' not in tabela:
+        return np.full(len(tabela), -1, dtype=np.int64)
+    return tabela['sexo'].cat.codes.to_numpy().astype(np.int64)
+
+
+def inteiros_tabela(tabela: pd.DataFrame, papel: str) -> np.ndarray:
+    """Coluna inteira como int64 (-1 para ausente ou sem a coluna)"""
+    if papel not in tabela:
+        return np.full(len(tabela), -1, dtype=np.int64)
+    return tabela[papel].to_numpy(dtype=np.float64, na_value=-1).astype(np.int64)
+
+
+def anos_decimais_tabela(tabela: pd.DataFrame, papel: str) -> np.ndarray:
+    """Coluna de datas em anos decimais (NaN para ausente ou sem a coluna)"""
+    if papel not in tabela:
+        return np.full(len(tabela), np.nan)
+    return anos_decimais(tabela[papel].to_numpy())
+
+
+def montar_tabela_nomes() -> Dict[int, str]:
+    """Tabela de str.translate: letras latinas sem acento em maiúsculas, o resto vira espaço"""
+    tabela = {}
+    for codigo in range(0x250):
+        base = unicodedata.normalize('NFKD', chr(codigo)).encode('ascii', 'ignore').decode().upper()
+        tabela[codigo] = base if len(base) == 1 and 'A' <= base <= 'Z' else ' '
+    # Ç soa como S (GONÇALVES/GONSALVES)
+    tabela[ord('Ç')] = tabela[ord('ç')] = 'S'
+    return tabela
+
+
+TABELA_NOMES = str.maketrans(montar_tabela_nomes())
+# str.translate que deixa só os dígitos ASCII (pontuação do CPF)
+TABELA_CPF = str.maketrans('', '', ''.join(chr(codigo) for codigo in range(128) if not chr(codigo).isdigit()))
+# Regras do código fonético, aplicadas em ordem sobre o nome já sem acentos
+REGRAS_FONETICAS = [(re.compile(padrao), troca) for padrao, troca in (
+    (r'^H', ''), (r'PH', 'F'), (r'TH', 'T'), (r'LH', 'L'), (r'NH', 'N'), (r'SCH|SH|CH', 'X'),
+    (r'Y', 'I'), (r'W', 'V'), (r'QU(?=[EI])', 'K'), (r'GU(?=[EI])', 'G'),
+    (r'Q', 'K'), (r'C(?=[EI])', 'S'), (r'C', 'K'), (r'G(?=[EI])', 'J'), (r'Z', 'S'), (r'H', ''), (r'M$', 'N')
+)]
+
+
+def codigo_fonetico(nome: str) -> str:
+    """Código fonético simplificado de um nome em português
+    
+    Aplica REGRAS_FONETICAS e fica com a primeira letra mais as consoantes
+    seguintes, sem repetições: SOUZA/SOUSA, LUIZ/LUIS, MANOEL/MANUEL e
+    RAFAEL/RAPHAEL dão o mesmo código.
+    """
+    for padrao, troca in REGRAS_FONETICAS:
+        nome = padrao.sub(troca, nome)
+    if not nome:
+        return ''
+    return nome[0] + re.sub(r'(.)\1+', r'\1', re.sub(r'[AEIOU]', '', nome[1:]))
+
+
+def normalizar_cpfs(valores: np.ndarray) -> np.ndarray:
+    """CPFs com 11 dígitos e dígitos verificadores válidos; None para ausentes ou malformados
+    
+    Pontuação é descartada e os zeros à esquerda perdidos em células numéricas
+    são repostos (9 a 11 dígitos); sequências de um só dígito são recusadas.
+    """
+    texto = [(valor if valor.isdigit() else valor.translate(TABELA_CPF)) if isinstance(valor, str) else ''
+             for valor in valores]
+    comprimentos = np.fromiter(map(len, texto), dtype=np.int64, count=len(texto))
+    candidatos = np.flatnonzero((comprimentos >= 9) & (comprimentos <= 11))
+    resultado = np.full(len(texto), None, dtype=object)
+    if not len(candidatos):
+        return resultado
+    
+    cpfs = np.array([texto[k].zfill(11) for k in candidatos], dtype='U11')
+    digitos = cpfs.view(np.uint32).reshape(-1, 11).astype(np.int64) - ord('0')
+    primeiro = digitos[:, :9] @ np.arange(10, 1, -1) * 10 % 11 % 10
+    segundo = digitos[:, :10] @ np.arange(11, 1, -1) * 10 % 11 % 10
+    validos = ((primeiro == digitos[:, 9]) & (segundo == digitos[:, 10]) & ((digitos >= 0) & (digitos <= 9)).all(axis=1)
+               & (digitos != digitos[:, :1]).any(axis=1))
+    resultado[candidatos[validos]] = cpfs[validos].astype(object)
+    return resultado
+
+
+def limpar_nome(nome: str) -> str:
+    """Nome sem acentos e pontuação, em maiúsculas e com os espaços colapsados"""
+    return ' '.join(nome.translate(TABELA_NOMES).split())
+
+
+def partes_nomes(nomes: np.ndarray):
+    """Primeiro e último pedaço de cada nome como escritos ('' quando ausente)
+    
+    A limpeza (limpar_nome) fica para os pedaços distintos, bem menos numerosos
+    que os registros; só os nomes terminados em sufixo de geração, número ou
+    pontuação são limpos inteiros para achar o último nome.
+    """
+    aparados = [nome.strip() if isinstance(nome, str) else '' for nome in nomes]
+    ultimos = [nome.rpartition(' ')[2] for nome in aparados]
+    for k in [k for k, ultimo in enumerate(ultimos) if ultimo and (not ultimo.isalpha() or ultimo.upper() in SUFIXOS_NOME)]:
+        palavras = [palavra for palavra in limpar_nome(aparados[k]).split() if palavra not in SUFIXOS_NOME]
+        ultimos[k] = palavras[-1] if palavras else ''
+    return [nome.partition(' ')[0] for nome in aparados], ultimos
+
+
+def pares_por_bloco(chaves_massa: np.ndarray, chaves_obitos: np.ndarray, limite: int):
+    """Pares (óbito, massa) que compartilham a chave de bloco; chaves negativas não formam pares
+    
+    A massa é ordenada uma vez e cada óbito acha o seu bloco por busca binária,
+    sem comparar registros de blocos diferentes. Blocos com mais de `limite`
+    registros da massa são ignorados. Devolve (óbitos, massa, óbitos cujo bloco foi ignorado).
+    """
+    validas = np.flatnonzero(chaves_massa >= 0)
+    ordem = validas[np.argsort(chaves_massa[validas], kind='stable')]
+    ordenadas = chaves_massa[ordem]
+    inicio = np.searchsorted(ordenadas, chaves_obitos, side='left')
+    tamanho = np.searchsorted(ordenadas, chaves_obitos, side='right') - inicio
+    tamanho[chaves_obitos < 0] = 0
+    grandes = tamanho > limite
+    tamanho[grandes] = 0
+    
+    obitos = np.repeat(np.arange(len(chaves_obitos)), tamanho)
+    deslocamento = np.arange(len(obitos)) - np.repeat(np.cumsum(tamanho) - tamanho, tamanho)
+    return obitos, ordem[np.repeat(inicio, tamanho) + deslocamento], grandes
+
+
+def atributos_ligacao(tabela: pd.DataFrame, linhas: np.ndarray) -> Dict[str, Any]:
+    """Nascimento (dias desde 1800, ano, mês, dia; -1 ausente), sexo e nome das linhas da ligação aproximada"""
+    if 'data_nascimento' in tabela:
+        nascimento = tabela['data_nascimento'].to_numpy()[linhas].astype('datetime64[D]')
+    else:
+        nascimento = np.full(len(linhas), np.datetime64('NaT'), dtype='datetime64[D]')
+    ausente = np.isnat(nascimento)
+    anos = nascimento.astype('datetime64[Y]')
+    meses = nascimento.astype('datetime64[M]')
+    sexo = codigos_sexo_tabela(tabela)[linhas]
+    nomes = tabela['nome'].to_numpy()[linhas] if 'nome' in tabela else np.full(len(linhas), None, dtype=object)
+    primeiros, ultimos = partes_nomes(nomes)
+    return {
+        'dias': np.where(ausente, -1, (nascimento - np.datetime64('1800-01-01', 'D')).astype(np.int64)),
+        'ano': np.where(ausente, -1, anos.astype(np.int64) + 1970),
+        'mes': np.where(ausente, -1, (meses - anos.astype('datetime64[M]')).astype(np.int64) + 1),
+        'dia': np.where(ausente, -1, (nascimento - meses.astype('datetime64[D]')).astype(np.int64) + 1),
+        'sexo': np.where(sexo == CATEGORIAS_SEXO.index('OUTROS'), -1, sexo),
+        'nomes': nomes,
+        'primeiros': primeiros,
+        'ultimos': ultimos
+    }
+
+
+def pontuar_pares(massa: Dict[str, Any], obitos: Dict[str, Any], i: np.ndarray, j: np.ndarray,
+                  minimo: float = -np.inf) -> np.ndarray:
+    """Pontuação de concordância (PESOS_LIGACAO) de cada par óbito i × massa j
+    
+    O nome completo, o único campo que exige limpar o texto, só é comparado nos
+    pares que ainda podem chegar a `minimo`.
+    """
+    pontos = np.zeros(len(i))
+    
+    def somar(campo, a, b):
+        concorda, discorda = PESOS_LIGACAO[campo]
+        presentes = (a >= 0) & (b >= 0)
+        pontos[presentes] += np.where(a == b, concorda, discorda)[presentes]
+        return presentes
+    
+    for campo in ('primeiro_nome', 'ultimo_nome', 'sexo'):
+        somar(campo, obitos[campo][i], massa[campo][j])
+    
+    presentes = somar('data_nascimento', obitos['dias'][i], massa['dias'][j])
+    campos_iguais = sum((obitos[campo][i] == massa[campo][j]).astype(np.int64) for campo in ('ano', 'mes', 'dia'))
+    trocados = ((obitos['ano'][i] == massa['ano'][j]) & (obitos['dia'][i] == massa['mes'][j])
+                & (obitos['mes'][i] == massa['dia'][j]) & (obitos['dia'][i] != obitos['mes'][i]))
+    parciais = presentes & ((campos_iguais == 2) | trocados)
+    pontos[parciais] += PESO_NASCIMENTO_PARCIAL - PESOS_LIGACAO['data_nascimento'][1]
+    
+    # Nome completo só pode coincidir se primeiro e último coincidem: limpa apenas esses pares
+    mesmos_nomes = np.flatnonzero((obitos['primeiro_nome'][i] >= 0) & (obitos['primeiro_nome'][i] == massa['primeiro_nome'][j])
+                                  & (obitos['ultimo_nome'][i] == massa['ultimo_nome'][j])
+                                  & (pontos + PESOS_LIGACAO['nome_completo'][0] >= minimo))
+    if len(mesmos_nomes):
+        limpos = {}
+        for tabela, atributos, linhas in (('obitos', obitos, i[mesmos_nomes]), ('massa', massa, j[mesmos_nomes])):
+            distintas = np.flatnonzero(np.bincount(linhas, minlength=len(atributos['dias'])))
+            nomes = np.full(len(atributos['dias']), '', dtype=object)
+            nomes[distintas] = [limpar_nome(atributos['nomes'][k]) for k in distintas]
+            limpos[tabela] = nomes[linhas]
+        pontos[mesmos_nomes] += np.where(limpos['obitos'] == limpos['massa'], *PESOS_LIGACAO['nome_completo'])
+    return pontos
+
+
+def ligar_aproximadamente(massa: pd.DataFrame, obitos: pd.DataFrame, pendentes: np.ndarray, elegiveis: np.ndarray,
+                          vinculo: np.ndarray, metodo: np.ndarray, motivos: np.ndarray, limiar: float,
+                          limite_bloco: int) -> Dict[str, Any]:
+    """Ligação aproximada dos óbitos pendentes (ver ligar_obitos_massa); atualiza vínculo, método e motivos
+    
+    elegiveis marca as linhas da massa que representam um participante (a
+    última de cada matrícula); as que já têm óbito ligado não são candidatas.
+    """
+    elegiveis = elegiveis.copy()
+    elegiveis[vinculo[vinculo >= 0]] = False
+    candidatos = np.flatnonzero(elegiveis)
+    a_massa, a_obitos = atributos_ligacao(massa, candidatos), atributos_ligacao(obitos, pendentes)
+    
+    # Primeiro e último nome das duas tabelas em códigos comuns: fonético e trigrama inicial
+    partes = [a_obitos['primeiros'], a_obitos['ultimos'], a_massa['primeiros'], a_massa['ultimos']]
+    codigos, unicos = pd.factorize(np.array([nome for parte in partes for nome in parte], dtype=object))
+    # Pedaços limpos: o primeiro nome fica com a primeira palavra e o último com a última
+    limpos = [limpar_nome(nome) for nome in unicos]
+    pedacos = np.array([nome.partition(' ')[0] for nome in limpos] + [nome.rpartition(' ')[2] for nome in limpos], dtype=object)
+    fonetico, _ = pd.factorize(np.array([codigo_fonetico(nome) for nome in pedacos], dtype=object))
+    trigrama, _ = pd.factorize(np.array([nome[:3] for nome in pedacos], dtype=object))
+    vazios = pedacos == ''
+    fonetico[vazios] = trigrama[vazios] = -1
+    inicios = np.cumsum([0] + [len(parte) for parte in partes])
+    for atributos, (primeiro, ultimo) in ((a_obitos, (0, 1)), (a_massa, (2, 3))):
+        codigos_primeiro = codigos[inicios[primeiro]:inicios[primeiro + 1]]
+        codigos_ultimo = codigos[inicios[ultimo]:inicios[ultimo + 1]] + len(unicos)
+        atributos['primeiro_nome'] = fonetico[codigos_primeiro]
+        atributos['ultimo_nome'] = fonetico[codigos_ultimo]
+        com_nome = atributos['primeiro_nome'] >= 0
+        atributos['blocos'] = [
+            atributos['dias'],
+            np.where(com_nome, atributos['primeiro_nome'] * (len(pedacos) + 1) + atributos['ultimo_nome'], -1),
+            np.where(com_nome & (atributos['ano'] >= 0),
+                     (trigrama[codigos_primeiro] * (len(pedacos) + 1) + trigrama[codigos_ultimo]) * 512
+                     + atributos['ano'] - ANO_MINIMO_DATA, -1)
+        ]
+    
+    pares_i, pares_j = [], []
+    grandes = np.zeros(len(pendentes), dtype=bool)
+    for chaves_massa, chaves_obitos in zip(a_massa['blocos'], a_obitos['blocos']):
+        i, j, ignorados = pares_por_bloco(chaves_massa, chaves_obitos, limite_bloco)
+        pares_i.append(i)
+        pares_j.append(j)
+        grandes |= ignorados
+    # Um par achado por mais de um bloco é comparado uma vez só
+    pares = np.sort(np.concatenate(pares_i) * np.int64(len(candidatos) + 1) + np.concatenate(pares_j))
+    pares = pares[np.r_[True, pares[1:] != pares[:-1]]] if len(pares) else pares
+    i, j = pares // (len(candidatos) + 1), pares % (len(candidatos) + 1)
+    motivos[pendentes] = 'sem_candidatos'
+    vencedores = np.zeros(0, dtype=np.int64)
+    
+    if len(pares):
+        pontos = pontuar_pares(a_massa, a_obitos, i, j, limiar)
+        
+        # Melhor par de cada óbito; empate no topo torna o óbito ambíguo
+        ordem = np.lexsort((-pontos, i))
+        i, j, pontos = i[ordem], j[ordem], pontos[ordem]
+        primeiros = np.flatnonzero(np.r_[True, i[1:] != i[:-1]])
+        proximos = np.minimum(primeiros + 1, len(i) - 1)
+        empatados = (proximos != primeiros) & (i[proximos] == i[primeiros]) & (pontos[proximos] == pontos[primeiros])
+        aceitos = primeiros[(pontos[primeiros] >= limiar) & ~empatados]
+        
+        # Participante disputado por mais de um óbito: fica com o de maior pontuação, se único
+        ordem = aceitos[np.lexsort((-pontos[aceitos], j[aceitos]))]
+        mesmo_participante = j[ordem][1:] == j[ordem][:-1]
+        validos = np.ones(len(ordem), dtype=bool)
+        validos[1:] &= ~mesmo_participante
+        validos[:-1] &= ~(mesmo_participante & (pontos[ordem][1:] == pontos[ordem][:-1]))
+        vencedores = ordem[validos]
+        
+        motivos[pendentes[i[primeiros]]] = 'abaixo_do_limiar'
+        motivos[pendentes[i[primeiros[empatados & (pontos[primeiros] >= limiar)]]]] = 'ambiguo'
+        motivos[pendentes[i[np.setdiff1d(aceitos, vencedores)]]] = 'ambiguo'
+        vinculo[pendentes[i[vencedores]]] = candidatos[j[vencedores]]
+        metodo[pendentes[i[vencedores]]] = METODOS_LIGACAO.index('aproximada')
+    
+    motivos_pendentes = motivos[pendentes][vinculo[pendentes] < 0]
+    return {
+        'limiar': limiar,
+        'obitos_avaliados': int(len(pendentes)),
+        'participantes_candidatos': int(len(candidatos)),
+        'comparacoes': int(len(pares)),
+        'obitos_em_blocos_grandes': int(grandes.sum()),
+        'ligados': int(len(vencedores)),
+        'ambiguos': int((motivos_pendentes == 'ambiguo').sum()),
+        'abaixo_do_limiar': int((motivos_pendentes == 'abaixo_do_limiar').sum()),
+        'sem_candidatos': int((motivos_pendentes == 'sem_candidatos').sum())
+    }
+
+
+def ligar_obitos_massa(massa: pd.DataFrame, obitos: pd.DataFrame, aproximada: bool = True,
+                       limiar: float = LIMIAR_LIGACAO_APROXIMADA, limite_bloco: int = LIMITE_BLOCO_LIGACAO):
+    """Liga cada óbito a um registro da massa; devolve (vínculo, método, resumo)
+    
+    Primeiro por junções exatas em tabela hash (pd.Index.get_indexer) na
+    matrícula e, para os óbitos que sobrarem, no CPF válido, sempre contra a
+    última ocorrência da chave na massa. Os ainda sem vínculo (chaves ausentes,
+    malformadas ou fora da massa) vão para a ligação aproximada: os candidatos
+    vêm só de blocos que compartilham a data de nascimento, o código fonético do
+    primeiro e do último nome ou os trigramas iniciais desses nomes com o ano de
+    nascimento, de modo que as comparações crescem com o número de óbitos e não
+    com o produto massa × óbitos. Vale o melhor par com pontuação (PESOS_LIGACAO)
+    de pelo menos `limiar`, sem empate e sem outro óbito disputando o participante.
+    vínculo é a linha da massa (-1 sem vínculo); método, o índice em METODOS_LIGACAO.
+    """
+    n = len(obitos)
+    vinculo = np.full(n, -1, dtype=np.int64)
+    metodo = np.full(n, -1, dtype=np.int8)
+    motivos = np.full(n, 'chave_nao_encontrada', dtype=object)
+    chaves = {}
+    com_chave = np.zeros(n, dtype=bool)
+    
+    def juntar(chaves_massa: np.ndarray, chaves_obitos: np.ndarray, codigo: int) -> np.ndarray:
+        """Junção exata contra a última ocorrência de cada chave; devolve essas linhas da massa"""
+        indice = pd.Index(chaves_massa)
+        ultimas = np.arange(len(indice))
+        if not indice.is_unique:
+            ultimas = np.flatnonzero(~indice.duplicated(keep='last'))
+            indice = indice[ultimas]
+        posicoes = indice.get_indexer(chaves_obitos)
+        encontrados = (posicoes >= 0) & pd.notna(chaves_obitos) & (vinculo < 0)
+        vinculo[encontrados] = ultimas[posicoes[encontrados]]
+        metodo[encontrados] = codigo
+        return ultimas
+    
+    # Linhas da massa que representam um participante: a última de cada matrícula (todas, sem a coluna)
+    elegiveis = np.ones(len(massa), dtype=bool)
+    if 'matricula' in obitos:
+        com_chave |= obitos['matricula'].notna().to_numpy()
+        chaves['matricula_ausente'] = int(n - com_chave.sum())
+    if 'matricula' in massa:
+        matriculas = massa['matricula'].to_numpy()
+        if 'matricula' in obitos:
+            ultimas = juntar(matriculas, obitos['matricula'].to_numpy(), METODOS_LIGACAO.index('matricula'))
+        else:
+            ultimas = np.flatnonzero(~pd.Index(matriculas).duplicated(keep='last'))
+        elegiveis[:] = pd.isna(matriculas)
+        elegiveis[ultimas] = True
+    
+    if 'cpf' in obitos:
+        cpf_obitos = normalizar_cpfs(obitos['cpf'].to_numpy())
+        chaves['cpf_ausente'] = int(obitos['cpf'].isna().sum())
+        chaves['cpf_invalido'] = int((obitos['cpf'].notna().to_numpy() & pd.isna(cpf_obitos)).sum())
+        com_chave |= pd.notna(cpf_obitos)
+        if 'cpf' in massa and (pd.notna(cpf_obitos) & (vinculo < 0)).any():
+            juntar(normalizar_cpfs(massa['cpf'].to_numpy()), cpf_obitos, METODOS_LIGACAO.index('cpf'))
+    motivos[(vinculo < 0) & ~com_chave] = 'sem_chave'
+    
+    resumo_aproximada = None
+    pendentes = np.flatnonzero(vinculo < 0)
+    comuns = [papel for papel in ('nome', 'data_nascimento') if papel in massa and papel in obitos]
+    if aproximada and len(pendentes) and comuns:
+        resumo_aproximada = ligar_aproximadamente(massa, obitos, pendentes, elegiveis, vinculo, metodo, motivos,
+                                                  limiar, limite_bloco)
+    
+    ligados = int((vinculo >= 0).sum())
+    nao_ligados = np.flatnonzero(vinculo < 0)
+    exemplos = []
+    for k in nao_ligados[:LIMITE_OBITOS_NAO_LIGADOS]:
+        exemplo = {'registro': int(k)}
+        for papel in ('matricula', 'nome', 'data_nascimento', 'data_obito'):
+            if papel in obitos:
+                valor = obitos[papel].iat[k]
+                exemplo[papel] = None if pd.isna(valor) else (
+                    str(valor)[:10] if papel.startswith('data_') else valor)
+        exemplo['motivo'] = motivos[k]
+        exemplos.append(exemplo)
+    
+    resumo = {
+        'obitos': n,
+        'ligados': ligados,
+        'taxa_ligacao': ligados / n if n else None,
+        'por_metodo': {
+            nome: {'ligados': int((metodo == codigo).sum()), 'taxa': float((metodo == codigo).sum() / n) if n else None}
+            for codigo, nome in enumerate(METODOS_LIGACAO)
+        },
+        'chaves': chaves,
+        'aproximada': resumo_aproximada,
+        'nao_ligados': int(len(nao_ligados)),
+        'motivos_nao_ligados': dict(Counter(motivos[nao_ligados].tolist())),
+        'obitos_nao_ligados': exemplos
+    }
+    return vinculo, metodo, resumo
+
+
+class MotorExposicao:
+    """Exposição ao risco e óbitos observados/esperados por ano × sexo × idade
+    
+    Os acumuladores são arrays densos [ano, sexo, idade] preenchidos com
+    np.bincount; o único laço em Python percorre os anos-calendário do período.
+    Idades são completas (último aniversário) e a idade máxima funciona como
+    grupo aberto. Datas entram como anos decimais (anos_decimais). O eixo do
+    meio tem um grupo por sexo; o CuboAgregado usa sexo × situação (grupos).
+    """
+    
+    def __init__(self, ano_inicial: int, ano_final: int, idade_maxima: int = 120, grupos: int = len(CATEGORIAS_SEXO)):
+        self.ano_inicial = ano_inicial
+        self.ano_final = ano_final
+        self.idade_maxima = idade_maxima
+        self.forma = (ano_final - ano_inicial + 1, grupos, idade_maxima + 1)
+        self.exposicao_central = np.zeros(self.forma)
+        # Complemento dos óbitos até o próximo aniversário (exposição inicial)
+        self.complemento_obitos = np.zeros(self.forma)
+        self.obitos = np.zeros(self.forma)
+        self.metodo = None
+    
+    def _acumular(self, destino: np.ndarray, ano, sexo, idade, pesos=None):
+        ano = np.broadcast_to(np.asarray(ano, dtype=np.int64), np.shape(sexo))
+        validos = (idade >= 0) & (ano >= self.ano_inicial) & (ano <= self.ano_final)
+        if pesos is not None:
+            validos &= pesos > 0
+            pesos = pesos[validos]
+        indices = np.ravel_multi_index(
+            (ano[validos] - self.ano_inicial, sexo[validos], np.minimum(idade[validos], self.idade_maxima)),
+            self.forma
+        )
+        destino += np.bincount(indices, weights=pesos, minlength=destino.size).reshape(self.forma)
+    
+    def expor_por_datas(self, sexo: np.ndarray, nascimento: np.ndarray, entrada: Optional[np.ndarray] = None,
+                        saida: Optional[np.ndarray] = None, morte: Optional[np.ndarray] = None):
+        """Exposição central fracionária a partir das datas de nascimento, entrada, saída e óbito
+        
+        Cada participante fica exposto de max(entrada, início do período) até
+        min(saída, óbito, fim do período). Dentro de cada ano o intervalo é
+        partido no aniversário, quando a idade muda.
+        """
+        self.metodo = 'datas'
+        inicio = np.full(len(sexo), float(self.ano_inicial))
+        if entrada is not None:
+            inicio = np.fmax(inicio, entrada)
+        fim = np.full(len(sexo), float(self.ano_final + 1))
+        for limite in (saida, morte):
+            if limite is not None:
+                fim = np.fmin(fim, limite)
+        
+        expostos = np.isfinite(nascimento) & (fim > inicio)
+        sexo, nascimento, inicio, fim = sexo[expostos], nascimento[expostos], inicio[expostos], fim[expostos]
+        ano_nascimento = np.floor(nascimento)
+        fracao_nascimento = nascimento - ano_nascimento
+        
+        for ano in range(self.ano_inicial, self.ano_final + 1):
+            a = np.clip(inicio, ano, ano + 1)
+            b = np.clip(fim, ano, ano + 1)
+            presentes = b > a
+            if not presentes.any():
+                continue
+            a, b = a[presentes], b[presentes]
+            aniversario = ano + fracao_nascimento[presentes]
+            idade_antes = (ano - ano_nascimento[presentes] - 1).astype(np.int64)
+            sexo_ano = sexo[presentes]
+            self._acumular(self.exposicao_central, ano, sexo_ano, idade_antes,
+                           np.clip(np.minimum(b, aniversario) - a, 0, None))
+            self._acumular(self.exposicao_central, ano, sexo_ano, idade_antes + 1,
+                           np.clip(b - np.maximum(a, aniversario), 0, None))
+    
+    def expor_por_censo(self, sexo: np.ndarray, idade: np.ndarray, ano: np.ndarray):
+        """Massa recenseada por ano: cada registro vale um ano de exposição em (ano, sexo, idade)"""
+        self.metodo = 'censo'
+        self._acumular(self.exposicao_central, ano, sexo, idade)
+    
+    def registrar_obitos(self, sexo: np.ndarray, idade: np.ndarray, ano: np.ndarray,
+                         fracao_idade: Optional[np.ndarray] = None):
+        """Óbitos por (ano do óbito, sexo, idade no óbito)
+        
+        fracao_idade é a parte do ano de idade já vivida no óbito; o restante
+        até o próximo aniversário entra na exposição inicial.
+        """
+        self._acumular(self.obitos, ano, sexo, idade)
+        if fracao_idade is not None:
+            self._acumular(self.complemento_obitos, ano, sexo, idade, 1 - fracao_idade)
+    
+    def combinar(self, outro: 'MotorExposicao', sinal: float = 1.0):
+        """Soma (sinal 1) ou retira (sinal -1) os acumuladores de outro motor do mesmo período"""
+        for nome in ('exposicao_central', 'complemento_obitos', 'obitos'):
+            combinado = getattr(self, nome) + sinal * getattr(outro, nome)
+            # Resíduos de arredondamento da subtração não viram células expostas
+            combinado[np.abs(combinado) < 1e-9] = 0.0
+            setattr(self, nome, combinado)
+        self.metodo = self.metodo or outro.metodo
+    
+    @property
+    def exposicao_inicial(self) -> np.ndarray:
+        return self.exposicao_central + self.complemento_obitos
+    
+    def qx_efetivo(self, qx: np.ndarray) -> np.ndarray:
+        """qx[sexo, idade] que reproduz no período os esperados de uma tábua qx[ano, sexo, idade]"""
+        if qx.ndim == 2:
+            return qx
+        inicial = self.exposicao_inicial
+        total = inicial.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            efetivo = (inicial * qx).sum(axis=0) / total
+        # Sem exposição na célula: média dos anos
+        return np.where(total > 0, efetivo, qx.mean(axis=0))
+    
+    def resumir(self, qx: np.ndarray) -> Dict[str, Any]:
+        """Aplica a tábua qx[sexo, idade] (ou qx[ano, sexo, idade], com melhoria) à exposição inicial
+        e resume observados, esperados e A/E"""
+        inicial = self.exposicao_inicial
+        por_ano_qx = qx.ndim == 3
+        qx = np.broadcast_to(qx, self.forma)
+        sem_qx = ~np.isfinite(qx)
+        esperados = inicial * np.where(sem_qx, 0.0, qx)
+        
+        def indicadores(central, inicial, observados, esperados) -> Dict[str, Any]:
+            return {
+                'exposicao_central': round(float(central), 4),
+                'exposicao_inicial': round(float(inicial), 4),
+                'obitos_observados': int(round(float(observados))),
+                'obitos_esperados': round(float(esperados), 4),
+                'razao_ae': round(float(observados / esperados), 4) if esperados > 0 else None
+            }
+        
+        def por_eixo(eixos):
+            return [a.sum(axis=eixos) for a in (self.exposicao_central, inicial, self.obitos, esperados)]
+        
+        por_sexo = por_eixo((0, 2))
+        por_ano = por_eixo((1, 2))
+        por_idade_sexo = por_eixo(0)
+        
+        def qx_aplicado(sexo, idade):
+            if sem_qx[:, sexo, idade].all():
+                return None
+            if not por_ano_qx:
+                return float(qx[0, sexo, idade])
+            # qx variando por ano: taxa efetiva, esperados sobre a exposição inicial da célula
+            exposicao = por_idade_sexo[1][sexo, idade]
+            return float(por_idade_sexo[3][sexo, idade] / exposicao) if exposicao > 0 else None
+        
+        linhas = []
+        for sexo, idade in zip(*np.nonzero((por_idade_sexo[1] > 0) | (por_idade_sexo[2] > 0))):
+            linhas.append({
+                'sexo': CATEGORIAS_SEXO[sexo],
+                'sexo_codigo': int(sexo) + 1,
+                'idade': int(idade),
+                'qx_aplicado': qx_aplicado(sexo, idade),
+                **indicadores(*(a[sexo, idade] for a in por_idade_sexo))
+            })
+        
+        return {
+            'metodo': self.metodo,
+            'periodo': {'ano_inicial': self.ano_inicial, 'ano_final': self.ano_final},
+            'idade_maxima': self.idade_maxima,
+            'totais': indicadores(*(a.sum() for a in (self.exposicao_central, inicial, self.obitos, esperados))),
+            'exposicao_sem_qx': round(float((inicial * sem_qx).sum()), 4),
+            'por_sexo': {
+                CATEGORIAS_SEXO[sexo]: indicadores(*(a[sexo] for a in por_sexo))
+                for sexo in range(len(CATEGORIAS_SEXO)) if por_sexo[1][sexo] > 0 or por_sexo[2][sexo] > 0
+            },
+            'por_ano': {
+                str(self.ano_inicial + indice): indicadores(*(a[indice] for a in por_ano))
+                for indice in range(self.forma[0])
+            },
+            'por_idade_sexo': linhas
+        }
+
+
+class CuboAgregado:
+    """Agregados por ano × sexo × idade × situação, reagrupados por faixa e filtro sem refazer a análise
+    
+    Cada medida é um array denso float64 [ano, sexo, idade, situação], com
+    idades completas de 0 a idade_maxima (grupo aberto) e a situação do
+    participante no ano-calendário (SITUACOES_CUBO: ativo, saída ou óbito no
+    ano). 'participantes' conta os expostos no ano pela idade no início da
+    exposição no ano e 'salarios' soma o salário deles; exposição central e
+    inicial e óbitos observados e esperados são os do MotorExposicao,
+    repartidos pela situação. agregar filtra os eixos e soma faixas etárias com
+    np.add.reduceat, sem voltar à planilha; o cubo é gravado compactado
+    (np.savez_compressed) com os metadados em JSON.
+    """
+    
+    VERSAO = 1
+    MEDIDAS = ('participantes', 'salarios', 'exposicao_central', 'exposicao_inicial', 'obitos', 'obitos_esperados')
+    EIXOS = ('ano', 'sexo', 'faixa', 'situacao')
+    
+    def __init__(self, ano_inicial: int, medidas: Dict[str, np.ndarray], metadados: Optional[Dict[str, Any]] = None):
+        self.ano_inicial = ano_inicial
+        self.medidas = medidas
+        self.metadados = metadados or {}
+    
+    @property
+    def forma(self) -> tuple:
+        return self.medidas['participantes'].shape
+    
+    @property
+    def idade_maxima(self) -> int:
+        return self.forma[2] - 1
+    
+    @classmethod
+    def montar(cls, motor: MotorExposicao, dados: Dict[str, np.ndarray], massa: pd.DataFrame, por_datas: bool,
+               qx: np.ndarray) -> 'CuboAgregado':
+        """Cubo do período do motor a partir dos arrays de dados_exposicao e da tábua aplicada
+        
+        Por datas, a exposição de quem sai ou morre no período é partida em dois
+        trechos: até 1º de janeiro do ano do evento (ativo) e dali até o evento
+        (saída ou óbito), e os trechos passam pelo mesmo expor_por_datas do
+        motor com o grupo sexo × situação. No censo cada registro fica no ano do
+        cadastro, como óbito se o participante ligado morreu naquele ano.
+        """
+        situacoes = len(SITUACOES_CUBO)
+        ativo, saida, obito = (SITUACOES_CUBO.index(nome) for nome in ('ativo', 'saida', 'obito'))
+        cubo = MotorExposicao(motor.ano_inicial, motor.ano_final, motor.idade_maxima, len(CATEGORIAS_SEXO) * situacoes)
+        forma = (motor.forma[0], len(CATEGORIAS_SEXO), motor.forma[2], situacoes)
+        sexo = dados['sexo_massa']
+        salario = (massa['salario'].to_numpy(dtype=np.float64, na_value=np.nan) if 'salario' in massa
+                   else np.full(len(massa), np.nan))
+        salario = np.nan_to_num(salario, nan=0.0)
+        contados = dados['contados']
+        
+        def acumular_contagens(ano, sexo, idade, situacao, selecao):
+            # Participantes e salários por célula; idades negativas ou fora do período ficam de fora
+            validos = selecao & (idade >= 0) & (ano >= motor.ano_inicial) & (ano <= motor.ano_final)
+            indices = np.ravel_multi_index((ano[validos] - motor.ano_inicial, sexo[validos],
+                                            np.minimum(idade[validos], motor.idade_maxima), situacao[validos]), forma)
+            participantes[:] += np.bincount(indices, minlength=participantes.size).reshape(forma)
+            salarios[:] += np.bincount(indices, weights=salario[validos], minlength=salarios.size).reshape(forma)
+        
+        participantes, salarios = np.zeros(forma), np.zeros(forma)
+        if por_datas:
+            nascimento = dados['nascimento_massa']
+            inicio = np.fmax(np.full(len(sexo), float(motor.ano_inicial)), anos_decimais_tabela(massa, 'data_entrada'))
+            saida_massa, morte = anos_decimais_tabela(massa, 'data_saida'), dados['morte_massa']
+            fim = np.fmin(np.fmin(np.full(len(sexo), float(motor.ano_final + 1)), saida_massa), morte)
+            # Evento que encerra a exposição dentro do período; no empate o óbito prevalece
+            situacao = np.where(fim == morte, obito, np.where(fim == saida_massa, saida, ativo))
+            corte = np.where(situacao != ativo, np.floor(np.where(np.isfinite(fim), fim, 0)), fim)
+            cubo.expor_por_datas(sexo * situacoes + ativo, nascimento, inicio, corte)
+            terminal = situacao != ativo
+            cubo.expor_por_datas(sexo[terminal] * situacoes + situacao[terminal], nascimento[terminal],
+                                 np.fmax(inicio, corte)[terminal], fim[terminal])
+            cubo.registrar_obitos(dados['sexo_obito'][contados] * situacoes + obito, dados['idade_obito'][contados],
+                                  dados['ano_obito'][contados], dados['fracao_idade'][contados])
+            
+            expostos = np.isfinite(nascimento) & (fim > inicio)
+            ano_evento = np.floor(np.where(terminal, corte, np.nan))
+            for ano in range(motor.ano_inicial, motor.ano_final + 1):
+                a = np.clip(inicio, ano, ano + 1)
+                presentes = expostos & (np.clip(fim, ano, ano + 1) > a)
+                idade = np.floor(np.where(presentes, a - nascimento, -1)).astype(np.int64)
+                acumular_contagens(np.full(len(sexo), ano), sexo, idade,
+                                   np.where(ano_evento == ano, situacao, ativo), presentes)
+        else:
+            ano_cadastro, idade = inteiros_tabela(massa, 'ano_cadastro'), inteiros_tabela(massa, 'idade')
+            ano_morte = np.full(len(sexo), -1)
+            ligados = contados & dados['ligados']
+            ano_morte[dados['vinculo'][ligados]] = dados['ano_obito'][ligados]
+            situacao = np.where(ano_morte == ano_cadastro, obito, ativo)
+            cubo.expor_por_censo(sexo * situacoes + situacao, idade, ano_cadastro)
+            cubo.registrar_obitos(dados['sexo_obito'][contados] * situacoes + obito,
+                                  dados['idade_obito'][contados], dados['ano_obito'][contados])
+            acumular_contagens(ano_cadastro, sexo, idade, situacao, np.ones(len(sexo), dtype=bool))
+        
+        def eixos_cubo(array):
+            # [ano, sexo × situação, idade] → [ano, sexo, idade, situação]
+            return array.reshape(motor.forma[0], len(CATEGORIAS_SEXO), situacoes, motor.forma[2]).transpose(0, 1, 3, 2)
+        
+        inicial = eixos_cubo(cubo.exposicao_inicial)
+        qx = np.broadcast_to(qx, motor.forma)
+        medidas = {
+            'participantes': participantes,
+            'salarios': salarios,
+            'exposicao_central': eixos_cubo(cubo.exposicao_central),
+            'exposicao_inicial': inicial,
+            'obitos': eixos_cubo(cubo.obitos),
+            'obitos_esperados': inicial * np.where(np.isfinite(qx), qx, 0.0)[..., np.newaxis]
+        }
+        return cls(motor.ano_inicial, {nome: np.ascontiguousarray(array) for nome, array in medidas.items()},
+                   {'metodo': motor.metodo, 'salario': 'salario' in massa})
+    
+    def gravar(self, caminho: str):
+        os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+        metadados = {**self.metadados, 'versao': self.VERSAO, 'ano_inicial': self.ano_inicial}
+        temporario = f'{caminho}.{os.getpid()}.tmp'
+        # Arquivo aberto: np.savez_compressed não acrescenta a extensão ao temporário
+        with open(temporario, 'wb') as arquivo:
+            np.savez_compressed(arquivo, metadados=np.array(json.dumps(metadados, ensure_ascii=False, default=str)),
+                                **self.medidas)
+        os.replace(temporario, caminho)
+    
+    @classmethod
+    def carregar(cls, caminho: str) -> 'CuboAgregado':
+        with np.load(caminho) as arrays:
+            metadados = json.loads(str(arrays['metadados']))
+            if metadados.get('versao') != cls.VERSAO:
+                raise ValueError(f'Cubo de outra versão: {caminho}')
+            medidas = {nome: arrays[nome] for nome in cls.MEDIDAS}
+        return cls(int(metadados['ano_inicial']), medidas, metadados)
+    
+    def totais(self) -> Dict[str, Any]:
+        return self.agregar(por=())['totais']
+    
+    def agregar(self, tamanho_faixa: int = 1, por=('faixa',), sexos=None, anos=None, situacoes=None,
+                idade_minima: Optional[int] = None, idade_maxima: Optional[int] = None) -> Dict[str, Any]:
+        """Medidas somadas por faixa etária e pelos eixos em `por` (ano, sexo, faixa, situacao)
+        
+        As faixas têm tamanho_faixa anos a partir da idade 0, como nos testes de
+        aderência; a última inclui o grupo aberto. sexos (nomes ou códigos de
+        MAPA_SEXO), anos e situacoes filtram os eixos, e idade_minima e
+        idade_maxima recortam as idades antes do agrupamento.
+        """
+        por = tuple(por)
+        desconhecidos = set(por) - set(self.EIXOS)
+        if desconhecidos:
+            raise ValueError(f'Eixos desconhecidos: {sorted(desconhecidos)}')
+        tamanho_faixa = max(1, int(tamanho_faixa))
+        
+        anos_cubo = np.arange(self.ano_inicial, self.ano_inicial + self.forma[0])
+        indices_anos = np.arange(len(anos_cubo)) if anos is None else np.flatnonzero(np.isin(anos_cubo, list(anos)))
+        if sexos is None:
+            indices_sexos = np.arange(len(CATEGORIAS_SEXO))
+        else:
+            nomes = [MAPA_SEXO.get(str(sexo).strip().upper(), str(sexo).strip().upper()) for sexo in sexos]
+            invalidos = [nome for nome in nomes if nome not in CATEGORIAS_SEXO]
+            if invalidos:
+                raise ValueError(f'Sexo inválido: {invalidos}')
+            indices_sexos = np.array(sorted({CATEGORIAS_SEXO.index(nome) for nome in nomes}), dtype=np.int64)
+        if situacoes is None:
+            indices_situacoes = np.arange(len(SITUACOES_CUBO))
+        else:
+            invalidas = [situacao for situacao in situacoes if situacao not in SITUACOES_CUBO]
+            if invalidas:
+                raise ValueError(f'Situação inválida: {invalidas}')
+            indices_situacoes = np.array(sorted({SITUACOES_CUBO.index(situacao) for situacao in situacoes}), dtype=np.int64)
+        idades = np.arange(max(0, idade_minima or 0), min(self.idade_maxima, self.idade_maxima if idade_maxima is None else idade_maxima) + 1)
+        
+        faixas = idades // tamanho_faixa
+        inicios = np.flatnonzero(np.r_[True, faixas[1:] != faixas[:-1]]) if len(idades) else np.array([], dtype=np.int64)
+        somas = {}
+        for nome in self.MEDIDAS:
+            selecao = self.medidas[nome][np.ix_(indices_anos, indices_sexos, idades, indices_situacoes)]
+            if len(inicios):
+                selecao = np.add.reduceat(selecao, inicios, axis=2)
+            somas[nome] = selecao.sum(axis=tuple(eixo for eixo, nome_eixo in enumerate(self.EIXOS) if nome_eixo not in por),
+                                      keepdims=True)
+        
+        rotulos = {
+            'ano': [int(anos_cubo[indice]) for indice in indices_anos],
+            'sexo': [CATEGORIAS_SEXO[indice] for indice in indices_sexos],
+            'faixa': [(int(idades[inicio]), int(idades[fim - 1]))
+                      for inicio, fim in zip(inicios, list(inicios[1:]) + [len(idades)])],
+            'situacao': [SITUACOES_CUBO[indice] for indice in indices_situacoes]
+        }
+        
+        def indicadores(valores: Dict[str, float]) -> Dict[str, Any]:
+            linha = {nome: round(float(valor), 4) for nome, valor in valores.items()}
+            linha['participantes'] = int(round(valores['participantes']))
+            linha['salario_medio'] = (round(float(valores['salarios'] / valores['participantes']), 2)
+                                      if valores['participantes'] > 0 else None)
+            linha['taxa_bruta'] = (round(float(valores['obitos'] / valores['exposicao_inicial']), 6)
+                                   if valores['exposicao_inicial'] > 0 else None)
+            linha['razao_ae'] = (round(float(valores['obitos'] / valores['obitos_esperados']), 4)
+                                 if valores['obitos_esperados'] > 0 else None)
+            return linha
+        
+        linhas = []
+        ocupadas = np.zeros(somas['participantes'].shape, dtype=bool)
+        for nome in self.MEDIDAS:
+            ocupadas |= somas[nome] != 0
+        for celula in zip(*np.nonzero(ocupadas)):
+            linha = {}
+            for eixo, posicao in zip(self.EIXOS, celula):
+                if eixo not in por:
+                    continue
+                if eixo == 'faixa':
+                    inicio, fim = rotulos['faixa'][posicao]
+                    aberta = fim == self.idade_maxima
+                    linha['faixa'] = f'{inicio}+' if aberta else (str(inicio) if inicio == fim else f'{inicio}-{fim}')
+                    linha['idade_inicial'], linha['idade_final'] = inicio, None if aberta else fim
+                else:
+                    linha[eixo] = rotulos[eixo][posicao]
+            linha.update(indicadores({nome: somas[nome][celula] for nome in self.MEDIDAS}))
+            linhas.append(linha)
+        
+        return {
+            'consulta': {
+                'tamanho_faixa': tamanho_faixa, 'por': list(por), 'anos': rotulos['ano'], 'sexos': rotulos['sexo'],
+                'situacoes': rotulos['situacao'],
+                'idades': [int(idades[0]), int(idades[-1])] if len(idades) else None
+            },
+            'linhas': linhas,
+            'totais': indicadores({nome: somas[nome].sum() for nome in self.MEDIDAS})
+        }
+
+
+def completar_tabua_qx(qx: np.ndarray) -> Optional[np.ndarray]:
+    """Completa uma tábua [sexo, idade]: OUTROS usa o qx geral (ou a média dos sexos),
+    sexos sem valores usam o geral e idades acima da última repetem o último qx"""
+    if not np.isfinite(qx[2]).any():
+        disponiveis = np.isfinite(qx[:2])
+        qx[2] = np.where(disponiveis.any(axis=0), np.nansum(qx[:2], axis=0) / np.maximum(disponiveis.sum(axis=0), 1), np.nan)
+    for linha in (0, 1):
+        if not np.isfinite(qx[linha]).any():
+            qx[linha] = qx[2]
+    
+    for linha in range(len(qx)):
+        conhecidas = np.flatnonzero(np.isfinite(qx[linha]))
+        if len(conhecidas):
+            qx[linha, conhecidas[-1] + 1:] = qx[linha, conhecidas[-1]]
+    
+    return qx if np.isfinite(qx).any() else None
+
+
+def estatisticas_aderencia(o: np.ndarray, e: np.ndarray, correcao_continuidade: bool = False) -> tuple:
+    """(grupos válidos, qui-quadrado, razão de verossimilhança) somando o último eixo
+    
+    o e e são óbitos observados e esperados por grupo, em qualquer forma que
+    se combine por broadcasting (ex.: réplicas × tábuas × grupos). Grupos com
+    esperado zero ficam fora.
+    """
+    o, e = np.broadcast_arrays(o, e)
+    validos = e > 0
+    e_seguro = np.where(validos, e, 1.0)
+    
+    # Qui-quadrado (com correção de Yates opcional)
+    diferenca = np.abs(o - e)
+    if correcao_continuidade:
+        diferenca = np.maximum(diferenca - 0.5, 0)
+    qui_quadrado = np.where(validos, diferenca ** 2 / e_seguro, 0).sum(axis=-1)
+    
+    # Razão de verossimilhança (deviance de Poisson)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        termo_log = np.where(o > 0, o * np.log(np.where(o > 0, o, 1) / e_seguro), 0)
+    razao_verossimilhanca = 2 * np.where(validos, termo_log - (o - e), 0).sum(axis=-1)
+    return validos.sum(axis=-1), qui_quadrado, razao_verossimilhanca
+
+
+def testar_aderencia_lote(observados: np.ndarray, exposicao: np.ndarray, tabuas: np.ndarray,
+                          tamanho_faixa: int = 1, nivel_significancia: float = 0.05,
+                          correcao_continuidade: bool = False) -> Dict[str, np.ndarray]:
+    """Qui-quadrado, razão de verossimilhança e Kolmogorov–Smirnov contra várias tábuas de uma vez
+    
+    observados e exposicao são matrizes [sexo, idade] (óbitos e exposição
+    inicial); tabuas é [tábua, sexo, idade]. Os esperados de todas as tábuas
+    saem de um único produto e o agrupamento em faixas etárias (por sexo) é
+    feito com np.add.reduceat, sem laços por tábua. Grupos com esperado zero
+    ficam fora dos testes de cada tábua. O KS compara as distribuições
+    acumuladas por idade (sexos somados) e é aproximado para dados agrupados.
+    """
+    numero_idades = observados.shape[1]
+    faixa = np.arange(numero_idades) // max(1, int(tamanho_faixa))
+    numero_faixas = faixa[-1] + 1
+    
+    # Células com exposição, agrupadas por (sexo, faixa)
+    sexo, idade = np.nonzero(exposicao > 0)
+    grupo = sexo * numero_faixas + faixa[idade]
+    ordem = np.argsort(grupo, kind='stable')
+    sexo, idade, grupo = sexo[ordem], idade[ordem], grupo[ordem]
+    inicios = np.flatnonzero(np.r_[True, np.diff(grupo) != 0])
+    
+    esperados_celulas = exposicao[sexo, idade] * np.nan_to_num(tabuas[:, sexo, idade])
+    o = np.add.reduceat(observados[sexo, idade], inicios)
+    e = np.add.reduceat(esperados_celulas, inicios, axis=1)
+    grupos_validos, qui_quadrado, razao_verossimilhanca = estatisticas_aderencia(o, e, correcao_continuidade)
+    graus_liberdade = np.maximum(grupos_validos - 1, 1)
+    
+    # Kolmogorov–Smirnov sobre as faixas etárias (sexos somados)
+    faixas_ordem = np.argsort(faixa[idade], kind='stable')
+    faixa_celula = faixa[idade][faixas_ordem]
+    inicios_faixa = np.flatnonzero(np.r_[True, np.diff(faixa_celula) != 0])
+    o_faixa = np.add.reduceat(observados[sexo, idade][faixas_ordem], inicios_faixa)
+    e_faixa = np.add.reduceat(esperados_celulas[:, faixas_ordem], inicios_faixa, axis=1)
+    total_observado = o_faixa.sum()
+    total_esperado = e_faixa.sum(axis=1, keepdims=True)
+    if total_observado > 0:
+        acumulada_o = np.cumsum(o_faixa) / total_observado
+        acumulada_e = np.cumsum(e_faixa, axis=1) / np.where(total_esperado > 0, total_esperado, 1)
+        ks = np.abs(acumulada_e - acumulada_o).max(axis=1)
+        ks_valor_p = stats.kstwo.sf(ks, max(int(round(total_observado)), 1))
+    else:
+        ks = np.full(len(tabuas), np.nan)
+        ks_valor_p = np.full(len(tabuas), np.nan)
+    
+    return {
+        'grupos': np.full(len(tabuas), len(inicios)),
+        'grupos_validos': grupos_validos,
+        'graus_liberdade': graus_liberdade,
+        'qui_quadrado': qui_quadrado,
+        'qui_quadrado_valor_p': stats.chi2.sf(qui_quadrado, graus_liberdade),
+        'valor_critico': stats.chi2.isf(nivel_significancia, graus_liberdade),
+        'razao_verossimilhanca': razao_verossimilhanca,
+        'razao_verossimilhanca_valor_p': stats.chi2.sf(razao_verossimilhanca, graus_liberdade),
+        'ks': ks,
+        'ks_valor_p': ks_valor_p,
+        'obitos_observados': np.full(len(tabuas), float(o.sum())),
+        'obitos_esperados': e.sum(axis=1)
+    }
+
+
+def graduar_whittaker_henderson(taxas: np.ndarray, pesos: np.ndarray, suavizacao: np.ndarray,
+                                ordem: int = ORDEM_WHITTAKER_PADRAO) -> np.ndarray:
+    """Graduação de Whittaker–Henderson de várias tábuas [tábua, idade] num único sistema banda
+    
+    Minimiza Σ w·(v - u)² + h·Σ (Δᶻv)² em cada linha, com pesos w normalizados
+    para média 1 e h (suavizacao) próprio de cada linha. As linhas empilhadas
+    formam uma matriz bloco-diagonal simétrica com banda igual à ordem z,
+    resolvida de uma vez por solveh_banded. Só a faixa entre a primeira e a
+    última idade com peso é graduada; o resto e as linhas com até z idades com
+    peso ficam NaN (idades_insuficientes_whittaker aponta essas linhas).
+    """
+    if ordem < 1:
+        raise ValueError(f'Ordem de Whittaker–Henderson inválida: {ordem}')
+    numero_tabuas, numero_idades = taxas.shape
+    pesos = np.where(np.isfinite(taxas) & (pesos > 0), pesos, 0.0)
+    com_peso = pesos > 0
+    quantidade = com_peso.sum(axis=1)
+    media = pesos.sum(axis=1) / np.maximum(quantidade, 1)
+    pesos = pesos / np.where(media > 0, media, 1.0)[:, np.newaxis]
+    primeira = np.argmax(com_peso, axis=1)
+    ultima = numero_idades - 1 - np.argmax(com_peso[:, ::-1], axis=1)
+    idades = np.arange(numero_idades)
+    dentro = ((quantidade > ordem)[:, np.newaxis] & (idades >= primeira[:, np.newaxis])
+              & (idades <= ultima[:, np.newaxis]))
+    
+    # Δᶻ começando em cada idade, só onde a diferença cabe inteira na faixa da linha
+    coeficientes = np.array([(-1) ** (ordem - k) * math.comb(ordem, k) for k in range(ordem + 1)], dtype=np.float64)
+    inicios = idades[:max(numero_idades - ordem, 0)]
+    ativas = dentro[:, :len(inicios)] & (inicios + ordem <= ultima[:, np.newaxis])
+    penalidade = np.where(ativas, np.asarray(suavizacao, dtype=np.float64)[:, np.newaxis], 0.0)
+    
+    # Banda inferior de W + h·DᵀD, com identidade fora da faixa: banda[s, r] = A[r + s, r]
+    banda = np.zeros((ordem + 1, numero_tabuas, numero_idades))
+    banda[0] = np.where(dentro, pesos, 1.0)
+    for deslocamento in range(ordem + 1):
+        for k in range(ordem + 1 - deslocamento):
+            banda[deslocamento, :, k:k + len(inicios)] += penalidade * (coeficientes[k] * coeficientes[k + deslocamento])
+    # Nenhuma diferença atravessa duas linhas: os termos entre blocos vizinhos ficam zero
+    lado_direito = np.where(dentro, pesos * np.nan_to_num(taxas), 0.0)
+    graduadas = linalg.solveh_banded(banda.reshape(ordem + 1, -1), lado_direito.ravel(), lower=True, check_finite=False)
+    
+    return np.where(dentro, np.clip(graduadas.reshape(numero_tabuas, numero_idades), 0.0, 1.0), np.nan)
+
+
+def idades_insuficientes_whittaker(taxas: np.ndarray, pesos: np.ndarray,
+                                   ordem: int = ORDEM_WHITTAKER_PADRAO) -> np.ndarray:
+    """Linhas [tábua] com até `ordem` idades com peso, que graduar_whittaker_henderson deixa NaN"""
+    return (np.isfinite(taxas) & (pesos > 0)).sum(axis=1) <= ordem
+
+
+def ajustar_lei_mortalidade(obitos: np.ndarray, exposicao: np.ndarray, idades: np.ndarray,
+                            makeham: bool = False, maximo_iteracoes: int = 100,
+                            tolerancia: float = 1e-10) -> Dict[str, np.ndarray]:
+    """Gompertz (μx = B·cˣ) ou Makeham (μx = A + B·cˣ) por máxima verossimilhança de Poisson
+    
+    obitos e exposicao (central) são [tábua, idade] e idades é a idade de cada
+    coluna no meio do ano de idade. Todas as tábuas são ajustadas juntas por
+    scoring de Fisher, com os sistemas 2×2 (3×3 em Makeham) empilhados num
+    np.linalg.solve e o passo reduzido à metade enquanto a verossimilhança
+    cair. As idades são centradas na idade média exposta de cada tábua; A, B
+    e c voltam na forma usual. Tábuas sem óbitos ficam NaN.
+    
+    Só convergem ajustes com parâmetros finitos e plausíveis (B > 0,
+    1 < c ≤ C_MAXIMO_LEIS, A ≥ 0) e desvio abaixo do inicial; os demais saem
+    com convergiu False, qx NaN e o motivo em 'falha'.
+    """
+    usar = exposicao > 0
+    obitos = np.where(usar, obitos, 0.0)
+    exposicao = np.where(usar, exposicao, 0.0)
+    total_obitos, total_exposicao = obitos.sum(axis=1), exposicao.sum(axis=1)
+    numero_parametros = 3 if makeham else 2
+    ajustaveis = (total_obitos > 0) & (usar.sum(axis=1) >= numero_parametros)
+    
+    referencia = (exposicao * idades).sum(axis=1) / np.where(total_exposicao > 0, total_exposicao, 1.0)
+    centradas = idades[np.newaxis, :] - referencia[:, np.newaxis]
+    
+    # Parâmetros (log B na referência, log c[, log A]); início com c = e^0,1 e B pelo total de óbitos
+    inclinacao = np.full(len(obitos), 0.1)
+    esperados_unitarios = (exposicao * np.exp(inclinacao[:, np.newaxis] * centradas)).sum(axis=1)
+    nivel = np.log(np.maximum(total_obitos, 0.5) / np.maximum(esperados_unitarios, 1e-12))
+    parametros = [nivel, inclinacao]
+    if makeham:
+        # A inicial: 10% da força de Gompertz na idade exposta mais nova
+        mais_nova = np.where(usar, centradas, np.inf).min(axis=1)
+        parametros.append(nivel + inclinacao * np.where(np.isfinite(mais_nova), mais_nova, 0.0) + np.log(0.1))
+    parametros = np.column_stack(parametros)
+    
+    def forca(parametros):
+        gompertz = np.exp(np.clip(parametros[:, [0]] + parametros[:, [1]] * centradas, -700, 700))
+        constante = (np.exp(np.broadcast_to(np.clip(parametros[:, [2]], -700, 700), gompertz.shape)) if makeham
+                     else np.zeros_like(gompertz))
+        return gompertz, constante
+    
+    def verossimilhanca(mu):
+        # Passos exagerados dão μ infinito: verossimilhança -inf, recusados pela redução do passo
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            return np.where(usar, np.where(obitos > 0, obitos * np.log(mu), 0.0) - exposicao * mu, 0.0).sum(axis=1)
+    
+    def desvio_poisson(mu):
+        esperados = exposicao * mu
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            termo_log = np.where(obitos > 0, obitos * np.log(obitos / esperados), 0.0)
+            return 2 * np.where(usar, termo_log - (obitos - esperados), 0.0).sum(axis=1)
+    
+    gompertz, constante = forca(parametros)
+    atual = verossimilhanca(gompertz + constante)
+    desvio_inicial = desvio_poisson(gompertz + constante)
+    ativos = ajustaveis.copy()
+    convergiu = np.zeros(len(obitos), dtype=bool)
+    iteracoes = np.zeros(len(obitos), dtype=np.int64)
+    for _ in range(maximo_iteracoes):
+        if not ativos.any():
+            break
+        mu = gompertz + constante
+        derivadas = np.stack([gompertz, gompertz * centradas] + ([constante] if makeham else []), axis=-1)
+        escore = np.einsum('ki,kij->kj', np.where(usar, obitos / np.where(usar, mu, 1.0) - exposicao, 0.0), derivadas)
+        informacao = np.einsum('ki,kij,kil->kjl', np.where(usar, exposicao / np.where(usar, mu, 1.0), 0.0),
+                               derivadas, derivadas)
+        informacao[~ativos] = np.eye(numero_parametros)
+        escore[~ativos] = 0.0
+        passo = np.linalg.solve(informacao + 1e-12 * np.eye(numero_parametros), escore[..., np.newaxis])[..., 0]
+        
+        # Passo inteiro ou metades sucessivas, linha a linha, até a verossimilhança não cair
+        fator = np.ones(len(obitos))
+        melhora = np.zeros(len(obitos))
+        pendentes = ativos.copy()
+        for _ in range(40):
+            candidatos = parametros + fator[:, np.newaxis] * passo
+            gompertz_candidato, constante_candidata = forca(candidatos)
+            nova = verossimilhanca(gompertz_candidato + constante_candidata)
+            aceitos = pendentes & np.isfinite(nova) & (nova >= atual - 1e-12 * np.abs(atual))
+            parametros[aceitos] = candidatos[aceitos]
+            gompertz[aceitos], constante[aceitos] = gompertz_candidato[aceitos], constante_candidata[aceitos]
+            melhora = np.where(aceitos, nova - atual, melhora)
+            atual = np.where(aceitos, nova, atual)
+            pendentes &= ~aceitos
+            if not pendentes.any():
+                break
+            fator = np.where(pendentes, fator / 2, fator)
+        
+        iteracoes += ativos
+        # Para quando o passo ou o ganho somem (ou nem metades do passo melhoram: já no máximo)
+        estavel = ativos & (pendentes | (np.abs(fator[:, np.newaxis] * passo).max(axis=1) < tolerancia)
+                            | (melhora <= tolerancia * np.maximum(np.abs(atual), 1.0)))
+        convergiu |= estavel
+        ativos &= ~estavel
+    
+    parametros[~ajustaveis] = np.nan
+    desvio = np.where(ajustaveis, desvio_poisson(gompertz + constante), np.nan)
+    verossimilhanca_final = np.where(ajustaveis, atual, np.nan)
+    with np.errstate(over='ignore', invalid='ignore'):
+        A = np.exp(parametros[:, 2]) if makeham else np.zeros(len(obitos))
+        B = np.exp(parametros[:, 0] - parametros[:, 1] * referencia)
+        c = np.exp(parametros[:, 1])
+    
+    # Dados esparsos levam o scoring a estacionar em c absurdo (1e10) com o passo já nulo
+    plausiveis = (np.isfinite(A) & (A >= 0) & np.isfinite(B) & (B > 0) & np.isfinite(c) & (c > 1)
+                  & (c <= C_MAXIMO_LEIS))
+    desvio_caiu = np.isfinite(desvio) & (desvio <= desvio_inicial + 1e-9 * np.maximum(np.abs(desvio_inicial), 1.0))
+    falha = np.full(len(obitos), None, dtype=object)
+    falha[ajustaveis & ~convergiu] = f'sem convergência em {maximo_iteracoes} iterações'
+    falha[ajustaveis & convergiu & ~desvio_caiu] = 'desvio não diminuiu em relação ao ponto inicial'
+    falha[ajustaveis & convergiu & ~plausiveis] = f'parâmetros implausíveis (exige B > 0 e 1 < c ≤ {C_MAXIMO_LEIS})'
+    falha[~ajustaveis] = 'óbitos ou idades expostas insuficientes'
+    convergiu = convergiu & ajustaveis & plausiveis & desvio_caiu
+    mu = np.where(convergiu[:, np.newaxis], gompertz + constante, np.nan)
+    
+    return {
+        'A': A,
+        'B': B,
+        'c': c,
+        'log_verossimilhanca': verossimilhanca_final,
+        'aic': 2 * numero_parametros - 2 * verossimilhanca_final,
+        'desvio': desvio,
+        'iteracoes': iteracoes,
+        'convergiu': convergiu,
+        'falha': falha,
+        # Força constante dentro do ano de idade: qx = 1 - e^(-μ)
+        'qx': -np.expm1(-mu)
+    }
+
+
+def preparar_modelo_simulacao(exposicao: np.ndarray, taxas: np.ndarray, tabuas: np.ndarray, tamanho_faixa: int = 1,
+                              distribuicao: str = 'poisson', correcao_continuidade: bool = False) -> Dict[str, Any]:
+    """Células [sexo, idade] com exposição e esperados das tábuas, prontos para as réplicas
+    
+    exposicao (inicial) e taxas (qx ajustado) são [sexo, idade]; tabuas é
+    [tábua, sexo, idade]. As células ficam na ordem sexo → idade, então as
+    faixas etárias de cada sexo e os próprios sexos são trechos contíguos,
+    somados com np.add.reduceat como em testar_aderencia_lote.
+    
+    Na binomial cada célula vira n = round(E) vidas inteiras, e os esperados e
+    o qx das réplicas passam a usar n como exposição, para que óbitos inteiros
+    Bin(n, q) tenham média n·q e variância n·q(1−q) coerentes com eles. Células
+    com E < 0,5 (n = 0) continuam em Poisson(E·q) sobre a exposição original.
+    """
+    sexo, idade = np.nonzero(exposicao > 0)
+    faixa = idade // max(1, int(tamanho_faixa))
+    grupo = sexo * (faixa.max(initial=0) + 1) + faixa
+    exposicao_celulas = exposicao[sexo, idade]
+    vidas = np.zeros(len(sexo), dtype=np.int64)
+    if distribuicao == 'binomial':
+        vidas = np.round(exposicao_celulas).astype(np.int64)
+        exposicao_celulas = np.where(vidas > 0, vidas, exposicao_celulas)
+    esperados = exposicao_celulas * np.nan_to_num(tabuas[:, sexo, idade])
+    inicios_grupos = np.flatnonzero(np.r_[True, np.diff(grupo) != 0])
+    inicios_sexos = np.flatnonzero(np.r_[True, np.diff(sexo) != 0])
+    return {
+        'sexo': sexo,
+        'idade': idade,
+        'exposicao': exposicao_celulas,
+        'vidas': vidas,
+        'taxas': np.clip(np.nan_to_num(taxas[sexo, idade]), 0.0, 1.0),
+        'distribuicao': distribuicao,
+        'correcao_continuidade': correcao_continuidade,
+        'inicios_grupos': inicios_grupos,
+        'inicios_sexos': inicios_sexos,
+        'sexos': sexo[inicios_sexos],
+        'esperados_grupos': np.add.reduceat(esperados, inicios_grupos, axis=1),
+        'esperados_sexos': np.add.reduceat(esperados, inicios_sexos, axis=1),
+        'esperados_totais': esperados.sum(axis=1)
+    }
+
+
+def estatisticas_replicas(modelo: Dict[str, Any], obitos: np.ndarray) -> Dict[str, np.ndarray]:
+    """qx por célula, A/E (total e por sexo) e estatísticas de aderência de cada réplica [réplica, célula]"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        razao_ae = obitos.sum(axis=1)[:, np.newaxis] / modelo['esperados_totais']
+        razao_ae_sexos = (np.add.reduceat(obitos, modelo['inicios_sexos'], axis=1)[:, np.newaxis, :]
+                          / modelo['esperados_sexos'])
+    _, qui_quadrado, razao_verossimilhanca = estatisticas_aderencia(
+        np.add.reduceat(obitos, modelo['inicios_grupos'], axis=1)[:, np.newaxis, :],
+        modelo['esperados_grupos'], modelo['correcao_continuidade'])
+    return {
+        'qx': (obitos / modelo['exposicao']).astype(np.float32),
+        'razao_ae': razao_ae,
+        'razao_ae_sexos': razao_ae_sexos,
+        'qui_quadrado': qui_quadrado,
+        'razao_verossimilhanca': razao_verossimilhanca
+    }
+
+
+def simular_bloco_replicas(modelo: Dict[str, Any], semente: np.random.SeedSequence, replicas: int) -> Dict[str, np.ndarray]:
+    """Um bloco de réplicas: óbitos sorteados das taxas ajustadas sobre a exposição de cada célula
+    
+    Poisson(E·q) por padrão; na binomial, Bin(n, q) inteiro sobre as vidas
+    de preparar_modelo_simulacao, com Poisson nas células sem vida inteira.
+    Cada bloco tem a própria semente filha, então o resultado não depende de
+    quantos processos dividem os blocos.
+    """
+    gerador = np.random.default_rng(semente)
+    forma = (replicas, len(modelo['exposicao']))
+    binomiais = modelo['vidas'] > 0
+    obitos = np.empty(forma, dtype=np.float64)
+    obitos[:, binomiais] = gerador.binomial(modelo['vidas'][binomiais], modelo['taxas'][binomiais],
+                                            size=(replicas, int(binomiais.sum())))
+    obitos[:, ~binomiais] = gerador.poisson((modelo['exposicao'] * modelo['taxas'])[~binomiais],
+                                            size=(replicas, int((~binomiais).sum())))
+    return estatisticas_replicas(modelo, obitos)
+
+
+def simular_replicas(modelo: Dict[str, Any], replicas: int, semente: int, processos: int = 1,
+                     memoria_bloco_mb: float = MEMORIA_BLOCO_SIMULACAO_MB,
+                     ao_concluir_bloco: Optional[Callable[[int, int], None]] = None) -> Dict[str, np.ndarray]:
+    """Réplicas em blocos de memória limitada, num pool de processos quando processos > 1
+    
+    O tamanho dos blocos depende só do modelo e do limite de memória e cada
+    bloco recebe uma semente de SeedSequence(semente).spawn: a mesma semente
+    reproduz as mesmas réplicas com qualquer número de processos.
+    """
+    celulas = len(modelo['exposicao'])
+    tabuas, grupos = modelo['esperados_grupos'].shape
+    # Bytes por réplica: óbitos e qx das células e os intermediários réplica × tábua × grupo
+    por_replica = 8 * (2 * celulas + 4 * tabuas * grupos) + 1
+    tamanho = max(1, min(REPLICAS_POR_BLOCO_SIMULACAO, int(memoria_bloco_mb * (1 << 20) // por_replica)))
+    blocos = [min(tamanho, replicas - inicio) for inicio in range(0, replicas, tamanho)]
+    sementes = np.random.SeedSequence(semente).spawn(len(blocos))
+    
+    resultados = [None] * len(blocos)
+    if processos > 1 and len(blocos) > 1:
+        with ProcessPoolExecutor(max_workers=min(processos, len(blocos))) as executor:
+            futuros = {executor.submit(simular_bloco_replicas, modelo, semente_bloco, quantidade): indice
+                       for indice, (semente_bloco, quantidade) in enumerate(zip(sementes, blocos))}
+            for concluidos, futuro in enumerate(as_completed(futuros), start=1):
+                resultados[futuros[futuro]] = futuro.result()
+                if ao_concluir_bloco is not None:
+                    ao_concluir_bloco(concluidos, len(blocos))
+    else:
+        for indice, (semente_bloco, quantidade) in enumerate(zip(sementes, blocos)):
+            resultados[indice] = simular_bloco_replicas(modelo, semente_bloco, quantidade)
+            if ao_concluir_bloco is not None:
+                ao_concluir_bloco(indice + 1, len(blocos))
+    
+    simuladas = {chave: np.concatenate([resultado[chave] for resultado in resultados]) for chave in resultados[0]}
+    simuladas['blocos'] = np.array(blocos)
+    return simuladas
+
+
+def valores_json_seguros(valor: Any) -> Any:
+    """Troca NaN/Infinito por None: JSON.parse (Node) não aceita esses literais"""
+    if isinstance(valor, float):
+        return valor if np.isfinite(valor) else None
+    if isinstance(valor, dict):
+        return {chave: valores_json_seguros(item) for chave, item in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [valores_json_seguros(item) for item in valor]
+    return valor
+
+
+def linha_ndjson(objeto: Dict[str, Any]) -> str:
+    """Serializa um objeto como uma linha NDJSON"""
+    return json.dumps(valores_json_seguros(objeto), ensure_ascii=False, default=str) + '\n'
+
+
+def emitir_ndjson(evento: Dict[str, Any]):
+    """Escreve um evento no stdout como linha NDJSON (saídas --ndjson da CLI)"""
+    sys.stdout.write(linha_ndjson(evento))
+    sys.stdout.flush()
+
+
+def calcular_hash_arquivo(caminho_arquivo: str, tamanho_leitura: int = 1 << 20) -> str:
+    """SHA-256 do conteúdo do arquivo, lido em blocos"""
+    resumo = hashlib.sha256()
+    with open(caminho_arquivo, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(tamanho_leitura), b''):
+            resumo.update(bloco)
+    return resumo.hexdigest()
+
+
+def diretorio_cache_padrao(caminho_arquivo: str, configuracao: Dict[str, Any]) -> str:
+    """Diretório de cache: configuracao.diretorioCache, ANALISE_MORTALIDADE_CACHE ou junto ao arquivo"""
+    return (
+        configuracao.get('diretorioCache')
+        or os.environ.get('ANALISE_MORTALIDADE_CACHE')
+        or os.path.join(os.path.dirname(os.path.abspath(caminho_arquivo)), '.cache-analise')
+    )
+
+
+def tamanho_entrada_cache(caminho: str) -> int:
+    """Bytes de um arquivo do cache ou de um diretório inteiro (sidecar colunar)"""
+    if not os.path.isdir(caminho):
+        return os.path.getsize(caminho)
+    return sum(os.path.getsize(os.path.join(raiz, nome))
+               for raiz, _, nomes in os.walk(caminho) for nome in nomes)
+
+
+def podar_cache(diretorio: str, tamanho_maximo_bytes: int) -> int:
+    """Descarta as entradas menos usadas do cache até respeitar o tamanho máximo; retorna quantas saíram
+    
+    Cada resultado (resultados/*.json), cubo agregado (cubos/*.npz) e sidecar
+    colunar inteiro (colunar/<hash>/) é uma entrada; o uso mais recente é o
+    mtime do arquivo ou do diretório do sidecar, renovado a cada leitura.
+    """
+    entradas = []
+    for subdiretorio, extensao in (('resultados', '.json'), ('cubos', '.npz'), ('colunar', None)):
+        base = os.path.join(diretorio, subdiretorio)
+        try:
+            nomes = os.listdir(base)
+        except OSError:
+            continue
+        for nome in nomes:
+            caminho = os.path.join(base, nome)
+            if (nome.endswith(extensao) if extensao else os.path.isdir(caminho)):
+                try:
+                    entradas.append((os.stat(caminho).st_mtime, tamanho_entrada_cache(caminho), caminho))
+                except OSError:
+                    continue
+    
+    total = sum(tamanho for _, tamanho, _ in entradas)
+    removidas = 0
+    for _, tamanho, caminho in sorted(entradas):
+        if total <= tamanho_maximo_bytes:
+            break
+        if os.path.isdir(caminho):
+            shutil.rmtree(caminho, ignore_errors=True)
+        else:
+            try:
+                os.unlink(caminho)
+            except OSError:
+                continue
+        total -= tamanho
+        removidas += 1
+    return removidas
+
+
+def diretorio_tabuas_padrao(configuracao: Dict[str, Any]) -> str:
+    """Registro de tábuas: configuracao.registroTabuas, ANALISE_MORTALIDADE_TABUAS ou o diretório de dados do usuário"""
+    return (
+        configuracao.get('registroTabuas')
+        or os.environ.get('ANALISE_MORTALIDADE_TABUAS')
+        or os.path.join(os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share'),
+                        'analise-mortalidade', 'tabuas')
+    )
+
+
+class CacheResultados:
+    """Cache em disco dos resultados de executar_analise, endereçado por conteúdo
+    
+    A chave combina o hash do arquivo, a configuração normalizada e a versão do
+    analisador. Entradas são podadas em ordem LRU, junto com os sidecars
+    colunares, quando o cache passa do tamanho máximo.
+    """
+    
+    def __init__(self, diretorio: str, tamanho_maximo_bytes: int = 512 * 1024 * 1024):
+        self.diretorio = os.path.join(diretorio, 'resultados')
+        self.tamanho_maximo_bytes = tamanho_maximo_bytes
+        os.makedirs(self.diretorio, exist_ok=True)
+    
+    @staticmethod
+    def normalizar_configuracao(configuracao: Dict[str, Any]) -> Dict[str, Any]:
+        """Remove opções que não alteram o resultado e preenche os valores padrão"""
+        normalizada = dict(CONFIGURACAO_PADRAO)
+        normalizada.update({
+            chave: valor for chave, valor in configuracao.items()
+            if chave not in CHAVES_CONFIGURACAO_SEM_EFEITO
+        })
+        return normalizada
+    
+    def chave(self, hash_arquivo: str, configuracao: Dict[str, Any]) -> str:
+        conteudo = json.dumps(
+            [hash_arquivo, self.normalizar_configuracao(configuracao), VERSAO_ANALISADOR],
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        # O prefixo do hash do arquivo permite invalidar todas as entradas de um arquivo
+        return f"{hash_arquivo[:16]}-{hashlib.sha256(conteudo.encode('utf-8')).hexdigest()}"
+    
+    def ler(self, chave: str) -> Optional[Dict[str, Any]]:
+        caminho = os.path.join(self.diretorio, f'{chave}.json')
+        try:
+            with open(caminho, 'r', encoding='utf-8') as arquivo:
+                resultado = json.load(arquivo)
+        except (OSError, ValueError):
+            return None
+        # Marcar uso recente para a poda LRU
+        os.utime(caminho)
+        return resultado
+    
+    def gravar(self, chave: str, resultado: Dict[str, Any], texto: Optional[str] = None):
+        """Grava o resultado; texto é o JSON já serializado, quando houver"""
+        caminho = os.path.join(self.diretorio, f'{chave}.json')
+        temporario = f'{caminho}.{os.getpid()}.tmp'
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            if texto is not None:
+                arquivo.write(texto)
+            else:
+                json.dump(resultado, arquivo, ensure_ascii=False, default=str)
+        os.replace(temporario, caminho)
+        self.podar()
+    
+    def invalidar(self, hash_arquivo: Optional[str] = None) -> int:
+        """Remove as entradas de um arquivo (ou todas, sem hash); retorna quantas saíram"""
+        removidas = 0
+        for nome in os.listdir(self.diretorio):
+            if nome.endswith('.json') and (hash_arquivo is None or nome.startswith(hash_arquivo[:16])):
+                os.unlink(os.path.join(self.diretorio, nome))
+                removidas += 1
+        return removidas
+    
+    def podar(self):
+        """Descarta as entradas menos usadas do cache inteiro (ver podar_cache) até respeitar o tamanho máximo"""
+        podar_cache(os.path.dirname(self.diretorio), self.tamanho_maximo_bytes)
+
+
+def rss_maximo_kb() -> Optional[int]:
+    """Pico de memória residente do processo até agora (KiB no Linux; None sem resource)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else None
+
+
+class AnaliseCancelada(Exception):
+    """Cancelamento pedido (fila de análises, fila-analises-mortalidade.py), levantado entre etapas pelo ponto de controle"""
+
+
+class PerfilExecucao:
+    """Tempo, CPU e memória de cada etapa da análise (metadados.perfil)
+    
+    As etapas podem ser aninhadas (extrair_formulas dentro de ler_planilha) e
+    guardam o nível de aninhamento. O pico de memória rastreada vem do
+    tracemalloc e só é medido com rastrear_memoria=True, pois o rastreamento
+    deixa a análise bem mais lenta; o pico de RSS do processo sai sempre.
+    ao_iniciar_etapa recebe o nome de cada etapa antes dela começar (ponto de
+    controle da fila: progresso e cancelamento cooperativo).
+    """
+    
+    def __init__(self, rastrear_memoria: bool = False, ao_iniciar_etapa: Optional[Callable[[str], None]] = None):
+        self.rastrear_memoria = rastrear_memoria
+        self.ao_iniciar_etapa = ao_iniciar_etapa
+        self.etapas = []
+        # Maior pico já visto dentro de cada etapa aberta (as filhas reiniciam o pico do tracemalloc)
+        self.picos_abertos = []
+        self.iniciou_rastreamento = False
+        self.inicio = time.perf_counter()
+        self.inicio_cpu = time.process_time()
+    
+    def iniciar(self):
+        self.inicio = time.perf_counter()
+        self.inicio_cpu = time.process_time()
+        if self.rastrear_memoria and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.iniciou_rastreamento = True
+    
+    def encerrar(self):
+        if self.iniciou_rastreamento:
+            tracemalloc.stop()
+            self.iniciou_rastreamento = False
+    
+    @contextmanager
+    def etapa(self, nome: str, **dados):
+        """Mede o bloco; o registro devolvido aceita contagens (linhas, células, fórmulas)"""
+        if self.ao_iniciar_etapa is not None:
+            self.ao_iniciar_etapa(nome)
+        registro = {'etapa': nome, **dados, 'nivel': len(self.picos_abertos)}
+        self.etapas.append(registro)
+        memoria = self.rastrear_memoria and tracemalloc.is_tracing()
+        if memoria:
+            if self.picos_abertos:
+                self.picos_abertos[-1] = max(self.picos_abertos[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.picos_abertos.append(0)
+        inicio, inicio_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield registro
+        finally:
+            registro['tempo'] = round(time.perf_counter() - inicio, 6)
+            registro['tempo_cpu'] = round(time.process_time() - inicio_cpu, 6)
+            pico = self.picos_abertos.pop()
+            if memoria:
+                pico = max(pico, tracemalloc.get_traced_memory()[1])
+                registro['pico_memoria'] = pico
+                if self.picos_abertos:
+                    self.picos_abertos[-1] = max(self.picos_abertos[-1], pico)
+            registro['rss_maximo_kb'] = rss_maximo_kb()
+    
+    def incorporar(self, etapas: List[Dict[str, Any]], **dados):
+        """Acrescenta etapas medidas em outro processo, abaixo da etapa aberta"""
+        for etapa in etapas:
+            self.etapas.append({**etapa, **dados, 'nivel': etapa['nivel'] + len(self.picos_abertos)})
+    
+    def resumir(self) -> Dict[str, Any]:
+        return {
+            'tempo_total': round(time.perf_counter() - self.inicio, 6),
+            'tempo_cpu_total': round(time.process_time() - self.inicio_cpu, 6),
+            'memoria_rastreada': self.rastrear_memoria,
+            'rss_maximo_kb': rss_maximo_kb(),
+            'etapas': self.etapas
+        }
+
+
+class PacoteXlsx:
+    """Acesso direto ao pacote .xlsx (zip): mapa de planilhas, sharedStrings e XML em trechos"""
+
+    NS_PLANILHA = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+    NS_RELACOES = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+    NS_REFERENCIA = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+    LINHA = re.compile(rb'<row\b[^>]*?\br="(\d+)"')
+
+    def __init__(self, caminho_arquivo: str):
+        self.caminho_arquivo = caminho_arquivo
+        self._planilhas = None
+        self._strings = None
+
+    def planilhas(self) -> Dict[str, str]:
+        """Nome da planilha → caminho do XML dentro do zip"""
+        if self._planilhas is None:
+            with zipfile.ZipFile(self.caminho_arquivo) as pacote:
+                workbook = ET.fromstring(pacote.read('xl/workbook.xml'))
+                relacoes = ET.fromstring(pacote.read('xl/_rels/workbook.xml.rels'))
+            alvos = {}
+            for relacao in relacoes.iter(f'{self.NS_RELACOES}Relationship'):
+                alvo = relacao.get('Target', '')
+                # Alvos relativos a xl/ ou absolutos a partir da raiz do pacote
+                alvos[relacao.get('Id')] = alvo.lstrip('/') if alvo.startswith('/') else posixpath.normpath(f'xl/{alvo}')
+            self._planilhas = {
+                planilha.get('name'): alvos.get(planilha.get(f'{self.NS_REFERENCIA}id'))
+                for planilha in workbook.iter(f'{self.NS_PLANILHA}sheet')
+            }
+        return self._planilhas
+
+    def strings_compartilhadas(self, pacote: zipfile.ZipFile) -> List[str]:
+        """Tabela sharedStrings, carregada uma vez na primeira consulta"""
+        if self._strings is None:
+            self._strings = []
+            if 'xl/sharedStrings.xml' in pacote.namelist():
+                # Mesmo leitor do OpenPyXL: textos idênticos aos das células lidas por ele
+                with pacote.open('xl/sharedStrings.xml') as arquivo:
+                    self._strings = read_string_table(arquivo)
+        return self._strings
+
+    @staticmethod
+    def texto(bruto: bytes) -> str:
+        texto = bruto.decode('utf-8')
+        return html.unescape(texto) if '&' in texto else texto
+
+    def blocos_linhas(self, pacote: zipfile.ZipFile, nome_planilha: str):
+        """XML da planilha em blocos de linhas completas (<row>...</row>)
+
+        Devolve pares (bloco, número da última linha vista até aqui).
+        """
+        caminho_xml = self.planilhas().get(nome_planilha)
+        if caminho_xml is None:
+            raise KeyError(nome_planilha)
+
+        ultima_linha = 0
+        with pacote.open(caminho_xml) as arquivo:
+            pendente = b''
+            while True:
+                trecho = arquivo.read(TAMANHO_TRECHO_XML)
+                pendente += trecho
+                # Só linhas completas são processadas; o resto segue para o próximo trecho
+                fim = len(pendente) if not trecho else pendente.rfind(b'</row>')
+                if fim < 0:
+                    continue
+                if trecho:
+                    fim += len(b'</row>')
+                bloco, pendente = pendente[:fim], pendente[fim:]
+
+                inicio_linha = bloco.rfind(b'<row ')
+                if inicio_linha >= 0:
+                    numero = self.LINHA.match(bloco, inicio_linha)
+                    if numero:
+                        ultima_linha = int(numero.group(1))
+
+                yield bloco, ultima_linha
+                if not trecho:
+                    break
+
+
+class ScannerFormulas(PacoteXlsx):
+    """Extrai as fórmulas direto do XML das planilhas (sem objetos de célula)
+
+    O XML de cada planilha é lido do zip em trechos e só as células com <f>
+    são decodificadas, junto com o valor em cache (<v>) gravado pelo Excel no
+    último cálculo. Fórmulas compartilhadas (t="shared") aparecem por extenso
+    apenas na célula mestre; nas demais são traduzidas a partir dela.
+    """
+
+    # <c ...><f ...>texto</f><v>valor</v>: <f> é sempre o primeiro filho de <c>
+    CELULA_FORMULA = re.compile(
+        rb'<c\b([^>]*)>\s*<f\b([^>]*?)(?:/>|>(.*?)</f>)\s*(?:<v>(.*?)</v>|<v\s*/>)?', re.S
+    )
+    ATRIBUTO = re.compile(rb'\b(r|t|si)="([^"]*)"')
+
+    def valor_em_cache(self, bruto: Optional[bytes], tipo: Optional[bytes], pacote: zipfile.ZipFile) -> Any:
+        if bruto is None or bruto == b'':
+            return None
+        if tipo in (b'str', b'inlineStr', b'e'):
+            return self.texto(bruto)
+        if tipo == b'b':
+            return bruto.strip() == b'1'
+        if tipo == b's':
+            strings = self.strings_compartilhadas(pacote)
+            indice = int(bruto)
+            return strings[indice] if indice < len(strings) else None
+        numero = float(bruto)
+        return int(numero) if numero.is_integer() and b'.' not in bruto and b'E' not in bruto.upper() else numero
+
+    def extrair(self, nome_planilha: str) -> tuple:
+        """Fórmulas da planilha ({celula, formula, valor_calculado}) e número da última linha"""
+        formulas = []
+        # si → tradutor da fórmula mestre das fórmulas compartilhadas
+        mestres = {}
+        ultima_linha = 0
+
+        with zipfile.ZipFile(self.caminho_arquivo) as pacote:
+            for bloco, ultima_linha in self.blocos_linhas(pacote, nome_planilha):
+                for atributos_celula, atributos_formula, texto_formula, valor in self.CELULA_FORMULA.findall(bloco):
+                    celula = dict(self.ATRIBUTO.findall(atributos_celula))
+                    formula = dict(self.ATRIBUTO.findall(atributos_formula))
+                    coordenada = celula.get(b'r', b'').decode('ascii')
+
+                    if formula.get(b't') == b'shared':
+                        si = formula.get(b'si')
+                        if texto_formula:
+                            texto = '=' + self.texto(texto_formula)
+                            mestres[si] = Translator(texto, origin=coordenada)
+                        elif si in mestres:
+                            texto = mestres[si].translate_formula(coordenada)
+                        else:
+                            continue
+                    elif texto_formula:
+                        texto = '=' + self.texto(texto_formula)
+                    else:
+                        # Células do intervalo de uma fórmula matricial sem texto próprio
+                        continue
+
+                    formulas.append({
+                        'celula': coordenada,
+                        'formula': texto,
+                        'valor_calculado': self.valor_em_cache(valor, celula.get(b't'), pacote)
+                    })
+
+        return formulas, ultima_linha
+
+
+class IndiceStrings(PacoteXlsx):
+    """Índice invertido termo → strings do arquivo, para buscas em todas as células
+
+    Os termos são procurados uma vez em cada string da tabela sharedStrings
+    (minúsculas, por substring); nas planilhas só são localizadas as células
+    que apontam para strings encontradas, com o filtro feito pela própria
+    expressão regular, além das strings em linha (t="inlineStr"). O custo
+    acompanha o número de strings, não o de células.
+    """
+
+    TEXTO_EM_LINHA = re.compile(
+        rb'<c\b(?=[^>]*\bt="inlineStr")[^>]*?\br="([A-Z]+)(\d+)"[^>]*>\s*<is>(.*?)</is>', re.S
+    )
+    TRECHO_TEXTO = re.compile(rb'<t\b[^>]*>(.*?)</t>', re.S)
+    COLUNA_CELULA = re.compile(rb'<c\b[^>]*?\br="([A-Z]+)\d+"')
+
+    def __init__(self, caminho_arquivo: str, termos: List[str]):
+        super().__init__(caminho_arquivo)
+        self.termos = [termo.lower() for termo in termos]
+        # termo → índices na tabela sharedStrings
+        self.indice = None
+
+    def indexar(self, pacote: zipfile.ZipFile) -> Dict[str, List[int]]:
+        if self.indice is None:
+            self.indice = {termo: [] for termo in self.termos}
+            for posicao, texto in enumerate(self.strings_compartilhadas(pacote)):
+                texto = texto.lower()
+                for termo in self.termos:
+                    if termo in texto:
+                        self.indice[termo].append(posicao)
+        return self.indice
+
+    def termos_em(self, texto: str) -> List[str]:
+        texto = texto.lower()
+        return [termo for termo in self.termos if termo in texto]
+
+    def buscar(self, nome_planilha: Optional[str] = None) -> Dict[str, Any]:
+        """Células com algum dos termos, por planilha (todas, se nome_planilha for None)
+
+        Devolve {planilha: {'celulas': [{celula, valor, linha, coluna, termos}], 'linhas': n, 'colunas': m}},
+        com n e m a última linha e a última coluna com alguma célula (planilhas
+        sem <dimension> não informam o tamanho de outra forma).
+        """
+        with zipfile.ZipFile(self.caminho_arquivo) as pacote:
+            indice = self.indexar(pacote)
+            strings = self.strings_compartilhadas(pacote)
+            encontradas = sorted({posicao for posicoes in indice.values() for posicao in posicoes})
+            # Só as células t="s" cujo <v> é uma das strings encontradas chegam ao Python
+            celula_compartilhada = re.compile(
+                rb'<c\b(?=[^>]*\bt="s")[^>]*?\br="([A-Z]+)(\d+)"[^>]*>\s*<v>('
+                + b'|'.join(str(posicao).encode('ascii') for posicao in encontradas) + rb')</v>'
+            ) if encontradas else None
+
+            resultado = {}
+            nomes = [nome_planilha] if nome_planilha is not None else list(self.planilhas())
+            for nome in nomes:
+                celulas = []
+                ultima_linha = 0
+                colunas = set()
+                for bloco, ultima_linha in self.blocos_linhas(pacote, nome):
+                    colunas.update(self.COLUNA_CELULA.findall(bloco))
+                    if celula_compartilhada is not None:
+                        for letras, linha, posicao in celula_compartilhada.findall(bloco):
+                            texto = strings[int(posicao)]
+                            celulas.append((int(linha), indice_coluna(letras.decode('ascii')), texto))
+                    if b'inlineStr' in bloco:
+                        for letras, linha, conteudo in self.TEXTO_EM_LINHA.findall(bloco):
+                            texto = ''.join(self.texto(parte) for parte in self.TRECHO_TEXTO.findall(conteudo))
+                            if self.termos_em(texto):
+                                celulas.append((int(linha), indice_coluna(letras.decode('ascii')), texto))
+
+                celulas.sort(key=lambda celula: celula[:2])
+                resultado[nome] = {
+                    'celulas': [
+                        {
+                            'celula': f'{get_column_letter(coluna)}{linha}',
+                            'valor': texto,
+                            'linha': linha,
+                            'coluna': coluna,
+                            'termos': self.termos_em(texto)
+                        }
+                        for linha, coluna, texto in celulas
+                    ],
+                    'linhas': ultima_linha,
+                    'colunas': max((indice_coluna(letras.decode('ascii')) for letras in colunas), default=0)
+                }
+        return resultado
+
+    def resumo_termos(self, resultado: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+        """Por termo: strings distintas e células encontradas"""
+        resumo = {termo: {'strings': len(posicoes), 'celulas': 0} for termo, posicoes in (self.indice or {}).items()}
+        for planilha in resultado.values():
+            for celula in planilha['celulas']:
+                for termo in celula['termos']:
+                    resumo[termo]['celulas'] += 1
+        return resumo
+
+
+class LeitorColunasXml(PacoteXlsx):
+    """Leitura tipada direto do XML das planilhas, sem objetos de célula do OpenPyXL
+
+    Reproduz os valores que o OpenPyXL entrega em read_only/values_only com
+    data_only=False: números com estilo de data viram datetime (na época do
+    workbook), fórmulas viram o texto '=...' (compartilhadas traduzidas a
+    partir da mestre) e <v> vazio vira None. Estilos e época vêm do workbook
+    já aberto, para que a interpretação seja a mesma. O início da planilha é
+    lido linha a linha (ler); o restante, em trechos agrupados por coluna
+    (colunas), em que só as colunas pedidas são decodificadas e as colunas de
+    números simples são convertidas em lote.
+    """
+
+    # Atributos r/s/t capturados por lookahead: a ordem no XML varia entre geradores
+    LINHA_XML = re.compile(rb'<row\b(?:(?=[^>]*?\br="([^"]*)"))?[^>]*?(?:/>|>(.*?)</row>)', re.S)
+    CELULA = re.compile(
+        rb'<c\b(?:(?=[^>]*?\br="([^"]*)"))?(?:(?=[^>]*?\bs="(\d+)"))?(?:(?=[^>]*?\bt="(\w+)"))?'
+        rb'[^>]*?(?:/>|>(.*?)</c>)', re.S
+    )
+    # Forma usual (r como primeiro atributo), com o <v> simples e o início de <is>/<f> capturados à parte
+    CELULA_COORDENADA = re.compile(
+        rb'<c r="([A-Z]+)(\d+)"(?:(?=[^>]*?\bs="(\d+)"))?(?:(?=[^>]*?\bt="(\w+)"))?'
+        rb'[^>]*?(?:/>|>((?:<v>([^<]*)</v>|(<is>|<f\b))?.*?)</c>)', re.S
+    )
+    ATRIBUTO = re.compile(rb'\b([\w:]+)="([^"]*)"')
+    VALOR = re.compile(rb'<v>(.*?)</v>', re.S)
+    FORMULA = re.compile(rb'<f\b([^>]*?)(?:/>|>(.*?)</f>)', re.S)
+    TEXTO_EM_LINHA = re.compile(rb'<is>(.*?)</is>|<is\s*/>', re.S)
+    FONETICA = re.compile(rb'<rPh\b.*?</rPh>', re.S)
+    TRECHO_TEXTO = IndiceStrings.TRECHO_TEXTO
+    # Elementos com prefixo de namespace (<x:row>) não são tratados por este leitor
+    PREFIXADO = re.compile(rb'<\w+:(?:row|c)\b')
+
+    def __init__(self, caminho_arquivo: str, workbook):
+        super().__init__(caminho_arquivo)
+        self.strings = []
+        self.epoca = workbook.epoch
+        self.formatos_data = workbook._date_formats
+        self.formatos_duracao = workbook._timedelta_formats
+        # si → (tradutor, coordenada da célula mestre) das fórmulas compartilhadas
+        self.mestres = {}
+        self._colunas = {}
+
+    def coluna(self, coordenada: bytes) -> int:
+        letras = coordenada.rstrip(b'0123456789').lstrip(b'$')
+        indice = self._colunas.get(letras)
+        if indice is None:
+            indice = self._colunas[letras] = indice_coluna(letras.decode('ascii'))
+        return indice
+
+    def ler(self, nome_planilha: str, linhas_iniciais: int):
+        """Percorre o XML da planilha: linha a linha no início, em trechos depois
+
+        Gera ('linha', número, [(coluna, r, s, t, conteúdo), ...]) para as linhas
+        até linhas_iniciais e, dali em diante, ('trecho', bytes com linhas
+        completas, número da última linha do trecho) para colunas().
+        """
+        numero = 0
+        linha_a_linha = True
+        with zipfile.ZipFile(self.caminho_arquivo) as pacote:
+            self.strings = self.strings_compartilhadas(pacote)
+            for bloco, ultima_linha in self.blocos_linhas(pacote, nome_planilha):
+                if self.PREFIXADO.search(bloco):
+                    raise ValueError(f'XML da planilha {nome_planilha} usa prefixos de namespace')
+                inicio = 0
+                if linha_a_linha:
+                    inicio = len(bloco)
+                    for encontrada in self.LINHA_XML.finditer(bloco):
+                        r_linha, conteudo_linha = encontrada.groups()
+                        proximo = int(float(r_linha)) if r_linha else numero + 1
+                        if proximo > linhas_iniciais:
+                            inicio = encontrada.start()
+                            linha_a_linha = False
+                            break
+                        numero = proximo
+                        yield 'linha', numero, self.celulas_linha(numero, conteudo_linha or b'')
+                if inicio < len(bloco):
+                    yield 'trecho', bloco[inicio:], ultima_linha
+
+    def celulas_linha(self, numero: int, conteudo_linha: bytes) -> List[tuple]:
+        celulas = []
+        coluna = 0
+        for r, s, t, conteudo in self.CELULA.findall(conteudo_linha):
+            if r:
+                coluna = self.coluna(r)
+            else:
+                coluna += 1
+                r = f'{get_column_letter(coluna)}{numero}'.encode('ascii')
+            if b'si="' in conteudo:
+                self.registrar_mestre(r, conteudo)
+            celulas.append((coluna, r, s, t, conteudo))
+        return celulas
+
+    def colunas(self, trecho: bytes, pedidos: Dict[int, str], validacao: List[int], max_coluna: Optional[int],
+                max_linha: Optional[int], completas: int = 0, largura: int = 0) -> tuple:
+        """Células de um trecho agrupadas por coluna, alinhadas às linhas com valor
+
+        pedidos: coluna → 'numero', 'data' ou 'objeto'. Devolve (linhas com valor
+        em ordem crescente, {coluna: valores alinhados}, {coluna de validação:
+        máscara de presença}, maior coluna vista, linhas completas). Os valores
+        vêm como array float64/datetime64[ns] quando todas as células da coluna
+        no trecho são números simples (com estilo de data para 'data', sem ele
+        para 'numero'); nos demais casos, como lista de valores iguais aos do
+        OpenPyXL (None nas linhas sem a célula). As primeiras `completas` linhas
+        com valor também saem inteiras (colunas 1..largura), como tuplas. A
+        linha 1 (cabeçalho) fica de fora.
+        """
+        celulas = self.CELULA_COORDENADA.findall(trecho)
+        if len(celulas) != trecho.count(b'<c ') + trecho.count(b'<c>') + trecho.count(b'<c/>'):
+            raise ValueError('Células sem coordenada como primeiro atributo')
+        if not celulas:
+            return np.empty(0, dtype=np.int64), {}, {}, 0, []
+        if b'si="' in trecho:
+            for letras, numero, _, _, conteudo, _, _ in celulas:
+                if b'si="' in conteudo:
+                    self.registrar_mestre(letras + numero, conteudo)
+
+        total = len(celulas)
+        letras, numeros, estilos, tipos, conteudos, brutos, inicios = zip(*celulas)
+        linhas = np.fromiter(map(int, numeros), dtype=np.int64, count=total)
+        for letra in set(letras).difference(self._colunas):
+            self.coluna(letra)
+        colunas = np.fromiter(map(self._colunas.__getitem__, letras), dtype=np.int64, count=total)
+
+        # Mesmo critério de tem_valor(), decidido em lote para <v> simples, <is> e <f>
+        tamanho_conteudo = np.fromiter(map(len, conteudos), dtype=np.int64, count=total)
+        tamanho_bruto = np.fromiter(map(len, brutos), dtype=np.int64, count=total)
+        simples = (tamanho_conteudo == tamanho_bruto + 7) & (tamanho_bruto > 0)
+        texto_em_linha = np.fromiter(map(b'inlineStr'.__eq__, tipos), dtype=bool, count=total)
+        com_formula = np.fromiter(map(b'<f'.__eq__, inicios), dtype=bool, count=total)
+        com_is = texto_em_linha & np.fromiter(map(b'<is>'.__eq__, inicios), dtype=bool, count=total)
+        com_valor = (simples & ~texto_em_linha) | com_is | com_formula
+        numericas = simples & np.fromiter(map({b'', b'n'}.__contains__, tipos), dtype=bool, count=total)
+        for indice in np.flatnonzero((tamanho_conteudo > 0) & ~simples & ~com_is & ~com_formula).tolist():
+            com_valor[indice] = self.tem_valor(None, estilos[indice], tipos[indice], conteudos[indice])
+
+        manter = com_valor & (linhas > 1)
+        if max_linha is not None:
+            manter &= linhas <= max_linha
+        if max_coluna:
+            manter &= colunas <= max_coluna
+        linhas_com_valor = np.unique(linhas[manter])
+
+        # Números, sharedStrings e textos em linha simples sem passar por valor()
+        estilos_data = {estilo for estilo in set(estilos) if estilo and int(estilo) in self.formatos_data}
+        simples_lista = simples.tolist()
+        
+        def decodificar(indice):
+            tipo = tipos[indice]
+            if simples_lista[indice]:
+                bruto = brutos[indice]
+                if tipo == b's':
+                    return self.strings[int(bruto)]
+                if (not tipo or tipo == b'n') and estilos[indice] not in estilos_data:
+                    return float(bruto) if (b'.' in bruto or b'E' in bruto or b'e' in bruto) else int(bruto)
+            elif tipo == b'inlineStr':
+                conteudo = conteudos[indice]
+                if conteudo.startswith(b'<is><t>') and conteudo.endswith(b'</t></is>') and conteudo.count(b'<') == 4:
+                    return self.texto(conteudo[7:-9])
+            return self.valor(letras[indice] + numeros[indice], estilos[indice], tipos[indice], conteudos[indice])
+
+        valores = {}
+        for coluna, pedido in pedidos.items():
+            selecao = np.flatnonzero(manter & (colunas == coluna))
+            posicoes = np.searchsorted(linhas_com_valor, linhas[selecao])
+            tipados = None
+            if pedido != 'objeto' and len(selecao):
+                tipados = self.tipar(selecao, pedido, numericas, estilos, brutos)
+            if tipados is not None:
+                alinhados = np.full(len(linhas_com_valor), np.nan if pedido == 'numero' else np.datetime64('NaT'),
+                                    dtype=tipados.dtype)
+                alinhados[posicoes] = tipados
+            else:
+                alinhados = [None] * len(linhas_com_valor)
+                for posicao, indice in zip(posicoes.tolist(), selecao.tolist()):
+                    alinhados[posicao] = decodificar(indice)
+            valores[coluna] = alinhados
+
+        presenca = {coluna: np.isin(linhas_com_valor, linhas[manter & (colunas == coluna)]) for coluna in validacao}
+
+        linhas_completas = []
+        if completas and len(linhas_com_valor):
+            quantidade = min(completas, len(linhas_com_valor))
+            matriz = [[None] * largura for _ in range(quantidade)]
+            selecao = np.flatnonzero(manter & (linhas <= linhas_com_valor[quantidade - 1]) & (colunas <= largura))
+            posicoes = np.searchsorted(linhas_com_valor, linhas[selecao])
+            for posicao, indice, coluna in zip(posicoes.tolist(), selecao.tolist(), colunas[selecao].tolist()):
+                matriz[posicao][coluna - 1] = decodificar(indice)
+            linhas_completas = [tuple(linha) for linha in matriz]
+
+        return linhas_com_valor, valores, presenca, max_coluna or int(colunas.max()), linhas_completas
+
+    def tipar(self, selecao: np.ndarray, pedido: str, numericas: np.ndarray, estilos: tuple,
+              brutos: tuple) -> Optional[np.ndarray]:
+        """Conversão em lote de uma coluna de números simples (None se alguma célula não for)
+
+        Datas seguem a aritmética do from_excel do OpenPyXL (dias desde a época
+        mais a fração arredondada em milissegundos), restritas às séries em que
+        ele não tem casos especiais (antes de 01/03/1900 na época de 1900).
+        """
+        if not numericas[selecao].all():
+            return None
+        indices = selecao.tolist()
+        estilos_distintos = set(map(estilos.__getitem__, indices))
+        estilos_data = {estilo for estilo in estilos_distintos if estilo and int(estilo) in self.formatos_data}
+        numeros = np.fromiter(map(float, map(brutos.__getitem__, indices)), dtype=np.float64, count=len(indices))
+
+        if pedido == 'numero':
+            return None if estilos_data else numeros
+
+        if estilos_data != estilos_distintos or any(int(estilo) in self.formatos_duracao for estilo in estilos_data):
+            return None
+        minimo = 61 if self.epoca == WINDOWS_EPOCH else 1
+        if not ((numeros >= minimo) & (numeros < 100000)).all():
+            return None
+        dias = np.floor(numeros)
+        milissegundos = np.round((numeros - dias) * 86400 * 1000)
+        datas = (np.datetime64(self.epoca, 'ms') + dias.astype(np.int64).astype('timedelta64[D]')
+                 + milissegundos.astype(np.int64).astype('timedelta64[ms]'))
+        return datas.astype('datetime64[ns]')
+
+    def registrar_mestre(self, r: bytes, conteudo: bytes):
+        formula = self.FORMULA.search(conteudo)
+        if formula is None:
+            return
+        atributos = dict(self.ATRIBUTO.findall(formula.group(1)))
+        si = atributos.get(b'si')
+        if atributos.get(b't') == b'shared' and si not in self.mestres and formula.group(2):
+            coordenada = r.decode('ascii')
+            self.mestres[si] = (Translator('=' + self.texto(formula.group(2)), coordenada), coordenada)
+
+    def formula(self, encontrada: re.Match, r: bytes) -> Any:
+        texto = '=' + (self.texto(encontrada.group(2)) if encontrada.group(2) else '')
+        if not encontrada.group(1).strip():
+            return texto
+        atributos = dict(self.ATRIBUTO.findall(encontrada.group(1)))
+        tipo = atributos.get(b't')
+        if tipo == b'array':
+            return ArrayFormula(ref=atributos.get(b'ref', b'').decode('utf-8'), text=texto)
+        if tipo == b'shared':
+            mestre = self.mestres.get(atributos.get(b'si'))
+            coordenada = r.decode('ascii')
+            if mestre is not None and mestre[1] != coordenada:
+                return mestre[0].translate_formula(coordenada)
+        elif tipo == b'dataTable':
+            return DataTableFormula(**{chave.decode('utf-8'): valor.decode('utf-8')
+                                       for chave, valor in atributos.items()})
+        return texto
+
+    def valor(self, r: bytes, s: bytes, t: bytes, conteudo: bytes) -> Any:
+        """Valor da célula como o OpenPyXL o devolveria"""
+        if not conteudo:
+            return None
+
+        if b'<f' in conteudo:
+            encontrada = self.FORMULA.search(conteudo)
+            if encontrada is not None:
+                return self.formula(encontrada, r)
+
+        if t == b'inlineStr':
+            if conteudo.startswith(b'<is><t>') and conteudo.endswith(b'</t></is>') and conteudo.count(b'<') == 4:
+                return self.texto(conteudo[7:-9])
+            texto = self.TEXTO_EM_LINHA.search(conteudo)
+            if texto is None:
+                return None
+            partes = texto.group(1) or b''
+            if b'<rPh' in partes:
+                partes = self.FONETICA.sub(b'', partes)
+            return ''.join(self.texto(parte) for parte in self.TRECHO_TEXTO.findall(partes))
+
+        if conteudo.startswith(b'<v>'):
+            bruto = conteudo[3:conteudo.find(b'</v>')]
+        else:
+            encontrado = self.VALOR.search(conteudo)
+            bruto = encontrado.group(1) if encontrado is not None else b''
+        if not bruto:
+            return None
+
+        if not t or t == b'n':
+            numero = float(bruto) if (b'.' in bruto or b'E' in bruto or b'e' in bruto) else int(bruto)
+            if s:
+                estilo = int(s)
+                if estilo in self.formatos_data:
+                    try:
+                        return from_excel(numero, self.epoca, timedelta=estilo in self.formatos_duracao)
+                    except (OverflowError, ValueError):
+                        return '#VALUE!'
+            return numero
+        if t == b's':
+            return self.strings[int(bruto)]
+        if t == b'b':
+            return bool(int(bruto))
+        texto = self.texto(bruto)
+        return from_ISO8601(texto) if t == b'd' else texto
+
+    def tem_valor(self, r: bytes, s: bytes, t: bytes, conteudo: bytes) -> bool:
+        """Equivale a valor(...) is not None, sem decodificar a célula"""
+        if not conteudo:
+            return False
+        if b'<f' in conteudo and self.FORMULA.search(conteudo):
+            return True
+        if t == b'inlineStr':
+            return self.TEXTO_EM_LINHA.search(conteudo) is not None
+        if conteudo.startswith(b'<v>'):
+            return not conteudo.startswith(b'<v></v>')
+        bruto = self.VALOR.search(conteudo)
+        return bruto is not None and bool(bruto.group(1))
+
+    def linha_completa(self, celulas: List[tuple], max_coluna: Optional[int]) -> tuple:
+        """Linha com todas as colunas, no formato de iter_rows(values_only=True)"""
+        if not celulas and not max_coluna:
+            return ()
+        largura = max_coluna or celulas[-1][0]
+        linha = [None] * largura
+        for coluna, r, s, t, conteudo in celulas:
+            if 1 <= coluna <= largura:
+                linha[coluna - 1] = self.valor(r, s, t, conteudo)
+        return tuple(linha)
+
+
+class BlocosColunas:
+    """Reagrupa em blocos de tamanho fixo as colunas lidas em trechos do XML
+    
+    Os trechos do XML não coincidem com os blocos do carregador: os pedaços de
+    cada papel (arrays tipados ou listas de valores) ficam pendentes até
+    completar um bloco com o mesmo número de linhas da leitura pelo OpenPyXL,
+    o que mantém idênticas as conversões feitas bloco a bloco.
+    """
+    
+    def __init__(self, papeis, tamanho: int):
+        self.tamanho = tamanho
+        self.pedacos = {papel: [] for papel in papeis}
+        self.validos = []
+        self.total = 0
+    
+    def adicionar(self, valores: Dict[str, Any], validos: np.ndarray):
+        for papel, pedaco in valores.items():
+            self.pedacos[papel].append(pedaco)
+        self.validos.append(validos)
+        self.total += len(validos)
+    
+    @staticmethod
+    def juntar(pedacos: List[Any]):
+        if pedacos and all(isinstance(pedaco, np.ndarray) for pedaco in pedacos) \
+                and len({pedaco.dtype for pedaco in pedacos}) == 1:
+            return np.concatenate(pedacos)
+        # Pedaços tipados e listas misturados: tudo volta a valores Python (NaT → None)
+        valores = []
+        for pedaco in pedacos:
+            if isinstance(pedaco, np.ndarray) and pedaco.dtype.kind == 'M':
+                valores.extend(pedaco.astype('datetime64[us]').tolist())
+            elif isinstance(pedaco, np.ndarray):
+                valores.extend(pedaco.tolist())
+            else:
+                valores.extend(pedaco)
+        return valores
+    
+    def blocos(self, final: bool = False):
+        """Gera (valores por papel, total de linhas, linhas válidas) de cada bloco completo"""
+        while self.total >= self.tamanho or (final and self.total):
+            n = min(self.tamanho, self.total)
+            validos = np.concatenate(self.validos)
+            bloco = {}
+            for papel, pedacos in self.pedacos.items():
+                valores = self.juntar(pedacos)
+                bloco[papel] = valores[:n]
+                self.pedacos[papel] = [valores[n:]] if len(valores) > n else []
+            self.validos = [validos[n:]] if len(validos) > n else []
+            self.total -= n
+            yield bloco, n, int(validos[:n].sum())
+
+
+# Referência A1 fora de textos ("...") e nomes de planilha ('...'); não casa
+# nomes de função (LOG10(), nomes definidos nem prefixos de planilha (A1!)
+REFERENCIA_A1 = re.compile(r"(?<![A-Za-z0-9_.$])(\$?)([A-Z]{1,3})(\$?)([0-9]+)(?![A-Za-z0-9_(!])")
+TRECHO_ENTRE_ASPAS = re.compile(r"(\"(?:[^\"]|\"\")*\"|'(?:[^']|'')*')")
+COORDENADA = re.compile(r'([A-Z]{1,3})([0-9]+)')
+
+
+@lru_cache(maxsize=None)
+def indice_coluna(letras: str) -> int:
+    indice = 0
+    for letra in letras:
+        indice = indice * 26 + ord(letra) - 64
+    return indice
+
+
+def formula_relativa(formula: str, celula: str) -> str:
+    """Fórmula em notação R1C1 relativa à célula (cópias da mesma fórmula ficam iguais)
+
+    =B2*2 em C2 e =B3*2 em C3 viram =RC[-1]*2; referências absolutas ($B$1)
+    viram R1C2.
+    """
+    base = COORDENADA.fullmatch(celula)
+    if base is None:
+        return formula
+    coluna_base, linha_base = indice_coluna(base.group(1)), int(base.group(2))
+
+    def converter(referencia: re.Match) -> str:
+        coluna_absoluta, letras, linha_absoluta, linha = referencia.groups()
+        linha, coluna = int(linha), indice_coluna(letras)
+        if linha_absoluta:
+            parte_linha = f'R{linha}'
+        else:
+            parte_linha = f'R[{linha - linha_base}]' if linha != linha_base else 'R'
+        if coluna_absoluta:
+            parte_coluna = f'C{coluna}'
+        else:
+            parte_coluna = f'C[{coluna - coluna_base}]' if coluna != coluna_base else 'C'
+        return parte_linha + parte_coluna
+
+    if '"' not in formula and "'" not in formula:
+        return REFERENCIA_A1.sub(converter, formula)
+    trechos = TRECHO_ENTRE_ASPAS.split(formula)
+    # Índices ímpares são os trechos entre aspas, mantidos como estão
+    return ''.join(trecho if i % 2 else REFERENCIA_A1.sub(converter, trecho) for i, trecho in enumerate(trechos))
+
+
+class AgrupadorFormulas:
+    """Agrupa as fórmulas por planilha e padrão R1C1
+
+    Cada padrão guarda as células que cobre (resumidas em intervalos
+    retangulares no final), a contagem e alguns exemplos, de modo que o
+    relatório cresce com o número de fórmulas distintas e não com o tamanho
+    da planilha.
+    """
+
+    def __init__(self, exemplos: int = 3, limite_intervalos: int = 20):
+        self.exemplos = exemplos
+        self.limite_intervalos = limite_intervalos
+        self.total = 0
+        # (planilha, padrão) → {'ocorrencias', 'celulas': coluna → linhas, 'exemplos'}
+        self.padroes = OrderedDict()
+
+    def adicionar(self, nome_planilha: str, formulas: List[Dict[str, Any]]):
+        for formula in formulas:
+            celula = formula['celula']
+            chave = (nome_planilha, formula_relativa(formula['formula'], celula))
+            padrao = self.padroes.get(chave)
+            if padrao is None:
+                padrao = self.padroes[chave] = {'ocorrencias': 0, 'celulas': {}, 'exemplos': []}
+            padrao['ocorrencias'] += 1
+            if len(padrao['exemplos']) < self.exemplos:
+                padrao['exemplos'].append(formula)
+            coordenada = COORDENADA.fullmatch(celula)
+            if coordenada is not None:
+                padrao['celulas'].setdefault(coordenada.group(1), []).append(int(coordenada.group(2)))
+        self.total += len(formulas)
+
+    @staticmethod
+    def intervalos(celulas: Dict[str, List[int]]) -> List[str]:
+        """Células (coluna → linhas) como intervalos retangulares, ex.: C2:H121"""
+        # Sequências contíguas de linhas em cada coluna
+        colunas_por_faixa = {}
+        for letras, linhas in celulas.items():
+            linhas = np.unique(np.asarray(linhas))
+            quebras = np.flatnonzero(np.diff(linhas) != 1) + 1
+            inicios = np.concatenate(([0], quebras))
+            fins = np.concatenate((quebras - 1, [len(linhas) - 1]))
+            for inicio, fim in zip(linhas[inicios], linhas[fins]):
+                colunas_por_faixa.setdefault((int(inicio), int(fim)), []).append(indice_coluna(letras))
+
+        # Colunas vizinhas com a mesma faixa de linhas formam um retângulo
+        retangulos = []
+        for (inicio, fim), colunas in colunas_por_faixa.items():
+            colunas.sort()
+            primeira = anterior = colunas[0]
+            for coluna in colunas[1:] + [None]:
+                if coluna is not None and coluna == anterior + 1:
+                    anterior = coluna
+                    continue
+                retangulos.append((primeira, inicio, anterior, fim))
+                if coluna is not None:
+                    primeira = anterior = coluna
+
+        retangulos.sort()
+        return [
+            f'{get_column_letter(c0)}{l0}' if (c0, l0) == (c1, l1)
+            else f'{get_column_letter(c0)}{l0}:{get_column_letter(c1)}{l1}'
+            for c0, l0, c1, l1 in retangulos
+        ]
+
+    def resumir(self) -> Dict[str, Any]:
+        padroes = []
+        for (nome_planilha, padrao), dados in self.padroes.items():
+            intervalos = self.intervalos(dados['celulas'])
+            padroes.append({
+                'planilha': nome_planilha,
+                'padrao': padrao,
+                'ocorrencias': dados['ocorrencias'],
+                'intervalos': intervalos[:self.limite_intervalos],
+                'total_intervalos': len(intervalos),
+                'exemplos': dados['exemplos']
+            })
+        # Na ordem das planilhas; dentro de cada uma, os padrões mais repetidos primeiro
+        ordem = {nome: i for i, nome in enumerate(OrderedDict.fromkeys(p['planilha'] for p in padroes))}
+        padroes.sort(key=lambda p: (ordem[p['planilha']], -p['ocorrencias']))
+        return {
+            'total': self.total,
+            'padroes_distintos': len(padroes),
+            'padroes': padroes
+        }
+
+
+class SidecarColunar:
+    """Cópia colunar (.npy por coluna) das planilhas já lidas de um arquivo
+    
+    Fica em <cache>/colunar/<sha256 do arquivo>/ e é relida com
+    np.load(mmap_mode='r'): a recarga não reprocessa o XML e as páginas são
+    compartilhadas entre processos pelo cache do sistema operacional. Como o
+    diretório é endereçado pelo hash do conteúdo, um arquivo alterado nunca
+    reaproveita um sidecar antigo; o manifesto de cada planilha repete o hash
+    e a versão do formato para detectar cópias incompletas ou de outra versão.
+    O diretório inteiro é uma entrada do cache, podada em ordem LRU com os
+    resultados (podar_cache); cada leitura renova o seu mtime.
+    """
+    
+    VERSAO = 4
+    
+    def __init__(self, diretorio: str, hash_arquivo: str):
+        self.hash_arquivo = hash_arquivo
+        self.diretorio = os.path.join(diretorio, 'colunar', hash_arquivo)
+    
+    def _caminho(self, nome_planilha: str, sufixo: str) -> str:
+        prefixo = hashlib.sha1(nome_planilha.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.diretorio, f'{prefixo}{sufixo}')
+    
+    def _gravar_json(self, caminho: str, conteudo: Any):
+        os.makedirs(self.diretorio, exist_ok=True)
+        temporario = f'{caminho}.{os.getpid()}.tmp'
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump(conteudo, arquivo, ensure_ascii=False, default=str)
+        os.replace(temporario, caminho)
+    
+    def _ler_json(self, caminho: str) -> Optional[Any]:
+        try:
+            with open(caminho, 'r', encoding='utf-8') as arquivo:
+                conteudo = json.load(arquivo)
+        except (OSError, ValueError):
+            return None
+        if isinstance(conteudo, dict) and (conteudo.get('versao') != self.VERSAO
+                                           or conteudo.get('hash_arquivo') != self.hash_arquivo):
+            return None
+        return conteudo
+    
+    def gravar_planilhas(self, planilhas: List[str]):
+        self._gravar_json(os.path.join(self.diretorio, 'arquivo.json'),
+                          {'versao': self.VERSAO, 'hash_arquivo': self.hash_arquivo, 'planilhas': list(planilhas)})
+    
+    def ler_planilhas(self) -> Optional[List[str]]:
+        conteudo = self._ler_json(os.path.join(self.diretorio, 'arquivo.json'))
+        if not conteudo:
+            return None
+        try:
+            # Marcar uso recente para a poda LRU
+            os.utime(self.diretorio)
+        except OSError:
+            pass
+        return conteudo['planilhas']
+    
+    def gravar_leitura(self, nome_planilha: str, tipo: Optional[str], leitura: Dict[str, Any]):
+        """Grava colunas tipadas, janela inicial e dimensões de uma planilha lida"""
+        carregador = leitura['carregador']
+        manifesto = {
+            'versao': self.VERSAO,
+            'hash_arquivo': self.hash_arquivo,
+            'planilha': nome_planilha,
+            'tipo': tipo,
+            'linhas': leitura['linhas'],
+            'colunas': leitura.get('colunas', 0),
+            'janela': leitura.get('janela'),
+            'carregador': None
+        }
+        
+        os.makedirs(self.diretorio, exist_ok=True)
+        if carregador is not None:
+            n = carregador.total_registros
+            colunas = {}
+            for papel in carregador.colunas:
+                valores = carregador.valores[papel][:n]
+                ausentes = carregador.ausentes[papel][:n]
+                if TIPOS_COLUNAS[papel] == 'chave':
+                    # Texto de largura fixa ('U') para permitir mmap
+                    valores = np.where(ausentes, '', valores).astype(str)
+                np.save(self._caminho(nome_planilha, f'-{papel}.npy'), valores)
+                np.save(self._caminho(nome_planilha, f'-{papel}-ausentes.npy'), ausentes)
+                colunas[papel] = TIPOS_COLUNAS[papel]
+            manifesto['carregador'] = {
+                'colunas_identificadas': carregador.colunas_identificadas,
+                'total_registros': n,
+                'registros_validos': carregador.registros_validos,
+                'amostra': carregador.amostra,
+                'colunas': colunas,
+                'normalizacao_datas': {papel: normalizador.estado()
+                                       for papel, normalizador in carregador.normalizadores.items()}
+            }
+        
+        # O manifesto vai por último: sem ele a planilha não é considerada gravada
+        self._gravar_json(self._caminho(nome_planilha, '.json'), manifesto)
+    
+    def gravar_formulas(self, nome_planilha: str, formulas: List[Dict[str, Any]]):
+        self._gravar_json(self._caminho(nome_planilha, '-formulas.json'),
+                          {'versao': self.VERSAO, 'hash_arquivo': self.hash_arquivo, 'formulas': formulas})
+    
+    def ler_manifesto(self, nome_planilha: str) -> Optional[Dict[str, Any]]:
+        return self._ler_json(self._caminho(nome_planilha, '.json'))
+    
+    def ler_colunas(self, nome_planilha: str, manifesto: Dict[str, Any]):
+        """Colunas mapeadas em memória: (valores, ausentes) por papel"""
+        valores, ausentes = {}, {}
+        for papel, tipo in manifesto['carregador']['colunas'].items():
+            valores[papel] = np.load(self._caminho(nome_planilha, f'-{papel}.npy'), mmap_mode='r')
+            ausentes[papel] = np.load(self._caminho(nome_planilha, f'-{papel}-ausentes.npy'), mmap_mode='r')
+            if tipo == 'chave':
+                valores[papel] = valores[papel].astype(object)
+        return valores, ausentes
+    
+    def ler_formulas(self, nome_planilha: str) -> Optional[List[Dict[str, Any]]]:
+        conteudo = self._ler_json(self._caminho(nome_planilha, '-formulas.json'))
+        return conteudo['formulas'] if conteudo else None
+    
+    def remover(self):
+        shutil.rmtree(self.diretorio, ignore_errors=True)
+
+
+class RegistroLayouts:
+    """Registro local dos layouts de cabeçalho já vistos (impressão → papéis das colunas)
+    
+    A impressão de um layout é o sha256 do tipo da planilha com o cabeçalho
+    normalizado (minúsculas, espaços colapsados). Na primeira vez que um
+    layout aparece, os papéis encontrados pelas heurísticas identificar_colunas*
+    são gravados com a posição e o tipo final de cada coluna; nas seguintes o
+    mapeamento vem direto do registro, sem nova detecção. Entradas com origem
+    'manual' (copiadas de uma detectada e corrigidas à mão) valem sempre; as
+    detectadas expiram quando VERSAO muda, isto é, quando as heurísticas mudam.
+    """
+    
+    VERSAO = 2
+    
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self._layouts = None
+    
+    @staticmethod
+    def normalizar(cabecalho: List[str]) -> List[str]:
+        return [' '.join(str(coluna).split()).lower() for coluna in cabecalho]
+    
+    @classmethod
+    def impressao(cls, tipo: str, cabecalho: List[str]) -> str:
+        conteudo = json.dumps([tipo, cls.normalizar(cabecalho)], ensure_ascii=False)
+        return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+    
+    def _ler(self) -> Dict[str, Any]:
+        try:
+            with open(self.caminho, 'r', encoding='utf-8') as arquivo:
+                conteudo = json.load(arquivo)
+        except (OSError, ValueError):
+            return {}
+        layouts = conteudo.get('layouts') if isinstance(conteudo, dict) else None
+        return layouts if isinstance(layouts, dict) else {}
+    
+    def layouts(self) -> Dict[str, Any]:
+        if self._layouts is None:
+            self._layouts = self._ler()
+        return self._layouts
+    
+    def consultar(self, tipo: str, cabecalho: List[str]) -> Optional[Dict[str, Optional[str]]]:
+        """Mapeamento papel → coluna de um layout conhecido (None se ausente ou desatualizado)"""
+        entrada = self.layouts().get(self.impressao(tipo, cabecalho))
+        if not isinstance(entrada, dict) or entrada.get('cabecalho') != self.normalizar(cabecalho):
+            return None
+        if entrada.get('origem') != 'manual' and entrada.get('versao') != self.VERSAO:
+            return None
+        
+        tipos = entrada.get('tipos') or {}
+        mapeamento = {}
+        for papel, indice in (entrada.get('indices') or {}).items():
+            if indice is None:
+                mapeamento[papel] = None
+                continue
+            # Posição fora do cabeçalho ou tipo final diferente do atual: entrada inválida
+            if not isinstance(indice, int) or not 0 <= indice < len(cabecalho):
+                return None
+            if papel in tipos and tipos[papel] != TIPOS_COLUNAS.get(papel):
+                return None
+            mapeamento[papel] = cabecalho[indice]
+        return mapeamento
+    
+    def registrar(self, tipo: str, cabecalho: List[str], mapeamento: Dict[str, Optional[str]]):
+        """Grava o layout detectado (sem sobrescrever entradas manuais)"""
+        impressao = self.impressao(tipo, cabecalho)
+        # Relido antes de gravar: outras análises podem ter registrado layouts
+        layouts = self._ler()
+        if isinstance(layouts.get(impressao), dict) and layouts[impressao].get('origem') == 'manual':
+            self._layouts = layouts
+            return
+        
+        layouts[impressao] = {
+            'tipo': tipo,
+            'cabecalho': self.normalizar(cabecalho),
+            'colunas': mapeamento,
+            'indices': {papel: None if coluna is None else cabecalho.index(coluna)
+                        for papel, coluna in mapeamento.items()},
+            'tipos': {papel: TIPOS_COLUNAS[papel] for papel, coluna in mapeamento.items()
+                      if coluna is not None and papel in TIPOS_COLUNAS},
+            'origem': 'deteccao',
+            'versao': self.VERSAO,
+            'registrado_em': datetime.now().isoformat()
+        }
+        
+        diretorio = os.path.dirname(os.path.abspath(self.caminho))
+        os.makedirs(diretorio, exist_ok=True)
+        temporario = f'{self.caminho}.{os.getpid()}.tmp'
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump({'layouts': layouts}, arquivo, ensure_ascii=False, indent=1)
+        os.replace(temporario, self.caminho)
+        self._layouts = layouts
+
+
+class RegistroTabuas:
+    """Registro local de tábuas padrão (AT-2000, BR-EMS, IBGE...) como arrays densos de qx
+    
+    O pacote é um diretório com tabuas.json (metadados de cada tábua e escala
+    de melhoria, com a posição no array) e dois arrays float64 gravados por
+    np.save: qx [tábua, sexo, idade] e melhoria [escala, sexo, idade], com
+    idades de 0 a IDADE_MAXIMA_REGISTRO_TABUAS. Os arrays são abertos sob
+    demanda com mmap, então consultar um qx é indexação direta, sem reler a
+    tábua nem abrir planilha. As tábuas são guardadas completas
+    (completar_tabua_qx): OUTROS tem o qx geral e idades acima da última
+    conhecida repetem o último qx. Com escala de melhoria o qx do ano t é
+    qx * (1 - melhoria) ** (t - ano_base). Como no SnapshotIncremental, cada
+    gravação cria arrays de uma geração nova e só vale quando tabuas.json aponta
+    para ela.
+    """
+    
+    VERSAO = 1
+    
+    def __init__(self, diretorio: str):
+        self.diretorio = diretorio
+        self._indice = None
+        self._arrays = {}
+    
+    def _ler(self) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self.diretorio, 'tabuas.json'), 'r', encoding='utf-8') as arquivo:
+                indice = json.load(arquivo)
+        except (OSError, ValueError):
+            indice = None
+        if not isinstance(indice, dict) or indice.get('versao') != self.VERSAO:
+            return {'versao': self.VERSAO, 'geracao': None, 'tabuas': {}, 'escalas': {}}
+        return indice
+    
+    def indice(self) -> Dict[str, Any]:
+        if self._indice is None:
+            self._indice = self._ler()
+        return self._indice
+    
+    def _array(self, tipo: str) -> np.ndarray:
+        """qx ou melhoria da geração atual, mapeado em memória na primeira consulta"""
+        geracao = self.indice()['geracao']
+        if (tipo, geracao) not in self._arrays:
+            self._arrays[(tipo, geracao)] = np.load(os.path.join(self.diretorio, f'{tipo}-{geracao}.npy'), mmap_mode='r')
+        return self._arrays[(tipo, geracao)]
+    
+    def _gravar(self, indice: Dict[str, Any], qx: np.ndarray, melhoria: np.ndarray):
+        os.makedirs(self.diretorio, exist_ok=True)
+        geracao = f'{datetime.now().strftime("%Y%m%d%H%M%S%f")}-{os.getpid()}'
+        np.save(os.path.join(self.diretorio, f'qx-{geracao}.npy'), qx)
+        np.save(os.path.join(self.diretorio, f'melhoria-{geracao}.npy'), melhoria)
+        
+        indice = {**indice, 'versao': self.VERSAO, 'geracao': geracao}
+        caminho = os.path.join(self.diretorio, 'tabuas.json')
+        temporario = f'{caminho}.{os.getpid()}.tmp'
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump(indice, arquivo, ensure_ascii=False, indent=1)
+        os.replace(temporario, caminho)
+        self._indice, self._arrays = indice, {}
+        
+        # Arrays já mapeados por outro processo continuam válidos depois de removidos
+        for nome in os.listdir(self.diretorio):
+            if nome.endswith('.npy') and not nome.endswith(f'-{geracao}.npy'):
+                try:
+                    os.remove(os.path.join(self.diretorio, nome))
+                except OSError:
+                    pass
+    
+    def _atuais(self):
+        """Índice relido do disco e cópias dos arrays, para alterar e gravar"""
+        self._indice, self._arrays = None, {}
+        indice = self.indice()
+        forma = (0, len(CATEGORIAS_SEXO), IDADE_MAXIMA_REGISTRO_TABUAS + 1)
+        if indice['geracao'] is None:
+            return indice, np.empty(forma), np.empty(forma)
+        return indice, np.array(self._array('qx')), np.array(self._array('melhoria'))
+    
+    @staticmethod
+    def densa(valores: np.ndarray, idade_inicial: int = 0) -> np.ndarray:
+        """Array [sexo, idade] do registro a partir de valores [sexo, idade] desde idade_inicial"""
+        valores = np.asarray(valores, dtype=np.float64)
+        densa = np.full((len(CATEGORIAS_SEXO), IDADE_MAXIMA_REGISTRO_TABUAS + 1), np.nan)
+        fim = min(idade_inicial + valores.shape[1], densa.shape[1])
+        densa[:len(valores), idade_inicial:fim] = valores[:, :fim - idade_inicial]
+        return densa
+    
+    @staticmethod
+    def revisao(valores: np.ndarray) -> str:
+        return hashlib.sha256(np.ascontiguousarray(valores, dtype=np.float64).tobytes()).hexdigest()[:16]
+    
+    def registrar(self, nome: str, qx: np.ndarray, idade_inicial: int = 0, descricao: Optional[str] = None,
+                  fonte: Optional[str] = None, ano_base: Optional[int] = None, escala: Optional[str] = None,
+                  origem: str = 'usuario') -> Dict[str, Any]:
+        """Registra (ou substitui) uma tábua; qx[sexo, idade] com MASCULINO, FEMININO e geral a partir de idade_inicial"""
+        densa = self.densa(qx, idade_inicial)
+        conhecidas = np.flatnonzero(np.isfinite(densa).any(axis=0))
+        densa = completar_tabua_qx(densa)
+        if densa is None:
+            raise ValueError(f'Tábua sem valores de qx: {nome}')
+        if np.nanmin(densa) < 0 or np.nanmax(densa) > 1:
+            raise ValueError(f'Tábua com qx fora de [0, 1]: {nome}')
+        
+        indice, tabuas, melhoria = self._atuais()
+        if escala is not None and escala not in indice['escalas']:
+            raise KeyError(f'Escala de melhoria não registrada: {escala}')
+        atual = indice['tabuas'].get(nome)
+        if atual is not None:
+            tabuas[atual['indice']] = densa
+        else:
+            tabuas = np.concatenate([tabuas, densa[np.newaxis]])
+        entrada = {
+            'indice': atual['indice'] if atual is not None else len(tabuas) - 1,
+            'descricao': descricao or CATALOGO_TABUAS.get(nome),
+            'fonte': fonte,
+            'idade_inicial': int(conhecidas[0]),
+            'idade_final': int(conhecidas[-1]),
+            'ano_base': ano_base,
+            'escala': escala,
+            'origem': origem,
+            'revisao': self.revisao(densa),
+            'registrada_em': datetime.now().isoformat()
+        }
+        indice['tabuas'][nome] = entrada
+        self._gravar(indice, tabuas, melhoria)
+        return entrada
+    
+    def registrar_escala(self, nome: str, melhoria: np.ndarray, idade_inicial: int = 0,
+                         descricao: Optional[str] = None, fonte: Optional[str] = None) -> Dict[str, Any]:
+        """Registra uma escala de melhoria anual [sexo, idade]; idades sem valor ficam sem melhoria"""
+        densa = self.densa(melhoria, idade_inicial)
+        if not np.isfinite(densa[2]).any():
+            disponiveis = np.isfinite(densa[:2])
+            densa[2] = np.nansum(densa[:2], axis=0) / np.maximum(disponiveis.sum(axis=0), 1)
+        densa[:2] = np.where(np.isfinite(densa[:2]).any(axis=1, keepdims=True), densa[:2], densa[2])
+        densa = np.nan_to_num(densa, nan=0.0)
+        if densa.min() <= -1 or densa.max() >= 1:
+            raise ValueError(f'Escala com melhoria fora de (-1, 1): {nome}')
+        
+        indice, tabuas, melhorias = self._atuais()
+        atual = indice['escalas'].get(nome)
+        if atual is not None:
+            melhorias[atual['indice']] = densa
+        else:
+            melhorias = np.concatenate([melhorias, densa[np.newaxis]])
+        entrada = {
+            'indice': atual['indice'] if atual is not None else len(melhorias) - 1,
+            'descricao': descricao,
+            'fonte': fonte,
+            'revisao': self.revisao(densa),
+            'registrada_em': datetime.now().isoformat()
+        }
+        indice['escalas'][nome] = entrada
+        self._gravar(indice, tabuas, melhorias)
+        return entrada
+    
+    def remover(self, nome: str) -> bool:
+        """Remove uma tábua ou escala (as posições das seguintes são renumeradas)"""
+        indice, tabuas, melhorias = self._atuais()
+        for grupo in ('tabuas', 'escalas'):
+            if nome in indice[grupo]:
+                break
+        else:
+            return False
+        if grupo == 'escalas' and any(entrada.get('escala') == nome for entrada in indice['tabuas'].values()):
+            raise ValueError(f'Escala em uso como padrão de uma tábua: {nome}')
+        
+        removido = indice[grupo].pop(nome)['indice']
+        for entrada in indice[grupo].values():
+            if entrada['indice'] > removido:
+                entrada['indice'] -= 1
+        if grupo == 'tabuas':
+            tabuas = np.delete(tabuas, removido, axis=0)
+        else:
+            melhorias = np.delete(melhorias, removido, axis=0)
+        self._gravar(indice, tabuas, melhorias)
+        return True
+    
+    def listar(self) -> Dict[str, Any]:
+        """Tábuas e escalas registradas e as do catálogo ainda não importadas"""
+        indice = self.indice()
+        return {
+            'diretorio': self.diretorio,
+            'tabuas': indice['tabuas'],
+            'escalas': indice['escalas'],
+            'catalogo_nao_registrado': {nome: descricao for nome, descricao in CATALOGO_TABUAS.items()
+                                        if nome not in indice['tabuas']}
+        }
+    
+    def _escala(self, nome: str, entrada: Dict[str, Any], escala: Optional[str], anos) -> Optional[tuple]:
+        """(posição da escala, ano base) quando há melhoria a aplicar"""
+        escala = escala or entrada.get('escala')
+        if anos is None or not escala:
+            return None
+        if escala not in self.indice()['escalas']:
+            raise KeyError(f'Escala de melhoria não registrada: {escala}')
+        if entrada.get('ano_base') is None:
+            raise ValueError(f'Tábua sem ano base para aplicar a melhoria: {nome}')
+        return self.indice()['escalas'][escala]['indice'], int(entrada['ano_base'])
+    
+    def consultar(self, nome: str, idades, sexos, anos=None, escala: Optional[str] = None) -> np.ndarray:
+        """qx por registro: idades completas, códigos de sexo (posições em CATEGORIAS_SEXO) e,
+        com escala de melhoria (a informada ou a padrão da tábua), anos-calendário; os
+        argumentos são combinados por broadcasting e idades negativas resultam em NaN"""
+        entrada = self.indice()['tabuas'].get(nome)
+        if entrada is None:
+            raise KeyError(f'Tábua não registrada: {nome}')
+        idades = np.asarray(idades, dtype=np.int64)
+        sexos = np.asarray(sexos, dtype=np.int64)
+        posicoes = np.clip(idades, 0, IDADE_MAXIMA_REGISTRO_TABUAS)
+        
+        qx = self._array('qx')[entrada['indice']][sexos, posicoes]
+        melhoria = self._escala(nome, entrada, escala, anos)
+        if melhoria is not None:
+            posicao, ano_base = melhoria
+            taxas = self._array('melhoria')[posicao][sexos, posicoes]
+            qx = qx * (1.0 - taxas) ** (np.asarray(anos, dtype=np.float64) - ano_base)
+        return np.where(idades >= 0, qx, np.nan)
+    
+    def tabua(self, nome: str, idade_maxima: int, anos=None, escala: Optional[str] = None) -> np.ndarray:
+        """Tábua qx[sexo, idade] até idade_maxima, ou qx[ano, sexo, idade] com melhoria nos anos informados"""
+        idades = np.arange(idade_maxima + 1)
+        sexos = np.arange(len(CATEGORIAS_SEXO))[:, np.newaxis]
+        entrada = self.indice()['tabuas'].get(nome)
+        if anos is None or entrada is None or self._escala(nome, entrada, escala, anos) is None:
+            return self.consultar(nome, idades, sexos)
+        anos = np.asarray(anos)[:, np.newaxis, np.newaxis]
+        return self.consultar(nome, idades, sexos, anos, escala)
+    
+    def revisoes(self, nomes: List[str]) -> Dict[str, Optional[str]]:
+        """Revisão (hash dos valores) das tábuas e escalas citadas, para a chave do cache"""
+        indice = self.indice()
+        revisoes = {}
+        for nome in nomes:
+            entrada = indice['tabuas'].get(nome) or indice['escalas'].get(nome)
+            revisoes[nome] = entrada and entrada['revisao']
+            if entrada and entrada.get('escala'):
+                revisoes[entrada['escala']] = indice['escalas'].get(entrada['escala'], {}).get('revisao')
+        return revisoes
+
+
+class SnapshotIncremental:
+    """Estado da última base analisada no modo incremental
+    
+    Para massa e óbitos guarda as colunas tipadas (.npy por papel), o grupo de
+    cada linha (hash da matrícula, ou o da linha quando ela falta), o hash de
+    cada linha e o estado dos acumuladores das distribuições; para a exposição, os
+    arrays do MotorExposicao e as contagens de óbitos. Cada gravação vai para um
+    diretório de geração novo e só vale quando atual.json aponta para ele: uma
+    execução interrompida mantém o snapshot anterior.
+    """
+    
+    VERSAO = 3
+    
+    def __init__(self, diretorio: str):
+        self.diretorio = diretorio
+        self.manifesto = None
+    
+    def _geracao(self) -> str:
+        return os.path.join(self.diretorio, self.manifesto['geracao'])
+    
+    def carregar(self) -> Optional[Dict[str, Any]]:
+        """Manifesto do snapshot atual (None se ausente, ilegível ou de outra versão)"""
+        try:
+            with open(os.path.join(self.diretorio, 'atual.json'), 'r', encoding='utf-8') as arquivo:
+                manifesto = json.load(arquivo)
+        except (OSError, ValueError):
+            return None
+        if manifesto.get('versao') != self.VERSAO or not os.path.isdir(os.path.join(self.diretorio, manifesto.get('geracao', ''))):
+            return None
+        self.manifesto = manifesto
+        return manifesto
+    
+    def ler_tipo(self, tipo: str):
+        """Colunas (valores, ausentes), grupos e hashes das linhas de um tipo do snapshot"""
+        valores, ausentes = {}, {}
+        for papel in self.manifesto['tipos'][tipo]['colunas']:
+            valores[papel] = np.load(os.path.join(self._geracao(), f'{tipo}-{papel}.npy'))
+            ausentes[papel] = np.load(os.path.join(self._geracao(), f'{tipo}-{papel}-ausentes.npy'))
+        grupos = np.load(os.path.join(self._geracao(), f'{tipo}-grupos.npy'))
+        hashes = np.load(os.path.join(self._geracao(), f'{tipo}-hashes.npy'))
+        return valores, ausentes, grupos, hashes
+    
+    def ler_impressoes(self, tipo: str):
+        """Grupos distintos e impressões de um tipo, como gravados (ver impressoes)"""
+        return (np.load(os.path.join(self._geracao(), f'{tipo}-chaves.npy')),
+                np.load(os.path.join(self._geracao(), f'{tipo}-impressoes.npy')))
+    
+    def ler_exposicao(self) -> Dict[str, np.ndarray]:
+        with np.load(os.path.join(self._geracao(), 'exposicao.npz')) as arrays:
+            return {nome: arrays[nome] for nome in arrays.files}
+    
+    def gravar(self, manifesto: Dict[str, Any], tipos: Dict[str, tuple], exposicao: Optional[MotorExposicao]):
+        """Grava uma geração nova e passa atual.json para ela; remove as gerações anteriores
+        
+        tipos: ((valores, ausentes, grupos, hashes), (chaves, impressoes)) por tipo.
+        """
+        geracao = f'geracao-{datetime.now().strftime("%Y%m%d%H%M%S%f")}-{os.getpid()}'
+        destino = os.path.join(self.diretorio, geracao)
+        os.makedirs(destino)
+        for tipo, ((valores, ausentes, grupos, hashes), (chaves, impressoes)) in tipos.items():
+            for papel in valores:
+                np.save(os.path.join(destino, f'{tipo}-{papel}.npy'), valores[papel])
+                np.save(os.path.join(destino, f'{tipo}-{papel}-ausentes.npy'), ausentes[papel])
+            np.save(os.path.join(destino, f'{tipo}-grupos.npy'), grupos)
+            np.save(os.path.join(destino, f'{tipo}-hashes.npy'), hashes)
+            np.save(os.path.join(destino, f'{tipo}-chaves.npy'), chaves)
+            np.save(os.path.join(destino, f'{tipo}-impressoes.npy'), impressoes)
+        if exposicao is not None:
+            np.savez(os.path.join(destino, 'exposicao.npz'), exposicao_central=exposicao.exposicao_central,
+                     complemento_obitos=exposicao.complemento_obitos, obitos=exposicao.obitos)
+        
+        manifesto = {**manifesto, 'versao': self.VERSAO, 'geracao': geracao}
+        caminho = os.path.join(self.diretorio, 'atual.json')
+        temporario = f'{caminho}.{os.getpid()}.tmp'
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump(manifesto, arquivo, ensure_ascii=False, default=str)
+        os.replace(temporario, caminho)
+        self.manifesto = manifesto
+        
+        for nome in os.listdir(self.diretorio):
+            if nome.startswith('geracao-') and nome != geracao:
+                shutil.rmtree(os.path.join(self.diretorio, nome), ignore_errors=True)
+    
+    @staticmethod
+    def identificar_linhas(valores: Dict[str, np.ndarray], ausentes: Dict[str, np.ndarray]):
+        """Grupo e hash (uint64) de cada linha
+        
+        O hash mistura os bits de todas as colunas tipadas (e as ausências); o
+        grupo é o hash da matrícula ou, sem ela, o da própria linha.
+        """
+        n = len(next(iter(valores.values()))) if valores else 0
+        hashes = np.zeros(n, dtype=np.uint64)
+        hash_matricula = None
+        with np.errstate(over='ignore'):
+            for papel in sorted(valores):
+                coluna = valores[papel]
+                if TIPOS_COLUNAS[papel] == 'chave':
+                    # Texto de largura fixa visto como matriz de code points: um passo por caractere
+                    texto = coluna.astype(str, copy=False)
+                    bits = np.full(len(texto), np.uint64(0xBB67AE8584CAA73B))
+                    for codigos in texto.view(np.uint32).reshape(len(texto), -1).T:
+                        bits = (bits ^ codigos) * np.uint64(0xBF58476D1CE4E5B9)
+                        bits ^= bits >> np.uint64(31)
+                    hash_matricula = bits if papel == 'matricula' else hash_matricula
+                elif coluna.dtype.kind == 'f' or coluna.dtype.kind == 'M':
+                    bits = coluna.view(np.uint64)
+                else:
+                    bits = coluna.astype(np.int64).view(np.uint64)
+                bits = np.where(ausentes[papel], np.uint64(0x6A09E667F3BCC909), bits)
+                hashes = (hashes ^ bits) * np.uint64(0x9E3779B97F4A7C15)
+                hashes ^= hashes >> np.uint64(29)
+        if hash_matricula is None:
+            return hashes, hashes
+        return np.where(ausentes['matricula'], hashes, hash_matricula), hashes
+    
+    @staticmethod
+    def impressoes(grupos: np.ndarray, hashes: np.ndarray):
+        """Grupos distintos (ordenados) e uma impressão por grupo
+        
+        A impressão combina os hashes das linhas do grupo com a posição de cada
+        uma dentro dele, então muda com qualquer inclusão, exclusão, alteração
+        ou troca de ordem (a ligação dos óbitos usa a última ocorrência).
+        """
+        if not len(grupos):
+            return grupos, np.zeros(0, dtype=np.uint64)
+        ordem = np.argsort(grupos, kind='stable')
+        ordenados = grupos[ordem]
+        inicios = np.flatnonzero(np.r_[True, ordenados[1:] != ordenados[:-1]])
+        posicoes = np.arange(len(ordenados)) - np.repeat(inicios, np.diff(np.r_[inicios, len(ordenados)]))
+        with np.errstate(over='ignore'):
+            mistura = (hashes[ordem] ^ (posicoes.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15))) * np.uint64(0xBF58476D1CE4E5B9)
+        return ordenados[inicios], np.bitwise_xor.reduceat(mistura, inicios)
+    
+    @staticmethod
+    def comparar(grupos_antigos: np.ndarray, impressoes_antigas: np.ndarray,
+                 grupos_novos: np.ndarray, impressoes_novas: np.ndarray):
+        """Grupos que entraram, saíram e mudaram entre duas bases (arrays ordenados de impressoes)"""
+        def localizar(procurados, ordenados):
+            posicoes = np.minimum(np.searchsorted(ordenados, procurados), max(len(ordenados) - 1, 0))
+            return posicoes, (ordenados[posicoes] == procurados) if len(ordenados) else np.zeros(len(procurados), dtype=bool)
+        
+        posicoes, existiam = localizar(grupos_novos, grupos_antigos)
+        _, continuam = localizar(grupos_antigos, grupos_novos)
+        alterados = existiam.copy()
+        alterados[existiam] = impressoes_antigas[posicoes[existiam]] != impressoes_novas[existiam]
+        return grupos_novos[~existiam], grupos_antigos[~continuam], grupos_novos[alterados]
+
+
 class AnalisadorMortalidadeExcel:
-    def __init__(self, caminho_arquivo: str, configuracao: Dict[str, Any]):
+    def __init__(self, caminho_arquivo: str, configuracao: Dict[str, Any], memoria: Optional[Dict[str, Any]] = None,
+                 emitir_evento: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 ponto_controle: Optional[Callable[[str], None]] = None):
         self.caminho_arquivo = caminho_arquivo
         self.configuracao = configuracao
+        # Leituras já feitas deste arquivo, mantidas entre análises pelo modo worker
+        self.memoria = memoria
+        # Consumidor dos eventos de progresso (saída NDJSON); o pulso emite de outra thread
+        self.emitir_evento = emitir_evento
+        self._trava_emissao = threading.Lock()
         self.workbook = None
         self.dados_extraidos = {}
         self.estatisticas = {}
         self.validacao = {'erros_encontrados': [], 'warnings': [], 'integridade_ok': True}
         self.formulas_encontradas = []
+        self.total_formulas = 0
+        self.janela_planilha = []
+        self.colunas_planilha = 0
+        self._hash_arquivo = None
+        self._sidecar = None
+        self._scanner = None
+        self._registro_layouts = None
+        self._registro_tabuas = None
+        # Snapshot, colunas e delta da análise em andamento no modo incremental
+        self.incremental = None
+        # Exposição calculada, tábua da planilha e tábua de referência do registro (nome, qx), usadas nos testes de aderência
+        self.motor_exposicao = None
+        self.tabua_qx = None
+        self.tabua_referencia = None
+        self.tabuas_nao_registradas = {}
+        # Cubo agregado ano × sexo × idade × situação da exposição calculada (ver gravar_cubo)
+        self.cubo = None
+        # qx [sexo, idade] graduado no período inteiro, base das réplicas da simulação
+        self.taxas_graduadas = None
+        # Tabelas tipadas usadas na exposição (massa, obitos, qx), consultadas pelo modo lote
+        self.tabelas = {}
+        self.formulas_planilha = []
+        self.linhas_lidas = 0
+        # Tempo e memória por etapa (metadados.perfil); perfilDetalhado também liga o rastreamento
+        # ponto_controle é chamado no início de cada etapa e pode levantar AnaliseCancelada
+        self.perfil = PerfilExecucao(bool(configuracao.get('perfilMemoria') or configuracao.get('perfilDetalhado')),
+                                     ponto_controle)
+    
+    def emitir(self, evento: str, **dados):
+        """Envia um evento de progresso ao consumidor, se houver"""
+        if self.emitir_evento is not None:
+            with self._trava_emissao:
+                self.emitir_evento({'evento': evento, 'instante': datetime.now().isoformat(), **dados})
+    
+    @contextmanager
+    def pulso(self):
+        """Emite 'pulso' com a etapa aberta a cada intervaloPulsoSegundos enquanto o bloco roda
+        
+        Etapas como o load_workbook, a simulação e a varredura do XML passam
+        minutos sem outro evento; o pulso mostra ao consumidor que a análise
+        segue viva (0 desliga).
+        """
+        intervalo = float(self.configuracao.get('intervaloPulsoSegundos', INTERVALO_PULSO_SEGUNDOS))
+        if self.emitir_evento is None or intervalo <= 0:
+            yield
+            return
+        
+        parar = threading.Event()
+        
+        def pulsar():
+            while not parar.wait(intervalo):
+                abertas = [registro for registro in list(self.perfil.etapas) if 'tempo' not in registro]
+                atual = abertas[-1] if abertas else {}
+                self.emitir('pulso', etapa=atual.get('etapa'), planilha=atual.get('planilha'))
+        
+        thread = threading.Thread(target=pulsar, name='pulso-analise', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            parar.set()
+            thread.join()
         
     def carregar_arquivo(self):
         """Carrega o arquivo Excel usando OpenPyXL e Pandas"""
         try:
-            # Carregar com OpenPyXL para preservar fórmulas
-            self.workbook = load_workbook(self.caminho_arquivo, data_only=False)
+            sidecar = self.obter_sidecar()
+            
+            if self.memoria is not None and 'planilhas' in self.memoria:
+                # Arquivo já lido por uma análise anterior do worker
+                planilhas = list(self.memoria['planilhas'])
+            elif sidecar is not None and sidecar.ler_planilhas() is not None:
+                # Arquivo já lido por outra análise (sidecar colunar)
+                planilhas = sidecar.ler_planilhas()
+            else:
+                self.abrir_workbook()
+                
+                # Listar todas as planilhas
+                planilhas = self.workbook.sheetnames
+                
+                if sidecar is not None:
+                    try:
+                        sidecar.gravar_planilhas(planilhas)
+                    except OSError:
+                        pass
             
-            # Listar todas as planilhas
-            planilhas = self.workbook.sheetnames
+            if self.memoria is not None:
+                self.memoria['planilhas'] = list(planilhas)
             
             # Filtrar planilhas específicas se configurado
             if self.configuracao.get('planilhasEspecificas'):
@@ -54,216 +3898,1497 @@ class AnalisadorMortalidadeExcel:
             self.validacao['erros_encontrados'].append(f"Erro ao carregar arquivo: {str(e)}")
             raise
     
-    def extrair_formulas(self, worksheet):
-        """Extrai fórmulas da planilha"""
+    def calcular_hash(self) -> str:
+        """Hash do conteúdo do arquivo (guardado na memória do worker quando houver)"""
+        if self.memoria is not None and 'hash' in self.memoria:
+            return self.memoria['hash']
+        if self._hash_arquivo is None:
+            self._hash_arquivo = calcular_hash_arquivo(self.caminho_arquivo)
+            if self.memoria is not None:
+                self.memoria['hash'] = self._hash_arquivo
+        return self._hash_arquivo
+    
+    def tamanho_maximo_cache(self) -> int:
+        """Orçamento em bytes do cache (resultados e sidecars): configuracao.tamanhoMaximoCacheMB, padrão 512"""
+        return int(float(self.configuracao.get('tamanhoMaximoCacheMB', 512)) * 1024 * 1024)
+    
+    def obter_sidecar(self) -> Optional[SidecarColunar]:
+        """Sidecar colunar do arquivo (configuracao.usarSidecar, ativo por padrão)"""
+        if self._sidecar is None:
+            self._sidecar = False
+            if self.configuracao.get('usarSidecar', True):
+                try:
+                    self._sidecar = SidecarColunar(
+                        diretorio_cache_padrao(self.caminho_arquivo, self.configuracao),
+                        self.calcular_hash()
+                    )
+                    if self.configuracao.get('invalidarCache'):
+                        self._sidecar.remover()
+                except OSError:
+                    self._sidecar = False
+        return self._sidecar or None
+    
+    def obter_registro_layouts(self) -> Optional[RegistroLayouts]:
+        """Registro de layouts de cabeçalho (configuracao.usarRegistroLayouts, ativo por padrão)
+        
+        Fica em configuracao.registroLayouts ou em <cache>/layouts.json.
+        """
+        if self._registro_layouts is None:
+            self._registro_layouts = False
+            if self.configuracao.get('usarRegistroLayouts', True):
+                self._registro_layouts = RegistroLayouts(
+                    self.configuracao.get('registroLayouts')
+                    or os.path.join(diretorio_cache_padrao(self.caminho_arquivo, self.configuracao), 'layouts.json')
+                )
+        return self._registro_layouts or None
+    
+    def obter_registro_tabuas(self) -> RegistroTabuas:
+        """Registro de tábuas padrão (ver diretorio_tabuas_padrao)"""
+        if self._registro_tabuas is None:
+            self._registro_tabuas = RegistroTabuas(diretorio_tabuas_padrao(self.configuracao))
+        return self._registro_tabuas
+    
+    @staticmethod
+    def definicao_registro(definicao: Any) -> Optional[Dict[str, Any]]:
+        """{'tabua': nome, 'escala': ...} de uma referência ao registro (nome ou dicionário com 'tabua')"""
+        if isinstance(definicao, str):
+            return {'tabua': definicao}
+        if isinstance(definicao, dict) and isinstance(definicao.get('tabua'), str):
+            return definicao
+        return None
+    
+    def definicoes_tabuas_aderencia(self) -> Dict[str, Any]:
+        """configuracao.tabuasAderencia como nome → definição; uma lista contém só nomes do registro"""
+        definicoes = self.configuracao.get('tabuasAderencia') or {}
+        if isinstance(definicoes, list):
+            return {nome: nome for nome in definicoes}
+        return definicoes
+    
+    def tabuas_registro_citadas(self) -> List[str]:
+        """Tábuas do registro usadas por tabuaReferencia e tabuasAderencia"""
+        definicoes = [self.configuracao.get('tabuaReferencia'), *self.definicoes_tabuas_aderencia().values()]
+        return sorted({registro['tabua'] for registro in map(self.definicao_registro, definicoes) if registro})
+    
+    def tabua_registro(self, definicao: Dict[str, Any], motor: MotorExposicao) -> np.ndarray:
+        """qx[sexo, idade] de uma tábua do registro, ou qx[ano, sexo, idade] no período com escala de melhoria
+        ('escala' vazio na definição desliga a escala padrão da tábua)"""
+        sem_melhoria = 'escala' in definicao and not definicao['escala']
+        anos = None if sem_melhoria else np.arange(motor.ano_inicial, motor.ano_final + 1)
+        return self.obter_registro_tabuas().tabua(definicao['tabua'], motor.idade_maxima, anos,
+                                                  definicao.get('escala') or None)
+    
+    def resolver_colunas(self, nome_planilha: str, tipo: str, cabecalho: List[str]) -> Dict[str, Optional[str]]:
+        """Papéis das colunas: do registro de layouts, se o cabeçalho já é conhecido, ou detectados"""
+        cabecalho = list(cabecalho)
+        registro = self.obter_registro_layouts()
+        if registro is not None:
+            mapeamento = registro.consultar(tipo, cabecalho)
+            if mapeamento is not None:
+                self.emitir('layout_colunas', planilha=nome_planilha, origem='registro',
+                            impressao=registro.impressao(tipo, cabecalho))
+                return mapeamento
+        
+        identificadores = {
+            'massa': self.identificar_colunas,
+            'obitos': self.identificar_colunas_obitos,
+            'qx': self.identificar_colunas_qx
+        }
+        mapeamento = identificadores[tipo](cabecalho)
+        if registro is not None and any(mapeamento.values()):
+            try:
+                registro.registrar(tipo, cabecalho, mapeamento)
+                self.emitir('layout_colunas', planilha=nome_planilha, origem='deteccao',
+                            impressao=registro.impressao(tipo, cabecalho))
+            except OSError:
+                pass
+        return mapeamento
+    
+    def ler_planilha_sidecar(self, sidecar: SidecarColunar, nome_planilha: str, tipo: Optional[str],
+                             aproximado: bool, extrair: bool) -> Optional[Dict[str, Any]]:
+        """Leitura da planilha a partir do sidecar colunar (None se ausente ou incompleto)"""
+        manifesto = sidecar.ler_manifesto(nome_planilha)
+        if manifesto is None or (tipo is not None and manifesto['tipo'] != tipo):
+            return None
+        
         formulas = []
+        if extrair:
+            formulas = sidecar.ler_formulas(nome_planilha)
+            if formulas is None:
+                return None
         
-        if not self.configuracao.get('extrairFormulas', True):
-            return formulas
+        carregador = None
+        if tipo is not None and manifesto['carregador'] is not None:
+            dados = manifesto['carregador']
+            try:
+                valores, ausentes = sidecar.ler_colunas(nome_planilha, manifesto)
+            except (OSError, ValueError):
+                return None
             
-        for row in worksheet.iter_rows():
-            for cell in row:
-                if cell.data_type == 'f' and cell.value:  # Fórmula
-                    formulas.append({
-                        'celula': cell.coordinate,
-                        'formula': cell.value,
-                        'valor_calculado': cell.value if worksheet.parent.calculation.value else None
-                    })
+            argumentos = (dados['colunas_identificadas'], valores, ausentes, dados['total_registros'],
+                          dados['registros_validos'], dados['amostra'])
+            if aproximado:
+                carregador = CarregadorAproximado.de_colunas(
+                    *argumentos,
+                    erro_relativo=float(self.configuracao.get('erroRelativoQuantis', ERRO_RELATIVO_QUANTIS)),
+                    semente=int(self.configuracao.get('sementeAmostra', 0))
+                )
+            else:
+                carregador = CarregadorColunar.de_colunas(*argumentos)
+            carregador.normalizadores = {papel: NormalizadorDatas.de_estado(estado)
+                                         for papel, estado in dados['normalizacao_datas'].items()}
+        
+        return {
+            'carregador': carregador,
+            'formulas': formulas,
+            'linhas': manifesto['linhas'],
+            'colunas': manifesto['colunas'],
+            'janela': manifesto['janela']
+        }
+    
+    def abrir_workbook(self):
+        """Abre o workbook com OpenPyXL (sob demanda quando há leituras em memória)"""
+        if self.workbook is None:
+            # Carregar com OpenPyXL para preservar fórmulas. No modo streaming
+            # (padrão) o arquivo é lido sob demanda, linha a linha, em vez de
+            # materializar todas as células de todas as planilhas
+            self.workbook = load_workbook(
+                self.caminho_arquivo,
+                read_only=self.configuracao.get('leituraStreaming', True),
+                data_only=False
+            )
+        return self.workbook
+    
+    def extrair_formulas(self, nome_planilha: str) -> Optional[tuple]:
+        """Fórmulas da planilha e última linha, lidas do XML pelo ScannerFormulas
         
-        return formulas
+        Devolve None se o pacote não puder ser lido diretamente; nesse caso as
+        fórmulas são coletadas na passada do OpenPyXL, sem valor em cache.
+        """
+        if self._scanner is None:
+            self._scanner = ScannerFormulas(self.caminho_arquivo)
+        with self.perfil.etapa('extrair_formulas', planilha=nome_planilha) as etapa:
+            try:
+                extraidas = self._scanner.extrair(nome_planilha)
+            except (KeyError, ValueError, zipfile.BadZipFile, ET.ParseError):
+                return None
+            etapa['formulas'] = len(extraidas[0])
+            return extraidas
     
-    def analisar_planilha_massa(self, worksheet) -> Dict[str, Any]:
-        """Analisa planilha de massa de participantes"""
-        try:
-            # Converter para DataFrame
-            data = []
-            headers = None
+    def iterar_blocos(self, worksheet, coletar_dados: bool = True, coletar_formulas: bool = False,
+                      limite_linhas: Optional[int] = None):
+        """Percorre a planilha uma única vez, entregando blocos de linhas como DataFrame
+        
+        Apenas o bloco corrente fica em memória. O total de linhas lidas fica
+        em self.linhas_lidas. Com coletar_dados=False a planilha é apenas
+        percorrida (contagem de linhas e janela inicial), sem gerar blocos, e
+        limite_linhas interrompe a leitura. Com coletar_formulas=True (pacote
+        ilegível pelo ScannerFormulas) as fórmulas são coletadas na mesma
+        passada em self.formulas_planilha.
+        """
+        tamanho_bloco = max(1, int(self.configuracao.get('tamanhoBloco', TAMANHO_BLOCO_PADRAO)))
+        self.formulas_planilha = []
+        self.linhas_lidas = 0
+        # Janela inicial (valor e tipo) guardada no sidecar para a análise estrutural
+        self.janela_planilha = []
+        self.colunas_planilha = 0
+        headers = None
+        bloco = []
+        
+        for i, row in enumerate(worksheet.iter_rows(values_only=True), start=1):
+            if limite_linhas is not None and i > limite_linhas:
+                break
+            self.linhas_lidas = i
+            self.colunas_planilha = max(self.colunas_planilha, len(row))
+            if i <= LINHAS_JANELA:
+                self.janela_planilha.append([[cell, type(cell).__name__] for cell in row[:COLUNAS_JANELA]])
+            
+            # Sinal de vida para o consumidor de eventos em planilhas longas
+            if i % tamanho_bloco == 0:
+                self.emitir('progresso_leitura', planilha=worksheet.title, linhas=i)
+            
+            if coletar_formulas:
+                for j, cell in enumerate(row, start=1):
+                    # Em values_only as fórmulas chegam como texto iniciado por '='
+                    if isinstance(cell, str) and cell.startswith('='):
+                        self.formulas_planilha.append({
+                            'celula': f"{get_column_letter(j)}{i}",
+                            'formula': cell,
+                            'valor_calculado': None
+                        })
+            
+            if headers is None:
+                headers = [str(cell).strip() if cell else f"col_{j}" for j, cell in enumerate(row)]
+                continue
+            
+            if coletar_dados and any(cell is not None for cell in row):
+                # Linhas irregulares (comuns no modo read_only) são ajustadas ao cabeçalho
+                if len(row) != len(headers):
+                    row = tuple(row[:len(headers)]) + (None,) * (len(headers) - len(row))
+                bloco.append(row)
+                
+                if len(bloco) >= tamanho_bloco:
+                    yield pd.DataFrame(bloco, columns=headers)
+                    bloco = []
+        
+        if bloco:
+            yield pd.DataFrame(bloco, columns=headers)
+    
+    def modo_incremental(self) -> bool:
+        # O modo RAPIDO não guarda as colunas que o delta compara
+        return bool(self.configuracao.get('modoIncremental')) and not self.modo_rapido()
+    
+    def obter_snapshot_incremental(self) -> SnapshotIncremental:
+        """Snapshot da base anterior: configuracao.diretorioIncremental ou <cache>/incremental"""
+        return SnapshotIncremental(
+            self.configuracao.get('diretorioIncremental')
+            or os.path.join(diretorio_cache_padrao(self.caminho_arquivo, self.configuracao), 'incremental')
+        )
+    
+    def modo_rapido(self) -> bool:
+        return self.configuracao.get('metodoAnalise') == 'RAPIDO'
+    
+    def carregar_planilha_tipada(self, worksheet, tipo: str, aproximado: bool = False,
+                                 coletar_formulas: bool = False) -> Optional[CarregadorColunar]:
+        """Lê a planilha em uma passada e devolve o carregador com as colunas tipadas
+        
+        Com aproximado=True (modo RAPIDO) usa o CarregadorAproximado, que resume as
+        colunas em acumuladores de tamanho fixo em vez de guardá-las.
+        """
+        carregador = None
+        
+        for df in self.iterar_blocos(worksheet, coletar_formulas=coletar_formulas):
+            if carregador is None:
+                colunas_identificadas = self.resolver_colunas(worksheet.title, tipo, df.columns)
+                if aproximado:
+                    carregador = CarregadorAproximado(
+                        colunas_identificadas,
+                        erro_relativo=float(self.configuracao.get('erroRelativoQuantis', ERRO_RELATIVO_QUANTIS)),
+                        semente=int(self.configuracao.get('sementeAmostra', 0))
+                    )
+                else:
+                    # A dimensão declarada (read_only) permite pré-alocar os buffers
+                    carregador = CarregadorColunar(colunas_identificadas, capacidade=worksheet.max_row or 0)
+            carregador.adicionar_bloco(df)
+        
+        if carregador is None or not carregador.total_registros:
+            return None
+        return carregador
+    
+    def carregar_planilha_xml(self, worksheet, tipo: str) -> Optional[CarregadorColunar]:
+        """Como carregar_planilha_tipada (modo exato), lendo as células direto do XML
+        
+        As primeiras LINHAS_JANELA linhas (cabeçalho e janela) são lidas linha a
+        linha; o restante, em trechos por coluna (LeitorColunasXml.colunas). Até
+        fechar o primeiro bloco, de onde sai a amostra, todas as colunas são
+        decodificadas; depois, só as dos papéis resolvidos, com números e datas
+        simples convertidos em lote. Linhas ausentes, largura das linhas, blocos
+        e contagens seguem o iter_rows do OpenPyXL. Levanta KeyError, ValueError,
+        BadZipFile ou ParseError se o pacote não puder ser lido assim.
+        """
+        leitor = LeitorColunasXml(self.caminho_arquivo, self.workbook)
+        tamanho_bloco = max(1, int(self.configuracao.get('tamanhoBloco', TAMANHO_BLOCO_PADRAO)))
+        max_linha, max_coluna = worksheet.max_row, worksheet.max_column
+        self.formulas_planilha = []
+        self.linhas_lidas = 0
+        self.janela_planilha = []
+        self.colunas_planilha = 0
+        linha_vazia = (None,) * max_coluna if max_coluna else ()
+        
+        estado = {'headers': None, 'carregador': None, 'blocos': None, 'amostra_pronta': False}
+        primeiras = []
+        # papel → posição no cabeçalho; colunas da validação (registros_validos)
+        posicoes = {}
+        validacao = []
+        pedidos = {}
+        
+        def iniciar(linha):
+            headers = [str(cell).strip() if cell else f"col_{j}" for j, cell in enumerate(linha)]
+            carregador = CarregadorColunar(self.resolver_colunas(worksheet.title, tipo, headers),
+                                           capacidade=max_linha or 0)
+            posicoes.update({papel: headers.index(coluna) for papel, coluna in carregador.colunas.items()})
+            nomes_validacao = set(carregador.colunas_validacao)
+            validacao.extend(j for j, coluna in enumerate(headers) if coluna in nomes_validacao)
+            for papel, posicao in posicoes.items():
+                tipo_coluna = TIPOS_COLUNAS[papel]
+                pedidos[posicao + 1] = ('numero' if tipo_coluna in ('int16', 'float64')
+                                        else 'data' if tipo_coluna.startswith('datetime64') else 'objeto')
+            estado.update(headers=headers, carregador=carregador, blocos=BlocosColunas(posicoes, tamanho_bloco))
+        
+        def fechar_amostra():
+            headers = estado['headers']
+            estado['carregador'].amostra = pd.DataFrame(primeiras, columns=headers).head(5).to_dict('records')
+            estado['blocos'].adicionar(
+                {papel: [linha[posicao] for linha in primeiras] for papel, posicao in posicoes.items()},
+                np.array([all(linha[j] is not None for j in validacao) for linha in primeiras], dtype=bool)
+            )
+            estado['amostra_pronta'] = True
+            primeiras.clear()
+        
+        def linha_inicial(i, linha):
+            self.linhas_lidas = i
+            if i % tamanho_bloco == 0:
+                self.emitir('progresso_leitura', planilha=worksheet.title, linhas=i)
+            self.colunas_planilha = max(self.colunas_planilha, len(linha))
+            if i <= LINHAS_JANELA:
+                self.janela_planilha.append([[cell, type(cell).__name__] for cell in linha[:COLUNAS_JANELA]])
+            
+            if estado['headers'] is None:
+                iniciar(linha)
+            elif any(cell is not None for cell in linha):
+                largura = len(estado['headers'])
+                if len(linha) != largura:
+                    linha = tuple(linha[:largura]) + (None,) * (largura - len(linha))
+                if estado['amostra_pronta']:
+                    estado['blocos'].adicionar(
+                        {papel: [linha[posicao]] for papel, posicao in posicoes.items()},
+                        np.array([all(linha[j] is not None for j in validacao)], dtype=bool)
+                    )
+                else:
+                    primeiras.append(linha)
+                    if len(primeiras) >= tamanho_bloco:
+                        fechar_amostra()
+        
+        def trecho_colunar(trecho, ultima_linha):
+            headers = estado['headers']
+            anterior = self.linhas_lidas
+            faltam = 0 if estado['amostra_pronta'] else tamanho_bloco - len(primeiras)
+            linhas, valores, presenca, maior_coluna, completas = leitor.colunas(
+                trecho, pedidos, [j + 1 for j in validacao], max_coluna, max_linha, faltam, len(headers)
+            )
+            self.colunas_planilha = max(self.colunas_planilha, maior_coluna)
+            self.linhas_lidas = max(anterior, min(ultima_linha, max_linha) if max_linha is not None else ultima_linha)
+            for marco in range(anterior // tamanho_bloco + 1, self.linhas_lidas // tamanho_bloco + 1):
+                self.emitir('progresso_leitura', planilha=worksheet.title, linhas=marco * tamanho_bloco)
+            if not len(linhas):
+                return
             
-            for i, row in enumerate(worksheet.iter_rows(values_only=True)):
-                if i == 0:
-                    headers = [str(cell).strip() if cell else f"col_{j}" for j, cell in enumerate(row)]
+            validos = np.ones(len(linhas), dtype=bool)
+            for j in validacao:
+                validos &= presenca[j + 1]
+            
+            # Linhas que completam o primeiro bloco chegam inteiras (amostra)
+            if completas:
+                primeiras.extend(completas)
+                if len(primeiras) >= tamanho_bloco:
+                    fechar_amostra()
+            if len(completas) < len(linhas):
+                inicio = len(completas)
+                estado['blocos'].adicionar(
+                    {papel: valores[posicao + 1][inicio:] for papel, posicao in posicoes.items()}, validos[inicio:]
+                )
+        
+        for evento, *dados in leitor.ler(worksheet.title, LINHAS_JANELA):
+            if evento == 'linha':
+                numero, celulas = dados
+                if max_linha is not None and numero > max_linha:
+                    # Como o iter_rows: linhas que faltam até a dimensão declarada saem vazias
+                    for vazia in range(self.linhas_lidas + 1, max_linha + 1):
+                        linha_inicial(vazia, linha_vazia)
+                    break
+                if numero <= self.linhas_lidas:
                     continue
-                    
-                if any(cell is not None for cell in row):
-                    data.append(row)
+                for vazia in range(self.linhas_lidas + 1, numero):
+                    linha_inicial(vazia, linha_vazia)
+                linha_inicial(numero, leitor.linha_completa(celulas, max_coluna))
+            else:
+                # Linhas do início ausentes no XML (inclusive o cabeçalho) saem vazias
+                limite = LINHAS_JANELA if max_linha is None else min(LINHAS_JANELA, max_linha)
+                for vazia in range(self.linhas_lidas + 1, limite + 1):
+                    linha_inicial(vazia, linha_vazia)
+                if estado['headers'] is not None:
+                    trecho_colunar(*dados)
+            
+            if estado['blocos'] is not None:
+                for valores, total, validos in estado['blocos'].blocos():
+                    estado['carregador'].adicionar_valores(valores, total, validos)
+        
+        carregador = estado['carregador']
+        if carregador is None:
+            return None
+        if primeiras:
+            fechar_amostra()
+        for valores, total, validos in estado['blocos'].blocos(final=True):
+            carregador.adicionar_valores(valores, total, validos)
+        return carregador if carregador.total_registros else None
+    
+    def classificar_planilha(self, nome_planilha: str) -> Optional[str]:
+        """Identifica o tipo da planilha pelo nome: massa, obitos, qx ou None (auxiliar)"""
+        nome_lower = nome_planilha.lower()
+        
+        if any(termo in nome_lower for termo in ['massa', 'participante', 'trabalhada', 'unificada']):
+            return 'massa'
+        elif any(termo in nome_lower for termo in ['obito', 'morte', 'morto', 'falecimento', 'death']):
+            return 'obitos'
+        elif any(termo in nome_lower for termo in ['qx', 'mortalidade', 'taxa']):
+            return 'qx'
+        return None
+    
+    def ler_planilha(self, nome_planilha: str, tipo: Optional[str]) -> Dict[str, Any]:
+        """Lê a planilha uma única vez: colunas tipadas, fórmulas e contagem de linhas
+        
+        Quando o analisador recebe uma memória (modo worker), leituras anteriores
+        do mesmo arquivo são reaproveitadas sem reabrir o workbook.
+        """
+        extrair = self.configuracao.get('extrairFormulas', True)
+        # Massa e óbitos (as planilhas grandes) usam o carregador aproximado no modo RAPIDO
+        aproximado = self.modo_rapido() and tipo in ('massa', 'obitos')
+        chave = (nome_planilha, tipo, extrair, aproximado)
+        
+        if self.memoria is not None and chave in self.memoria.setdefault('leituras', {}):
+            return self.memoria['leituras'][chave]
+        
+        sidecar = self.obter_sidecar()
+        if sidecar is not None:
+            leitura = self.ler_planilha_sidecar(sidecar, nome_planilha, tipo, aproximado, extrair)
+            if leitura is not None:
+                if self.memoria is not None:
+                    self.memoria['leituras'][chave] = leitura
+                return leitura
+        
+        worksheet = self.abrir_workbook()[nome_planilha]
+        carregador = None
+        
+        # Fórmulas e valores em cache direto do XML; sem ele, na passada do OpenPyXL
+        extraidas = self.extrair_formulas(nome_planilha) if extrair else None
+        coletar_formulas = extrair and extraidas is None
+        
+        if tipo is not None:
+            lida_do_xml = False
+            if not aproximado and not coletar_formulas and self.configuracao.get('leituraXmlDireta', True):
+                # Pacotes que o LeitorColunasXml não lê voltam para a passada do OpenPyXL
+                try:
+                    carregador = self.carregar_planilha_xml(worksheet, tipo)
+                    lida_do_xml = True
+                except (KeyError, ValueError, zipfile.BadZipFile, ET.ParseError):
+                    pass
+            if not lida_do_xml:
+                carregador = self.carregar_planilha_tipada(worksheet, tipo, aproximado, coletar_formulas)
+        elif extrair:
+            # Planilhas auxiliares: só a janela inicial (ou a planilha inteira, se
+            # as fórmulas tiverem de vir da passada do OpenPyXL)
+            for _ in self.iterar_blocos(worksheet, coletar_dados=False, coletar_formulas=coletar_formulas,
+                                        limite_linhas=None if coletar_formulas else LINHAS_JANELA):
+                pass
+        else:
+            self.formulas_planilha = []
+            self.linhas_lidas = 0
+            self.janela_planilha = []
+            self.colunas_planilha = 0
+        
+        ultima_linha = self.linhas_lidas
+        if extraidas is not None:
+            self.formulas_planilha, ultima_linha = extraidas[0], max(ultima_linha, extraidas[1])
+        
+        leitura = {
+            'carregador': carregador,
+            'formulas': self.formulas_planilha,
+            # No modo read_only max_row vem da dimensão declarada
+            'linhas': worksheet.max_row or ultima_linha,
+            'colunas': self.colunas_planilha,
+            'janela': self.janela_planilha
+        }
+        
+        # Sidecar colunar para as próximas leituras (só colunas exatas; o modo RAPIDO não as guarda)
+        if sidecar is not None and not aproximado and (tipo is not None or extrair):
+            try:
+                if extrair:
+                    sidecar.gravar_formulas(nome_planilha, self.formulas_planilha)
+                # Leituras só de fórmulas de planilhas classificadas não substituem as colunas
+                if tipo is not None or self.classificar_planilha(nome_planilha) is None:
+                    sidecar.gravar_leitura(nome_planilha, tipo, leitura)
+            except OSError:
+                pass
+        
+        if self.memoria is not None:
+            self.memoria['leituras'][chave] = leitura
+        return leitura
+    
+    def ler_planilha_medida(self, nome_planilha: str, tipo: Optional[str]) -> Dict[str, Any]:
+        """ler_planilha registrada no perfil, com linhas, colunas e células lidas"""
+        with self.perfil.etapa('ler_planilha', planilha=nome_planilha, tipo=tipo) as etapa:
+            leitura = self.ler_planilha(nome_planilha, tipo)
+            etapa.update(linhas=leitura['linhas'], colunas=leitura['colunas'],
+                         celulas=leitura['linhas'] * leitura['colunas'])
+            return leitura
+    
+    def processar_planilha(self, nome_planilha: str) -> Dict[str, Any]:
+        """Lê uma planilha e aplica o analisador correspondente ao seu tipo"""
+        tipo = self.classificar_planilha(nome_planilha)
+        analisadores = {
+            'massa': ('massa_participantes', self.analisar_planilha_massa, 'massa'),
+            'obitos': ('obitos_registrados', self.analisar_planilha_obitos, 'óbitos'),
+            'qx': ('qx_mortalidade', self.analisar_planilha_qx, 'qx')
+        }
+        
+        try:
+            leitura = self.ler_planilha_medida(nome_planilha, tipo)
+        except Exception as e:
+            if tipo is None:
+                raise
+            chave, _, rotulo = analisadores[tipo]
+            return {'tipo': tipo, 'chave': chave, 'dados': {'erro': f'Erro ao analisar {rotulo}: {str(e)}'},
+                    'linhas': 0, 'formulas': [], 'tabela': None}
+        
+        processamento = {
+            'tipo': tipo,
+            'chave': None,
+            'dados': None,
+            'linhas': leitura['linhas'],
+            'formulas': leitura['formulas'],
+            'tabela': None
+        }
+        
+        if tipo in analisadores:
+            chave, analisar, _ = analisadores[tipo]
+            processamento['chave'] = chave
+            carregador = leitura['carregador']
+            exato = carregador is not None and not isinstance(carregador, CarregadorAproximado)
+            if exato and tipo in ROTULOS_DELTA and self.modo_incremental():
+                # Massa e óbitos são analisados depois da leitura, a partir do delta (analisar_delta_incremental)
+                processamento['resumo'] = {
+                    'colunas_identificadas': carregador.colunas_identificadas,
+                    'total_registros': carregador.total_registros,
+                    'registros_validos': carregador.registros_validos,
+                    'amostra': carregador.amostra,
+                    'normalizacao_datas': carregador.normalizacao_datas()
+                }
+            else:
+                with self.perfil.etapa(f'analisar_planilha_{tipo}', planilha=nome_planilha) as etapa:
+                    processamento['dados'] = analisar(carregador)
+                    etapa['registros'] = carregador.total_registros if carregador is not None else 0
             
-            if not data:
+            # Colunas tipadas para o cálculo de exposição (não existem no modo RAPIDO)
+            if exato:
+                processamento['tabela'] = carregador.finalizar()
+        
+        return processamento
+    
+    def processar_planilhas_em_paralelo(self, planilhas: List[str], processos: int) -> List[Dict[str, Any]]:
+        """Distribui as planilhas entre processos e junta os resultados na ordem original
+        
+        Planilhas classificadas viram uma tarefa de análise (sem fórmulas) e a
+        extração de fórmulas de cada planilha roda como tarefa própria.
+        """
+        extrair = self.configuracao.get('extrairFormulas', True)
+        # A invalidação (cache e sidecar) já foi feita por este processo
+        configuracao = {**self.configuracao, 'invalidarCache': False}
+        configuracao_dados = {**configuracao, 'extrairFormulas': False}
+        tarefas = []
+        
+        for nome_planilha in planilhas:
+            if self.classificar_planilha(nome_planilha):
+                tarefas.append((nome_planilha, 'dados', configuracao_dados))
+            if extrair:
+                tarefas.append((nome_planilha, 'formulas', configuracao))
+        
+        processos = max(1, min(processos, len(tarefas)))
+        with self.perfil.etapa('planilhas_em_paralelo', tarefas=len(tarefas), processos=processos):
+            with ProcessPoolExecutor(max_workers=processos) as executor:
+                futuros = [
+                    executor.submit(processar_planilha_isolada, self.caminho_arquivo, configuracao, nome_planilha, tarefa)
+                    for nome_planilha, tarefa, configuracao in tarefas
+                ]
+                for concluidas, futuro in enumerate(as_completed(futuros), start=1):
+                    futuro.result()
+                    self.emitir('progresso_tarefas', concluidas=concluidas, total_tarefas=len(futuros))
+                respostas = [futuro.result() for futuro in futuros]
+            # Etapas medidas nos processos, na ordem das tarefas
+            for (_, tarefa, _), resposta in zip(tarefas, respostas):
+                self.perfil.incorporar(resposta.pop('perfil', []), tarefa=tarefa)
+        
+        processamentos = {
+            nome_planilha: {'tipo': self.classificar_planilha(nome_planilha), 'chave': None, 'dados': None,
+                            'linhas': 0, 'formulas': [], 'tabela': None}
+            for nome_planilha in planilhas
+        }
+        for (nome_planilha, tarefa, _), resposta in zip(tarefas, respostas):
+            processamento = processamentos[nome_planilha]
+            if tarefa == 'dados':
+                processamento.update(chave=resposta['chave'], dados=resposta['dados'], tabela=resposta.get('tabela'),
+                                     resumo=resposta.get('resumo'))
+            else:
+                processamento['formulas'] = resposta['formulas']
+            processamento['linhas'] = max(processamento['linhas'], resposta['linhas'])
+        
+        return [processamentos[nome_planilha] for nome_planilha in planilhas]
+    
+    def analisar_planilha_massa(self, carregador: Optional[CarregadorColunar]) -> Dict[str, Any]:
+        """Analisa planilha de massa de participantes"""
+        try:
+            if carregador is None:
                 return {'erro': 'Planilha vazia'}
-                
-            df = pd.DataFrame(data, columns=headers)
             
-            # Identificar colunas importantes
-            colunas_identificadas = self.identificar_colunas(df.columns)
+            tabela = carregador.finalizar()
             
             # Estatísticas básicas
             estatisticas = {
-                'total_registros': len(df),
-                'colunas_identificadas': colunas_identificadas,
-                'registros_validos': 0,
-                'registros_com_erro': 0
+                'total_registros': carregador.total_registros,
+                'colunas_identificadas': carregador.colunas_identificadas,
+                'registros_validos': carregador.registros_validos,
+                'registros_com_erro': carregador.total_registros - carregador.registros_validos
             }
+            if carregador.normalizacao_datas():
+                estatisticas['normalizacao_datas'] = carregador.normalizacao_datas()
             
             # Analisar dados por coluna identificada
             dados_processados = {}
             
-            for tipo_coluna, nome_coluna in colunas_identificadas.items():
-                if nome_coluna and nome_coluna in df.columns:
-                    serie = df[nome_coluna].dropna()
-                    
-                    if tipo_coluna == 'idade':
-                        dados_processados['distribuicao_idade'] = self.analisar_distribuicao_idade(serie)
-                    elif tipo_coluna == 'sexo':
-                        dados_processados['distribuicao_sexo'] = self.analisar_distribuicao_sexo(serie)
-                    elif tipo_coluna == 'data_nascimento':
-                        dados_processados['analise_datas'] = self.analisar_datas(serie)
-                    elif tipo_coluna == 'salario':
-                        dados_processados['estatisticas_salario'] = self.analisar_valores_monetarios(serie)
-            
-            # Contar registros válidos
-            estatisticas['registros_validos'] = len(df.dropna(subset=[col for col in colunas_identificadas.values() if col]))
-            estatisticas['registros_com_erro'] = estatisticas['total_registros'] - estatisticas['registros_validos']
+            if 'idade' in tabela:
+                dados_processados['distribuicao_idade'] = self.analisar_distribuicao_idade(tabela['idade'])
+            if 'sexo' in tabela:
+                dados_processados['distribuicao_sexo'] = self.analisar_distribuicao_sexo(tabela['sexo'])
+            if 'data_nascimento' in tabela:
+                dados_processados['analise_datas'] = self.analisar_datas(tabela['data_nascimento'])
+            if 'salario' in tabela:
+                dados_processados['estatisticas_salario'] = self.analisar_valores_monetarios(tabela['salario'])
             
             return {
                 'estatisticas': estatisticas,
                 'dados_processados': dados_processados,
-                'amostra_dados': df.head(5).to_dict('records')
+                'amostra_dados': carregador.amostra
             }
             
         except Exception as e:
             return {'erro': f'Erro ao analisar massa: {str(e)}'}
     
-    def analisar_planilha_obitos(self, worksheet) -> Dict[str, Any]:
+    def analisar_planilha_obitos(self, carregador: Optional[CarregadorColunar]) -> Dict[str, Any]:
         """Analisa planilha de óbitos"""
         try:
-            # Converter para DataFrame
-            data = []
-            headers = None
-            
-            for i, row in enumerate(worksheet.iter_rows(values_only=True)):
-                if i == 0:
-                    headers = [str(cell).strip() if cell else f"col_{j}" for j, cell in enumerate(row)]
-                    continue
-                    
-                if any(cell is not None for cell in row):
-                    data.append(row)
-            
-            if not data:
+            if carregador is None:
                 return {'erro': 'Planilha de óbitos vazia'}
-                
-            df = pd.DataFrame(data, columns=headers)
             
-            # Identificar colunas
-            colunas_identificadas = self.identificar_colunas_obitos(df.columns)
+            tabela = carregador.finalizar()
             
             # Análise específica de óbitos
             estatisticas_obitos = {
-                'total_obitos': len(df),
-                'colunas_identificadas': colunas_identificadas,
+                'total_obitos': carregador.total_registros,
+                'colunas_identificadas': carregador.colunas_identificadas,
                 'distribuicao_por_idade': {},
                 'distribuicao_por_sexo': {},
                 'distribuicao_temporal': {}
             }
+            if carregador.normalizacao_datas():
+                estatisticas_obitos['normalizacao_datas'] = carregador.normalizacao_datas()
             
             # Analisar distribuição por idade nos óbitos
-            if colunas_identificadas.get('idade_obito'):
-                col_idade = colunas_identificadas['idade_obito']
-                if col_idade in df.columns:
-                    idades = df[col_idade].dropna()
-                    estatisticas_obitos['distribuicao_por_idade'] = self.analisar_distribuicao_idade(idades)
+            if 'idade_obito' in tabela:
+                estatisticas_obitos['distribuicao_por_idade'] = self.analisar_distribuicao_idade(tabela['idade_obito'])
             
             # Analisar distribuição por sexo nos óbitos
-            if colunas_identificadas.get('sexo'):
-                col_sexo = colunas_identificadas['sexo']
-                if col_sexo in df.columns:
-                    sexos = df[col_sexo].dropna()
-                    estatisticas_obitos['distribuicao_por_sexo'] = self.analisar_distribuicao_sexo(sexos)
+            if 'sexo' in tabela:
+                estatisticas_obitos['distribuicao_por_sexo'] = self.analisar_distribuicao_sexo(tabela['sexo'])
             
             # Analisar distribuição temporal
-            if colunas_identificadas.get('data_obito'):
-                col_data = colunas_identificadas['data_obito']
-                if col_data in df.columns:
-                    datas = df[col_data].dropna()
-                    estatisticas_obitos['distribuicao_temporal'] = self.analisar_distribuicao_temporal(datas)
+            if 'data_obito' in tabela:
+                estatisticas_obitos['distribuicao_temporal'] = self.analisar_distribuicao_temporal(tabela['data_obito'])
             
             return {
                 'estatisticas': estatisticas_obitos,
-                'amostra_dados': df.head(5).to_dict('records')
+                'amostra_dados': carregador.amostra
+            }
+            
+        except Exception as e:
+            return {'erro': f'Erro ao analisar óbitos: {str(e)}'}
+    
+    def analisar_planilha_qx(self, carregador: Optional[CarregadorColunar]) -> Dict[str, Any]:
+        """Analisa planilha de qx (taxas de mortalidade)"""
+        try:
+            if carregador is None:
+                return {'erro': 'Planilha qx vazia'}
+            
+            tabela = carregador.finalizar()
+            
+            # Análise das taxas qx
+            estatisticas_qx = {
+                'total_idades': carregador.total_registros,
+                'colunas_identificadas': carregador.colunas_identificadas,
+                'faixa_idades': {},
+                'estatisticas_qx': {}
+            }
+            
+            # Analisar faixa de idades
+            if 'idade' in tabela:
+                idades = tabela['idade'].dropna()
+                if len(idades) > 0:
+                    estatisticas_qx['faixa_idades'] = {
+                        'idade_minima': int(idades.min()),
+                        'idade_maxima': int(idades.max()),
+                        'total_idades': len(idades)
+                    }
+            
+            # Analisar taxas qx por sexo
+            for sexo in ['masculino', 'feminino']:
+                if f'qx_{sexo}' in tabela:
+                    qx_values = tabela[f'qx_{sexo}'].dropna()
+                    if len(qx_values) > 0:
+                        estatisticas_qx['estatisticas_qx'][sexo] = {
+                            'media': float(qx_values.mean()),
+                            'mediana': float(qx_values.median()),
+                            'desvio_padrao': float(qx_values.std()),
+                            'minimo': float(qx_values.min()),
+                            'maximo': float(qx_values.max()),
+                            'total_valores': len(qx_values)
+                        }
+            
+            return {
+                'estatisticas': estatisticas_qx,
+                'amostra_dados': carregador.amostra
+            }
+            
+        except Exception as e:
+            return {'erro': f'Erro ao analisar qx: {str(e)}'}
+    
+    def montar_tabua_qx(self, tabela: pd.DataFrame, idade_maxima: int) -> Optional[np.ndarray]:
+        """Tábua qx da planilha como array [sexo, idade] (ver completar_tabua_qx)
+        
+        Linhas com idade negativa são descartadas com aviso: como índice do
+        array, voltariam pelo fim e sobrescreveriam as idades mais altas.
+        """
+        if 'idade' not in tabela:
+            return None
+        
+        idades = tabela['idade'].to_numpy(dtype=np.float64, na_value=np.nan)
+        negativas = int((idades < 0).sum())
+        if negativas:
+            self.validacao['warnings'].append(f'Tábua qx: {negativas} linha(s) com idade negativa ignorada(s)')
+        validas = np.isfinite(idades) & (idades >= 0) & (idades <= idade_maxima)
+        qx = np.full((len(CATEGORIAS_SEXO), idade_maxima + 1), np.nan)
+        for linha, papel in enumerate(('qx_masculino', 'qx_feminino', 'qx_geral')):
+            if papel in tabela:
+                qx[linha, idades[validas].astype(np.int64)] = tabela[papel].to_numpy(dtype=np.float64)[validas]
+        
+        return completar_tabua_qx(qx)
+    
+    def calcular_exposicao_ae(self, tabelas: Dict[str, pd.DataFrame]) -> Optional[Dict[str, Any]]:
+        """Exposição, óbitos observados e esperados e razão A/E por ano, sexo e idade
+        
+        Com datas de nascimento na massa e de óbito nos óbitos a exposição é
+        fracionária (entrada, saída e óbito); com idade e ano do cadastro cada
+        registro da massa vale um ano de exposição (censo). Os óbitos são ligados
+        à massa por ligar_obitos_massa (matrícula, CPF e, sem chave utilizável,
+        nome, nascimento e sexo); o resumo da ligação sai em 'ligacao'. Os
+        esperados usam a tábua do registro em configuracao.tabuaReferencia (nome
+        ou {'tabua': nome, 'escala': escala de melhoria}) ou, sem ela, a planilha
+        qx. Com configuracao.cuboAgregado (ativo por padrão) monta também o
+        CuboAgregado em self.cubo, sempre sobre as tabelas inteiras. No modo
+        incremental só as matrículas alteradas desde o snapshot são retiradas e
+        recontadas sobre os acumuladores da base anterior, enquanto todos os
+        óbitos estiverem ligados pela matrícula.
+        """
+        massa, obitos = tabelas.get('massa'), tabelas.get('obitos')
+        if massa is None or obitos is None:
+            return None
+        
+        idade_maxima = int(self.configuracao.get('idadeMaximaExposicao', 120))
+        qx = self.montar_tabua_qx(tabelas['qx'], idade_maxima) if tabelas.get('qx') is not None else None
+        referencia = self.definicao_registro(self.configuracao.get('tabuaReferencia'))
+        if referencia is not None and referencia['tabua'] not in self.obter_registro_tabuas().indice()['tabuas']:
+            return {'erro': f"Tábua de referência não registrada: {referencia['tabua']}"}
+        if qx is None and referencia is None:
+            return {'erro': 'Tábua qx não identificada para o cálculo dos óbitos esperados'}
+        
+        morte = anos_decimais_tabela(obitos, 'data_obito')
+        ano_obito = np.where(np.isfinite(morte), np.floor(np.where(np.isfinite(morte), morte, 0)),
+                             inteiros_tabela(obitos, 'ano_obito')).astype(np.int64)
+        
+        por_datas = bool('data_nascimento' in massa and massa['data_nascimento'].notna().any() and np.isfinite(morte).any())
+        por_censo = 'idade' in massa and 'ano_cadastro' in massa
+        if not (por_datas or por_censo):
+            return {'erro': 'Colunas insuficientes: são necessárias datas de nascimento e óbito ou idade e ano do cadastro'}
+        
+        # Período: configurado ou os anos cobertos pelos dados
+        anos_dados = ano_obito[ano_obito > 0] if por_datas else inteiros_tabela(massa, 'ano_cadastro')
+        anos_dados = anos_dados[anos_dados > 0]
+        if not len(anos_dados):
+            return {'erro': 'Não foi possível determinar o período de observação'}
+        ano_inicial = int(self.configuracao.get('anoInicialExposicao') or anos_dados.min())
+        ano_final = int(self.configuracao.get('anoFinalExposicao') or anos_dados.max())
+        if ano_final < ano_inicial:
+            return {'erro': 'Período de observação inválido'}
+        
+        with self.perfil.etapa('ligar_obitos', massa=len(massa), obitos=len(obitos)):
+            vinculo, metodo, ligacao = ligar_obitos_massa(
+                massa, obitos, bool(self.configuracao.get('ligacaoAproximada', True)),
+                float(self.configuracao.get('limiarLigacao', LIMIAR_LIGACAO_APROXIMADA)))
+        so_matricula = not (metodo > METODOS_LIGACAO.index('matricula')).any()
+        
+        motor = MotorExposicao(ano_inicial, ano_final, idade_maxima)
+        contagens = None
+        if self.incremental is not None:
+            contagens = self.atualizar_exposicao_incremental(motor, por_datas, so_matricula)
+        if contagens is None:
+            contagens = self.acumular_exposicao(motor, massa, obitos, por_datas, vinculo)
+        
+        self.motor_exposicao, self.tabua_qx = motor, qx
+        if self.incremental is not None:
+            self.incremental['exposicao'] = {'por_datas': por_datas, 'so_matricula': so_matricula, 'obitos': contagens}
+        if referencia is not None:
+            try:
+                qx = self.tabua_registro(referencia, motor)
+            except (KeyError, ValueError) as e:
+                return {'erro': f'Tábua de referência: {e.args[0]}'}
+            self.tabua_referencia = (referencia['tabua'], motor.qx_efetivo(qx))
+        if self.configuracao.get('cuboAgregado', True):
+            with self.perfil.etapa('montar_cubo'):
+                dados = self.dados_exposicao(massa, obitos, por_datas, vinculo)
+                self.cubo = CuboAgregado.montar(motor, dados, massa, por_datas, qx)
+        resumo = motor.resumir(qx)
+        if referencia is not None:
+            entrada = self.obter_registro_tabuas().indice()['tabuas'][referencia['tabua']]
+            resumo['tabua'] = {'origem': 'registro', 'nome': referencia['tabua'], 'revisao': entrada['revisao'],
+                               'escala': None if qx.ndim == 2 else (referencia.get('escala') or entrada['escala']),
+                               'ano_base': entrada['ano_base']}
+        else:
+            resumo['tabua'] = {'origem': 'planilha qx'}
+        if self.cubo is not None:
+            self.cubo.metadados['tabua'] = resumo['tabua']
+        resumo['obitos'] = dict(contagens)
+        resumo['ligacao'] = ligacao
+        return resumo
+    
+    def acumular_exposicao(self, motor: MotorExposicao, massa: pd.DataFrame, obitos: pd.DataFrame,
+                           por_datas: bool, vinculo: Optional[np.ndarray] = None) -> Dict[str, int]:
+        """Acumula no motor a exposição da massa e os óbitos ligados; devolve as contagens de óbitos
+        
+        vinculo é a linha da massa de cada óbito (ver ligar_obitos_massa); sem
+        ele os óbitos são ligados só pela matrícula. Nesse caso o resultado de
+        cada matrícula só depende das linhas dela na massa e nos óbitos, então a
+        função vale também para subconjuntos fechados por matrícula (o delta do
+        modo incremental).
+        """
+        dados = self.dados_exposicao(massa, obitos, por_datas, vinculo)
+        contados = dados['contados']
+        
+        if por_datas:
+            motor.expor_por_datas(dados['sexo_massa'], dados['nascimento_massa'], anos_decimais_tabela(massa, 'data_entrada'),
+                                  anos_decimais_tabela(massa, 'data_saida'), dados['morte_massa'])
+            motor.registrar_obitos(dados['sexo_obito'][contados], dados['idade_obito'][contados],
+                                   dados['ano_obito'][contados], dados['fracao_idade'][contados])
+        else:
+            motor.expor_por_censo(dados['sexo_massa'], inteiros_tabela(massa, 'idade'), inteiros_tabela(massa, 'ano_cadastro'))
+            motor.registrar_obitos(dados['sexo_obito'][contados], dados['idade_obito'][contados], dados['ano_obito'][contados])
+        
+        ano_obito = dados['ano_obito']
+        no_periodo = (ano_obito >= motor.ano_inicial) & (ano_obito <= motor.ano_final)
+        return {
+            'registrados': int(len(obitos)),
+            'ligados_a_massa': int(dados['ligados'].sum()),
+            'considerados': int((contados & no_periodo).sum()),
+            'fora_do_periodo': int((contados & ~no_periodo).sum()),
+            'descartados': int((~contados).sum())
+        }
+    
+    def dados_exposicao(self, massa: pd.DataFrame, obitos: pd.DataFrame, por_datas: bool,
+                        vinculo: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """Sexo e nascimento da massa e idade, ano e sexo dos óbitos ligados, como usados na exposição
+        
+        Sexo e nascimento ausentes no óbito vêm do participante ligado; sexo
+        desconhecido conta como OUTROS. 'contados' marca os óbitos que entram
+        no numerador e, por datas, 'morte_massa' é a data do óbito de cada
+        participante.
+        """
+        outros = CATEGORIAS_SEXO.index('OUTROS')
+        
+        if vinculo is None:
+            vinculo, _, _ = ligar_obitos_massa(massa.filter(['matricula']), obitos.filter(['matricula']), aproximada=False)
+        ligados = vinculo >= 0
+        
+        sexo_massa = codigos_sexo_tabela(massa)
+        nascimento_massa = anos_decimais_tabela(massa, 'data_nascimento')
+        
+        sexo_obito = codigos_sexo_tabela(obitos)
+        sexo_obito = np.where((sexo_obito < 0) & ligados, sexo_massa[vinculo], sexo_obito)
+        sexo_obito = np.where(sexo_obito < 0, outros, sexo_obito)
+        
+        morte = anos_decimais_tabela(obitos, 'data_obito')
+        nascimento_obito = anos_decimais_tabela(obitos, 'data_nascimento')
+        nascimento_obito = np.where(np.isnan(nascimento_obito) & ligados, nascimento_massa[vinculo], nascimento_obito)
+        
+        idade_exata = morte - nascimento_obito
+        com_datas = np.isfinite(idade_exata)
+        idade_obito = np.where(com_datas, np.floor(np.where(com_datas, idade_exata, 0)), inteiros_tabela(obitos, 'idade_obito')).astype(np.int64)
+        ano_obito = np.where(np.isfinite(morte), np.floor(np.where(np.isfinite(morte), morte, 0)), inteiros_tabela(obitos, 'ano_obito')).astype(np.int64)
+        
+        dados = {
+            'vinculo': vinculo,
+            'ligados': ligados,
+            'sexo_massa': np.where(sexo_massa < 0, outros, sexo_massa),
+            'nascimento_massa': nascimento_massa,
+            'sexo_obito': sexo_obito,
+            'idade_obito': idade_obito,
+            'ano_obito': ano_obito,
+            'fracao_idade': idade_exata - np.floor(np.where(com_datas, idade_exata, 0))
+        }
+        if por_datas:
+            # Só óbitos ligados a um participante exposto entram no numerador
+            contados = ligados & com_datas
+            dados['morte_massa'] = np.full(len(massa), np.nan)
+            dados['morte_massa'][vinculo[contados]] = morte[contados]
+        else:
+            contados = (idade_obito >= 0) & (ano_obito > 0)
+        dados['contados'] = contados
+        return dados
+    
+    def analisar_delta_incremental(self, pendentes: List[tuple], tabelas: Dict[str, pd.DataFrame]):
+        """Modo incremental: compara massa e óbitos com o snapshot e analisa a partir do delta
+        
+        A planilha de cada tipo usada na exposição é comparada com a do snapshot
+        por matrícula; os acumuladores das distribuições da base anterior perdem
+        as linhas antigas das matrículas que entraram, saíram ou mudaram e ganham
+        as novas. Outras planilhas do mesmo tipo são analisadas por inteiro.
+        """
+        snapshot = self.obter_snapshot_incremental()
+        anterior = snapshot.carregar()
+        self.incremental = {
+            'snapshot': snapshot,
+            'anterior': anterior,
+            'tipos': {},
+            'exposicao': None,
+            'delta': {
+                'base_anterior': None if anterior is None else {
+                    'arquivo': anterior.get('arquivo'),
+                    'hash_arquivo': anterior.get('hash_arquivo'),
+                    'gravado_em': anterior.get('gravado_em')
+                },
+                'tipos': {}
+            }
+        }
+        analisadores = {'massa': self.analisar_planilha_massa, 'obitos': self.analisar_planilha_obitos}
+        
+        for nome_planilha, processamento, tabela in pendentes:
+            tipo = processamento['tipo']
+            if tabela is not tabelas.get(tipo) or tipo in self.incremental['tipos']:
+                processamento['dados'] = analisadores[tipo](CarregadorResumo(processamento['resumo'], tabela))
+                continue
+            try:
+                acumuladores = self.atualizar_tipo_incremental(tipo, nome_planilha, tabela)
+            except Exception as e:
+                # Sem estado deste tipo o snapshot seguinte é montado com a base inteira
+                self.incremental['tipos'].pop(tipo, None)
+                self.incremental['delta']['tipos'][tipo] = {'planilha': nome_planilha, 'erro': str(e)}
+                processamento['dados'] = analisadores[tipo](CarregadorResumo(processamento['resumo'], tabela))
+                continue
+            processamento['dados'] = analisadores[tipo](CarregadorResumo(processamento['resumo'], acumuladores))
+    
+    def atualizar_tipo_incremental(self, tipo: str, nome_planilha: str, tabela: pd.DataFrame) -> Dict[str, Any]:
+        """Delta de uma planilha contra o snapshot; devolve os acumuladores da base nova
+        
+        Sem snapshot compatível (primeira execução, outras colunas ou outro erro
+        relativo dos quantis) os acumuladores são montados com a base inteira.
+        """
+        erro_relativo = float(self.configuracao.get('erroRelativoQuantis', ERRO_RELATIVO_QUANTIS))
+        valores, ausentes = CarregadorColunar.colunas_da_tabela(tabela)
+        grupos, hashes = SnapshotIncremental.identificar_linhas(valores, ausentes)
+        chaves, impressoes = SnapshotIncremental.impressoes(grupos, hashes)
+        colunas = {papel: TIPOS_COLUNAS[papel] for papel in valores}
+        
+        estado = {'planilha': nome_planilha, 'colunas': colunas, 'erro_relativo': erro_relativo,
+                  'novos': (valores, ausentes, grupos, hashes), 'impressoes': (chaves, impressoes),
+                  'antigos': None, 'afetados': None}
+        self.incremental['tipos'][tipo] = estado
+        delta = {'planilha': nome_planilha, 'registros': int(len(tabela)), 'matriculas': int(len(chaves))}
+        self.incremental['delta']['tipos'][tipo] = delta
+        
+        anterior = ((self.incremental['anterior'] or {}).get('tipos') or {}).get(tipo)
+        motivo = None
+        if anterior is None:
+            motivo = 'sem snapshot anterior'
+        elif anterior['colunas'] != colunas or anterior['erro_relativo'] != erro_relativo:
+            motivo = 'colunas ou configuração diferentes das do snapshot'
+        else:
+            try:
+                estado['antigos'] = self.incremental['snapshot'].ler_tipo(tipo)
+                impressoes_antigas = self.incremental['snapshot'].ler_impressoes(tipo)
+            except (OSError, ValueError):
+                motivo = 'snapshot ilegível'
+        
+        if motivo is not None:
+            acumuladores = CarregadorAproximado.criar_acumuladores(valores, erro_relativo)
+            for papel, acumulador in acumuladores.items():
+                acumulador.adicionar(valores[papel], ausentes[papel])
+            delta.update(status='completo', motivo=motivo)
+            estado['acumuladores'] = acumuladores
+            return acumuladores
+        
+        valores_antigos, ausentes_antigos, grupos_antigos, _ = estado['antigos']
+        incluidos, excluidos, alterados = SnapshotIncremental.comparar(*impressoes_antigas, chaves, impressoes)
+        afetados = np.concatenate([incluidos, excluidos, alterados])
+        retiradas = np.isin(grupos_antigos, afetados)
+        incluidas = np.isin(grupos, afetados)
+        
+        acumuladores = {papel: ACUMULADORES[definicao['classe']].de_estado(definicao)
+                        for papel, definicao in anterior['acumuladores'].items()}
+        for papel, acumulador in acumuladores.items():
+            extremos = acumulador.remover(valores_antigos[papel][retiradas], ausentes_antigos[papel][retiradas])
+            acumulador.adicionar(valores[papel][incluidas], ausentes[papel][incluidas])
+            if extremos:
+                acumulador.redefinir_extremos(valores[papel], ausentes[papel])
+        
+        estado.update(afetados=afetados, acumuladores=acumuladores)
+        delta['status'] = 'incremental'
+        matriculas = {}
+        for rotulo, lista, (colunas_lista, ausentes_lista, grupos_lista, _) in zip(
+                ROTULOS_DELTA[tipo], (incluidos, excluidos, alterados), (estado['novos'], estado['antigos'], estado['novos'])):
+            delta[rotulo] = int(len(lista))
+            if 'matricula' in colunas_lista:
+                linhas = np.flatnonzero(np.isin(grupos_lista, lista) & ~ausentes_lista['matricula'])
+                matriculas[rotulo] = sorted(set(colunas_lista['matricula'][linhas].tolist()))[:LIMITE_MATRICULAS_DELTA]
+        delta['inalterados'] = int(len(chaves) - len(incluidos) - len(alterados))
+        delta['linhas_reprocessadas'] = int(retiradas.sum() + incluidas.sum())
+        delta['exemplos_matriculas'] = matriculas
+        return acumuladores
+    
+    def atualizar_exposicao_incremental(self, motor: MotorExposicao, por_datas: bool,
+                                        so_matricula: bool = True) -> Optional[Dict[str, int]]:
+        """Exposição da base nova a partir da do snapshot e das matrículas alteradas
+        
+        Retira do motor anterior a contribuição das linhas antigas das matrículas
+        afetadas (na massa ou nos óbitos) e soma a das linhas novas. Devolve as
+        contagens de óbitos, ou None quando o cálculo tem de ser refeito por
+        inteiro (sem snapshot, outro período, outra idade máxima ou outro método,
+        ou óbitos ligados por CPF ou aproximação nesta base ou na anterior, cujo
+        efeito não fica restrito às matrículas alteradas).
+        """
+        anterior = (self.incremental['anterior'] or {}).get('exposicao')
+        massa, obitos = self.incremental['tipos'].get('massa'), self.incremental['tipos'].get('obitos')
+        status = {'status': 'completo'}
+        self.incremental['delta']['exposicao'] = status
+        
+        if anterior is None or massa is None or obitos is None or massa['antigos'] is None or obitos['antigos'] is None:
+            status['motivo'] = 'sem snapshot anterior de massa, óbitos e exposição'
+            return None
+        if [anterior['ano_inicial'], anterior['ano_final'], anterior['idade_maxima'], anterior['por_datas']] != \
+                [motor.ano_inicial, motor.ano_final, motor.idade_maxima, por_datas]:
+            status['motivo'] = 'período, idade máxima ou método diferentes dos do snapshot'
+            return None
+        if not (so_matricula and anterior.get('so_matricula')):
+            status['motivo'] = 'óbitos ligados por CPF ou ligação aproximada'
+            return None
+        try:
+            arrays = self.incremental['snapshot'].ler_exposicao()
+        except (OSError, ValueError, KeyError):
+            status['motivo'] = 'snapshot ilegível'
+            return None
+        
+        motor.exposicao_central = arrays['exposicao_central']
+        motor.complemento_obitos = arrays['complemento_obitos']
+        motor.obitos = arrays['obitos']
+        motor.metodo = 'datas' if por_datas else 'censo'
+        afetados = np.unique(np.concatenate([massa['afetados'], obitos['afetados']]))
+        
+        def subconjunto(valores, ausentes, grupos, *_):
+            linhas = np.isin(grupos, afetados)
+            return CarregadorColunar.de_colunas(
+                {papel: papel for papel in valores},
+                {papel: coluna[linhas] for papel, coluna in valores.items()},
+                {papel: coluna[linhas] for papel, coluna in ausentes.items()},
+                int(linhas.sum()), 0, []
+            ).finalizar()
+        
+        contagens = dict(anterior['obitos'])
+        for sinal, versao in ((-1, 'antigos'), (1, 'novos')):
+            parcial = MotorExposicao(motor.ano_inicial, motor.ano_final, motor.idade_maxima)
+            parciais = self.acumular_exposicao(parcial, subconjunto(*massa[versao]), subconjunto(*obitos[versao]), por_datas)
+            motor.combinar(parcial, sinal)
+            for chave, valor in parciais.items():
+                contagens[chave] += sinal * valor
+        
+        status.update(status='incremental', matriculas_reprocessadas=int(len(afetados)))
+        return contagens
+    
+    def gravar_snapshot_incremental(self):
+        """Grava massa, óbitos, acumuladores e exposição desta análise como a base da próxima"""
+        tipos = self.incremental['tipos']
+        manifesto = {
+            'gravado_em': datetime.now().isoformat(),
+            'arquivo': os.path.basename(self.caminho_arquivo),
+            'hash_arquivo': self.calcular_hash(),
+            'tipos': {
+                tipo: {
+                    'planilha': estado['planilha'],
+                    'colunas': estado['colunas'],
+                    'erro_relativo': estado['erro_relativo'],
+                    'acumuladores': {
+                        papel: {'classe': type(acumulador).__name__, **acumulador.estado()}
+                        for papel, acumulador in estado['acumuladores'].items()
+                    }
+                }
+                for tipo, estado in tipos.items()
+            },
+            'exposicao': None
+        }
+        
+        motor = None
+        if self.incremental['exposicao'] is not None and self.motor_exposicao is not None:
+            motor = self.motor_exposicao
+            manifesto['exposicao'] = {
+                'ano_inicial': motor.ano_inicial,
+                'ano_final': motor.ano_final,
+                'idade_maxima': motor.idade_maxima,
+                **self.incremental['exposicao']
+            }
+        
+        self.incremental['snapshot'].gravar(
+            manifesto, {tipo: (estado['novos'], estado['impressoes']) for tipo, estado in tipos.items()}, motor)
+    
+    def gravar_cubo(self) -> Dict[str, Any]:
+        """Grava self.cubo em <cache>/cubos e descreve dimensões, medidas e totais
+        
+        O nome combina o hash do arquivo com a configuração normalizada, como a
+        chave do cache de resultados; a consulta é feita depois por --cubo ou
+        pelo comando 'agregar' do modo worker, sem reler a planilha. Os cubos
+        entram na poda LRU do cache (podar_cache) junto com os resultados.
+        """
+        configuracao = json.dumps(CacheResultados.normalizar_configuracao(self.configuracao),
+                                  sort_keys=True, ensure_ascii=False, default=str)
+        caminho = os.path.join(
+            diretorio_cache_padrao(self.caminho_arquivo, self.configuracao), 'cubos',
+            f"{self.calcular_hash()[:16]}-{hashlib.sha256(configuracao.encode('utf-8')).hexdigest()[:16]}.npz"
+        )
+        self.cubo.metadados.update({'arquivo': os.path.basename(self.caminho_arquivo), 'hash_arquivo': self.calcular_hash(),
+                                    'versao_analisador': VERSAO_ANALISADOR, 'criado_em': datetime.now().isoformat()})
+        descricao = {
+            'arquivo': caminho,
+            'dimensoes': {
+                'ano': [self.cubo.ano_inicial, self.cubo.ano_inicial + self.cubo.forma[0] - 1],
+                'sexo': CATEGORIAS_SEXO,
+                'idade': [0, self.cubo.idade_maxima],
+                'situacao': list(SITUACOES_CUBO)
+            },
+            'medidas': list(CuboAgregado.MEDIDAS),
+            'totais': self.cubo.totais()
+        }
+        try:
+            self.cubo.gravar(caminho)
+            descricao['bytes'] = os.path.getsize(caminho)
+        except OSError as e:
+            descricao['arquivo'] = None
+            self.validacao['warnings'].append(f'Não foi possível gravar o cubo agregado: {str(e)}')
+        return descricao
+    
+    def montar_tabuas_aderencia(self, idade_maxima: int) -> Dict[str, np.ndarray]:
+        """Tábuas candidatas: a da planilha qx, a de referência e as informadas em configuracao.tabuasAderencia
+        
+        Cada tábua configurada é {'masculino': [...], 'feminino': [...], 'geral': [...],
+        'idadeInicial': 0}, com um qx por idade a partir da idade inicial, ou uma
+        referência ao registro de tábuas (nome ou {'tabua': nome, 'escala': ...});
+        tábuas com melhoria entram pelo qx efetivo do período (MotorExposicao.qx_efetivo).
+        Referências a tábuas não registradas ficam em self.tabuas_nao_registradas.
+        """
+        tabuas = {}
+        if self.tabua_qx is not None:
+            tabuas['planilha qx'] = self.tabua_qx
+        if self.tabua_referencia is not None:
+            tabuas[self.tabua_referencia[0]] = self.tabua_referencia[1]
+        
+        self.tabuas_nao_registradas = {}
+        for nome, definicao in self.definicoes_tabuas_aderencia().items():
+            registro = self.definicao_registro(definicao)
+            if registro is not None:
+                try:
+                    tabuas[nome] = self.motor_exposicao.qx_efetivo(self.tabua_registro(registro, self.motor_exposicao))
+                except (KeyError, ValueError) as e:
+                    self.tabuas_nao_registradas[nome] = e.args[0]
+                continue
+            qx = np.full((len(CATEGORIAS_SEXO), idade_maxima + 1), np.nan)
+            idade_inicial = int(definicao.get('idadeInicial', 0))
+            for linha, papel in enumerate(('masculino', 'feminino', 'geral')):
+                valores = np.asarray(definicao.get(papel) or [], dtype=np.float64)[:max(0, idade_maxima + 1 - idade_inicial)]
+                qx[linha, idade_inicial:idade_inicial + len(valores)] = valores
+            qx = completar_tabua_qx(qx)
+            if qx is not None:
+                tabuas[nome] = qx
+        return tabuas
+    
+    def testar_aderencia(self) -> Optional[Dict[str, Any]]:
+        """Testes de aderência de todas as tábuas candidatas sobre a exposição calculada"""
+        motor = self.motor_exposicao
+        if motor is None:
+            return None
+        
+        tabuas = self.montar_tabuas_aderencia(motor.idade_maxima)
+        if not tabuas:
+            return {'erro': 'Nenhuma tábua candidata para os testes de aderência',
+                    **({'tabuas_indisponiveis': self.tabuas_nao_registradas} if self.tabuas_nao_registradas else {})}
+        
+        nivel = float(self.configuracao.get('nivelSignificancia', 0.05))
+        tamanho_faixa = int(self.configuracao.get('tamanhoFaixaEtaria') or 1)
+        testes = testar_aderencia_lote(
+            motor.obitos.sum(axis=0),
+            motor.exposicao_inicial.sum(axis=0),
+            np.stack(list(tabuas.values())),
+            tamanho_faixa=tamanho_faixa,
+            nivel_significancia=nivel,
+            correcao_continuidade=bool(self.configuracao.get('correcaoContinuidade', False))
+        )
+        
+        def resultado_teste(valor_p):
+            if not np.isfinite(valor_p):
+                return None
+            return 'REJEITA' if valor_p < nivel else 'ACEITA'
+        
+        resultados = {}
+        for i, nome in enumerate(tabuas):
+            observados, esperados = testes['obitos_observados'][i], testes['obitos_esperados'][i]
+            resultados[nome] = {
+                'obitos_observados': int(round(observados)),
+                'obitos_esperados': round(float(esperados), 4),
+                'razao_ae': round(float(observados / esperados), 4) if esperados > 0 else None,
+                'grupos_validos': int(testes['grupos_validos'][i]),
+                'qui_quadrado': {
+                    'estatistica': round(float(testes['qui_quadrado'][i]), 4),
+                    'graus_liberdade': int(testes['graus_liberdade'][i]),
+                    'valor_p': float(testes['qui_quadrado_valor_p'][i]),
+                    'valor_critico': round(float(testes['valor_critico'][i]), 4),
+                    'resultado_teste': resultado_teste(testes['qui_quadrado_valor_p'][i])
+                },
+                'razao_verossimilhanca': {
+                    'estatistica': round(float(testes['razao_verossimilhanca'][i]), 4),
+                    'graus_liberdade': int(testes['graus_liberdade'][i]),
+                    'valor_p': float(testes['razao_verossimilhanca_valor_p'][i]),
+                    'resultado_teste': resultado_teste(testes['razao_verossimilhanca_valor_p'][i])
+                },
+                'kolmogorov_smirnov': {
+                    'estatistica': float(testes['ks'][i]),
+                    'valor_p': float(testes['ks_valor_p'][i]),
+                    'resultado_teste': resultado_teste(testes['ks_valor_p'][i])
+                }
             }
-            
-        except Exception as e:
-            return {'erro': f'Erro ao analisar óbitos: {str(e)}'}
+        
+        return {
+            'configuracao': {
+                'nivel_significancia': nivel,
+                'tamanho_faixa_etaria': tamanho_faixa,
+                'correcao_continuidade': bool(self.configuracao.get('correcaoContinuidade', False)),
+                'graus_liberdade': 'grupos com esperado > 0 menos 1'
+            },
+            'grupos': int(testes['grupos'][0]) if len(tabuas) else 0,
+            'tabuas': resultados,
+            **({'tabuas_indisponiveis': self.tabuas_nao_registradas} if self.tabuas_nao_registradas else {}),
+            # Melhor aderência primeiro: maior valor-p do qui-quadrado
+            'ranking': sorted(tabuas, key=lambda nome: -np.nan_to_num(resultados[nome]['qui_quadrado']['valor_p'], nan=-1.0))
+        }
     
-    def analisar_planilha_qx(self, worksheet) -> Dict[str, Any]:
-        """Analisa planilha de qx (taxas de mortalidade)"""
-        try:
-            # Converter para DataFrame
-            data = []
-            headers = None
-            
-            for i, row in enumerate(worksheet.iter_rows(values_only=True)):
-                if i == 0:
-                    headers = [str(cell).strip() if cell else f"col_{j}" for j, cell in enumerate(row)]
+    def graduar_taxas(self) -> Optional[Dict[str, Any]]:
+        """Graduação das taxas brutas da exposição por sexo × período (total e cada ano) com óbitos
+        
+        As taxas brutas (óbitos / exposição inicial) de todas as combinações e
+        de cada suavização em configuracao.suavizacaoWhittaker passam juntas por
+        graduar_whittaker_henderson; Gompertz e Makeham são ajustados sobre a
+        exposição central, na faixa idadeInicialLeis–idadeFinalLeis, por
+        ajustar_lei_mortalidade. O grupo aberto (idade máxima) fica fora.
+        """
+        motor = self.motor_exposicao
+        if motor is None or not self.configuracao.get('graduarTaxas', True):
+            return None
+        
+        suavizacoes = self.configuracao.get('suavizacaoWhittaker', SUAVIZACAO_WHITTAKER_PADRAO)
+        suavizacoes = [float(h) for h in (suavizacoes if isinstance(suavizacoes, (list, tuple)) else [suavizacoes])]
+        ordem = int(self.configuracao.get('ordemWhittaker', ORDEM_WHITTAKER_PADRAO))
+        idade_inicial_leis = int(self.configuracao.get('idadeInicialLeis', IDADE_INICIAL_LEIS_PADRAO))
+        idade_final_leis = int(self.configuracao.get('idadeFinalLeis') or motor.idade_maxima - 1)
+        
+        # Combinações [sexo × período]: o período inteiro e, havendo mais de um, cada ano
+        acumuladores = [motor.obitos, motor.exposicao_inicial, motor.exposicao_central]
+        periodos = [('total', [a.sum(axis=0) for a in acumuladores])]
+        if motor.forma[0] > 1:
+            periodos += [(str(motor.ano_inicial + indice), [a[indice] for a in acumuladores])
+                         for indice in range(motor.forma[0])]
+        rotulos = [(periodo, sexo) for periodo, _ in periodos for sexo in range(len(CATEGORIAS_SEXO))]
+        obitos, inicial, central = (np.concatenate([matrizes[i] for _, matrizes in periodos]) for i in range(3))
+        expostas = (inicial[:, :motor.idade_maxima].sum(axis=1) > 0) & (obitos[:, :motor.idade_maxima].sum(axis=1) > 0)
+        if not expostas.any():
+            return {'erro': 'Sem óbitos com exposição para graduar'}
+        rotulos = [rotulo for rotulo, exposta in zip(rotulos, expostas) if exposta]
+        obitos, inicial, central = obitos[expostas], inicial[expostas], central[expostas]
+        inicial[:, motor.idade_maxima] = 0.0
+        central[:, motor.idade_maxima] = 0.0
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            brutas = np.where(inicial > 0, np.minimum(obitos / inicial, 1.0), np.nan)
+        graduadas = graduar_whittaker_henderson(
+            np.tile(brutas, (len(suavizacoes), 1)), np.tile(inicial, (len(suavizacoes), 1)),
+            np.repeat(suavizacoes, len(brutas)), ordem
+        ).reshape(len(suavizacoes), len(brutas), -1)
+        insuficientes = idades_insuficientes_whittaker(brutas, inicial, ordem)
+        # Período inteiro com a primeira suavização: taxas usadas pela simulação
+        self.taxas_graduadas = np.full((len(CATEGORIAS_SEXO), motor.idade_maxima + 1), np.nan)
+        for i, (periodo, sexo) in enumerate(rotulos):
+            if periodo == 'total':
+                self.taxas_graduadas[sexo] = graduadas[0, i]
+        
+        idades = np.arange(motor.idade_maxima + 1)
+        na_faixa = (idades >= idade_inicial_leis) & (idades <= idade_final_leis)
+        leis = {nome: ajustar_lei_mortalidade(obitos * na_faixa, central * na_faixa, idades + 0.5, makeham=makeham)
+                for nome, makeham in (('gompertz', False), ('makeham', True))}
+        
+        def lista(valores, inicio, fim):
+            return [round(float(valor), 8) for valor in valores[inicio:fim + 1]]
+        
+        combinacoes = []
+        for i, (periodo, sexo) in enumerate(rotulos):
+            com_exposicao = np.flatnonzero(inicial[i] > 0)
+            inicio, fim = int(com_exposicao[0]), int(com_exposicao[-1])
+            whittaker = []
+            for j, suavizacao in enumerate(suavizacoes):
+                if insuficientes[i]:
+                    whittaker.append({
+                        'suavizacao': suavizacao,
+                        'erro': (f'Whittaker–Henderson de ordem {ordem} exige ao menos {ordem + 1} idades com '
+                                 f'exposição; há {int(len(com_exposicao))}'),
+                        'qx': None
+                    })
                     continue
-                    
-                if any(cell is not None for cell in row):
-                    data.append(row)
-            
-            if not data:
-                return {'erro': 'Planilha qx vazia'}
-                
-            df = pd.DataFrame(data, columns=headers)
-            
-            # Identificar colunas de qx
-            colunas_qx = self.identificar_colunas_qx(df.columns)
-            
-            # Análise das taxas qx
-            estatisticas_qx = {
-                'total_idades': len(df),
-                'colunas_identificadas': colunas_qx,
-                'faixa_idades': {},
-                'estatisticas_qx': {}
-            }
-            
-            # Analisar faixa de idades
-            if colunas_qx.get('idade'):
-                col_idade = colunas_qx['idade']
-                if col_idade in df.columns:
-                    idades = df[col_idade].dropna()
-                    estatisticas_qx['faixa_idades'] = {
-                        'idade_minima': int(idades.min()),
-                        'idade_maxima': int(idades.max()),
-                        'total_idades': len(idades)
-                    }
-            
-            # Analisar taxas qx por sexo
-            for sexo in ['masculino', 'feminino']:
-                col_qx = colunas_qx.get(f'qx_{sexo}')
-                if col_qx and col_qx in df.columns:
-                    qx_values = pd.to_numeric(df[col_qx], errors='coerce').dropna()
-                    if len(qx_values) > 0:
-                        estatisticas_qx['estatisticas_qx'][sexo] = {
-                            'media': float(qx_values.mean()),
-                            'mediana': float(qx_values.median()),
-                            'desvio_padrao': float(qx_values.std()),
-                            'minimo': float(qx_values.min()),
-                            'maximo': float(qx_values.max()),
-                            'total_valores': len(qx_values)
-                        }
-            
-            return {
-                'estatisticas': estatisticas_qx,
-                'amostra_dados': df.head(5).to_dict('records')
+                esperados = inicial[i] * np.nan_to_num(graduadas[j, i])
+                positivos = esperados > 0
+                whittaker.append({
+                    'suavizacao': suavizacao,
+                    'obitos_esperados': round(float(esperados.sum()), 4),
+                    'qui_quadrado': round(float(((obitos[i][positivos] - esperados[positivos]) ** 2
+                                                 / esperados[positivos]).sum()), 4),
+                    'qx': lista(graduadas[j, i], inicio, fim)
+                })
+            ajustes = {}
+            for nome, lei in leis.items():
+                ajustes[nome] = {
+                    **({'A': float(lei['A'][i])} if nome == 'makeham' else {}),
+                    'B': float(lei['B'][i]),
+                    'c': float(lei['c'][i]),
+                    'log_verossimilhanca': round(float(lei['log_verossimilhanca'][i]), 4),
+                    'aic': round(float(lei['aic'][i]), 4),
+                    'desvio': round(float(lei['desvio'][i]), 4),
+                    'iteracoes': int(lei['iteracoes'][i]),
+                    'convergiu': bool(lei['convergiu'][i]),
+                    **({'erro': f"Ajuste de {nome} falhou: {lei['falha'][i]}"} if not lei['convergiu'][i] else {}),
+                    'qx': lista(lei['qx'][i], inicio, fim)
+                }
+            combinacoes.append({
+                'sexo': CATEGORIAS_SEXO[sexo],
+                'periodo': periodo,
+                'idade_inicial': inicio,
+                'idade_final': fim,
+                'obitos': int(round(float(obitos[i].sum()))),
+                'exposicao_inicial': round(float(inicial[i].sum()), 4),
+                'qx_bruta': lista(brutas[i], inicio, fim),
+                'whittaker_henderson': whittaker,
+                **ajustes
+            })
+        
+        return {
+            'configuracao': {
+                'suavizacao_whittaker': suavizacoes,
+                'ordem_whittaker': ordem,
+                'faixa_leis': [idade_inicial_leis, idade_final_leis],
+                'exposicao': 'inicial (taxas brutas e Whittaker–Henderson); central (Gompertz/Makeham)'
+            },
+            'combinacoes': combinacoes
+        }
+    
+    def simular_intervalos(self) -> Optional[Dict[str, Any]]:
+        """Intervalos de confiança por bootstrap paramétrico (configuracao.replicasSimulacao > 0)
+        
+        Os óbitos de cada réplica são sorteados (Poisson ou binomial) das taxas
+        graduadas por Whittaker–Henderson no período inteiro, ou das brutas onde
+        não houver graduação, sobre a exposição inicial. Das réplicas saem
+        intervalos percentis do qx por idade, da razão A/E de cada tábua
+        candidata (total e por sexo) e do qui-quadrado e da razão de
+        verossimilhança dos testes de aderência.
+        """
+        motor = self.motor_exposicao
+        replicas = int(self.configuracao.get('replicasSimulacao') or 0)
+        if motor is None or replicas <= 0:
+            return None
+        
+        tabuas = self.montar_tabuas_aderencia(motor.idade_maxima)
+        if not tabuas:
+            return {'erro': 'Nenhuma tábua candidata para a simulação'}
+        
+        semente = int(self.configuracao.get('sementeSimulacao', 0))
+        nivel = float(self.configuracao.get('nivelConfianca', 0.95))
+        distribuicao = str(self.configuracao.get('distribuicaoSimulacao') or 'poisson').lower()
+        if distribuicao not in ('poisson', 'binomial'):
+            return {'erro': f'Distribuição de simulação desconhecida: {distribuicao}'}
+        processos = int(self.configuracao.get('processosSimulacao') or os.cpu_count() or 1)
+        processos = max(1, min(processos, os.cpu_count() or 1))
+        
+        obitos, inicial = motor.obitos.sum(axis=0), motor.exposicao_inicial.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            brutas = np.where(inicial > 0, np.minimum(obitos / inicial, 1.0), np.nan)
+        taxas = brutas
+        if self.taxas_graduadas is not None:
+            taxas = np.where(np.isfinite(self.taxas_graduadas), self.taxas_graduadas, brutas)
+        
+        tamanho_faixa = int(self.configuracao.get('tamanhoFaixaEtaria') or 1)
+        correcao = bool(self.configuracao.get('correcaoContinuidade', False))
+        modelo = preparar_modelo_simulacao(inicial, taxas, np.stack(list(tabuas.values())), tamanho_faixa,
+                                           distribuicao, correcao)
+        if not len(modelo['exposicao']):
+            return {'erro': 'Sem exposição para simular'}
+        
+        simuladas = simular_replicas(
+            modelo, replicas, semente, processos,
+            memoria_bloco_mb=float(self.configuracao.get('memoriaBlocoSimulacaoMB') or MEMORIA_BLOCO_SIMULACAO_MB),
+            ao_concluir_bloco=lambda concluidos, total: self.emitir('progresso_simulacao', blocos_concluidos=concluidos,
+                                                                    total_blocos=total)
+        )
+        observadas = estatisticas_replicas(modelo, obitos[modelo['sexo'], modelo['idade']][np.newaxis, :])
+        cauda = (1 - nivel) / 2
+        limites = {chave: np.nanquantile(valores, [cauda, 1 - cauda], axis=0)
+                   for chave, valores in simuladas.items() if chave != 'blocos'}
+        
+        def intervalo(chave, *indice):
+            estimativa = float(observadas[chave][(0,) + indice])
+            inferior, superior = (float(limite[indice]) for limite in limites[chave])
+            return {'estimativa': round(estimativa, 6) if np.isfinite(estimativa) else None,
+                    'limite_inferior': round(inferior, 6) if np.isfinite(inferior) else None,
+                    'limite_superior': round(superior, 6) if np.isfinite(superior) else None}
+        
+        qx_por_idade = []
+        for celula, (sexo, idade) in enumerate(zip(modelo['sexo'], modelo['idade'])):
+            qx_por_idade.append({
+                'sexo': CATEGORIAS_SEXO[sexo],
+                'idade': int(idade),
+                'exposicao_inicial': round(float(inicial[sexo, idade]), 4),
+                'obitos_observados': int(round(float(obitos[sexo, idade]))),
+                'qx_ajustado': round(float(modelo['taxas'][celula]), 8),
+                **intervalo('qx', celula)
+            })
+        
+        resultados = {}
+        for t, nome in enumerate(tabuas):
+            resultados[nome] = {
+                'razao_ae': intervalo('razao_ae', t),
+                'razao_ae_por_sexo': {CATEGORIAS_SEXO[sexo]: intervalo('razao_ae_sexos', t, s)
+                                      for s, sexo in enumerate(modelo['sexos'])},
+                'qui_quadrado': intervalo('qui_quadrado', t),
+                'razao_verossimilhanca': intervalo('razao_verossimilhanca', t)
             }
-            
-        except Exception as e:
-            return {'erro': f'Erro ao analisar qx: {str(e)}'}
+        
+        return {
+            'configuracao': {
+                'replicas': replicas,
+                'semente': semente,
+                'nivel_confianca': nivel,
+                'distribuicao': distribuicao,
+                'taxas': 'graduadas (Whittaker–Henderson)' if self.taxas_graduadas is not None else 'brutas',
+                'blocos': len(simuladas['blocos']),
+                'replicas_por_bloco': int(simuladas['blocos'].max()),
+                'processos': processos
+            },
+            'qx_por_idade': qx_por_idade,
+            'tabuas': resultados
+        }
     
     def identificar_colunas(self, colunas: List[str]) -> Dict[str, str]:
         """Identifica automaticamente as colunas importantes"""
         mapeamento = {
+            'matricula': None,
             'idade': None,
             'sexo': None,
             'data_nascimento': None,
+            'ano_cadastro': None,
+            'data_entrada': None,
+            'data_saida': None,
             'salario': None,
             'nome': None,
             'cpf': None
@@ -272,8 +5397,22 @@ class AnalisadorMortalidadeExcel:
         for col in colunas:
             col_lower = col.lower().strip()
             
+            # Identificar matrícula (chave de ligação com os óbitos)
+            if any(termo in col_lower for termo in ['matricula', 'matrícula']):
+                mapeamento['matricula'] = col
+            
+            # Identificar ano do cadastro (massa recenseada por ano)
+            elif any(termo in col_lower for termo in ['ano cadastro', 'ano do cadastro', 'ano_cadastro', 'ano base']):
+                mapeamento['ano_cadastro'] = col
+            
+            # Identificar datas de entrada e saída da observação
+            elif any(termo in col_lower for termo in ['admissao', 'admissão', 'entrada', 'data_inicio', 'dt_inicio']):
+                mapeamento['data_entrada'] = col
+            elif any(termo in col_lower for termo in ['desligamento', 'saida', 'saída', 'data_fim', 'dt_fim']):
+                mapeamento['data_saida'] = col
+            
             # Identificar idade
-            if any(termo in col_lower for termo in ['idade', 'age', 'anos']):
+            elif any(termo in col_lower for termo in ['idade', 'age', 'anos']):
                 mapeamento['idade'] = col
             
             # Identificar sexo
@@ -301,17 +5440,27 @@ class AnalisadorMortalidadeExcel:
     def identificar_colunas_obitos(self, colunas: List[str]) -> Dict[str, str]:
         """Identifica colunas específicas de óbitos"""
         mapeamento = {
+            'matricula': None,
             'idade_obito': None,
             'sexo': None,
+            'data_nascimento': None,
             'data_obito': None,
+            'ano_obito': None,
             'causa_obito': None,
+            'nome': None,
             'cpf': None
         }
         
         for col in colunas:
             col_lower = col.lower().strip()
             
-            if any(termo in col_lower for termo in ['idade', 'age']):
+            if any(termo in col_lower for termo in ['matricula', 'matrícula']):
+                mapeamento['matricula'] = col
+            elif any(termo in col_lower for termo in ['nascimento', 'birth']):
+                mapeamento['data_nascimento'] = col
+            elif re.search(r'\bano\b|\byear\b', col_lower):
+                mapeamento['ano_obito'] = col
+            elif any(termo in col_lower for termo in ['idade', 'age']):
                 mapeamento['idade_obito'] = col
             elif any(termo in col_lower for termo in ['sexo', 'sex']):
                 mapeamento['sexo'] = col
@@ -319,12 +5468,15 @@ class AnalisadorMortalidadeExcel:
                 mapeamento['data_obito'] = col
             elif any(termo in col_lower for termo in ['causa', 'motivo', 'reason']):
                 mapeamento['causa_obito'] = col
+            elif any(termo in col_lower for termo in ['nome', 'name', 'participante']):
+                mapeamento['nome'] = col
             elif any(termo in col_lower for termo in ['cpf', 'documento', 'id']):
                 mapeamento['cpf'] = col
         
         return mapeamento
     
-    def identificar_colunas_qx(self, colunas: List[str]) -> Dict[str, str]:
+    @staticmethod
+    def identificar_colunas_qx(colunas: List[str]) -> Dict[str, str]:
         """Identifica colunas de taxas qx"""
         mapeamento = {
             'idade': None,
@@ -335,21 +5487,50 @@ class AnalisadorMortalidadeExcel:
         
         for col in colunas:
             col_lower = col.lower().strip()
+            # Palavras inteiras: 'm'/'f' e 'x' não podem casar dentro de outras palavras
+            palavras = set(re.split(r'[^a-z0-9()]+', col_lower))
+            feminino = 'fem' in col_lower or bool(palavras & {'f', 'female'})
+            masculino = not feminino and ('masc' in col_lower or bool(palavras & {'m', 'male'}))
             
-            if any(termo in col_lower for termo in ['idade', 'age', 'x']):
+            if col_lower == 'x' or any(termo in col_lower for termo in ['idade', 'age']):
                 mapeamento['idade'] = col
-            elif any(termo in col_lower for termo in ['qx', 'q(x)', 'taxa']) and any(termo in col_lower for termo in ['masc', 'male', 'm']):
+            elif any(termo in col_lower for termo in ['qx', 'q(x)', 'taxa']) and masculino:
                 mapeamento['qx_masculino'] = col
-            elif any(termo in col_lower for termo in ['qx', 'q(x)', 'taxa']) and any(termo in col_lower for termo in ['fem', 'female', 'f']):
+            elif any(termo in col_lower for termo in ['qx', 'q(x)', 'taxa']) and feminino:
                 mapeamento['qx_feminino'] = col
-            elif any(termo in col_lower for termo in ['qx', 'q(x)', 'taxa']) and not any(termo in col_lower for termo in ['masc', 'male', 'm', 'fem', 'female', 'f']):
+            elif any(termo in col_lower for termo in ['qx', 'q(x)', 'taxa']):
                 mapeamento['qx_geral'] = col
         
         return mapeamento
     
     def analisar_distribuicao_idade(self, serie_idade) -> Dict[str, Any]:
         """Analisa distribuição de idades"""
-        idades = pd.to_numeric(serie_idade, errors='coerce').dropna()
+        if isinstance(serie_idade, EstatisticaStreaming):
+            # Modo RAPIDO: histograma por idade inteira (quantis e faixas exatos)
+            if not serie_idade.n:
+                return {'erro': 'Nenhuma idade válida encontrada'}
+            return {
+                'total': serie_idade.n,
+                'media': serie_idade.media,
+                'mediana': serie_idade.quantil(0.5),
+                'desvio_padrao': serie_idade.desvio_padrao,
+                'minima': int(serie_idade.minimo),
+                'maxima': int(serie_idade.maximo),
+                'distribuicao_faixas': {
+                    rotulo: serie_idade.contar_intervalo(inferior, superior)
+                    for rotulo, inferior, superior in FAIXAS_IDADE
+                },
+                'aproximacao': {
+                    'metodo': 'passada única: momentos de Welford/Chan e histograma por idade inteira',
+                    'erro_quantis': 0.0,
+                    'erro_media_desvio': 0.0
+                }
+            }
+        
+        # Colunas vindas do carregador colunar já são numéricas
+        if not is_numeric_dtype(serie_idade):
+            serie_idade = pd.to_numeric(serie_idade, errors='coerce')
+        idades = serie_idade.dropna()
         
         if len(idades) == 0:
             return {'erro': 'Nenhuma idade válida encontrada'}
@@ -362,27 +5543,35 @@ class AnalisadorMortalidadeExcel:
             'minima': int(idades.min()),
             'maxima': int(idades.max()),
             'distribuicao_faixas': {
-                '0-20': len(idades[idades <= 20]),
-                '21-30': len(idades[(idades > 20) & (idades <= 30)]),
-                '31-40': len(idades[(idades > 30) & (idades <= 40)]),
-                '41-50': len(idades[(idades > 40) & (idades <= 50)]),
-                '51-60': len(idades[(idades > 50) & (idades <= 60)]),
-                '61-70': len(idades[(idades > 60) & (idades <= 70)]),
-                '71+': len(idades[idades > 70])
+                rotulo: len(idades[((idades > inferior) if inferior is not None else True)
+                                   & ((idades <= superior) if superior is not None else True)])
+                for rotulo, inferior, superior in FAIXAS_IDADE
             }
         }
     
     def analisar_distribuicao_sexo(self, serie_sexo) -> Dict[str, Any]:
         """Analisa distribuição por sexo"""
-        sexos = serie_sexo.dropna().astype(str).str.upper()
+        if isinstance(serie_sexo, ContagemCategorias):
+            distribuicao = serie_sexo.distribuicao()
+            total = sum(distribuicao.values())
+            if not total:
+                return {'total': 0, 'distribuicao': {}, 'percentuais': {}}
+            return {
+                'total': total,
+                'distribuicao': distribuicao,
+                'percentuais': {k: round(v/total*100, 2) for k, v in distribuicao.items()}
+            }
         
-        # Normalizar valores
-        sexos_normalizados = sexos.map({
-            'M': 'MASCULINO', 'MASC': 'MASCULINO', 'MASCULINO': 'MASCULINO', 'MALE': 'MASCULINO',
-            'F': 'FEMININO', 'FEM': 'FEMININO', 'FEMININO': 'FEMININO', 'FEMALE': 'FEMININO'
-        }).fillna('OUTROS')
+        if isinstance(serie_sexo.dtype, pd.CategoricalDtype):
+            # Já normalizado pelo carregador colunar
+            sexos_normalizados = serie_sexo.dropna()
+        else:
+            sexos = serie_sexo.dropna().astype(str).str.upper()
+            
+            # Normalizar valores
+            sexos_normalizados = sexos.map(MAPA_SEXO).fillna('OUTROS')
         
-        distribuicao = sexos_normalizados.value_counts().to_dict()
+        distribuicao = {k: v for k, v in sexos_normalizados.value_counts().to_dict().items() if v > 0}
         total = len(sexos_normalizados)
         
         return {
@@ -394,7 +5583,20 @@ class AnalisadorMortalidadeExcel:
     def analisar_datas(self, serie_datas) -> Dict[str, Any]:
         """Analisa série de datas"""
         try:
-            datas = pd.to_datetime(serie_datas, errors='coerce').dropna()
+            if isinstance(serie_datas, ContagemDatas):
+                if not serie_datas.n:
+                    return {'erro': 'Nenhuma data válida encontrada'}
+                return {
+                    'total': serie_datas.n,
+                    'data_minima': pd.Timestamp(serie_datas.minimo).strftime('%Y-%m-%d'),
+                    'data_maxima': pd.Timestamp(serie_datas.maximo).strftime('%Y-%m-%d'),
+                    'distribuicao_por_ano': serie_datas.contagem_anos().sort_values(ascending=False, kind='stable').to_dict(),
+                    'distribuicao_por_mes': serie_datas.contagem_meses().sort_values(ascending=False, kind='stable').to_dict()
+                }
+            
+            if not is_datetime64_any_dtype(serie_datas):
+                serie_datas = pd.Series(NormalizadorDatas().converter(serie_datas)[0])
+            datas = serie_datas.dropna()
             
             if len(datas) == 0:
                 return {'erro': 'Nenhuma data válida encontrada'}
@@ -411,7 +5613,32 @@ class AnalisadorMortalidadeExcel:
     
     def analisar_valores_monetarios(self, serie_valores) -> Dict[str, Any]:
         """Analisa valores monetários"""
-        valores = pd.to_numeric(serie_valores, errors='coerce').dropna()
+        if isinstance(serie_valores, EstatisticaStreaming):
+            # Modo RAPIDO: média/desvio exatos, quantis pelo sketch de erro relativo
+            if not serie_valores.n:
+                return {'erro': 'Nenhum valor monetário válido encontrado'}
+            return {
+                'total': serie_valores.n,
+                'media': serie_valores.media,
+                'mediana': serie_valores.quantil(0.5),
+                'desvio_padrao': serie_valores.desvio_padrao,
+                'minimo': serie_valores.minimo,
+                'maximo': serie_valores.maximo,
+                'quartis': {
+                    'q1': serie_valores.quantil(0.25),
+                    'q2': serie_valores.quantil(0.5),
+                    'q3': serie_valores.quantil(0.75)
+                },
+                'aproximacao': {
+                    'metodo': 'passada única: momentos de Welford/Chan e sketch de quantis DDSketch',
+                    'erro_relativo_quantis': serie_valores.erro_relativo,
+                    'erro_media_desvio': 0.0
+                }
+            }
+        
+        if not is_numeric_dtype(serie_valores):
+            serie_valores = pd.to_numeric(serie_valores, errors='coerce')
+        valores = serie_valores.dropna()
         
         if len(valores) == 0:
             return {'erro': 'Nenhum valor monetário válido encontrado'}
@@ -433,7 +5660,23 @@ class AnalisadorMortalidadeExcel:
     def analisar_distribuicao_temporal(self, serie_datas) -> Dict[str, Any]:
         """Analisa distribuição temporal de óbitos"""
         try:
-            datas = pd.to_datetime(serie_datas, errors='coerce').dropna()
+            if isinstance(serie_datas, ContagemDatas):
+                if not serie_datas.n:
+                    return {'erro': 'Nenhuma data de óbito válida encontrada'}
+                return {
+                    'total_obitos': serie_datas.n,
+                    'periodo': {
+                        'inicio': pd.Timestamp(serie_datas.minimo).strftime('%Y-%m-%d'),
+                        'fim': pd.Timestamp(serie_datas.maximo).strftime('%Y-%m-%d')
+                    },
+                    'distribuicao_anual': serie_datas.contagem_anos().to_dict(),
+                    'distribuicao_mensal': serie_datas.contagem_meses().to_dict(),
+                    'tendencia': self.calcular_tendencia_temporal(serie_datas)
+                }
+            
+            if not is_datetime64_any_dtype(serie_datas):
+                serie_datas = pd.Series(NormalizadorDatas().converter(serie_datas)[0])
+            datas = serie_datas.dropna()
             
             if len(datas) == 0:
                 return {'erro': 'Nenhuma data de óbito válida encontrada'}
@@ -455,7 +5698,10 @@ class AnalisadorMortalidadeExcel:
         """Calcula tendência temporal dos óbitos"""
         try:
             # Agrupar por ano e contar
-            obitos_por_ano = datas.dt.year.value_counts().sort_index()
+            if isinstance(datas, ContagemDatas):
+                obitos_por_ano = datas.contagem_anos()
+            else:
+                obitos_por_ano = datas.dt.year.value_counts().sort_index()
             
             if len(obitos_por_ano) < 2:
                 return {'erro': 'Dados insuficientes para calcular tendência'}
@@ -466,8 +5712,17 @@ class AnalisadorMortalidadeExcel:
             # Regressão linear simples
             slope, intercept, r_value, p_value, std_err = stats.linregress(anos, counts)
             
+            # Intervalo t do coeficiente angular (precisa de ao menos 3 anos)
+            nivel = float(self.configuracao.get('nivelConfianca', 0.95))
+            intervalo = None
+            if len(anos) > 2:
+                margem = stats.t.ppf(1 - (1 - nivel) / 2, len(anos) - 2) * std_err
+                intervalo = {'nivel_confianca': nivel, 'limite_inferior': float(slope - margem),
+                             'limite_superior': float(slope + margem)}
+            
             return {
                 'coeficiente_angular': float(slope),
+                'intervalo_confianca': intervalo,
                 'intercepto': float(intercept),
                 'correlacao': float(r_value),
                 'r_quadrado': float(r_value**2),
@@ -479,7 +5734,61 @@ class AnalisadorMortalidadeExcel:
             return {'erro': 'Erro no cálculo de tendência'}
     
     def executar_analise(self) -> Dict[str, Any]:
-        """Executa análise completa do arquivo"""
+        """Executa análise completa do arquivo, com o perfil de execução em metadados.perfil
+        
+        Com configuracao.perfilDetalhado o cProfile e um snapshot do tracemalloc
+        da análise inteira são gravados em diretorioPerfil (padrão: <cache>/perfil).
+        """
+        perfilador = None
+        if self.configuracao.get('perfilDetalhado'):
+            perfilador = cProfile.Profile()
+        self.perfil.iniciar()
+        try:
+            if perfilador is not None:
+                try:
+                    perfilador.enable()
+                except ValueError:
+                    # Outro perfilador já ativo no processo
+                    perfilador = None
+            try:
+                with self.pulso():
+                    resultado = self.analisar_arquivo()
+            finally:
+                if perfilador is not None:
+                    perfilador.disable()
+            
+            resultado['metadados']['perfil'] = self.perfil.resumir()
+            if self.configuracao.get('perfilDetalhado'):
+                try:
+                    resultado['metadados']['perfil']['arquivos'] = self.gravar_perfil_detalhado(perfilador)
+                except OSError as e:
+                    self.validacao['warnings'].append(f'Não foi possível gravar o perfil detalhado: {str(e)}')
+            return resultado
+        finally:
+            self.perfil.encerrar()
+    
+    def gravar_perfil_detalhado(self, perfilador: Optional[cProfile.Profile]) -> Dict[str, str]:
+        """Grava o cProfile (.prof, legível pelo pstats) e o snapshot do tracemalloc da análise"""
+        diretorio = self.configuracao.get('diretorioPerfil') or os.path.join(
+            diretorio_cache_padrao(self.caminho_arquivo, self.configuracao), 'perfil'
+        )
+        os.makedirs(diretorio, exist_ok=True)
+        base = os.path.join(diretorio, '%s-%s-%d' % (
+            os.path.splitext(os.path.basename(self.caminho_arquivo))[0],
+            datetime.now().strftime('%Y%m%dT%H%M%S'), os.getpid()
+        ))
+        
+        arquivos = {}
+        if perfilador is not None:
+            arquivos['cprofile'] = f'{base}.prof'
+            perfilador.dump_stats(arquivos['cprofile'])
+        if tracemalloc.is_tracing():
+            arquivos['tracemalloc'] = f'{base}.tracemalloc'
+            tracemalloc.take_snapshot().dump(arquivos['tracemalloc'])
+        return arquivos
+    
+    def analisar_arquivo(self) -> Dict[str, Any]:
+        """Etapas da análise: cache, leitura e análise das planilhas, exposição e aderência"""
         resultado = {
             'metadados': {
                 'arquivo': os.path.basename(self.caminho_arquivo),
@@ -490,19 +5799,51 @@ class AnalisadorMortalidadeExcel:
                 'bibliotecas': {
                     'pandas': pd.__version__,
                     'numpy': np.__version__,
-                    'openpyxl': '3.1.2'  # versão estimada
+                    'openpyxl': openpyxl.__version__,
+                    'scipy': scipy.__version__
                 }
             },
             'estrutura_arquivo': {},
+            'formulas': {},
             'dados_extraidos': {},
             'estatisticas': {},
             'validacao': self.validacao,
             'warnings': []
         }
         
+        if self.configuracao.get('modoIncremental') and self.modo_rapido():
+            self.validacao['warnings'].append('Modo incremental ignorado no modo RAPIDO (as colunas não são guardadas)')
+        
+        if self.modo_rapido():
+            erro_relativo = float(self.configuracao.get('erroRelativoQuantis', ERRO_RELATIVO_QUANTIS))
+            resultado['metadados']['modo_analise'] = {
+                'metodo': 'RAPIDO',
+                'descricao': 'Massa e óbitos resumidos em uma passada, sem guardar as colunas',
+                'limites_erro': {
+                    'contagens_e_distribuicoes': 0.0,
+                    'media_desvio_minimo_maximo': 0.0,
+                    'quantis_idade': 0.0,
+                    'quantis_valores_erro_relativo': erro_relativo
+                },
+                'amostra': 'reservatório uniforme sobre todas as linhas (sementeAmostra=%d)' % int(self.configuracao.get('sementeAmostra', 0))
+            }
+        
+        # Resultado já calculado para o mesmo conteúdo e configuração
+        cache, chave_cache = self.consultar_cache(resultado['metadados'])
+        if cache is not None and resultado['metadados']['cache']['status'] == 'hit':
+            armazenado = cache.ler(chave_cache)
+            if armazenado is not None:
+                armazenado['metadados']['cache'] = resultado['metadados']['cache']
+                armazenado['metadados']['configuracao_utilizada'] = self.configuracao
+                self.emitir('cache_encontrado', chave=armazenado['metadados']['cache'].get('chave'))
+                return armazenado
+            resultado['metadados']['cache']['status'] = 'miss'
+        
         try:
             # Carregar arquivo
-            planilhas = self.carregar_arquivo()
+            with self.perfil.etapa('carregar_arquivo') as etapa:
+                planilhas = self.carregar_arquivo()
+                etapa['planilhas'] = len(planilhas)
             
             resultado['estrutura_arquivo'] = {
                 'planilhas': planilhas,
@@ -511,36 +5852,105 @@ class AnalisadorMortalidadeExcel:
             
             total_linhas = 0
             formulas_total = 0
+            # Fórmulas agrupadas por padrão R1C1; célula a célula só no modo DETALHADO
+            agrupador_formulas = AgrupadorFormulas()
+            formulas_detalhadas = self.configuracao.get('metodoAnalise') == 'DETALHADO'
+            # Tabela tipada mais completa de cada tipo (massa, obitos, qx) para a exposição
+            tabelas = {}
+            # Massa e óbitos do modo incremental, analisados depois do delta
+            pendentes = []
+            self.emitir('analise_iniciada', arquivo=resultado['metadados']['arquivo'], planilhas=planilhas)
             
-            # Analisar cada planilha
-            for nome_planilha in planilhas:
-                worksheet = self.workbook[nome_planilha]
-                
-                # Contar linhas
-                linhas_planilha = worksheet.max_row
-                total_linhas += linhas_planilha
-                
-                # Extrair fórmulas se configurado
-                if self.configuracao.get('extrairFormulas', True):
-                    formulas = self.extrair_formulas(worksheet)
-                    formulas_total += len(formulas)
-                    self.formulas_encontradas.extend(formulas)
+            def processar_em_sequencia():
+                for indice, nome_planilha in enumerate(planilhas):
+                    self.emitir('planilha_iniciada', planilha=nome_planilha, indice=indice, total_planilhas=len(planilhas))
+                    yield self.processar_planilha(nome_planilha)
+            
+            # Analisar cada planilha (uma única passada de leitura por planilha)
+            # Modo paralelo opcional, limitado ao número de núcleos disponíveis
+            processos = min(int(self.configuracao.get('processosParalelos') or 0), os.cpu_count() or 1)
+            if processos > 1 and len(planilhas) > 1:
+                for indice, nome_planilha in enumerate(planilhas):
+                    self.emitir('planilha_iniciada', planilha=nome_planilha, indice=indice, total_planilhas=len(planilhas))
+                processamentos = self.processar_planilhas_em_paralelo(planilhas, processos)
+            else:
+                processamentos = processar_em_sequencia()
+            
+            for indice, (nome_planilha, processamento) in enumerate(zip(planilhas, processamentos)):
+                if processamento['chave']:
+                    resultado['dados_extraidos'][processamento['chave']] = processamento['dados']
                 
-                # Identificar tipo de planilha e analisar
-                nome_lower = nome_planilha.lower()
+                tabela = processamento.pop('tabela', None)
+                if tabela is not None:
+                    preenchimento = int(tabela.notna().to_numpy().sum())
+                    if preenchimento > tabelas.get(processamento['tipo'], (-1, None))[0]:
+                        tabelas[processamento['tipo']] = (preenchimento, tabela)
+                if processamento.get('resumo') is not None:
+                    pendentes.append((nome_planilha, processamento, tabela))
                 
-                if any(termo in nome_lower for termo in ['massa', 'participante', 'trabalhada', 'unificada']):
-                    resultado['dados_extraidos']['massa_participantes'] = self.analisar_planilha_massa(worksheet)
+                total_linhas += processamento['linhas']
                 
-                elif any(termo in nome_lower for termo in ['obito', 'morte', 'falecimento', 'death']):
-                    resultado['dados_extraidos']['obitos_registrados'] = self.analisar_planilha_obitos(worksheet)
+                # Fórmulas da planilha. No modo DETALHADO, com consumidor de
+                # eventos, a lista célula a célula segue em lotes e não fica
+                # acumulada na análise
+                formulas = processamento['formulas']
+                formulas_total += len(formulas)
+                self.total_formulas += len(formulas)
+                agrupador_formulas.adicionar(nome_planilha, formulas)
+                if formulas_detalhadas:
+                    if self.emitir_evento is not None:
+                        for inicio in range(0, len(formulas), TAMANHO_LOTE_FORMULAS):
+                            self.emitir('lote_formulas', planilha=nome_planilha, inicio=inicio,
+                                        formulas=formulas[inicio:inicio + TAMANHO_LOTE_FORMULAS])
+                    else:
+                        self.formulas_encontradas.extend(formulas)
                 
-                elif any(termo in nome_lower for termo in ['qx', 'mortalidade', 'taxa']):
-                    resultado['dados_extraidos']['qx_mortalidade'] = self.analisar_planilha_qx(worksheet)
+                self.emitir('planilha_concluida', planilha=nome_planilha, indice=indice,
+                            total_planilhas=len(planilhas), tipo=processamento['tipo'],
+                            chave=processamento['chave'], linhas=processamento['linhas'],
+                            formulas=len(formulas), dados=processamento['dados'])
+            
+            if self.workbook is not None:
+                self.workbook.close()
+            
+            self.tabelas = {tipo: tabela for tipo, (_, tabela) in tabelas.items()}
+            if pendentes:
+                with self.perfil.etapa('analisar_delta_incremental', planilhas=len(pendentes)):
+                    self.analisar_delta_incremental(pendentes, self.tabelas)
+                for _, processamento, _ in pendentes:
+                    resultado['dados_extraidos'][processamento['chave']] = processamento['dados']
+            
+            # Exposição e A/E a partir das planilhas de massa, óbitos e qx
+            with self.perfil.etapa('calcular_exposicao_ae'):
+                exposicao = self.calcular_exposicao_ae(self.tabelas)
+            if exposicao is not None:
+                resultado['dados_extraidos']['exposicao_ae'] = exposicao
+                if self.cubo is not None:
+                    with self.perfil.etapa('gravar_cubo'):
+                        resultado['dados_extraidos']['cubo_agregado'] = self.gravar_cubo()
+                with self.perfil.etapa('testar_aderencia'):
+                    aderencia = self.testar_aderencia()
+                if aderencia is not None:
+                    resultado['dados_extraidos']['aderencia'] = aderencia
+                with self.perfil.etapa('graduar_taxas'):
+                    graduacao = self.graduar_taxas()
+                if graduacao is not None:
+                    resultado['dados_extraidos']['graduacao'] = graduacao
+                with self.perfil.etapa('simular_intervalos'):
+                    intervalos = self.simular_intervalos()
+                if intervalos is not None:
+                    resultado['dados_extraidos']['intervalos_confianca'] = intervalos
+            elif self.modo_rapido() and {'massa_participantes', 'obitos_registrados'} <= set(resultado['dados_extraidos']):
+                resultado['dados_extraidos']['exposicao_ae'] = {
+                    'erro': 'Exposição e A/E exigem os registros individuais; indisponível no modo RAPIDO'
+                }
             
             # Estatísticas gerais
             resultado['estrutura_arquivo']['total_linhas'] = total_linhas
             resultado['estrutura_arquivo']['formulas_encontradas'] = formulas_total
+            resultado['formulas'] = agrupador_formulas.resumir()
+            if formulas_detalhadas and self.emitir_evento is None:
+                resultado['formulas']['detalhadas'] = self.formulas_encontradas
             
             # Calcular estatísticas consolidadas
             resultado['estatisticas'] = self.calcular_estatisticas_consolidadas()
@@ -549,17 +5959,93 @@ class AnalisadorMortalidadeExcel:
             if not resultado['dados_extraidos']:
                 self.validacao['warnings'].append('Nenhum dado específico foi extraído das planilhas')
             
+            if self.incremental is not None:
+                resultado['dados_extraidos']['delta_incremental'] = self.incremental['delta']
+                self.emitir('delta_incremental', delta=self.incremental['delta'])
+                # A base só vira o novo snapshot quando a análise termina sem erro
+                if self.validacao['integridade_ok'] and not self.validacao['erros_encontrados']:
+                    try:
+                        self.gravar_snapshot_incremental()
+                    except OSError as e:
+                        self.validacao['warnings'].append(f'Não foi possível gravar o snapshot incremental: {str(e)}')
+            
             resultado['validacao'] = self.validacao
             resultado['warnings'] = self.validacao['warnings']
             
+            # Apenas análises sem erro são guardadas no cache
+            gravar_cache = cache is not None and self.validacao['integridade_ok'] and not self.validacao['erros_encontrados']
+            texto = None
+            if gravar_cache or self.perfil.rastrear_memoria:
+                # O mesmo JSON vai para o cache; sem cache, só é medido a pedido (perfilMemoria)
+                with self.perfil.etapa('serializacao') as etapa:
+                    texto = json.dumps(valores_json_seguros(resultado), ensure_ascii=False, default=str)
+                    etapa['caracteres'] = len(texto)
+            if gravar_cache:
+                try:
+                    cache.gravar(chave_cache, resultado, texto)
+                except OSError as e:
+                    self.validacao['warnings'].append(f'Não foi possível gravar o cache: {str(e)}')
+            elif self.obter_sidecar() is not None or resultado['dados_extraidos'].get('cubo_agregado', {}).get('arquivo'):
+                # Sem gravação de resultado, a poda do sidecar e do cubo recém-gravados fica por conta da análise
+                podar_cache(diretorio_cache_padrao(self.caminho_arquivo, self.configuracao), self.tamanho_maximo_cache())
+            
             return resultado
             
+        except AnaliseCancelada:
+            raise
         except Exception as e:
             self.validacao['erros_encontrados'].append(f"Erro na análise: {str(e)}")
             self.validacao['integridade_ok'] = False
             resultado['validacao'] = self.validacao
             return resultado
     
+    def consultar_cache(self, metadados: Dict[str, Any]):
+        """Prepara o cache de resultados e registra hit/miss em metadados['cache']"""
+        if not self.configuracao.get('usarCache', True):
+            metadados['cache'] = {'status': 'desativado'}
+            return None, None
+        
+        if self.modo_incremental():
+            # O delta depende do snapshot da base anterior, não só do arquivo e da configuração
+            metadados['cache'] = {'status': 'desativado', 'motivo': 'modo incremental'}
+            return None, None
+        
+        if self.configuracao.get('metodoAnalise') == 'DETALHADO' and self.configuracao.get('extrairFormulas', True):
+            # As fórmulas célula a célula saem em lotes (ou em formulas.detalhadas) durante a leitura
+            # e não são guardadas no cache: um hit as perderia
+            metadados['cache'] = {'status': 'desativado', 'motivo': 'fórmulas detalhadas'}
+            return None, None
+        
+        try:
+            cache = CacheResultados(
+                diretorio_cache_padrao(self.caminho_arquivo, self.configuracao),
+                self.tamanho_maximo_cache()
+            )
+            
+            hash_arquivo = self.calcular_hash()
+            
+            if self.configuracao.get('invalidarCache'):
+                cache.invalidar(hash_arquivo)
+            
+            configuracao = self.configuracao
+            citadas = self.tabuas_registro_citadas()
+            if citadas:
+                # Tábuas do registro alteradas depois da análise mudam o resultado
+                configuracao = {**configuracao, 'revisoesTabuas': self.obter_registro_tabuas().revisoes(citadas)}
+            chave = cache.chave(hash_arquivo, configuracao)
+            existe = os.path.exists(os.path.join(cache.diretorio, f'{chave}.json'))
+            metadados['cache'] = {
+                'status': 'hit' if existe else 'miss',
+                'chave': chave,
+                'hash_arquivo': hash_arquivo,
+                'versao_analisador': VERSAO_ANALISADOR
+            }
+            return cache, chave
+        
+        except OSError as e:
+            metadados['cache'] = {'status': 'erro', 'erro': str(e)}
+            return None, None
+    
     def calcular_estatisticas_consolidadas(self) -> Dict[str, Any]:
         """Calcula estatísticas consolidadas de todos os dados"""
         stats = {
@@ -567,7 +6053,7 @@ class AnalisadorMortalidadeExcel:
                 'massa_analisada': False,
                 'obitos_analisados': False,
                 'qx_analisado': False,
-                'total_formulas': len(self.formulas_encontradas)
+                'total_formulas': self.total_formulas
             }
         }
         
@@ -594,18 +6080,596 @@ class AnalisadorMortalidadeExcel:
         
         return stats
 
+def processar_planilha_isolada(caminho_arquivo: str, configuracao: Dict[str, Any],
+                               nome_planilha: str, tarefa: str) -> Dict[str, Any]:
+    """Tarefa do pool de processos: análise ('dados') ou fórmulas de uma planilha"""
+    analisador = AnalisadorMortalidadeExcel(caminho_arquivo, configuracao)
+    analisador.perfil.iniciar()
+    try:
+        if tarefa == 'formulas':
+            # Sem tipo, a leitura só percorre a planilha coletando fórmulas
+            leitura = analisador.ler_planilha_medida(nome_planilha, None)
+            resposta = {'chave': None, 'dados': None, 'linhas': leitura['linhas'], 'formulas': leitura['formulas']}
+        else:
+            resposta = analisador.processar_planilha(nome_planilha)
+        resposta['perfil'] = analisador.perfil.etapas
+        return resposta
+    finally:
+        analisador.perfil.encerrar()
+        if analisador.workbook is not None:
+            analisador.workbook.close()
+
+
+class MemoriaArquivos:
+    """Leituras de arquivos recentes mantidas pelo modo worker (LRU por arquivo)
+    
+    Cada entrada é invalidada quando o arquivo muda (mtime ou tamanho).
+    """
+    
+    def __init__(self, max_arquivos: int = 4):
+        self.max_arquivos = max(1, max_arquivos)
+        self.arquivos = OrderedDict()
+    
+    def obter(self, caminho_arquivo: str) -> Dict[str, Any]:
+        """Devolve a memória do arquivo, criando uma nova se ele mudou ou não existe"""
+        estado = os.stat(caminho_arquivo)
+        assinatura = (estado.st_mtime_ns, estado.st_size)
+        chave = os.path.realpath(caminho_arquivo)
+        
+        entrada = self.arquivos.pop(chave, None)
+        if entrada is None or entrada['assinatura'] != assinatura:
+            entrada = {'assinatura': assinatura}
+        self.arquivos[chave] = entrada
+        
+        while len(self.arquivos) > self.max_arquivos:
+            self.arquivos.popitem(last=False)
+        return entrada
+    
+    def limpar(self):
+        self.arquivos.clear()
+
+
+def consultar_cubo(caminho_cubo: str, consulta: Dict[str, Any]) -> Dict[str, Any]:
+    """Agrega um cubo gravado (CuboAgregado.agregar) com as chaves da consulta em camelCase:
+    tamanhoFaixa, por, sexos, anos (ou anoInicial/anoFinal), situacoes, idadeMinima e idadeMaxima"""
+    cubo = CuboAgregado.carregar(caminho_cubo)
+    try:
+        # Marcar uso recente para a poda LRU
+        os.utime(caminho_cubo)
+    except OSError:
+        pass
+    anos = consulta.get('anos')
+    if anos is None and (consulta.get('anoInicial') is not None or consulta.get('anoFinal') is not None):
+        anos = range(int(consulta.get('anoInicial') or cubo.ano_inicial),
+                     int(consulta.get('anoFinal') or cubo.ano_inicial + cubo.forma[0] - 1) + 1)
+    inicio = time.perf_counter()
+    resultado = cubo.agregar(
+        tamanho_faixa=int(consulta.get('tamanhoFaixa') or 1),
+        por=consulta.get('por', ('faixa',)),
+        sexos=consulta.get('sexos'),
+        anos=anos,
+        situacoes=consulta.get('situacoes'),
+        idade_minima=consulta.get('idadeMinima'),
+        idade_maxima=consulta.get('idadeMaxima')
+    )
+    resultado['consulta']['tempo_ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+    resultado['cubo'] = cubo.metadados
+    return resultado
+
+
+def atender_requisicao(requisicao: Dict[str, Any], memoria: MemoriaArquivos,
+                       emitir_evento: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Executa uma requisição do modo worker e devolve a resposta"""
+    id_requisicao = requisicao.get('id')
+    comando = requisicao.get('comando', 'analisar')
+    
+    if comando == 'ping':
+        return {'id': id_requisicao, 'ok': True, 'arquivos_em_memoria': len(memoria.arquivos)}
+    
+    if comando == 'limpar':
+        memoria.limpar()
+        return {'id': id_requisicao, 'ok': True}
+    
+    if comando == 'agregar':
+        # Reagrupa um cubo gravado por uma análise anterior (dados_extraidos.cubo_agregado.arquivo)
+        try:
+            resultado = consultar_cubo(requisicao.get('caminhoCubo') or '', requisicao.get('consulta') or {})
+        except (OSError, KeyError, ValueError) as e:
+            return {'id': id_requisicao, 'ok': False, 'erro': f'Erro ao consultar o cubo: {str(e)}'}
+        return {'id': id_requisicao, 'ok': True, 'resultado': resultado}
+    
+    if comando != 'analisar':
+        return {'id': id_requisicao, 'ok': False, 'erro': f'Comando desconhecido: {comando}'}
+    
+    caminho_arquivo = requisicao.get('caminhoArquivo')
+    if not caminho_arquivo or not os.path.exists(caminho_arquivo):
+        return {'id': id_requisicao, 'ok': False, 'erro': f'Arquivo não encontrado: {caminho_arquivo}'}
+    
+    analisador = AnalisadorMortalidadeExcel(
+        caminho_arquivo,
+        requisicao.get('configuracao') or {},
+        memoria.obter(caminho_arquivo),
+        emitir_evento
+    )
+    return {'id': id_requisicao, 'ok': True, 'resultado': analisador.executar_analise()}
+
+
+ID_REQUISICAO_BRUTA = re.compile(r'"id"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+)')
+
+
+def id_requisicao_bruta(linha: str) -> Any:
+    """Id de uma requisição que não passou no parse, recuperado do texto (None se ausente)"""
+    encontrado = ID_REQUISICAO_BRUTA.search(linha)
+    if encontrado is None:
+        return None
+    try:
+        return json.loads(encontrado.group(1))
+    except ValueError:
+        return None
+
+
+def servir_fluxo(entrada, saida, memoria: MemoriaArquivos) -> bool:
+    """Atende requisições NDJSON (uma por linha); retorna False ao receber 'encerrar'
+    
+    Toda resposta, inclusive as de erro, repete o id da requisição (recuperado
+    do texto quando o JSON é inválido), para o cliente encerrar a pendência.
+    """
+    def emitir_evento(id_requisicao, evento):
+        # Progresso antes da resposta final, marcado com o id da requisição
+        saida.write(linha_ndjson({'id': id_requisicao, 'evento': evento}))
+        saida.flush()
+    
+    for linha in entrada:
+        linha = linha.strip()
+        if not linha:
+            continue
+        
+        continuar = True
+        try:
+            requisicao = json.loads(linha)
+        except json.JSONDecodeError as e:
+            requisicao = None
+            resposta = {'id': id_requisicao_bruta(linha), 'ok': False,
+                        'erro': f'Erro ao fazer parse da requisição JSON: {str(e)}'}
+        else:
+            if not isinstance(requisicao, dict):
+                requisicao = None
+                resposta = {'id': None, 'ok': False, 'erro': 'A requisição deve ser um objeto JSON'}
+        
+        if requisicao is not None:
+            id_requisicao = requisicao.get('id')
+            try:
+                if requisicao.get('comando') == 'encerrar':
+                    resposta = {'id': id_requisicao, 'ok': True}
+                    continuar = False
+                else:
+                    emissor = partial(emitir_evento, id_requisicao) if requisicao.get('eventos') else None
+                    resposta = atender_requisicao(requisicao, memoria, emissor)
+            except Exception as e:
+                resposta = {'id': id_requisicao, 'ok': False, 'erro': f'Erro inesperado: {str(e)}', 'tipo_erro': type(e).__name__}
+        
+        saida.write(linha_ndjson(resposta))
+        saida.flush()
+        
+        if not continuar:
+            return False
+    return True
+
+
+def executar_worker(caminho_socket: Optional[str] = None, max_arquivos: int = 4):
+    """Modo worker: processo de longa duração que atende análises via stdin/stdout ou socket Unix
+    
+    As bibliotecas são importadas uma única vez e as leituras dos arquivos mais
+    recentes ficam em memória, de modo que análises repetidas não reabrem o workbook.
+    """
+    memoria = MemoriaArquivos(max_arquivos)
+    
+    if not caminho_socket:
+        servir_fluxo(sys.stdin, sys.stdout, memoria)
+        return
+    
+    if os.path.exists(caminho_socket):
+        os.unlink(caminho_socket)
+    
+    estado = {'ativo': True}
+    
+    class ManipuladorConexao(socketserver.StreamRequestHandler):
+        def handle(self):
+            entrada = io.TextIOWrapper(self.rfile, encoding='utf-8')
+            saida = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+            if not servir_fluxo(entrada, saida, memoria):
+                estado['ativo'] = False
+    
+    # Conexões atendidas em sequência: a análise é limitada por CPU
+    with socketserver.UnixStreamServer(caminho_socket, ManipuladorConexao) as servidor:
+        try:
+            while estado['ativo']:
+                servidor.handle_request()
+        finally:
+            if os.path.exists(caminho_socket):
+                os.unlink(caminho_socket)
+
+
+def expandir_arquivos_lote(entradas: List[str]) -> List[str]:
+    """Caminhos e padrões glob do lote, em ordem e sem repetições"""
+    arquivos, vistos = [], set()
+    for entrada in entradas:
+        encontrados = sorted(glob.glob(entrada)) if glob.has_magic(entrada) else [entrada]
+        for caminho in encontrados:
+            if os.path.realpath(caminho) not in vistos:
+                vistos.add(os.path.realpath(caminho))
+                arquivos.append(caminho)
+    return arquivos
+
+
+def tabela_obitos_lote(analisador: AnalisadorMortalidadeExcel) -> Optional[pd.DataFrame]:
+    """Óbitos registro a registro de um arquivo já analisado
+    
+    Resultados vindos do cache ou do modo RAPIDO não guardam as colunas; nesses
+    casos só as planilhas de óbitos são relidas, com colunas exatas.
+    """
+    if analisador.tabelas.get('obitos') is not None:
+        return analisador.tabelas['obitos']
+    
+    leitor = AnalisadorMortalidadeExcel(analisador.caminho_arquivo, {
+        **analisador.configuracao, 'metodoAnalise': 'COMPLETO', 'extrairFormulas': False, 'invalidarCache': False
+    })
+    try:
+        melhor = (-1, None)
+        for nome_planilha in leitor.carregar_arquivo():
+            if leitor.classificar_planilha(nome_planilha) != 'obitos':
+                continue
+            carregador = leitor.ler_planilha(nome_planilha, 'obitos')['carregador']
+            if carregador is not None:
+                tabela = carregador.finalizar()
+                preenchimento = int(tabela.notna().to_numpy().sum())
+                if preenchimento > melhor[0]:
+                    melhor = (preenchimento, tabela)
+        return melhor[1]
+    finally:
+        if leitor.workbook is not None:
+            leitor.workbook.close()
+
+
+def analisar_arquivo_lote(caminho_arquivo: str, configuracao: Dict[str, Any]) -> Dict[str, Any]:
+    """Tarefa do modo lote: resultado do arquivo e seus óbitos para a consolidação"""
+    try:
+        analisador = AnalisadorMortalidadeExcel(caminho_arquivo, configuracao)
+        resultado = analisador.executar_analise()
+        tabela = tabela_obitos_lote(analisador)
+        if tabela is not None:
+            tabela = tabela[[papel for papel in ('matricula', 'data_obito', 'idade_obito', 'sexo') if papel in tabela]]
+        return {'arquivo': caminho_arquivo, 'resultado': resultado, 'obitos': tabela}
+    except Exception as e:
+        return {'arquivo': caminho_arquivo, 'erro': str(e), 'tipo_erro': type(e).__name__}
+
+
+def consolidar_exposicao_lote(analises: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Soma exposição, óbitos observados e esperados dos arquivos, se os períodos não se sobrepõem"""
+    periodos = {}
+    totais = Counter()
+    for analise in analises:
+        exposicao = analise['resultado'].get('dados_extraidos', {}).get('exposicao_ae') or {}
+        if 'totais' not in exposicao:
+            continue
+        periodos[analise['arquivo']] = exposicao['periodo']
+        totais.update({chave: exposicao['totais'][chave] for chave in
+                       ('exposicao_central', 'exposicao_inicial', 'obitos_observados', 'obitos_esperados')})
+    
+    if not periodos:
+        return None
+    
+    intervalos = sorted((periodo['ano_inicial'], periodo['ano_final']) for periodo in periodos.values())
+    if any(inicio <= fim_anterior for (_, fim_anterior), (inicio, _) in zip(intervalos, intervalos[1:])):
+        return {'erro': 'Períodos de exposição sobrepostos entre os arquivos; a soma contaria anos em dobro',
+                'periodos': periodos}
+    
+    return {
+        'periodo': {'ano_inicial': intervalos[0][0], 'ano_final': intervalos[-1][1]},
+        'periodos': periodos,
+        'totais': {
+            **{chave: round(float(valor), 4) for chave, valor in totais.items()},
+            'razao_ae': round(totais['obitos_observados'] / totais['obitos_esperados'], 4)
+            if totais['obitos_esperados'] > 0 else None
+        }
+    }
+
+
+def consolidar_lote(analises: List[Dict[str, Any]], configuracao: Dict[str, Any]) -> Dict[str, Any]:
+    """Resultado do período inteiro: óbitos sem duplicatas entre arquivos e tendência conjunta
+    
+    Uma matrícula com óbito em mais de um arquivo conta uma vez só, com o
+    registro do último arquivo do lote (entregas posteriores corrigem as anteriores).
+    """
+    consolidado = {'arquivos_analisados': len(analises)}
+    
+    exposicao = consolidar_exposicao_lote(analises)
+    if exposicao is not None:
+        consolidado['exposicao_ae'] = exposicao
+    
+    tabelas = [analise['obitos'].assign(arquivo=indice) for indice, analise in enumerate(analises)
+               if analise.get('obitos') is not None and len(analise['obitos'])]
+    if not tabelas:
+        consolidado['obitos'] = {'erro': 'Nenhuma planilha de óbitos nos arquivos do lote'}
+        return consolidado
+    
+    obitos = pd.concat(tabelas, ignore_index=True)
+    duplicados = pd.Series(False, index=obitos.index)
+    if 'matricula' in obitos:
+        duplicados = obitos['matricula'].notna() & obitos.duplicated('matricula', keep='last')
+    unicos = obitos[~duplicados]
+    
+    # Os métodos de distribuição e tendência são os da análise de um arquivo
+    analisador = AnalisadorMortalidadeExcel(analises[0]['arquivo'], configuracao)
+    resumo = {
+        'total_registros': len(obitos),
+        'obitos_duplicados': int(duplicados.sum()),
+        'total_obitos': len(unicos),
+        'por_arquivo': {
+            analises[indice]['arquivo']: int(total)
+            for indice, total in unicos['arquivo'].value_counts().sort_index().items()
+        },
+        'distribuicao_por_idade': {},
+        'distribuicao_por_sexo': {},
+        'distribuicao_temporal': {}
+    }
+    if 'idade_obito' in unicos:
+        resumo['distribuicao_por_idade'] = analisador.analisar_distribuicao_idade(unicos['idade_obito'])
+    if 'sexo' in unicos:
+        resumo['distribuicao_por_sexo'] = analisador.analisar_distribuicao_sexo(unicos['sexo'])
+    if 'data_obito' in unicos:
+        # Tendência sobre o período combinado, não arquivo a arquivo
+        resumo['distribuicao_temporal'] = analisador.analisar_distribuicao_temporal(unicos['data_obito'])
+    consolidado['obitos'] = resumo
+    return consolidado
+
+
+def executar_lote(entradas: List[str], configuracao: Dict[str, Any], processos: int = 0,
+                  emitir_evento: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Modo lote: analisa os arquivos de um estudo em um só processo principal
+    
+    Os arquivos são distribuídos entre processos de longa duração (bibliotecas
+    importadas uma vez por processo, caches e sidecars compartilhados em disco)
+    e o resultado traz cada arquivo e a consolidação do período inteiro.
+    """
+    def emitir(evento: str, **dados):
+        if emitir_evento is not None:
+            emitir_evento({'evento': evento, 'instante': datetime.now().isoformat(), **dados})
+    
+    inicio = time.perf_counter()
+    arquivos = expandir_arquivos_lote(entradas)
+    processos = max(1, min(processos or os.cpu_count() or 1, os.cpu_count() or 1, len(arquivos) or 1))
+    # Com vários arquivos ao mesmo tempo, cada um roda sem o próprio pool de processos
+    configuracao_arquivo = ({**configuracao, 'processosParalelos': 0, 'processosSimulacao': 1} if processos > 1
+                            else configuracao)
+    emitir('lote_iniciado', arquivos=arquivos, processos=processos)
+    
+    respostas = {}
+    
+    def concluir(resposta: Dict[str, Any]):
+        respostas[resposta['arquivo']] = resposta
+        emitir('arquivo_concluido', arquivo=resposta['arquivo'], concluidos=len(respostas), total_arquivos=len(arquivos),
+               resultado=resposta.get('resultado'), erro=resposta.get('erro'))
+    
+    ausentes = [caminho for caminho in arquivos if not os.path.exists(caminho)]
+    for caminho in ausentes:
+        concluir({'arquivo': caminho, 'erro': f'Arquivo não encontrado: {caminho}'})
+    presentes = [caminho for caminho in arquivos if caminho not in ausentes]
+    
+    if processos > 1 and len(presentes) > 1:
+        with ProcessPoolExecutor(max_workers=processos) as executor:
+            futuros = [executor.submit(analisar_arquivo_lote, caminho, configuracao_arquivo) for caminho in presentes]
+            for futuro in as_completed(futuros):
+                concluir(futuro.result())
+    else:
+        for caminho in presentes:
+            concluir(analisar_arquivo_lote(caminho, configuracao_arquivo))
+    
+    analises = [respostas[caminho] for caminho in arquivos if 'resultado' in respostas[caminho]]
+    return {
+        'metadados': {
+            'modo': 'lote',
+            'processado_em': datetime.now().isoformat(),
+            'versao_analisador': VERSAO_ANALISADOR,
+            'configuracao_utilizada': configuracao,
+            'total_arquivos': len(arquivos),
+            'processos': processos,
+            'tempo_total': round(time.perf_counter() - inicio, 6)
+        },
+        'arquivos': [
+            {'arquivo': caminho, 'resultado': respostas[caminho]['resultado']} if 'resultado' in respostas[caminho]
+            else {'arquivo': caminho, 'erro': respostas[caminho]['erro']}
+            for caminho in arquivos
+        ],
+        'consolidado': consolidar_lote(analises, configuracao) if analises else {'erro': 'Nenhum arquivo analisado'}
+    }
+
+
+def ler_tabua_arquivo(caminho: str, planilha: Optional[str] = None, divisor: float = 1.0) -> tuple:
+    """Valores [sexo, idade] de uma tábua em CSV ou planilha (primeira linha com os nomes das colunas)
+    
+    As colunas são identificadas como na planilha qx (identificar_colunas_qx);
+    retorna (valores, idade_inicial, colunas identificadas).
+    """
+    if caminho.lower().endswith(('.csv', '.txt')):
+        tabela = pd.read_csv(caminho, sep=None, engine='python')
+    else:
+        tabela = pd.read_excel(caminho, sheet_name=planilha or 0, engine='openpyxl')
+    tabela.columns = [str(coluna) for coluna in tabela.columns]
+    colunas = AnalisadorMortalidadeExcel.identificar_colunas_qx(list(tabela.columns))
+    if colunas['idade'] is None or not any(colunas[papel] for papel in ('qx_masculino', 'qx_feminino', 'qx_geral')):
+        raise ValueError(f'Colunas de idade e qx não identificadas: {list(tabela.columns)}')
+    
+    idades = pd.to_numeric(tabela[colunas['idade']], errors='coerce').to_numpy(dtype=np.float64)
+    validas = np.isfinite(idades) & (idades >= 0) & (idades == np.floor(idades))
+    idades = idades[validas].astype(np.int64)
+    if not len(idades):
+        raise ValueError('Nenhuma idade válida na tábua')
+    idade_inicial = int(idades.min())
+    valores = np.full((len(CATEGORIAS_SEXO), idades.max() - idade_inicial + 1), np.nan)
+    for linha, papel in enumerate(('qx_masculino', 'qx_feminino', 'qx_geral')):
+        if colunas[papel] is not None:
+            qx = pd.to_numeric(tabela[colunas[papel]], errors='coerce').to_numpy(dtype=np.float64)[validas]
+            valores[linha, idades - idade_inicial] = qx / divisor
+    return valores, idade_inicial, colunas
+
+
+def executar_comando_tabuas(argumentos: List[str]):
+    """--tabuas <comando>: listar, importar, consultar e remover tábuas do registro (JSON na saída)"""
+    parser = argparse.ArgumentParser(prog='analisar-mortalidade-python.py --tabuas')
+    parser.add_argument('--diretorio', help='Diretório do registro (padrão: ANALISE_MORTALIDADE_TABUAS ou dados do usuário)')
+    comandos = parser.add_subparsers(dest='comando', required=True)
+    
+    comandos.add_parser('listar', help='Tábuas e escalas registradas e as do catálogo ainda não importadas')
+    
+    importar = comandos.add_parser('importar', help='Registra uma tábua (ou escala de melhoria) de um CSV ou planilha')
+    importar.add_argument('arquivo')
+    importar.add_argument('--nome', required=True, help=f'Nome da tábua, por exemplo {", ".join(CATALOGO_TABUAS)}')
+    importar.add_argument('--planilha', help='Planilha do arquivo (padrão: a primeira)')
+    importar.add_argument('--divisor', type=float, default=1.0, help='Divide os valores (1000 para qx por mil)')
+    importar.add_argument('--descricao')
+    importar.add_argument('--fonte')
+    importar.add_argument('--ano-base', type=int, help='Ano a que a tábua se refere, base da melhoria')
+    importar.add_argument('--escala-padrao', help='Escala de melhoria aplicada por padrão a esta tábua')
+    importar.add_argument('--escala', action='store_true', help='O arquivo é uma escala de melhoria anual, não uma tábua')
+    
+    consultar = comandos.add_parser('consultar', help='qx de uma tábua por idade e sexo')
+    consultar.add_argument('nome')
+    consultar.add_argument('--idades', required=True, help='Idades separadas por vírgula ou intervalo inicio-fim')
+    consultar.add_argument('--sexo', default='MASCULINO', help='M, F ou OUTROS')
+    consultar.add_argument('--ano', type=int, help='Ano-calendário, para aplicar a escala de melhoria')
+    consultar.add_argument('--escala', help='Escala de melhoria (padrão: a da tábua)')
+    
+    remover = comandos.add_parser('remover', help='Remove uma tábua ou escala')
+    remover.add_argument('nome')
+    
+    argumentos = parser.parse_args(argumentos)
+    registro = RegistroTabuas(argumentos.diretorio or diretorio_tabuas_padrao({}))
+    
+    def imprimir(objeto):
+        print(json.dumps(valores_json_seguros(objeto), ensure_ascii=False, indent=2, default=str))
+    
+    try:
+        if argumentos.comando == 'listar':
+            imprimir(registro.listar())
+        
+        elif argumentos.comando == 'importar':
+            valores, idade_inicial, colunas = ler_tabua_arquivo(argumentos.arquivo, argumentos.planilha, argumentos.divisor)
+            if argumentos.escala:
+                entrada = registro.registrar_escala(argumentos.nome, valores, idade_inicial, argumentos.descricao,
+                                                    argumentos.fonte or os.path.basename(argumentos.arquivo))
+            else:
+                entrada = registro.registrar(argumentos.nome, valores, idade_inicial, argumentos.descricao,
+                                             argumentos.fonte or os.path.basename(argumentos.arquivo),
+                                             argumentos.ano_base, argumentos.escala_padrao, 'importacao')
+            imprimir({'nome': argumentos.nome, 'colunas_identificadas': colunas, **entrada})
+        
+        elif argumentos.comando == 'consultar':
+            if '-' in argumentos.idades:
+                inicio, fim = argumentos.idades.split('-', 1)
+                idades = np.arange(int(inicio), int(fim) + 1)
+            else:
+                idades = np.array([int(idade) for idade in argumentos.idades.split(',')])
+            sexo = MAPA_SEXO.get(argumentos.sexo.strip().upper(), argumentos.sexo.strip().upper())
+            if sexo not in CATEGORIAS_SEXO:
+                raise ValueError(f'Sexo inválido: {argumentos.sexo}')
+            qx = registro.consultar(argumentos.nome, idades, CATEGORIAS_SEXO.index(sexo), argumentos.ano, argumentos.escala)
+            imprimir({'tabua': argumentos.nome, 'sexo': sexo, 'ano': argumentos.ano,
+                      'qx': {str(idade): None if not np.isfinite(valor) else float(valor) for idade, valor in zip(idades, qx)}})
+        
+        else:
+            if not registro.remover(argumentos.nome):
+                imprimir({'erro': f'Tábua ou escala não registrada: {argumentos.nome}'})
+                sys.exit(1)
+            imprimir({'removida': argumentos.nome})
+    
+    except (OSError, KeyError, ValueError) as e:
+        imprimir({'erro': str(e.args[0] if isinstance(e, KeyError) else e)})
+        sys.exit(1)
+
+
 def main():
     """Função principal do script"""
-    if len(sys.argv) != 3:
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        parser = argparse.ArgumentParser(prog='analisar-mortalidade-python.py --worker')
+        parser.add_argument('--socket', help='Caminho do socket Unix (padrão: stdin/stdout)')
+        parser.add_argument('--max-arquivos', type=int, default=4, help='Arquivos mantidos em memória')
+        argumentos = parser.parse_args(sys.argv[2:])
+        executar_worker(argumentos.socket, argumentos.max_arquivos)
+        return
+    
+    if len(sys.argv) > 1 and sys.argv[1] == '--lote':
+        parser = argparse.ArgumentParser(prog='analisar-mortalidade-python.py --lote')
+        parser.add_argument('arquivos', nargs='+', help='Arquivos ou padrões glob do período analisado')
+        parser.add_argument('--configuracao', default='{}', help='Configuração JSON aplicada a todos os arquivos')
+        parser.add_argument('--processos', type=int, default=0, help='Arquivos analisados ao mesmo tempo (padrão: núcleos)')
+        parser.add_argument('--ndjson', action='store_true', help='Eventos por arquivo, terminando em resultado_final')
+        argumentos = parser.parse_args(sys.argv[2:])
+        try:
+            configuracao = json.loads(argumentos.configuracao)
+        except json.JSONDecodeError as e:
+            print(json.dumps({'erro': f'Erro ao fazer parse da configuração JSON: {str(e)}'}))
+            sys.exit(1)
+        
+        if argumentos.ndjson:
+            resultado = executar_lote(argumentos.arquivos, configuracao, argumentos.processos, emitir_ndjson)
+            emitir_ndjson({'evento': 'resultado_final', 'instante': datetime.now().isoformat(), 'resultado': resultado})
+            return
+        
+        resultado = executar_lote(argumentos.arquivos, configuracao, argumentos.processos)
+        print(json.dumps(valores_json_seguros(resultado), ensure_ascii=False, indent=2, default=str))
+        return
+    
+    if len(sys.argv) > 1 and sys.argv[1] == '--tabuas':
+        executar_comando_tabuas(sys.argv[2:])
+        return
+    
+    if len(sys.argv) > 1 and sys.argv[1] == '--cubo':
+        parser = argparse.ArgumentParser(prog='analisar-mortalidade-python.py --cubo')
+        parser.add_argument('cubo', help='Arquivo .npz do cubo (dados_extraidos.cubo_agregado.arquivo)')
+        parser.add_argument('--tamanho-faixa', type=int, default=1, help='Anos por faixa etária, a partir da idade 0')
+        parser.add_argument('--por', default='faixa', help=f'Eixos mantidos, separados por vírgula: {",".join(CuboAgregado.EIXOS)}')
+        parser.add_argument('--sexos', help='Sexos separados por vírgula (M, F, OUTROS)')
+        parser.add_argument('--anos', help='Anos separados por vírgula ou intervalo inicio-fim')
+        parser.add_argument('--situacoes', help=f'Situações separadas por vírgula: {",".join(SITUACOES_CUBO)}')
+        parser.add_argument('--idade-minima', type=int)
+        parser.add_argument('--idade-maxima', type=int)
+        argumentos = parser.parse_args(sys.argv[2:])
+        
+        def lista(texto):
+            return [item.strip() for item in texto.split(',') if item.strip()] if texto else None
+        
+        consulta = {'tamanhoFaixa': argumentos.tamanho_faixa, 'por': lista(argumentos.por) or [],
+                    'sexos': lista(argumentos.sexos), 'situacoes': lista(argumentos.situacoes),
+                    'idadeMinima': argumentos.idade_minima, 'idadeMaxima': argumentos.idade_maxima}
+        if argumentos.anos and '-' in argumentos.anos:
+            consulta['anoInicial'], consulta['anoFinal'] = (int(ano) for ano in argumentos.anos.split('-', 1))
+        elif argumentos.anos:
+            consulta['anos'] = [int(ano) for ano in lista(argumentos.anos)]
+        try:
+            resultado = consultar_cubo(argumentos.cubo, consulta)
+        except (OSError, KeyError, ValueError) as e:
+            print(json.dumps({'erro': f'Erro ao consultar o cubo: {str(e)}'}, ensure_ascii=False))
+            sys.exit(1)
+        print(json.dumps(valores_json_seguros(resultado), ensure_ascii=False, indent=2, default=str))
+        return
+    
+    # --ndjson: eventos de progresso, um objeto JSON por linha, terminando em 'resultado_final'
+    argumentos = [argumento for argumento in sys.argv[1:] if argumento != '--ndjson']
+    ndjson = len(argumentos) != len(sys.argv) - 1
+    
+    if len(argumentos) != 2:
         print(json.dumps({
-            'erro': 'Uso: python script.py <caminho_arquivo> <configuracao_json>',
+            'erro': 'Uso: python script.py <caminho_arquivo> <configuracao_json> [--ndjson] | --worker [--socket caminho]'
+                    ' | --lote <arquivos...> [--configuracao json] [--processos n] [--ndjson]'
+                    ' | --tabuas [--diretorio dir] {listar,importar,consultar,remover} ...'
+                    ' | --cubo <cubo.npz> [--tamanho-faixa n] [--por eixos] [--sexos ...] [--anos ...] [--situacoes ...]',
             'argumentos_recebidos': sys.argv
         }))
         sys.exit(1)
     
     try:
-        caminho_arquivo = sys.argv[1]
-        configuracao_json = sys.argv[2]
+        caminho_arquivo, configuracao_json = argumentos
         
         # Parse da configuração
         configuracao = json.loads(configuracao_json)
@@ -617,12 +6681,17 @@ def main():
             }))
             sys.exit(1)
         
+        if ndjson:
+            analisador = AnalisadorMortalidadeExcel(caminho_arquivo, configuracao, emitir_evento=emitir_ndjson)
+            analisador.emitir('resultado_final', resultado=analisador.executar_analise())
+            return
+        
         # Executar análise
         analisador = AnalisadorMortalidadeExcel(caminho_arquivo, configuracao)
         resultado = analisador.executar_analise()
         
         # Retornar resultado como JSON
-        print(json.dumps(resultado, ensure_ascii=False, indent=2))
+        print(json.dumps(valores_json_seguros(resultado), ensure_ascii=False, indent=2, default=str))
         
     except json.JSONDecodeError as e:
         print(json.dumps({
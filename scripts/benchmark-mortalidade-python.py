@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark do analisar-mortalidade-python.py sobre planilhas sintéticas
+Gera workbooks de mortalidade (massa, óbitos, tábua qx com fórmulas e resumo)
+e mede tempo e pico de memória de cada etapa da análise
+"""
+
+import sys
+import os
+import gc
+import json
+import time
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+import importlib.util
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from openpyxl import Workbook
+
+# Versão do gerador; entra no nome dos workbooks guardados (mudou o gerador, muda o arquivo)
+VERSAO_GERADOR = 1
+
+# Tamanhos padrão da massa (o gerador aceita de 10 mil a 1 milhão de linhas)
+LINHAS_PADRAO = [10_000, 100_000]
+
+# Data-base do cadastro e período dos óbitos sintéticos
+DATA_BASE = date(2024, 12, 31)
+ANOS_OBITOS = (2019, 2024)
+
+# Análise sem caches: cada repetição relê e reprocessa o arquivo
+CONFIGURACAO_BENCHMARK = {
+    'usarCache': False,
+    'usarSidecar': False,
+    'usarRegistroLayouts': False,
+    'extrairFormulas': True
+}
+
+# Etapas abaixo deste tempo (segundos) nas duas execuções não entram na comparação
+MINIMO_COMPARACAO = 0.01
+
+
+def carregar_analisador():
+    """Importa o analisar-mortalidade-python.py (nome com hífens) da mesma pasta"""
+    caminho = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analisar-mortalidade-python.py')
+    spec = importlib.util.spec_from_file_location('analisar_mortalidade_python', caminho)
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def qx_gompertz_makeham(idades: np.ndarray, feminino: bool = False) -> np.ndarray:
+    """qx sintético de Gompertz-Makeham (as mulheres com a mortalidade de 4 anos mais novas)"""
+    idades = idades - 4 if feminino else idades
+    return np.minimum(0.0005 + 0.00003 * np.exp(0.095 * idades), 1.0)
+
+
+def gerar_workbook(caminho: str, linhas: int, semente: int = 0):
+    """Grava um workbook sintético no layout reconhecido pelo analisador
+
+    - MASSA PARTICIPANTES: matrícula, nome, sexo (códigos variados), idade,
+      nascimento, admissão, salário e uma coluna de fórmula por linha;
+    - OBITOS: óbitos sorteados pela tábua sintética no período ANOS_OBITOS,
+      com uma pequena parte sem participante correspondente na massa;
+    - TABUA QX: qx masculino e feminino e o qx geral como fórmula;
+    - RESUMO: planilha auxiliar só com fórmulas sobre as outras.
+    """
+    gerador = np.random.default_rng(semente)
+
+    idades = np.clip(np.rint(gerador.normal(62, 13, linhas)), 18, 105).astype(np.int64)
+    sexos = gerador.choice(['M', 'F', '1', '2', 'MASC', 'FEM'], size=linhas, p=[0.40, 0.35, 0.10, 0.10, 0.03, 0.02])
+    nascimento = (np.datetime64(DATA_BASE) - (idades * 365.25).astype('timedelta64[D]')
+                  - gerador.integers(0, 365, linhas).astype('timedelta64[D]'))
+    admissao = nascimento + (gerador.uniform(18, 40, linhas) * 365.25).astype('timedelta64[D]')
+    admissao = np.minimum(admissao, np.datetime64(DATA_BASE))
+    salarios = np.round(gerador.lognormal(8.3, 0.6, linhas), 2)
+    salario_ausente = gerador.random(linhas) < 0.01
+    sexo_ausente = gerador.random(linhas) < 0.005
+    matriculas = np.arange(100_001, 100_001 + linhas)
+
+    # Óbitos: cada participante morre no período com a probabilidade acumulada dos anos
+    anos = ANOS_OBITOS[1] - ANOS_OBITOS[0] + 1
+    feminino = np.isin(sexos, ['F', '2', 'FEM'])
+    qx = np.where(feminino, qx_gompertz_makeham(idades, True), qx_gompertz_makeham(idades))
+    mortos = np.flatnonzero(gerador.random(linhas) < 1 - (1 - qx) ** anos)
+    data_obito = (np.datetime64(f'{ANOS_OBITOS[0]}-01-01')
+                  + gerador.integers(0, anos * 365, len(mortos)).astype('timedelta64[D]'))
+    sem_vinculo = gerador.random(len(mortos)) < 0.02
+
+    workbook = Workbook(write_only=True)
+
+    massa = workbook.create_sheet('MASSA PARTICIPANTES')
+    massa.append(['MATRICULA', 'NOME', 'SEXO', 'IDADE', 'DATA NASCIMENTO', 'DATA ADMISSAO', 'SALARIO', 'TEMPO DE CASA'])
+    for indice, (matricula, sexo, idade, nasc, adm, salario) in enumerate(zip(
+            matriculas.tolist(), sexos.tolist(), idades.tolist(), nascimento.astype(object).tolist(),
+            admissao.astype(object).tolist(), salarios.tolist())):
+        linha = indice + 2
+        massa.append([
+            matricula, f'PARTICIPANTE {matricula}', None if sexo_ausente[indice] else sexo, idade, nasc, adm,
+            None if salario_ausente[indice] else salario, f'=INT((DATE(2024,12,31)-F{linha})/365.25)'
+        ])
+
+    obitos = workbook.create_sheet('OBITOS')
+    obitos.append(['MATRICULA', 'SEXO', 'DATA NASCIMENTO', 'DATA OBITO', 'IDADE OBITO', 'CAUSA'])
+    for posicao, (participante, obito) in enumerate(zip(mortos.tolist(), data_obito.astype(object).tolist())):
+        nasc = nascimento[participante].astype(object)
+        obitos.append([
+            900_000 + posicao if sem_vinculo[posicao] else int(matriculas[participante]),
+            str(sexos[participante]), nasc, obito,
+            obito.year - nasc.year - ((obito.month, obito.day) < (nasc.month, nasc.day)),
+            'NATURAL'
+        ])
+
+    tabua = workbook.create_sheet('TABUA QX')
+    tabua.append(['IDADE', 'QX MASCULINO', 'QX FEMININO', 'QX GERAL'])
+    idades_tabua = np.arange(121)
+    for idade, masculino, feminino in zip(idades_tabua.tolist(), qx_gompertz_makeham(idades_tabua).tolist(),
+                                          qx_gompertz_makeham(idades_tabua, True).tolist()):
+        tabua.append([idade, masculino, feminino, f'=(B{idade + 2}+C{idade + 2})/2'])
+
+    resumo = workbook.create_sheet('RESUMO')
+    resumo.append(['INDICADOR', 'VALOR'])
+    resumo.append(['Participantes', "=COUNTA('MASSA PARTICIPANTES'!A:A)-1"])
+    resumo.append(['Idade média', "=AVERAGE('MASSA PARTICIPANTES'!D:D)"])
+    resumo.append(['Óbitos', '=COUNTA(OBITOS!A:A)-1'])
+    resumo.append(['Faixa', 'Participantes', 'Óbitos'])
+    for inicio in range(20, 110, 10):
+        linha = f'"<{inicio + 10}"'
+        resumo.append([
+            f'{inicio}-{inicio + 9}',
+            f"=COUNTIFS('MASSA PARTICIPANTES'!D:D,\">={inicio}\",'MASSA PARTICIPANTES'!D:D,{linha})",
+            f'=COUNTIFS(OBITOS!E:E,">={inicio}",OBITOS!E:E,{linha})'
+        ])
+
+    temporario = f'{caminho}.{os.getpid()}.tmp'
+    workbook.save(temporario)
+    os.replace(temporario, caminho)
+    return {'linhas_massa': linhas, 'obitos': int(len(mortos)), 'obitos_sem_vinculo': int(sem_vinculo.sum())}
+
+
+def obter_workbook(diretorio: str, linhas: int, semente: int) -> Dict[str, Any]:
+    """Caminho do workbook sintético; gerado só quando ainda não existe no diretório"""
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = os.path.join(diretorio, f'mortalidade-{linhas}-s{semente}-v{VERSAO_GERADOR}.xlsx')
+    geracao = {'caminho': caminho, 'gerado_agora': False, 'tempo_geracao': None}
+    if not os.path.exists(caminho):
+        inicio = time.perf_counter()
+        geracao.update(gerar_workbook(caminho, linhas, semente))
+        geracao.update(gerado_agora=True, tempo_geracao=round(time.perf_counter() - inicio, 3))
+    geracao['tamanho_arquivo'] = os.path.getsize(caminho)
+    return geracao
+
+
+def medidor(memoria: bool) -> Callable:
+    """Função que executa uma etapa e devolve (resultado, medição)
+
+    Com memoria=True o pico vem do tracemalloc (alocações Python e NumPy da
+    etapa); o rastreamento deixa a execução mais lenta, por isso os tempos
+    saem das repetições sem ele.
+    """
+    def medir(funcao: Callable[[], Any]):
+        gc.collect()
+        if memoria:
+            tracemalloc.start()
+        inicio, inicio_cpu = time.perf_counter(), time.process_time()
+        try:
+            resultado = funcao()
+            medicao = {'tempo': time.perf_counter() - inicio, 'tempo_cpu': time.process_time() - inicio_cpu}
+            if memoria:
+                medicao['pico_memoria'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            if memoria:
+                tracemalloc.stop()
+        return resultado, medicao
+    return medir
+
+
+def executar_etapas(modulo, caminho: str, configuracao: Dict[str, Any], medir: Callable) -> List[Dict[str, Any]]:
+    """Uma passada por todas as etapas: carregamento, conversão e análise por
+    planilha, extração de fórmulas, exposição/aderência, a análise completa e a
+    serialização do resultado"""
+    etapas = []
+
+    def registrar(etapa: str, funcao: Callable[[], Any], planilha: Optional[str] = None, tipo: Optional[str] = None):
+        resultado, medicao = medir(funcao)
+        etapas.append({'etapa': etapa, 'planilha': planilha, 'tipo': tipo, **medicao})
+        return resultado
+
+    analisador = modulo.AnalisadorMortalidadeExcel(caminho, {**configuracao, 'extrairFormulas': False})
+    analisadores = {
+        'massa': analisador.analisar_planilha_massa,
+        'obitos': analisador.analisar_planilha_obitos,
+        'qx': analisador.analisar_planilha_qx
+    }
+    tabelas = {}
+
+    planilhas = registrar('carregamento', analisador.carregar_arquivo)
+    for nome_planilha in planilhas:
+        tipo = analisador.classificar_planilha(nome_planilha)
+        leitura = registrar('conversao', lambda: analisador.ler_planilha(nome_planilha, tipo), nome_planilha, tipo)
+        etapas[-1].update(linhas=leitura['linhas'], colunas=leitura['colunas'])
+
+        carregador = leitura['carregador']
+        if tipo is not None:
+            registrar(f'analise_{tipo}', lambda: analisadores[tipo](carregador), nome_planilha, tipo)
+            if carregador is not None and not isinstance(carregador, modulo.CarregadorAproximado):
+                tabelas[tipo] = carregador.finalizar()
+                etapas[-1]['registros'] = carregador.total_registros
+
+        extraidas = registrar('extracao_formulas', lambda: analisador.extrair_formulas(nome_planilha), nome_planilha, tipo)
+        etapas[-1]['formulas'] = len(extraidas[0]) if extraidas is not None else None
+
+    registrar('exposicao_ae', lambda: analisador.calcular_exposicao_ae(tabelas))
+    registrar('aderencia', analisador.testar_aderencia)
+    if analisador.workbook is not None:
+        analisador.workbook.close()
+
+    resultado = registrar('executar_analise', modulo.AnalisadorMortalidadeExcel(caminho, configuracao).executar_analise)
+    erros = resultado['validacao']['erros_encontrados']
+    if erros:
+        raise RuntimeError(f'Análise com erro: {erros}')
+
+    texto = registrar('serializacao_json', lambda: json.dumps(modulo.valores_json_seguros(resultado),
+                                                               ensure_ascii=False, indent=2, default=str))
+    etapas[-1]['bytes'] = len(texto.encode('utf-8'))
+    return etapas
+
+
+def medir_cenario(modulo, caminho: str, configuracao: Dict[str, Any], repeticoes: int, memoria: bool) -> List[Dict[str, Any]]:
+    """Repete as etapas e resume cada uma: tempos (mediana, mínimo), CPU e pico de memória"""
+    execucoes = [executar_etapas(modulo, caminho, configuracao, medidor(False)) for _ in range(repeticoes)]
+    picos = executar_etapas(modulo, caminho, configuracao, medidor(True)) if memoria else None
+
+    etapas = []
+    for posicao, base in enumerate(execucoes[0]):
+        tempos = [execucao[posicao]['tempo'] for execucao in execucoes]
+        etapa = {chave: valor for chave, valor in base.items() if chave not in ('tempo', 'tempo_cpu')}
+        etapa.update(
+            tempo_mediano=round(statistics.median(tempos), 6),
+            tempo_minimo=round(min(tempos), 6),
+            tempos=[round(tempo, 6) for tempo in tempos],
+            tempo_cpu_mediano=round(statistics.median(execucao[posicao]['tempo_cpu'] for execucao in execucoes), 6),
+            pico_memoria=picos[posicao]['pico_memoria'] if picos else None
+        )
+        etapas.append(etapa)
+    return etapas
+
+
+def chave_etapa(cenario: Dict[str, Any], etapa: Dict[str, Any]) -> tuple:
+    return (cenario['linhas_massa'], etapa['etapa'], etapa['planilha'])
+
+
+def comparar(anterior: Dict[str, Any], atual: Dict[str, Any], limite: float) -> int:
+    """Imprime a razão atual/anterior dos tempos medianos; devolve o número de regressões"""
+    tempos_anteriores = {
+        chave_etapa(cenario, etapa): etapa['tempo_mediano']
+        for cenario in anterior.get('cenarios', []) for etapa in cenario['etapas']
+    }
+    regressoes = 0
+    print(f"\n📊 Comparação com {anterior.get('commit') or '?'} ({anterior.get('gerado_em')})")
+    for cenario in atual['cenarios']:
+        for etapa in cenario['etapas']:
+            chave = chave_etapa(cenario, etapa)
+            if chave not in tempos_anteriores:
+                continue
+            antes, agora = tempos_anteriores[chave], etapa['tempo_mediano']
+            if max(antes, agora) < MINIMO_COMPARACAO:
+                continue
+            razao = agora / antes if antes > 0 else float('inf')
+            marca = '⚠️ ' if razao > limite else '   '
+            regressoes += razao > limite
+            print(f"{marca}{chave[0]:>9} {chave[1]:<20} {chave[2] or '':<22} {antes:9.3f}s → {agora:9.3f}s  ×{razao:.2f}")
+    return regressoes
+
+
+def commit_atual(diretorio: str) -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=diretorio, capture_output=True,
+                              text=True, check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='Benchmark do analisador de mortalidade sobre workbooks sintéticos')
+    parser.add_argument('--linhas', type=int, nargs='+', default=LINHAS_PADRAO,
+                        help='Linhas da massa de cada cenário (ex.: 10000 100000 1000000)')
+    parser.add_argument('--repeticoes', type=int, default=3, help='Execuções cronometradas por cenário')
+    parser.add_argument('--semente', type=int, default=20241231, help='Semente do gerador sintético')
+    parser.add_argument('--metodo', choices=['COMPLETO', 'RAPIDO', 'DETALHADO'], default='COMPLETO',
+                        help='configuracao.metodoAnalise usado nas análises')
+    parser.add_argument('--sem-memoria', action='store_true', help='Não faz a passada com tracemalloc')
+    parser.add_argument('--diretorio-planilhas', default=os.path.join(tempfile.gettempdir(), 'benchmark-mortalidade'),
+                        help='Onde os workbooks sintéticos são gerados e reaproveitados')
+    parser.add_argument('--saida', help='Arquivo JSON do resultado (padrão: XLOGS/benchmark-mortalidade-<data>.json)')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior para comparar os tempos')
+    parser.add_argument('--limite-regressao', type=float, default=1.25,
+                        help='Razão de tempo acima da qual a etapa conta como regressão')
+    argumentos = parser.parse_args()
+
+    modulo = carregar_analisador()
+    configuracao = {**CONFIGURACAO_BENCHMARK, 'metodoAnalise': argumentos.metodo}
+    agora = datetime.now(timezone.utc)
+    resultado = {
+        'gerado_em': agora.isoformat(),
+        'commit': commit_atual(raiz),
+        'versao_analisador': modulo.VERSAO_ANALISADOR,
+        'versao_gerador': VERSAO_GERADOR,
+        'ambiente': {
+            'python': sys.version,
+            'plataforma': platform.platform(),
+            'processador': platform.processor() or platform.machine(),
+            'nucleos': os.cpu_count(),
+            'bibliotecas': {'numpy': np.__version__, 'pandas': modulo.pd.__version__,
+                            'openpyxl': sys.modules['openpyxl'].__version__}
+        },
+        'parametros': {
+            'repeticoes': argumentos.repeticoes,
+            'semente': argumentos.semente,
+            'memoria': not argumentos.sem_memoria,
+            'configuracao': configuracao
+        },
+        'cenarios': []
+    }
+
+    for linhas in argumentos.linhas:
+        print(f'🔧 Cenário com {linhas} linhas de massa')
+        geracao = obter_workbook(argumentos.diretorio_planilhas, linhas, argumentos.semente)
+        if geracao['gerado_agora']:
+            print(f"   workbook gerado em {geracao['tempo_geracao']}s ({geracao['tamanho_arquivo']} bytes)")
+
+        etapas = medir_cenario(modulo, geracao['caminho'], configuracao, max(1, argumentos.repeticoes),
+                               not argumentos.sem_memoria)
+        resultado['cenarios'].append({
+            'linhas_massa': linhas,
+            'arquivo': os.path.basename(geracao['caminho']),
+            'tamanho_arquivo': geracao['tamanho_arquivo'],
+            'tempo_geracao': geracao['tempo_geracao'],
+            'etapas': etapas,
+            # Máximo do processo até aqui (ru_maxrss em KiB no Linux)
+            'pico_rss_processo_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        })
+        for etapa in etapas:
+            pico = f"{etapa['pico_memoria'] / 2**20:8.1f} MiB" if etapa['pico_memoria'] is not None else ''
+            print(f"   {etapa['etapa']:<20} {etapa['planilha'] or '':<22} {etapa['tempo_mediano']:9.3f}s {pico}")
+
+    saida = argumentos.saida or os.path.join(raiz, 'XLOGS', f"benchmark-mortalidade-{agora.strftime('%Y%m%dT%H%M%SZ')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False, default=str)
+    print(f'💾 Resultado salvo em: {saida}')
+
+    if argumentos.comparar:
+        with open(argumentos.comparar, 'r', encoding='utf-8') as f:
+            regressoes = comparar(json.load(f), resultado, argumentos.limite_regressao)
+        if regressoes:
+            print(f'❌ {regressoes} etapa(s) acima de ×{argumentos.limite_regressao}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fila de análises do analisar-mortalidade-python.py
+Trabalhos duráveis num arquivo SQLite, executados em processos próprios com
+concorrência limitada, progresso por etapa e cancelamento cooperativo
+"""
+
+import sys
+import os
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import importlib.util
+import multiprocessing
+import multiprocessing.connection
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+# Análises ao mesmo tempo no executor da fila (executar)
+CONCORRENCIA_FILA_PADRAO = 2
+
+
+def carregar_analisador():
+    """Importa o analisar-mortalidade-python.py (nome com hífens) da mesma pasta, uma vez por processo"""
+    if 'analisar_mortalidade_python' in sys.modules:
+        return sys.modules['analisar_mortalidade_python']
+    caminho = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analisar-mortalidade-python.py')
+    spec = importlib.util.spec_from_file_location('analisar_mortalidade_python', caminho)
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+class FilaAnalises:
+    """Fila durável de análises num arquivo SQLite local
+    
+    Cada trabalho guarda arquivo, configuração, prioridade (padrão: tamanho do
+    arquivo, os menores primeiro), estado, etapas já iniciadas, último evento
+    de progresso e o resultado JSON. A reserva do próximo trabalho é atômica
+    (BEGIN IMMEDIATE), então vários executores podem dividir o mesmo banco.
+    """
+    
+    ESTADOS = ('pendente', 'executando', 'concluido', 'erro', 'cancelado')
+    
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        diretorio = os.path.dirname(os.path.abspath(caminho))
+        os.makedirs(diretorio, exist_ok=True)
+        with self.conectar() as conexao:
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute("""
+                CREATE TABLE IF NOT EXISTS trabalhos (
+                    id TEXT PRIMARY KEY,
+                    caminho_arquivo TEXT NOT NULL,
+                    configuracao TEXT NOT NULL,
+                    prioridade INTEGER NOT NULL,
+                    estado TEXT NOT NULL,
+                    cancelar INTEGER NOT NULL DEFAULT 0,
+                    tentativas INTEGER NOT NULL DEFAULT 0,
+                    pid INTEGER,
+                    etapa TEXT,
+                    etapas TEXT NOT NULL DEFAULT '[]',
+                    progresso TEXT,
+                    resultado TEXT,
+                    erro TEXT,
+                    criado_em TEXT NOT NULL,
+                    iniciado_em TEXT,
+                    atualizado_em TEXT,
+                    concluido_em TEXT
+                )""")
+            conexao.execute('CREATE INDEX IF NOT EXISTS trabalhos_fila ON trabalhos (estado, prioridade, criado_em)')
+    
+    @contextmanager
+    def conectar(self):
+        # Autocommit; transações explícitas só na reserva
+        conexao = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+        conexao.row_factory = sqlite3.Row
+        try:
+            yield conexao
+        finally:
+            conexao.close()
+    
+    def atualizar(self, id_trabalho: str, condicao: str = '', **campos) -> bool:
+        """UPDATE dos campos do trabalho (atualizado_em sempre); condicao restringe o estado atual"""
+        campos['atualizado_em'] = datetime.now().isoformat()
+        atribuicoes = ', '.join(f'{campo} = ?' for campo in campos)
+        with self.conectar() as conexao:
+            cursor = conexao.execute(f'UPDATE trabalhos SET {atribuicoes} WHERE id = ? {condicao}',
+                                     [*campos.values(), id_trabalho])
+            return cursor.rowcount > 0
+    
+    def enfileirar(self, caminho_arquivo: str, configuracao: Dict[str, Any], prioridade: Optional[int] = None) -> str:
+        caminho_arquivo = os.path.abspath(caminho_arquivo)
+        if prioridade is None:
+            prioridade = os.path.getsize(caminho_arquivo)
+        id_trabalho = uuid.uuid4().hex
+        with self.conectar() as conexao:
+            conexao.execute(
+                'INSERT INTO trabalhos (id, caminho_arquivo, configuracao, prioridade, estado, criado_em) '
+                "VALUES (?, ?, ?, ?, 'pendente', ?)",
+                (id_trabalho, caminho_arquivo, json.dumps(configuracao, ensure_ascii=False), int(prioridade),
+                 datetime.now().isoformat())
+            )
+        return id_trabalho
+    
+    def reservar(self, pid: int) -> Optional[str]:
+        """Passa o próximo pendente (menor prioridade, mais antigo) para executando pelo processo pid"""
+        with self.conectar() as conexao:
+            conexao.execute('BEGIN IMMEDIATE')
+            try:
+                linha = conexao.execute(
+                    "SELECT id FROM trabalhos WHERE estado = 'pendente' ORDER BY prioridade, criado_em LIMIT 1"
+                ).fetchone()
+                if linha is not None:
+                    agora = datetime.now().isoformat()
+                    conexao.execute(
+                        "UPDATE trabalhos SET estado = 'executando', tentativas = tentativas + 1, pid = ?, "
+                        'iniciado_em = ?, atualizado_em = ? WHERE id = ?', (pid, agora, agora, linha['id']))
+                conexao.execute('COMMIT')
+            except BaseException:
+                conexao.execute('ROLLBACK')
+                raise
+        return linha['id'] if linha is not None else None
+    
+    def consultar(self, id_trabalho: str, com_resultado: bool = False) -> Optional[Dict[str, Any]]:
+        with self.conectar() as conexao:
+            linha = conexao.execute('SELECT * FROM trabalhos WHERE id = ?', (id_trabalho,)).fetchone()
+        return self.descrever(linha, com_resultado) if linha is not None else None
+    
+    def listar(self, estado: Optional[str] = None, limite: int = 100) -> List[Dict[str, Any]]:
+        with self.conectar() as conexao:
+            linhas = conexao.execute(
+                'SELECT * FROM trabalhos WHERE ? IS NULL OR estado = ? ORDER BY criado_em LIMIT ?',
+                (estado, estado, limite)
+            ).fetchall()
+        return [self.descrever(linha) for linha in linhas]
+    
+    def contagens(self) -> Dict[str, int]:
+        with self.conectar() as conexao:
+            linhas = conexao.execute('SELECT estado, COUNT(*) AS total FROM trabalhos GROUP BY estado').fetchall()
+        return {estado: 0 for estado in self.ESTADOS} | {linha['estado']: linha['total'] for linha in linhas}
+    
+    @staticmethod
+    def descrever(linha: sqlite3.Row, com_resultado: bool = False) -> Dict[str, Any]:
+        trabalho = {chave: linha[chave] for chave in linha.keys() if chave not in ('resultado', 'configuracao')}
+        trabalho['configuracao'] = json.loads(linha['configuracao'])
+        trabalho['cancelar'] = bool(linha['cancelar'])
+        trabalho['etapas'] = json.loads(linha['etapas'])
+        trabalho['progresso'] = json.loads(linha['progresso']) if linha['progresso'] else None
+        if com_resultado:
+            trabalho['resultado'] = json.loads(linha['resultado']) if linha['resultado'] else None
+        return trabalho
+    
+    def cancelar(self, id_trabalho: str) -> Optional[str]:
+        """Pendentes são cancelados na hora; em execução param na próxima etapa"""
+        if self.atualizar(id_trabalho, "AND estado = 'pendente'", estado='cancelado', cancelar=1,
+                          concluido_em=datetime.now().isoformat()):
+            return 'cancelado'
+        self.atualizar(id_trabalho, "AND estado = 'executando'", cancelar=1)
+        trabalho = self.consultar(id_trabalho)
+        return trabalho['estado'] if trabalho is not None else None
+    
+    def cancelamento_pedido(self, id_trabalho: str) -> bool:
+        with self.conectar() as conexao:
+            linha = conexao.execute('SELECT cancelar FROM trabalhos WHERE id = ?', (id_trabalho,)).fetchone()
+        return bool(linha is None or linha['cancelar'])
+    
+    def encerrar(self, id_trabalho: str, estado: str, resultado: Optional[str] = None, erro: Optional[str] = None):
+        self.atualizar(id_trabalho, "AND estado = 'executando'", estado=estado, resultado=resultado, erro=erro,
+                       pid=None, concluido_em=datetime.now().isoformat())
+    
+    def recuperar_interrompidos(self) -> List[str]:
+        """Trabalhos 'executando' cujo processo não existe mais voltam para pendente
+        
+        Acontece quando o executor cai no meio de uma análise. A retomada
+        reaproveita o sidecar e o cache do arquivo, então as planilhas já lidas
+        (e a análise inteira, se ela terminou) não são refeitas.
+        """
+        with self.conectar() as conexao:
+            linhas = conexao.execute("SELECT id, pid, cancelar FROM trabalhos WHERE estado = 'executando'").fetchall()
+        recuperados = []
+        for linha in linhas:
+            if linha['pid'] is not None and processo_ativo(linha['pid']):
+                continue
+            if linha['cancelar']:
+                self.encerrar(linha['id'], 'cancelado')
+            elif self.atualizar(linha['id'], "AND estado = 'executando'", estado='pendente', pid=None):
+                recuperados.append(linha['id'])
+        return recuperados
+
+
+def processo_ativo(pid: int) -> bool:
+    """Se o processo pid existe; no Windows o sinal 0 encerraria o processo, então ele é tido como vivo"""
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def executar_trabalho(caminho_banco: str, id_trabalho: str, concorrencia: int = 1):
+    """Roda um trabalho da fila no processo atual e grava o desfecho no banco
+    
+    O ponto de controle do analisador, chamado no início de cada etapa, grava
+    a etapa no banco e interrompe a análise (AnaliseCancelada) se o
+    cancelamento foi pedido. O resultado é o mesmo da linha de comando sem
+    --ndjson (sem eventos, que tirariam as fórmulas detalhadas do JSON).
+    """
+    analisador = carregar_analisador()
+    fila = FilaAnalises(caminho_banco)
+    fila.atualizar(id_trabalho, pid=os.getpid())
+    trabalho = fila.consultar(id_trabalho)
+    configuracao = trabalho['configuracao']
+    if concorrencia > 1:
+        # Com vários trabalhos ao mesmo tempo, cada um roda sem o próprio pool de processos
+        configuracao = {**configuracao, 'processosParalelos': 0, 'processosSimulacao': 1}
+    
+    etapas = []
+    progresso = {'tentativa': trabalho['tentativas']}
+    if trabalho['tentativas'] > 1:
+        progresso['etapas_tentativa_anterior'] = trabalho['etapas']
+    
+    def ponto_controle(etapa: str):
+        if fila.cancelamento_pedido(id_trabalho):
+            raise analisador.AnaliseCancelada(etapa)
+        etapas.append(etapa)
+        fila.atualizar(id_trabalho, etapa=etapa, etapas=json.dumps(etapas),
+                       progresso=json.dumps({**progresso, 'etapa': etapa, 'etapas_iniciadas': len(etapas),
+                                             'instante': datetime.now().isoformat()}, ensure_ascii=False))
+    
+    if not os.path.exists(trabalho['caminho_arquivo']):
+        fila.encerrar(id_trabalho, 'erro', erro=f"Arquivo não encontrado: {trabalho['caminho_arquivo']}")
+        return
+    try:
+        resultado = analisador.AnalisadorMortalidadeExcel(trabalho['caminho_arquivo'], configuracao,
+                                                          ponto_controle=ponto_controle).executar_analise()
+    except analisador.AnaliseCancelada:
+        fila.encerrar(id_trabalho, 'cancelado')
+        return
+    except Exception as e:
+        fila.encerrar(id_trabalho, 'erro', erro=f'Erro inesperado: {str(e)}')
+        return
+    
+    erros = resultado.get('validacao', {}).get('erros_encontrados') or []
+    fila.encerrar(id_trabalho, 'erro' if erros else 'concluido',
+                  resultado=json.dumps(analisador.valores_json_seguros(resultado), ensure_ascii=False, default=str),
+                  erro='; '.join(erros) or None)
+
+
+def executar_fila(caminho_banco: str, concorrencia: int = CONCORRENCIA_FILA_PADRAO, continuo: bool = False,
+                  intervalo: float = 1.0, emitir_evento: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Executor da fila: no máximo `concorrencia` análises ao mesmo tempo, um processo novo por trabalho
+    
+    Cada análise roda num processo próprio, que devolve a memória ao sistema
+    quando termina; as demais esperam no banco na ordem de prioridade. Ao
+    iniciar, trabalhos de um executor anterior que caiu voltam para a fila.
+    Sem `continuo`, o executor termina quando a fila esvazia.
+    """
+    def emitir(evento: str, **dados):
+        if emitir_evento is not None:
+            emitir_evento({'evento': evento, 'instante': datetime.now().isoformat(), **dados})
+    
+    fila = FilaAnalises(caminho_banco)
+    concorrencia = max(1, concorrencia)
+    recuperados = fila.recuperar_interrompidos()
+    emitir('fila_iniciada', concorrencia=concorrencia, retomados=recuperados, trabalhos=fila.contagens())
+    
+    contexto = multiprocessing.get_context()
+    em_execucao = {}
+    desfechos = Counter()
+    while True:
+        while len(em_execucao) < concorrencia:
+            id_trabalho = fila.reservar(os.getpid())
+            if id_trabalho is None:
+                break
+            processo = contexto.Process(target=executar_trabalho, args=(caminho_banco, id_trabalho, concorrencia),
+                                        name=f'analise-{id_trabalho[:8]}')
+            processo.start()
+            em_execucao[processo.sentinel] = (processo, id_trabalho)
+            trabalho = fila.consultar(id_trabalho)
+            emitir('trabalho_iniciado', id=id_trabalho, arquivo=trabalho['caminho_arquivo'],
+                   tentativa=trabalho['tentativas'], em_execucao=len(em_execucao))
+        
+        if not em_execucao:
+            if not continuo:
+                break
+            time.sleep(intervalo)
+            continue
+        
+        for sentinela in multiprocessing.connection.wait(list(em_execucao), timeout=intervalo):
+            processo, id_trabalho = em_execucao.pop(sentinela)
+            processo.join()
+            trabalho = fila.consultar(id_trabalho)
+            if trabalho['estado'] == 'executando':
+                # O processo morreu sem gravar o desfecho (falta de memória, sinal)
+                fila.encerrar(id_trabalho, 'erro', erro=f'Processo da análise terminou com código {processo.exitcode}')
+                trabalho = fila.consultar(id_trabalho)
+            desfechos[trabalho['estado']] += 1
+            emitir('trabalho_concluido', id=id_trabalho, arquivo=trabalho['caminho_arquivo'], estado=trabalho['estado'],
+                   erro=trabalho['erro'], em_execucao=len(em_execucao))
+    
+    resumo = {'desfechos': dict(desfechos), 'trabalhos': fila.contagens()}
+    emitir('fila_vazia', **resumo)
+    return resumo
+
+
+def executar_comando_fila(argumentos: List[str]):
+    """<banco> <comando>: enfileirar, executar, status, cancelar e resultado (JSON na saída)"""
+    parser = argparse.ArgumentParser(prog='fila-analises-mortalidade.py')
+    parser.add_argument('banco', help='Arquivo SQLite da fila (criado se não existir)')
+    comandos = parser.add_subparsers(dest='comando', required=True)
+    
+    enfileirar = comandos.add_parser('enfileirar', help='Acrescenta uma análise à fila')
+    enfileirar.add_argument('arquivo')
+    enfileirar.add_argument('--configuracao', default='{}', help='Configuração JSON da análise')
+    enfileirar.add_argument('--prioridade', type=int, help='Menor roda antes (padrão: tamanho do arquivo em bytes)')
+    
+    executar = comandos.add_parser('executar', help='Executa os trabalhos pendentes')
+    executar.add_argument('--concorrencia', type=int, default=CONCORRENCIA_FILA_PADRAO, help='Análises ao mesmo tempo')
+    executar.add_argument('--continuo', action='store_true', help='Continua aguardando novos trabalhos com a fila vazia')
+    executar.add_argument('--intervalo', type=float, default=1.0, help='Segundos entre consultas à fila')
+    executar.add_argument('--ndjson', action='store_true', help='Eventos do executor, um por linha')
+    
+    status = comandos.add_parser('status', help='Estado de um trabalho ou da fila')
+    status.add_argument('id', nargs='?')
+    status.add_argument('--estado', choices=FilaAnalises.ESTADOS)
+    
+    cancelar = comandos.add_parser('cancelar', help='Cancela um trabalho (em execução, na próxima etapa)')
+    cancelar.add_argument('id')
+    
+    resultado = comandos.add_parser('resultado', help='Resultado JSON de um trabalho concluído')
+    resultado.add_argument('id')
+    
+    argumentos = parser.parse_args(argumentos)
+    analisador = carregar_analisador()
+    fila = FilaAnalises(argumentos.banco)
+    
+    def imprimir(objeto):
+        print(json.dumps(analisador.valores_json_seguros(objeto), ensure_ascii=False, indent=2, default=str))
+    
+    if argumentos.comando == 'enfileirar':
+        try:
+            configuracao = json.loads(argumentos.configuracao)
+        except json.JSONDecodeError as e:
+            imprimir({'erro': f'Erro ao fazer parse da configuração JSON: {str(e)}'})
+            sys.exit(1)
+        if not os.path.exists(argumentos.arquivo):
+            imprimir({'erro': f'Arquivo não encontrado: {argumentos.arquivo}'})
+            sys.exit(1)
+        id_trabalho = fila.enfileirar(argumentos.arquivo, configuracao, argumentos.prioridade)
+        imprimir({'id': id_trabalho, 'estado': 'pendente', 'trabalhos': fila.contagens()})
+    
+    elif argumentos.comando == 'executar':
+        resumo = executar_fila(argumentos.banco, argumentos.concorrencia, argumentos.continuo, argumentos.intervalo,
+                               analisador.emitir_ndjson if argumentos.ndjson else None)
+        if not argumentos.ndjson:
+            imprimir(resumo)
+    
+    elif argumentos.comando == 'status':
+        if argumentos.id:
+            trabalho = fila.consultar(argumentos.id)
+            imprimir(trabalho if trabalho is not None else {'erro': f'Trabalho não encontrado: {argumentos.id}'})
+        else:
+            imprimir({'trabalhos': fila.contagens(), 'lista': fila.listar(argumentos.estado)})
+    
+    elif argumentos.comando == 'cancelar':
+        estado = fila.cancelar(argumentos.id)
+        imprimir({'id': argumentos.id, 'estado': estado} if estado else {'erro': f'Trabalho não encontrado: {argumentos.id}'})
+    
+    else:
+        trabalho = fila.consultar(argumentos.id, com_resultado=True)
+        if trabalho is None or trabalho['resultado'] is None:
+            imprimir({'erro': f'Resultado indisponível: {argumentos.id}',
+                      'estado': trabalho['estado'] if trabalho else None})
+            sys.exit(1)
+        # O resultado já foi gravado como JSON seguro
+        print(json.dumps(trabalho['resultado'], ensure_ascii=False, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    executar_comando_fila(sys.argv[1:])
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures dos testes do analisar-mortalidade-python.py
+Workbooks pequenos gerados em tmp_path e o módulo importado pelo caminho
+(o nome do script tem hífens)
+"""
+
+import os
+import sys
+import importlib.util
+from datetime import date
+
+import pytest
+from openpyxl import Workbook
+
+# Configuração sem estado em disco compartilhado entre testes
+CONFIGURACAO_TESTE = {
+    'usarSidecar': False,
+    'usarRegistroLayouts': False,
+    'replicasSimulacao': 0
+}
+
+
+def calcular_qx_sintetico(idade: int, feminino: bool = False) -> float:
+    """qx de Gompertz-Makeham da tábua dos workbooks de teste (mulheres 4 anos mais novas)"""
+    idade = idade - 4 if feminino else idade
+    return min(0.0005 + 0.00003 * 2.718281828459045 ** (0.095 * idade), 1.0)
+
+
+def escrever_workbook(caminho: str, massa, obitos, salarios=None):
+    """Grava massa [(matrícula, sexo, nascimento)], óbitos [(matrícula, sexo, nascimento, óbito)] e a tábua qx
+
+    A massa traz uma coluna de fórmula por linha, para os testes de fórmulas,
+    e a coluna SALARIO quando salarios (um valor ou None por linha) é dado.
+    """
+    workbook = Workbook()
+    planilha = workbook.active
+    planilha.title = 'MASSA PARTICIPANTES'
+    planilha.append(['MATRICULA', 'NOME', 'SEXO', 'DATA NASCIMENTO', 'TEMPO DE CASA']
+                    + (['SALARIO'] if salarios is not None else []))
+    for linha, (matricula, sexo, nascimento) in enumerate(massa, start=2):
+        planilha.append([matricula, f'PARTICIPANTE {matricula}', sexo, nascimento,
+                         f'=INT((DATE(2020,12,31)-D{linha})/365.25)']
+                        + ([salarios[linha - 2]] if salarios is not None else []))
+
+    planilha = workbook.create_sheet('OBITOS')
+    planilha.append(['MATRICULA', 'SEXO', 'DATA NASCIMENTO', 'DATA OBITO'])
+    for registro in obitos:
+        planilha.append(list(registro))
+
+    planilha = workbook.create_sheet('TABUA QX')
+    planilha.append(['IDADE', 'QX MASCULINO', 'QX FEMININO'])
+    for idade in range(121):
+        planilha.append([idade, calcular_qx_sintetico(idade), calcular_qx_sintetico(idade, True)])
+
+    workbook.save(caminho)
+    return caminho
+
+
+@pytest.fixture(scope='session')
+def qx_sintetico():
+    """qx(idade, feminino=False) da tábua gravada nos workbooks de teste"""
+    return calcular_qx_sintetico
+
+
+@pytest.fixture(scope='session')
+def gravar_workbook():
+    """gravar(caminho, massa, obitos): grava um workbook de teste e devolve o caminho"""
+    return escrever_workbook
+
+
+@pytest.fixture(scope='session')
+def analisador():
+    """Módulo analisar-mortalidade-python.py"""
+    caminho = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'analisar-mortalidade-python.py')
+    spec = importlib.util.spec_from_file_location('analisar_mortalidade_python', caminho)
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+@pytest.fixture
+def analisar(analisador):
+    """Executa a análise completa com CONFIGURACAO_TESTE; eventos, quando lista, recebe os eventos emitidos"""
+    def executar(caminho: str, eventos=None, **configuracao):
+        return analisador.AnalisadorMortalidadeExcel(
+            caminho, {**CONFIGURACAO_TESTE, **configuracao},
+            emitir_evento=eventos.append if eventos is not None else None
+        ).executar_analise()
+    return executar
+
+
+@pytest.fixture
+def workbook_um_obito(tmp_path):
+    """Uma vida nascida em 01/07/1960, falecida em 01/10/2020, e uma sobrevivente"""
+    return escrever_workbook(
+        str(tmp_path / 'um-obito.xlsx'),
+        [(1, 'M', date(1960, 7, 1)), (2, 'F', date(1955, 1, 1))],
+        [(1, 'M', date(1960, 7, 1), date(2020, 10, 1))]
+    )
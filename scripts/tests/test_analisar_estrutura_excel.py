@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Testes do analisar-estrutura-excel.py"""
+
+import os
+import sys
+import importlib.util
+
+import pytest
+from openpyxl import Workbook
+
+
+@pytest.fixture(scope='module')
+def estrutura(analisador):
+    """Módulo analisar-estrutura-excel.py (depois do analisador, que ele reaproveita)"""
+    caminho = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'analisar-estrutura-excel.py')
+    spec = importlib.util.spec_from_file_location('analisar_estrutura_excel', caminho)
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def test_planilha_sem_dimensao_informa_a_ultima_coluna_real(estrutura, tmp_path):
+    # write_only não grava <dimension>: no modo leitura max_column fica None
+    workbook = Workbook(write_only=True)
+    planilha = workbook.create_sheet('TABUA QX')
+    planilha.append(['IDADE', 'QX MASCULINO', 'QX FEMININO', 'QX GERAL'])
+    for idade in range(10):
+        planilha.append([idade, 0.001, 0.0008, '=(B{0}+C{0})/2'.format(idade + 2)])
+    planilha.append([None, None, None, None, None, 'nota da tábua'])
+    caminho = str(tmp_path / 'sem-dimensao.xlsx')
+    workbook.save(caminho)
+    
+    busca = estrutura.analisar_estrutura_excel(caminho, busca_completa=True)
+    completa = estrutura.analisar_estrutura_excel(caminho)
+    
+    assert busca['origem'] == 'indice_strings'
+    [tabua] = busca['planilhas']
+    assert tabua['dimensoes'] == completa['planilhas'][0]['dimensoes'] == {
+        'linhas': 12, 'colunas': 6, 'intervalo': 'A1:F12'
+    }
+    assert [cabecalho['valor'] for cabecalho in tabua['cabecalhos']] == [
+        'IDADE', 'QX MASCULINO', 'QX FEMININO', 'QX GERAL', '', ''
+    ]
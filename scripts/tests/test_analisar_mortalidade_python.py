@@ -0,0 +1,488 @@
+# -*- coding: utf-8 -*-
+"""Testes do analisar-mortalidade-python.py sobre workbooks pequenos"""
+
+import os
+import re
+import json
+import zipfile
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+# Sidecar ligado e cache de resultados desligado: as análises repetidas releem o sidecar
+CONFIGURACAO_SIDECAR = {'usarSidecar': True, 'usarCache': False}
+# Análise sem nenhum cache, lida sempre do arquivo
+CONFIGURACAO_TESTE_XML = {'usarSidecar': False, 'usarCache': False, 'usarRegistroLayouts': False}
+
+
+def test_formulas_detalhadas_sobrevivem_a_segunda_analise(analisar, workbook_um_obito, tmp_path):
+    configuracao = {'metodoAnalise': 'DETALHADO', 'diretorioCache': str(tmp_path / 'cache')}
+    for _ in range(2):
+        resultado = analisar(workbook_um_obito, **configuracao)
+        assert resultado['metadados']['cache']['status'] == 'desativado'
+        assert len(resultado['formulas']['detalhadas']) == 2
+        
+        eventos = []
+        analisar(workbook_um_obito, eventos, **configuracao)
+        lotes = [evento for evento in eventos if evento['evento'] == 'lote_formulas']
+        assert sum(len(lote['formulas']) for lote in lotes) == 2
+
+
+def linhas_por_idade_sexo(exposicao):
+    return {(linha['sexo'], linha['idade']): linha for linha in exposicao['por_idade_sexo']}
+
+
+def sem_metadados(analisador, resultado):
+    """Resultado em JSON (como sai do cache), sem metadados de execução e cache"""
+    texto = json.dumps(analisador.valores_json_seguros(resultado), ensure_ascii=False, default=str)
+    resultado = json.loads(texto)
+    resultado.pop('metadados')
+    return resultado
+
+
+def test_exposicao_pelas_datas_confere_com_o_calculo_manual(analisar, workbook_um_obito):
+    exposicao = analisar(workbook_um_obito, usarCache=False)['dados_extraidos']['exposicao_ae']
+    linhas = linhas_por_idade_sexo(exposicao)
+    
+    # 2020 é bissexto: 59 anos de 01/01 a 01/07 (182 dias), 60 anos de 01/07 ao óbito em 01/10 (92 dias)
+    assert exposicao['periodo'] == {'ano_inicial': 2020, 'ano_final': 2020}
+    assert linhas[('MASCULINO', 59)]['exposicao_central'] == pytest.approx(182 / 366, abs=1e-4)
+    assert linhas[('MASCULINO', 60)]['exposicao_central'] == pytest.approx(92 / 366, abs=1e-4)
+    # A exposição inicial completa o ano de idade do óbito: 0,2514 + 0,7486
+    assert linhas[('MASCULINO', 59)]['exposicao_inicial'] == pytest.approx(182 / 366, abs=1e-4)
+    assert linhas[('MASCULINO', 60)]['exposicao_inicial'] == pytest.approx(1.0, abs=1e-4)
+    assert linhas[('MASCULINO', 60)]['obitos_observados'] == 1
+    assert linhas[('FEMININO', 65)]['exposicao_central'] == pytest.approx(1.0, abs=1e-4)
+    assert exposicao['totais']['exposicao_central'] == pytest.approx(182 / 366 + 92 / 366 + 1.0, abs=1e-3)
+
+
+def test_razao_ae_usa_a_tabua_da_planilha(analisar, workbook_um_obito, qx_sintetico):
+    exposicao = analisar(workbook_um_obito, usarCache=False)['dados_extraidos']['exposicao_ae']
+    
+    esperados_masculino = 182 / 366 * qx_sintetico(59) + qx_sintetico(60)
+    esperados = esperados_masculino + qx_sintetico(65, feminino=True)
+    assert exposicao['totais']['obitos_observados'] == 1
+    assert exposicao['totais']['obitos_esperados'] == pytest.approx(esperados, abs=1e-4)
+    assert exposicao['totais']['razao_ae'] == pytest.approx(1 / esperados, rel=1e-3)
+    assert exposicao['por_sexo']['MASCULINO']['razao_ae'] == pytest.approx(1 / esperados_masculino, rel=1e-3)
+    assert exposicao['por_sexo']['FEMININO']['obitos_observados'] == 0
+
+
+def test_cache_devolve_o_mesmo_resultado_da_analise(analisador, analisar, workbook_um_obito, tmp_path):
+    configuracao = {'diretorioCache': str(tmp_path / 'cache')}
+    perda = analisar(workbook_um_obito, **configuracao)
+    acerto = analisar(workbook_um_obito, **configuracao)
+    
+    assert perda['metadados']['cache']['status'] == 'miss'
+    assert acerto['metadados']['cache']['status'] == 'hit'
+    assert acerto['metadados']['cache']['chave'] == perda['metadados']['cache']['chave']
+    assert sem_metadados(analisador, acerto) == sem_metadados(analisador, perda)
+
+
+def test_analise_incremental_iguala_a_completa(analisar, gravar_workbook, tmp_path):
+    configuracao = {'usarCache': False, 'modoIncremental': True, 'diretorioIncremental': str(tmp_path / 'incremental')}
+    massa = [(matricula, 'M' if matricula % 2 else 'F', date(1940 + matricula, 1 + matricula % 12, 1))
+             for matricula in range(1, 31)]
+    obitos = [(3, 'M', date(1943, 4, 1), date(2019, 5, 10)), (8, 'F', date(1948, 9, 1), date(2020, 2, 20))]
+    base = gravar_workbook(str(tmp_path / 'base.xlsx'), massa, obitos)
+    delta = analisar(base, **configuracao)['dados_extraidos']['delta_incremental']
+    assert delta['base_anterior'] is None and delta['exposicao']['status'] == 'completo'
+    
+    # Nova base: um participante incluído, um excluído e um óbito a mais
+    massa_nova = [registro for registro in massa if registro[0] != 20] + [(31, 'F', date(1950, 6, 15))]
+    obitos_novos = obitos + [(11, 'M', date(1951, 12, 1), date(2020, 8, 31))]
+    nova = gravar_workbook(str(tmp_path / 'nova.xlsx'), massa_nova, obitos_novos)
+    incremental = analisar(nova, **configuracao)['dados_extraidos']
+    completa = analisar(nova, usarCache=False)['dados_extraidos']
+    
+    assert incremental['delta_incremental']['exposicao']['status'] == 'incremental'
+    assert incremental['exposicao_ae']['periodo'] == completa['exposicao_ae']['periodo']
+    assert incremental['exposicao_ae']['totais'] == pytest.approx(completa['exposicao_ae']['totais'], abs=1e-4)
+    for campo in ('por_sexo', 'por_ano'):
+        assert incremental['exposicao_ae'][campo].keys() == completa['exposicao_ae'][campo].keys()
+        for chave, totais in completa['exposicao_ae'][campo].items():
+            assert incremental['exposicao_ae'][campo][chave] == pytest.approx(totais, abs=1e-4)
+    linhas_incremental = linhas_por_idade_sexo(incremental['exposicao_ae'])
+    linhas_completa = linhas_por_idade_sexo(completa['exposicao_ae'])
+    assert linhas_incremental.keys() == linhas_completa.keys()
+    for chave, linha in linhas_completa.items():
+        for campo in ('exposicao_central', 'exposicao_inicial', 'obitos_observados', 'obitos_esperados'):
+            assert linhas_incremental[chave][campo] == pytest.approx(linha[campo], abs=1e-4)
+
+
+def test_tabua_qx_ignora_idades_negativas(analisador):
+    analise = analisador.AnalisadorMortalidadeExcel('inexistente.xlsx', {})
+    tabela = pd.DataFrame({'idade': [-1.0, 0.0, 1.0, 2.0], 'qx_masculino': [0.9, 0.01, 0.02, 0.03],
+                           'qx_feminino': [0.9, 0.01, 0.02, 0.03]})
+    
+    qx = analise.montar_tabua_qx(tabela, 2)
+    
+    assert qx[0, 2] == pytest.approx(0.03)
+    assert np.isfinite(qx[:2]).all() and not (qx[:2] == 0.9).any()
+    assert any('idade negativa' in aviso for aviso in analise.validacao['warnings'])
+
+
+def test_modo_rapido_respeita_os_limites_de_erro(analisar, gravar_workbook, tmp_path):
+    gerador = np.random.default_rng(7)
+    massa = [(matricula, 'M' if matricula % 3 else 'F',
+              date(int(gerador.integers(1930, 2000)), int(gerador.integers(1, 13)), int(gerador.integers(1, 29))))
+             for matricula in range(1, 601)]
+    salarios = [None if indice % 40 == 0 else round(float(valor), 2)
+                for indice, valor in enumerate(gerador.lognormal(8.3, 0.6, len(massa)))]
+    caminho = gravar_workbook(str(tmp_path / 'rapido.xlsx'), massa, [], salarios)
+    
+    completo = analisar(caminho, usarCache=False)
+    rapido = analisar(caminho, usarCache=False, metodoAnalise='RAPIDO')
+    limites = rapido['metadados']['modo_analise']['limites_erro']
+    exato = completo['dados_extraidos']['massa_participantes']['dados_processados']
+    aproximado = rapido['dados_extraidos']['massa_participantes']['dados_processados']
+    
+    assert limites['contagens_e_distribuicoes'] == 0.0 and limites['media_desvio_minimo_maximo'] == 0.0
+    for campo in ('total', 'media', 'desvio_padrao', 'minimo', 'maximo'):
+        assert aproximado['estatisticas_salario'][campo] == exato['estatisticas_salario'][campo]
+    for quartil, valor in exato['estatisticas_salario']['quartis'].items():
+        assert aproximado['estatisticas_salario']['quartis'][quartil] == pytest.approx(
+            valor, rel=limites['quantis_valores_erro_relativo'])
+    assert aproximado['estatisticas_salario']['mediana'] == pytest.approx(
+        exato['estatisticas_salario']['mediana'], rel=limites['quantis_valores_erro_relativo'])
+    
+    for campo in ('distribuicao_sexo', 'analise_datas'):
+        assert aproximado[campo] == exato[campo]
+
+
+def diretorios_sidecar(diretorio_cache):
+    base = os.path.join(diretorio_cache, 'colunar')
+    return sorted(os.listdir(base)) if os.path.isdir(base) else []
+
+
+def test_sidecar_recarregado_reproduz_a_analise(analisador, workbook_um_obito, tmp_path):
+    configuracao = {**CONFIGURACAO_SIDECAR, 'diretorioCache': str(tmp_path / 'cache')}
+    primeira = analisador.AnalisadorMortalidadeExcel(workbook_um_obito, configuracao)
+    lida = primeira.executar_analise()
+    assert len(diretorios_sidecar(configuracao['diretorioCache'])) == 1
+    
+    # A segunda análise não pode abrir o workbook: tudo vem das colunas mapeadas em memória
+    segunda = analisador.AnalisadorMortalidadeExcel(workbook_um_obito, configuracao)
+    segunda.abrir_workbook = lambda: pytest.fail('workbook aberto apesar do sidecar')
+    recarregada = segunda.executar_analise()
+    
+    # O .npz do cubo, regravado a cada análise com o instante de criação, varia alguns bytes
+    extraidos_recarregados, extraidos_lidos = (sem_metadados(analisador, resultado)['dados_extraidos']
+                                               for resultado in (recarregada, lida))
+    for extraidos in (extraidos_recarregados, extraidos_lidos):
+        extraidos['cubo_agregado'].pop('bytes')
+    assert extraidos_recarregados == extraidos_lidos
+    normalizacao = recarregada['dados_extraidos']['massa_participantes']['estatisticas']['normalizacao_datas']
+    assert normalizacao['data_nascimento']['convertidos'] == {'datetime': 2}
+
+
+def test_sidecar_nao_e_reaproveitado_com_o_arquivo_alterado(analisador, analisar, gravar_workbook, tmp_path):
+    configuracao = {**CONFIGURACAO_SIDECAR, 'diretorioCache': str(tmp_path / 'cache')}
+    caminho = str(tmp_path / 'base.xlsx')
+    gravar_workbook(caminho, [(1, 'M', date(1960, 7, 1))], [])
+    assert analisar(caminho, **configuracao)['dados_extraidos']['massa_participantes']['estatisticas']['total_registros'] == 1
+    
+    gravar_workbook(caminho, [(1, 'M', date(1960, 7, 1)), (2, 'F', date(1970, 3, 1))], [])
+    alterada = analisar(caminho, **configuracao)
+    
+    assert alterada['dados_extraidos']['massa_participantes']['estatisticas']['total_registros'] == 2
+    assert len(diretorios_sidecar(configuracao['diretorioCache'])) == 2
+    
+    
+    # invalidarCache apaga o sidecar do arquivo atual, que a própria análise volta a gravar
+    marcador = os.path.join(configuracao['diretorioCache'], 'colunar', analisador.calcular_hash_arquivo(caminho), 'marcador')
+    open(marcador, 'w').close()
+    analisar(caminho, invalidarCache=True, **configuracao)
+    assert not os.path.exists(marcador)
+    assert len(diretorios_sidecar(configuracao['diretorioCache'])) == 2
+
+
+def test_sidecar_entra_no_orcamento_do_cache(analisar, gravar_workbook, tmp_path):
+    diretorio = str(tmp_path / 'cache')
+    antigo = gravar_workbook(str(tmp_path / 'antigo.xlsx'), [(1, 'M', date(1960, 7, 1))], [])
+    novo = gravar_workbook(str(tmp_path / 'novo.xlsx'), [(2, 'F', date(1970, 3, 1))], [])
+    analisar(antigo, **CONFIGURACAO_SIDECAR, diretorioCache=diretorio)
+    [hash_antigo] = diretorios_sidecar(diretorio)
+    tamanho = sum(os.path.getsize(os.path.join(raiz, nome))
+                  for raiz, _, nomes in os.walk(os.path.join(diretorio, 'colunar')) for nome in nomes)
+    
+    # Cabe um sidecar, não dois: o menos usado sai
+    analisar(novo, **CONFIGURACAO_SIDECAR, diretorioCache=diretorio, tamanhoMaximoCacheMB=1.5 * tamanho / (1024 * 1024))
+    
+    assert len(diretorios_sidecar(diretorio)) == 1
+    assert diretorios_sidecar(diretorio) != [hash_antigo]
+
+
+def test_cubos_entram_no_orcamento_do_cache(analisador, analisar, gravar_workbook, tmp_path):
+    diretorio = str(tmp_path / 'cache')
+    configuracao = {'usarCache': False, 'diretorioCache': diretorio}
+    caminhos = [gravar_workbook(str(tmp_path / f'{ano}.xlsx'), [(1, 'M', date(ano, 7, 1)), (2, 'F', date(1955, 1, 1))],
+                                [(1, 'M', date(ano, 7, 1), date(2020, 10, 1))]) for ano in (1960, 1961, 1962)]
+    cubos = []
+    for segundos, caminho in enumerate(caminhos[:2]):
+        cubos.append(analisar(caminho, **configuracao)['dados_extraidos']['cubo_agregado']['arquivo'])
+        # mtimes distintos e no passado: primeiro o de 1960, depois o de 1961
+        os.utime(cubos[-1], (1e9 + segundos, 1e9 + segundos))
+    
+    # Consultar o cubo mais antigo renova o uso: na poda sai o de 1961, o menos usado
+    analisador.consultar_cubo(cubos[0], {})
+    tamanho = max(os.path.getsize(cubo) for cubo in cubos)
+    novo = analisar(caminhos[2], **configuracao, tamanhoMaximoCacheMB=2.5 * tamanho / (1024 * 1024))
+    
+    cubos = [cubos[0], novo['dados_extraidos']['cubo_agregado']['arquivo']]
+    assert sorted(os.listdir(os.path.join(diretorio, 'cubos'))) == sorted(map(os.path.basename, cubos))
+
+def gravar_massa_irregular(caminho):
+    """Massa com linhas ausentes, linhas de larguras diferentes, strings em linha e compartilhadas e sem <dimension>"""
+    workbook = Workbook()
+    planilha = workbook.active
+    planilha.title = 'MASSA PARTICIPANTES'
+    planilha.append(['MATRICULA', 'NOME', 'SEXO', 'DATA NASCIMENTO', 'SALARIO', 'TEMPO DE CASA'])
+    linha = 2
+    for matricula in range(1, 261):
+        if matricula in (40, 41, 120, 205):
+            linha += 2  # linhas inteiras ausentes no XML
+        valores = [matricula, f'PARTICIPANTE {matricula}', 'MF'[matricula % 2],
+                   date(1940 + matricula % 50, 1 + matricula % 12, 1 + matricula % 28) if matricula % 17 else '15/03/1961',
+                   round(1500 + 37.5 * matricula, 2), f'=INT((DATE(2020,12,31)-D{linha})/365.25)']
+        if matricula % 9 == 0:
+            valores = valores[:3]  # linha curta
+        elif matricula % 13 == 0:
+            valores += [None, 'observação']  # linha mais larga que o cabeçalho
+        for coluna, valor in enumerate(valores, start=1):
+            if valor is not None:
+                planilha.cell(linha, coluna, valor)
+        linha += 1
+    workbook.save(caminho)
+    
+    # O OpenPyXL grava todo texto em linha (t="inlineStr"); o das linhas ímpares vai para uma
+    # tabela sharedStrings (t="s"), como no Excel, e a dimensão declarada sai
+    with zipfile.ZipFile(caminho) as pacote:
+        partes = {nome: pacote.read(nome) for nome in pacote.namelist()}
+    strings = []
+    
+    def compartilhada(celula):
+        strings.append(celula.group(3))
+        return b'<c r="%s"%s t="s"><v>%d</v></c>' % (celula.group(1), celula.group(2), len(strings) - 1)
+    
+    xml = re.sub(rb'<dimension [^>]*/>', b'', partes['xl/worksheets/sheet1.xml'])
+    partes['xl/worksheets/sheet1.xml'] = re.sub(
+        rb'<c r="([A-Z]+\d*[13579])"([^>]*?) t="inlineStr"><is><t>(.*?)</t></is></c>', compartilhada, xml)
+    partes['xl/sharedStrings.xml'] = (
+        b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        b'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="%d" uniqueCount="%d">'
+        % (len(strings), len(strings)) + b''.join(b'<si><t>%s</t></si>' % texto for texto in strings) + b'</sst>'
+    )
+    partes['xl/_rels/workbook.xml.rels'] = partes['xl/_rels/workbook.xml.rels'].replace(
+        b'</Relationships>',
+        b'<Relationship Id="rIdSst" Target="sharedStrings.xml" '
+        b'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/></Relationships>')
+    partes['[Content_Types].xml'] = partes['[Content_Types].xml'].replace(
+        b'</Types>',
+        b'<Override PartName="/xl/sharedStrings.xml" '
+        b'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/></Types>')
+    with zipfile.ZipFile(caminho, 'w', zipfile.ZIP_DEFLATED) as pacote:
+        for nome, conteudo in partes.items():
+            pacote.writestr(nome, conteudo)
+    return caminho
+
+
+def test_leitura_xml_direta_reproduz_o_openpyxl(analisador, analisar, tmp_path):
+    caminho = gravar_massa_irregular(str(tmp_path / 'irregular.xlsx'))
+    with zipfile.ZipFile(caminho) as pacote:
+        xml = pacote.read('xl/worksheets/sheet1.xml')
+    assert b'<dimension' not in xml and b't="inlineStr"' in xml and b't="s"' in xml
+    
+    configuracao = {**CONFIGURACAO_TESTE_XML, 'tamanhoBloco': 7}
+    direta = analisador.AnalisadorMortalidadeExcel(caminho, {**configuracao, 'leituraXmlDireta': True})
+    # Sem recurso à passada do OpenPyXL: um erro do leitor XML tem de aparecer aqui
+    direta.carregar_planilha_tipada = lambda *argumentos: pytest.fail('leitura XML recorreu ao OpenPyXL')
+    resultado_direta = direta.executar_analise()
+    openpyxl_ = analisador.AnalisadorMortalidadeExcel(caminho, {**configuracao, 'leituraXmlDireta': False})
+    resultado_openpyxl = openpyxl_.executar_analise()
+    
+    assert direta.tabelas.keys() == openpyxl_.tabelas.keys() == {'massa'}
+    pd.testing.assert_frame_equal(direta.tabelas['massa'], openpyxl_.tabelas['massa'])
+    assert len(direta.tabelas['massa']) == 260
+    for parte in ('estrutura_arquivo', 'dados_extraidos', 'estatisticas'):
+        assert sem_metadados(analisador, resultado_direta)[parte] == sem_metadados(analisador, resultado_openpyxl)[parte]
+
+
+@pytest.mark.parametrize('makeham', [False, True])
+def test_leis_recuperam_os_parametros_conhecidos(analisador, makeham):
+    idades = np.arange(30, 101) + 0.5
+    exposicao = np.linspace(5000.0, 200.0, len(idades))
+    parametros = [(0.0, 3e-5, 1.10), (0.0, 8e-5, 1.09)] if not makeham else [(5e-4, 3e-5, 1.10), (1e-3, 2e-5, 1.11)]
+    # Óbitos iguais aos esperados: a máxima verossimilhança de Poisson é exatamente a lei geradora
+    obitos = np.array([exposicao * (A + B * c ** idades) for A, B, c in parametros])
+    
+    ajuste = analisador.ajustar_lei_mortalidade(obitos, np.tile(exposicao, (2, 1)), idades, makeham=makeham)
+    
+    assert ajuste['convergiu'].all()
+    for i, (A, B, c) in enumerate(parametros):
+        assert ajuste['B'][i] == pytest.approx(B, rel=1e-4)
+        assert ajuste['c'][i] == pytest.approx(c, rel=1e-6)
+        assert ajuste['A'][i] == pytest.approx(A, rel=1e-4, abs=1e-9)
+        assert ajuste['desvio'][i] == pytest.approx(0.0, abs=1e-6)
+
+
+def test_whittaker_henderson_sem_suavizacao_devolve_as_brutas(analisador):
+    gerador = np.random.default_rng(3)
+    brutas = 0.001 * np.exp(0.08 * np.arange(40)) * gerador.uniform(0.8, 1.2, 40)
+    pesos = gerador.uniform(100.0, 2000.0, 40)
+    
+    graduadas = analisador.graduar_whittaker_henderson(brutas[np.newaxis], pesos[np.newaxis], np.array([1e-9]))
+    
+    np.testing.assert_allclose(graduadas[0], brutas, rtol=1e-6)
+
+
+@pytest.mark.parametrize('ordem', [2, 3])
+def test_whittaker_henderson_com_suavizacao_grande_ajusta_polinomio(analisador, ordem):
+    # h → ∞ anula as diferenças de ordem z: sobra o polinômio de grau z - 1 de mínimos quadrados ponderados
+    # (h bem maior que os pesos, mas sem chegar ao mau condicionamento do sistema banda)
+    gerador = np.random.default_rng(5)
+    idades = np.arange(40)
+    brutas = 0.02 + 0.0005 * idades + gerador.normal(0, 0.002, 40)
+    pesos = gerador.uniform(100.0, 2000.0, 40)
+    
+    graduadas = analisador.graduar_whittaker_henderson(brutas[np.newaxis], pesos[np.newaxis], np.array([1e9]), ordem)
+    
+    polinomio = np.polynomial.Polynomial.fit(idades, brutas, ordem - 1, w=np.sqrt(pesos))
+    np.testing.assert_allclose(graduadas[0], polinomio(idades), rtol=1e-4)
+    assert np.abs(np.diff(graduadas[0], ordem)).max() < 1e-8
+
+
+def test_simulacao_binomial_sorteia_obitos_inteiros_sobre_as_vidas(analisador):
+    # Célula [0, 0] com 40,4 de exposição (40 vidas) e [0, 1] com 0,3 (sem vida inteira: Poisson)
+    exposicao = np.array([[40.4, 0.3]])
+    taxas = np.array([[0.1, 0.2]])
+    modelo = analisador.preparar_modelo_simulacao(exposicao, taxas, taxas[np.newaxis], distribuicao='binomial')
+    assert modelo['vidas'].tolist() == [40, 0]
+    assert modelo['exposicao'].tolist() == [40.0, 0.3]
+    assert modelo['esperados_totais'][0] == pytest.approx(40 * 0.1 + 0.3 * 0.2)
+    
+    replicas = 20000
+    qx = analisador.simular_bloco_replicas(modelo, np.random.SeedSequence(11), replicas)['qx']
+    obitos = qx.astype(np.float64) * modelo['exposicao']
+    vidas = np.round(obitos[:, 0])
+    np.testing.assert_allclose(obitos[:, 0], vidas, atol=1e-4)
+    assert vidas.max() <= 40
+    erro = 4 * np.sqrt(40 * 0.1 * 0.9 / replicas)
+    assert vidas.mean() == pytest.approx(40 * 0.1, abs=erro)
+    assert vidas.var() == pytest.approx(40 * 0.1 * 0.9, rel=0.05)
+    assert obitos[:, 1].mean() == pytest.approx(0.3 * 0.2, abs=4 * np.sqrt(0.06 / replicas))
+
+
+def tabela_ligacao(analisador, registros):
+    """Tabela tipada como a do carregador: (matrícula, CPF, nome, sexo, nascimento, óbito) por linha"""
+    colunas = list(zip(*registros))
+    chaves = [np.array(valores, dtype=object) for valores in colunas[:3]]
+    codigos = [analisador.CODIGOS_SEXO.get(sexo, -1) if sexo else -1 for sexo in colunas[3]]
+    return pd.DataFrame({
+        'matricula': chaves[0],
+        'cpf': chaves[1],
+        'nome': chaves[2],
+        'sexo': pd.Categorical.from_codes(codigos, analisador.CATEGORIAS_SEXO),
+        'data_nascimento': pd.to_datetime(list(colunas[4])).to_numpy(dtype='datetime64[ns]'),
+        'data_obito': pd.to_datetime(list(colunas[5])).to_numpy(dtype='datetime64[ns]')
+    })
+
+
+@pytest.fixture
+def massa_ligacao(analisador):
+    return tabela_ligacao(analisador, [
+        ('10', '529.982.247-25', 'MARIA APARECIDA SOUZA', 'F', date(1950, 3, 10), None),
+        ('11', '111.444.777-35', 'JOSÉ CARLOS PEREIRA', 'M', date(1948, 5, 20), None),
+        ('12', None, 'MANOEL DA SILVA', 'M', date(1945, 8, 1), None),
+        ('13', '012.345.678-90', 'ANA LIMA', 'F', date(1970, 1, 1), None),
+        ('14', None, 'RAFAEL GONÇALVES', 'M', date(1960, 2, 2), None)
+    ])
+
+
+@pytest.fixture
+def obitos_ligacao(analisador):
+    return tabela_ligacao(analisador, [
+        # Matrícula da massa
+        ('10', None, 'MARIA A SOUZA', 'F', date(1950, 3, 10), date(2020, 4, 1)),
+        # Matrícula fora da massa e CPF sem pontuação
+        ('999', '11144477735', 'JOSE C PEREIRA', 'M', date(1948, 5, 20), date(2020, 5, 1)),
+        # Sem matrícula nem CPF, nome quase igual (MANUEL/MANOEL): 2 + 2 + 4 + 1 = 9 pontos
+        (None, None, 'MANUEL DA SILVA', 'M', date(1945, 8, 1), date(2020, 6, 1)),
+        # CPF numérico sem o zero à esquerda, sem sexo nem nascimento
+        (None, '1234567890', 'ANA LIMA', None, None, date(2020, 6, 1)),
+        # CPF com dígito verificador errado e ninguém parecido na massa
+        (None, '123.456.789-00', 'JOÃO NINGUÉM', 'M', date(1930, 1, 1), date(2020, 7, 1))
+    ])
+
+
+def test_ligacao_por_matricula_cpf_e_aproximada(analisador, massa_ligacao, obitos_ligacao):
+    vinculo, metodo, resumo = analisador.ligar_obitos_massa(massa_ligacao, obitos_ligacao)
+    
+    assert vinculo.tolist() == [0, 1, 2, 3, -1]
+    assert [analisador.METODOS_LIGACAO[k] if k >= 0 else None for k in metodo] == [
+        'matricula', 'cpf', 'aproximada', 'cpf', None]
+    assert resumo['chaves'] == {'matricula_ausente': 3, 'cpf_ausente': 2, 'cpf_invalido': 1}
+    assert {nome: dados['ligados'] for nome, dados in resumo['por_metodo'].items()} == {
+        'matricula': 1, 'cpf': 2, 'aproximada': 1}
+    assert resumo['aproximada']['participantes_candidatos'] == 2
+    assert resumo['motivos_nao_ligados'] == {'sem_candidatos': 1}
+    assert resumo['obitos_nao_ligados'][0]['registro'] == 4
+
+
+def test_ligacao_aproximada_respeita_o_limiar(analisador, massa_ligacao, obitos_ligacao):
+    obitos = obitos_ligacao.iloc[[2]].reset_index(drop=True)
+    
+    vinculo, _, _ = analisador.ligar_obitos_massa(massa_ligacao, obitos, limiar=9.0)
+    assert vinculo.tolist() == [2]
+    vinculo, _, resumo = analisador.ligar_obitos_massa(massa_ligacao, obitos, limiar=9.5)
+    assert vinculo.tolist() == [-1]
+    assert resumo['motivos_nao_ligados'] == {'abaixo_do_limiar': 1}
+    vinculo, _, resumo = analisador.ligar_obitos_massa(massa_ligacao, obitos, aproximada=False)
+    assert vinculo.tolist() == [-1]
+    assert resumo['aproximada'] is None
+
+
+def test_ligacao_aproximada_recusa_empates_e_participantes_disputados(analisador):
+    joao = ('JOÃO SANTOS', 'M', date(1950, 1, 1))
+    # Dois participantes iguais: o óbito empata entre eles
+    massa = tabela_ligacao(analisador, [('1', None, *joao, None), ('2', None, *joao, None)])
+    obitos = tabela_ligacao(analisador, [(None, None, *joao, date(2020, 1, 1))])
+    vinculo, _, resumo = analisador.ligar_obitos_massa(massa, obitos)
+    assert vinculo.tolist() == [-1]
+    assert resumo['motivos_nao_ligados'] == {'ambiguo': 1}
+    
+    # Dois óbitos para um participante: vence o de maior pontuação (o outro erra o dia do nascimento)
+    massa = tabela_ligacao(analisador, [('1', None, *joao, None)])
+    obitos = tabela_ligacao(analisador, [(None, None, 'JOÃO SANTOS', 'M', date(1950, 1, 2), date(2020, 1, 1)),
+                                         (None, None, *joao, date(2020, 1, 1))])
+    vinculo, _, resumo = analisador.ligar_obitos_massa(massa, obitos)
+    assert vinculo.tolist() == [-1, 0]
+    assert resumo['motivos_nao_ligados'] == {'ambiguo': 1}
+    
+    # Com a mesma pontuação nenhum dos dois fica com o participante
+    obitos = tabela_ligacao(analisador, [(None, None, *joao, date(2020, 1, 1)), (None, None, *joao, date(2020, 2, 1))])
+    vinculo, _, resumo = analisador.ligar_obitos_massa(massa, obitos)
+    assert vinculo.tolist() == [-1, -1]
+    assert resumo['aproximada']['ambiguos'] == 2
+
+
+def test_dados_exposicao_completa_os_obitos_pelo_participante(analisador, massa_ligacao, obitos_ligacao, tmp_path):
+    motor = analisador.AnalisadorMortalidadeExcel(str(tmp_path / 'sem-arquivo.xlsx'), {})
+    vinculo, _, _ = analisador.ligar_obitos_massa(massa_ligacao, obitos_ligacao)
+    
+    dados = motor.dados_exposicao(massa_ligacao, obitos_ligacao, True, vinculo)
+    
+    assert dados['contados'].tolist() == [True, True, True, True, False]
+    # ANA LIMA, ligada pelo CPF, herda sexo e nascimento da massa
+    assert dados['sexo_obito'][3] == analisador.CATEGORIAS_SEXO.index('FEMININO')
+    assert dados['idade_obito'].tolist()[:4] == [70, 71, 74, 50]
+    assert np.isfinite(dados['morte_massa']).tolist() == [True, True, True, True, False]
+    
+    # Sem vínculo dado, liga só pela matrícula
+    dados = motor.dados_exposicao(massa_ligacao, obitos_ligacao, True)
+    assert dados['vinculo'].tolist() == [0, -1, -1, -1, -1]
+    assert dados['contados'].tolist() == [True, False, False, False, False]
+    assert dados['sexo_obito'][3] == analisador.CATEGORIAS_SEXO.index('OUTROS')
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Testes do fila-analises-mortalidade.py"""
+
+import os
+import sys
+import json
+import importlib.util
+
+import pytest
+
+# Análise sem estado em disco fora do tmp_path do teste
+CONFIGURACAO_FILA = {'usarCache': False, 'usarSidecar': False, 'usarRegistroLayouts': False, 'replicasSimulacao': 0}
+
+
+@pytest.fixture(scope='module')
+def fila_analises(analisador):
+    """Módulo fila-analises-mortalidade.py (depois do analisador, que ele reaproveita)"""
+    caminho = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fila-analises-mortalidade.py')
+    spec = importlib.util.spec_from_file_location('fila_analises_mortalidade', caminho)
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def saida_comando(fila_analises, capsys, *argumentos):
+    fila_analises.executar_comando_fila(list(argumentos))
+    return json.loads(capsys.readouterr().out)
+
+
+def test_trabalho_enfileirado_executa_e_guarda_o_resultado(fila_analises, workbook_um_obito, tmp_path, capsys):
+    banco = str(tmp_path / 'fila.sqlite')
+    enfileirado = saida_comando(fila_analises, capsys, banco, 'enfileirar', workbook_um_obito,
+                                '--configuracao', json.dumps(CONFIGURACAO_FILA))
+    assert enfileirado['estado'] == 'pendente'
+    assert enfileirado['trabalhos']['pendente'] == 1
+    
+    resumo = fila_analises.executar_fila(banco, concorrencia=1, intervalo=0.1)
+    assert resumo['desfechos'] == {'concluido': 1}
+    
+    status = saida_comando(fila_analises, capsys, banco, 'status', enfileirado['id'])
+    assert status['estado'] == 'concluido'
+    assert status['tentativas'] == 1 and status['pid'] is None
+    assert 'calcular_exposicao_ae' in status['etapas']
+    assert status['progresso']['etapas_iniciadas'] == len(status['etapas'])
+    
+    resultado = saida_comando(fila_analises, capsys, banco, 'resultado', enfileirado['id'])
+    assert resultado['dados_extraidos']['exposicao_ae']['obitos']['considerados'] == 1
+
+
+def test_cancelamento_de_trabalho_pendente_e_em_execucao(fila_analises, workbook_um_obito, tmp_path, capsys):
+    banco = str(tmp_path / 'fila.sqlite')
+    fila = fila_analises.FilaAnalises(banco)
+    cancelado, executado = (fila.enfileirar(workbook_um_obito, CONFIGURACAO_FILA, prioridade) for prioridade in (1, 2))
+    
+    # Pendente sai da fila na hora e nunca roda
+    assert saida_comando(fila_analises, capsys, banco, 'cancelar', cancelado) == {'id': cancelado, 'estado': 'cancelado'}
+    resumo = fila_analises.executar_fila(banco, concorrencia=1, intervalo=0.1)
+    assert resumo['desfechos'] == {'concluido': 1}
+    assert fila.consultar(executado)['estado'] == 'concluido'
+    trabalho = fila.consultar(cancelado, com_resultado=True)
+    assert trabalho['estado'] == 'cancelado' and trabalho['tentativas'] == 0 and trabalho['resultado'] is None
+    with pytest.raises(SystemExit):
+        saida_comando(fila_analises, capsys, banco, 'resultado', cancelado)
+    
+    # Em execução só marca o pedido; a análise para no próximo ponto de controle
+    id_trabalho = fila.enfileirar(workbook_um_obito, CONFIGURACAO_FILA)
+    assert fila.reservar(os.getpid()) == id_trabalho
+    assert fila.cancelar(id_trabalho) == 'executando'
+    fila_analises.executar_trabalho(banco, id_trabalho)
+    trabalho = fila.consultar(id_trabalho)
+    assert trabalho['estado'] == 'cancelado' and trabalho['etapas'] == []
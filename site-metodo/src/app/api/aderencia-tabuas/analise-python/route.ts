@@ -1,5 +1,7 @@
 import { NextRequest, NextResponse } from 'next/server'
-import { spawn } from 'child_process'
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process'
+import { randomUUID } from 'crypto'
+import { createWriteStream } from 'fs'
 import { writeFile } from 'fs/promises'
 import { join } from 'path'
 import { z } from 'zod'
@@ -19,11 +21,36 @@ const AnalisePythonSchema = z.object({
   })
 })
 
+// Eventos NDJSON emitidos pelo script (--ndjson) e pelo worker (eventos: true)
+type EventoAnalise = {
+  evento:
+    | 'analise_iniciada'
+    | 'planilha_iniciada'
+    | 'progresso_leitura'
+    | 'progresso_tarefas'
+    | 'lote_formulas'
+    | 'planilha_concluida'
+    | 'cache_encontrado'
+    | 'layout_colunas'
+    | 'delta_incremental'
+    | 'progresso_simulacao'
+    | 'pulso'
+    | 'resultado_final'
+  instante: string
+  [campo: string]: any
+}
+
+// Sem nenhum evento nesse intervalo o processo é considerado travado. Etapas longas
+// (load_workbook, simulação, varredura do XML) emitem 'pulso' a cada 15s, então o
+// limite só dispara se o processo parar de fato; ANALISE_PYTHON_INATIVIDADE_MS=0 desliga
+const INATIVIDADE_MAXIMA_MS = Number(process.env.ANALISE_PYTHON_INATIVIDADE_MS ?? 120000)
+
 function executarScriptPython(
   caminhoArquivo: string, 
   configuracao: any, 
-  timeoutMs: number
-): Promise<{ stdout: string; stderr: string }> {
+  timeoutMs: number,
+  aoReceberEvento?: (evento: EventoAnalise) => void
+): Promise<{ resultado: any; stderr: string }> {
   return new Promise((resolve, reject) => {
     const scriptPath = join(process.cwd(), 'scripts', 'analisar-mortalidade-python.py')
     
@@ -31,7 +58,8 @@ function executarScriptPython(
     const args = [
       scriptPath,
       caminhoArquivo,
-      JSON.stringify(configuracao)
+      JSON.stringify(configuracao),
+      '--ndjson'
     ]
 
     const pythonProcess = spawn('python3', args, {
@@ -39,11 +67,69 @@ function executarScriptPython(
       timeout: timeoutMs
     })
 
-    let stdout = ''
+    let buffer = ''
     let stderr = ''
+    let resultado: any = null
+    let finalizado = false
+    let timerTimeout: NodeJS.Timeout | undefined
+    let timerInatividade: NodeJS.Timeout | undefined
+
+    const encerrar = (erro: Error | null) => {
+      if (finalizado) return
+      finalizado = true
+      clearTimeout(timerTimeout)
+      clearTimeout(timerInatividade)
+      if (erro) {
+        pythonProcess.kill('SIGTERM')
+        reject(erro)
+      } else {
+        resolve({ resultado, stderr })
+      }
+    }
+
+    const reiniciarInatividade = () => {
+      clearTimeout(timerInatividade)
+      if (!(INATIVIDADE_MAXIMA_MS > 0)) return
+      timerInatividade = setTimeout(() => {
+        encerrar(new Error(`Script Python sem progresso há ${Math.round(INATIVIDADE_MAXIMA_MS / 1000)}s`))
+      }, Math.min(INATIVIDADE_MAXIMA_MS, timeoutMs))
+    }
+    reiniciarInatividade()
 
-    pythonProcess.stdout.on('data', (data) => {
-      stdout += data.toString()
+    // Cada linha é um evento completo: nada do stdout fica acumulado além da linha corrente
+    pythonProcess.stdout.setEncoding('utf8')
+    pythonProcess.stdout.on('data', (data: string) => {
+      buffer += data
+      let quebra = buffer.indexOf('\n')
+
+      while (quebra >= 0) {
+        const linha = buffer.slice(0, quebra).trim()
+        buffer = buffer.slice(quebra + 1)
+        quebra = buffer.indexOf('\n')
+
+        if (!linha) continue
+
+        let evento: any
+        try {
+          evento = JSON.parse(linha)
+        } catch (_parseError) {
+          encerrar(new Error(`Erro ao fazer parse da saída Python: ${linha.substring(0, 500)}...`))
+          return
+        }
+
+        reiniciarInatividade()
+
+        if (evento.erro) {
+          encerrar(new Error(`Script Python falhou: ${evento.erro}`))
+          return
+        }
+
+        if (evento.evento === 'resultado_final') {
+          resultado = evento.resultado
+        } else if (aoReceberEvento) {
+          aoReceberEvento(evento)
+        }
+      }
     })
 
     pythonProcess.stderr.on('data', (data) => {
@@ -51,25 +137,167 @@ function executarScriptPython(
     })
 
     pythonProcess.on('close', (code) => {
-      if (code === 0) {
-        resolve({ stdout, stderr })
+      if (code === 0 && resultado) {
+        encerrar(null)
       } else {
-        reject(new Error(`Processo Python falhou com código ${code}. Stderr: ${stderr}`))
+        encerrar(new Error(`Processo Python falhou com código ${code}. Stderr: ${stderr}`))
       }
     })
 
     pythonProcess.on('error', (error) => {
-      reject(new Error(`Erro ao executar script Python: ${error.message}`))
+      encerrar(new Error(`Erro ao executar script Python: ${error.message}`))
     })
 
     // Timeout manual adicional
-    setTimeout(() => {
-      pythonProcess.kill('SIGTERM')
-      reject(new Error('Timeout: Script Python demorou muito para executar'))
+    timerTimeout = setTimeout(() => {
+      encerrar(new Error('Timeout: Script Python demorou muito para executar'))
     }, timeoutMs)
   })
 }
 
+// Worker Python persistente (opcional, ANALISE_PYTHON_WORKER=1): evita pagar a
+// inicialização do interpretador e os imports de pandas/NumPy/SciPy/OpenPyXL a
+// cada requisição e mantém em memória as leituras dos arquivos recentes.
+// O worker atende uma requisição por vez: as demais aguardam na fila e o
+// timeout de cada uma só começa a contar quando ela é despachada
+type RequisicaoPendente = {
+  id: string
+  linha: string
+  timeoutMs: number
+  aoReceberEvento?: (evento: EventoAnalise) => void
+  resolve: (resultado: any) => void
+  reject: (error: Error) => void
+  timer?: NodeJS.Timeout
+}
+
+const LIMITE_STDERR_WORKER = 8192
+
+let workerPython: ChildProcessWithoutNullStreams | null = null
+let stderrWorker = ''
+let emAndamento: RequisicaoPendente | null = null
+const filaWorker: RequisicaoPendente[] = []
+
+function obterWorkerPython(): ChildProcessWithoutNullStreams {
+  if (workerPython && workerPython.exitCode === null) {
+    return workerPython
+  }
+
+  const scriptPath = join(process.cwd(), 'scripts', 'analisar-mortalidade-python.py')
+  const processo = spawn('python3', [scriptPath, '--worker'], { stdio: 'pipe' })
+  let buffer = ''
+  stderrWorker = ''
+
+  processo.stdout.setEncoding('utf8')
+  processo.stdout.on('data', (data: string) => {
+    buffer += data
+    let quebra = buffer.indexOf('\n')
+
+    while (quebra >= 0) {
+      const linha = buffer.slice(0, quebra).trim()
+      buffer = buffer.slice(quebra + 1)
+      quebra = buffer.indexOf('\n')
+
+      if (!linha) continue
+
+      let resposta: any
+      try {
+        resposta = JSON.parse(linha)
+      } catch (_parseError) {
+        continue
+      }
+
+      const pendente = emAndamento
+      if (!pendente) continue
+
+      // Erro sem id (requisição ilegível para o worker) encerra a requisição em andamento
+      if (resposta.id !== pendente.id && !(resposta.id === null && resposta.ok === false)) continue
+
+      if (resposta.evento) {
+        pendente.aoReceberEvento?.(resposta.evento)
+        continue
+      }
+
+      clearTimeout(pendente.timer)
+      emAndamento = null
+
+      if (resposta.ok) {
+        pendente.resolve(resposta.resultado)
+      } else {
+        pendente.reject(new Error(`Worker Python falhou: ${resposta.erro}`))
+      }
+      despacharProxima()
+    }
+  })
+
+  // Drenar o stderr evita que o pipe encha e bloqueie o worker (avisos, tracebacks)
+  processo.stderr.setEncoding('utf8')
+  processo.stderr.on('data', (data: string) => {
+    stderrWorker = (stderrWorker + data).slice(-LIMITE_STDERR_WORKER)
+    console.warn('Worker Python (stderr):', data.trimEnd())
+  })
+
+  processo.stdin.on('error', (error) => {
+    console.error('Erro ao escrever no worker Python:', error)
+  })
+
+  const aoEncerrar = (motivo: string) => {
+    // Um worker já substituído (ex.: após timeout) não afeta a fila atual
+    if (workerPython !== processo) return
+    workerPython = null
+
+    const pendente = emAndamento
+    emAndamento = null
+    if (pendente) {
+      clearTimeout(pendente.timer)
+      const detalhe = stderrWorker.trim() ? `: ${stderrWorker.trim().split('\n').slice(-5).join('\n')}` : ''
+      pendente.reject(new Error(`${motivo}${detalhe}`))
+    }
+    despacharProxima()
+  }
+
+  processo.on('exit', (code) => aoEncerrar(`Worker Python encerrado com código ${code}`))
+  processo.on('error', (error) => aoEncerrar(`Erro ao executar worker Python: ${error.message}`))
+
+  workerPython = processo
+  return processo
+}
+
+function despacharProxima() {
+  if (emAndamento) return
+  const pendente = filaWorker.shift()
+  if (!pendente) return
+
+  const processo = obterWorkerPython()
+  emAndamento = pendente
+
+  pendente.timer = setTimeout(() => {
+    if (emAndamento !== pendente) return
+    emAndamento = null
+    // Reiniciar o worker descarta só a análise travada; a fila segue num worker novo
+    workerPython = null
+    processo.kill('SIGTERM')
+    pendente.reject(new Error('Timeout: Worker Python demorou muito para executar'))
+    despacharProxima()
+  }, pendente.timeoutMs)
+
+  processo.stdin.write(pendente.linha)
+}
+
+function executarNoWorkerPython(
+  caminhoArquivo: string,
+  configuracao: any,
+  timeoutMs: number,
+  aoReceberEvento?: (evento: EventoAnalise) => void
+): Promise<any> {
+  return new Promise((resolve, reject) => {
+    const id = randomUUID()
+    const linha = JSON.stringify({ id, caminhoArquivo, configuracao, eventos: Boolean(aoReceberEvento) }) + '\n'
+
+    filaWorker.push({ id, linha, timeoutMs, aoReceberEvento, resolve, reject })
+    despacharProxima()
+  })
+}
+
 export async function POST(request: NextRequest) {
   try {
     const body = await request.json()
@@ -102,21 +330,62 @@ export async function POST(request: NextRequest) {
 
     const inicioProcessamento = Date.now()
 
+    // O resultado traz as fórmulas agrupadas por padrão. No modo DETALHADO a lista
+    // célula a célula chega em lotes e vai direto para um arquivo NDJSON, sem ficar em memória
+    const formulasPath = join(process.cwd(), 'uploads', 'mortalidade', `python-formulas-${dados.importacaoId}.ndjson`)
+    const saidaFormulas: { arquivo: ReturnType<typeof createWriteStream> | null } = { arquivo: null }
+    const progresso: { planilha: string; tipo: string | null; linhas: number; formulas: number; concluidaEm: string }[] = []
+
+    const aoReceberEvento = (evento: EventoAnalise) => {
+      if (evento.evento === 'lote_formulas') {
+        if (!saidaFormulas.arquivo) {
+          saidaFormulas.arquivo = createWriteStream(formulasPath)
+        }
+        const arquivo = saidaFormulas.arquivo
+        for (const formula of evento.formulas) {
+          arquivo.write(JSON.stringify({ planilha: evento.planilha, ...formula }) + '\n')
+        }
+      } else if (evento.evento === 'planilha_concluida') {
+        progresso.push({
+          planilha: evento.planilha,
+          tipo: evento.tipo,
+          linhas: evento.linhas,
+          formulas: evento.formulas,
+          concluidaEm: evento.instante
+        })
+        console.log(`Análise Python: planilha ${evento.indice + 1}/${evento.total_planilhas} (${evento.planilha}) concluída`)
+      }
+    }
+
     try {
       // Executar script Python
       const timeoutMs = dados.configuracao.timeoutSegundos * 1000
-      const { stdout, stderr } = await executarScriptPython(
-        importacao.caminhoArquivo,
-        dados.configuracao,
-        timeoutMs
-      )
-
-      // Parse do resultado JSON do Python
       let resultadoPython
+      let stderr = ''
+
       try {
-        resultadoPython = JSON.parse(stdout)
-      } catch (_parseError) {
-        throw new Error(`Erro ao fazer parse do resultado Python: ${stdout.substring(0, 500)}...`)
+        if (process.env.ANALISE_PYTHON_WORKER === '1') {
+          resultadoPython = await executarNoWorkerPython(
+            importacao.caminhoArquivo,
+            dados.configuracao,
+            timeoutMs,
+            aoReceberEvento
+          )
+        } else {
+          const saida = await executarScriptPython(
+            importacao.caminhoArquivo,
+            dados.configuracao,
+            timeoutMs,
+            aoReceberEvento
+          )
+          resultadoPython = saida.resultado
+          stderr = saida.stderr
+        }
+      } finally {
+        const arquivo = saidaFormulas.arquivo
+        if (arquivo) {
+          await new Promise((resolve) => arquivo.end(resolve))
+        }
       }
 
       const tempoProcessamento = Math.round((Date.now() - inicioProcessamento) / 1000)
@@ -140,6 +409,8 @@ export async function POST(request: NextRequest) {
             analisePython: {
               configuracao: dados.configuracao,
               caminhoResultado: resultadoPath,
+              caminhoFormulas: saidaFormulas.arquivo ? formulasPath : null,
+              progresso,
               stderr: stderr || null,
               processadoEm: new Date().toISOString(),
               versaoPython: resultadoPython.metadados?.versaoPython,
@@ -155,6 +426,7 @@ export async function POST(request: NextRequest) {
         resultado: resultadoPython,
         tempoProcessamento,
         caminhoResultado: resultadoPath,
+        caminhoFormulas: saidaFormulas.arquivo ? formulasPath : null,
         logs: {
           stderr: stderr || null,
           warnings: resultadoPython.warnings || []